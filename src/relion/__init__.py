@@ -20,6 +20,7 @@ from relion._parser.cryolo import Cryolo, CryoloAutoPick
 from relion._parser.ctffind import CTFFind
 from relion._parser.initialmodel import InitialModel
 from relion._parser.motioncorrection import MotionCorr
+from relion._parser.parse_cache import ParseCache
 from relion._parser.relativeicethickness import RelativeIceThickness
 from relion._parser.relion_pipeline import RelionPipeline
 from relion._parser.select import Select
@@ -42,6 +43,7 @@ __version__ = "0.13.16"
 __version_tuple__ = tuple(int(x) for x in __version__.split("."))
 
 pipeline_lock = ".relion_lock"
+parse_cache_dir = ".relion_cache"
 
 
 RelionJobResult = namedtuple(
@@ -76,14 +78,23 @@ class Project(RelionPipeline):
         message_constructors=None,
         cluster=False,
         version: int = 3,
+        parse_cache: bool = False,
     ):
         """
         Create an object representing a Relion project.
         :param path: A string or file system path object pointing to the root
                      directory of an existing Relion project.
+        :param parse_cache: If True the results parsed from job directories are
+                            stored in {path}/.relion_cache and reused by later
+                            Project objects while the job files are unchanged.
         """
         self.basepath = pathlib.Path(path)
         self._version = version
+        self._parse_cache = (
+            ParseCache(self.basepath / parse_cache_dir / "parse_cache.sqlite")
+            if parse_cache and self.basepath.is_dir()
+            else None
+        )
         super().__init__(
             "Import/job001", locklist=[self.basepath / "default_pipeline.star"]
         )
@@ -131,9 +142,11 @@ class Project(RelionPipeline):
         resd = {
             "CtfFind": self.ctffind,
             "MotionCorr": self.motioncorrection,
-            "AutoPick": self.autopick_cryolo
-            if self.run_options.autopick_do_cryolo and self._version == 4
-            else self.autopick,
+            "AutoPick": (
+                self.autopick_cryolo
+                if self.run_options.autopick_do_cryolo and self._version == 4
+                else self.autopick
+            ),
             "External/crYOLO_AutoPick/": self.cryolo,
             "Class2D": self.class2D,
             "InitialModel": self.initialmodel,
@@ -150,7 +163,7 @@ class Project(RelionPipeline):
         """access the CTFFind stage of the project.
         Returns a dictionary-like object with job names as keys,
         and lists of CTFMicrograph namedtuples as values."""
-        return CTFFind(self.basepath / "CtfFind")
+        return self._cached_stage(CTFFind(self.basepath / "CtfFind"))
 
     @property
     @functools.lru_cache(maxsize=1)
@@ -158,22 +171,22 @@ class Project(RelionPipeline):
         """access the motion correction stage of the project.
         Returns a dictionary-like object with job names as keys,
         and lists of MCMicrograph namedtuples as values."""
-        return MotionCorr(self.basepath / "MotionCorr")
+        return self._cached_stage(MotionCorr(self.basepath / "MotionCorr"))
 
     @property
     @functools.lru_cache(maxsize=1)
     def autopick(self):
-        return AutoPick(self.basepath / "AutoPick")
+        return self._cached_stage(AutoPick(self.basepath / "AutoPick"))
 
     @property
     @functools.lru_cache(maxsize=1)
     def autopick_cryolo(self):
-        return CryoloAutoPick(self.basepath / "AutoPick")
+        return self._cached_stage(CryoloAutoPick(self.basepath / "AutoPick"))
 
     @property
     @functools.lru_cache(maxsize=1)
     def cryolo(self):
-        return Cryolo(self.basepath / "External")
+        return self._cached_stage(Cryolo(self.basepath / "External"))
 
     @property
     @functools.lru_cache(maxsize=1)
@@ -181,7 +194,7 @@ class Project(RelionPipeline):
         """access the 2D classification stage of the project.
         Returns a dictionary-like object with job names as keys,
         and lists of Class2DParticleClass namedtuples as values."""
-        return Class2D(self.basepath / "Class2D")
+        return self._cached_stage(Class2D(self.basepath / "Class2D"))
 
     @property
     @functools.lru_cache(maxsize=1)
@@ -194,7 +207,7 @@ class Project(RelionPipeline):
         """access the 3D classification stage of the project.
         Returns a dictionary-like object with job names as keys,
         and lists of Class3DParticleClass namedtuples as values."""
-        return Class3D(self.basepath / "Class3D")
+        return self._cached_stage(Class3D(self.basepath / "Class3D"))
 
     @property
     @functools.lru_cache(maxsize=1)
@@ -211,6 +224,10 @@ class Project(RelionPipeline):
     def select(self):
         return Select(self.basepath / "Select")
 
+    def _cached_stage(self, stage):
+        stage._parse_cache = self._parse_cache
+        return stage
+
     def origin_present(self):
         try:
             self.load_nodes_from_star(self.basepath / "default_pipeline.star")
@@ -221,8 +238,18 @@ class Project(RelionPipeline):
         return (self.basepath / self.origin / "RELION_JOB_EXIT_SUCCESS").is_file()
 
     def load(self, clear_cache=True, cluster=False):
+        """
+        Load the pipeline and link its jobs to the results parsers.
+        :param clear_cache: If True all results are parsed again from scratch. If
+                            False the existing parsers are kept and only jobs whose
+                            files have changed since they were last parsed are
+                            read again.
+        """
         if clear_cache:
             self._clear_caches()
+        else:
+            for stage in set(self._results_dict.values()):
+                stage.refresh()
         self._data_pipeline = Graph("DataPipeline", [])
         # reset the in and out lists of database nodes
         # have to avoid removing the permanent connections from other database nodes
@@ -318,7 +345,6 @@ class Project(RelionPipeline):
 
     @property
     def messages(self):
-        self._clear_caches()
         msgs = []
         results = self._data_pipeline()
         if results is None:
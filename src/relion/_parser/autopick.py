@@ -60,10 +60,13 @@ class AutoPick(JobType):
             logger.debug(f"_rlnGroupNrParticles not found in file {file}")
             return []
 
-        all_particles = self.parse_star_file("_rlnGroupNrParticles", file, info_table)
+        columns = self.parse_star_loop(
+            ["_rlnGroupNrParticles", "_rlnMicrographName"], file, info_table
+        )
+        all_particles = columns["_rlnGroupNrParticles"]
         # num_particles = sum([int(n) for n in all_particles])
 
-        mc_micrographs = self.parse_star_file("_rlnMicrographName", file, info_table)
+        mc_micrographs = columns["_rlnMicrographName"]
 
         first_mc_micrograph = mc_micrographs[0]
 
@@ -101,6 +104,7 @@ class AutoPick(JobType):
                 micrograph.stem, micrograph.stem + "_autopick"
             )
         )
+        self._track(self._basepath / jobdir / particle_star_file)
         if self._particle_cache.get(jobdir):
             if self._particle_cache[jobdir].get(micrograph):
                 try:
@@ -132,10 +136,10 @@ class AutoPick(JobType):
                 f"_rlnMicrographFrameNumber not found in file {particle_star_file}"
             )
             return particle_data
-        xs = self.parse_star_file("_rlnCoordinateX", particle_star, info_table)
-        ys = self.parse_star_file("_rlnCoordinateY", particle_star, info_table)
-        for x, y in zip(xs, ys):
-            particle_data.append((x, y))
+        coordinates = self.parse_star_loop(
+            ["_rlnCoordinateX", "_rlnCoordinateY"], particle_star, info_table
+        )
+        particle_data.extend(zip(*coordinates.values()))
         try:
             self._particle_cache[jobdir][micrograph] = ParticleCacheRecord(
                 particle_data,
@@ -89,22 +89,20 @@ class Class3D(JobType):
             logger.debug(f"_rlnClassDistribution not found in file {mfile}")
             return []
 
-        class_distribution = self.parse_star_file(
-            "_rlnClassDistribution", smfile, info_table
+        columns = self.parse_star_loop(
+            [
+                "_rlnReferenceImage",
+                "_rlnClassDistribution",
+                "_rlnAccuracyRotations",
+                "_rlnAccuracyTranslationsAngst",
+                "_rlnEstimatedResolution",
+                "_rlnOverallFourierCompleteness",
+            ],
+            smfile,
+            info_table,
+            dtypes={"_rlnClassDistribution": float},
         )
-        accuracy_rotations = self.parse_star_file(
-            "_rlnAccuracyRotations", smfile, info_table
-        )
-        accuracy_translations_angst = self.parse_star_file(
-            "_rlnAccuracyTranslationsAngst", smfile, info_table
-        )
-        estimated_resolution = self.parse_star_file(
-            "_rlnEstimatedResolution", smfile, info_table
-        )
-        overall_fourier_completeness = self.parse_star_file(
-            "_rlnOverallFourierCompleteness", smfile, info_table
-        )
-        reference_image = self.parse_star_file("_rlnReferenceImage", smfile, info_table)
+        reference_image = columns["_rlnReferenceImage"]
 
         class_numbers = self.parse_star_file("_rlnClassNumber", sdfile, info_table)
         particle_sum = self._sum_all_particles(class_numbers)
@@ -138,16 +136,23 @@ class Class3D(JobType):
 
         particle_class_list = []
         try:
-            for j in range(len(reference_image)):
+            for j, (
+                image,
+                class_distribution,
+                accuracy_rotations,
+                accuracy_translations_angst,
+                estimated_resolution,
+                overall_fourier_completeness,
+            ) in enumerate(self.star_loop_rows(columns)):
                 particle_class_list.append(
                     Class3DParticleClass(
                         checked_particle_list[j],
-                        str(self._basepath.parent / reference_image[j]),
-                        float(class_distribution[j]),
-                        accuracy_rotations[j],
-                        accuracy_translations_angst[j],
-                        estimated_resolution[j],
-                        overall_fourier_completeness[j],
+                        str(self._basepath.parent / image),
+                        float(class_distribution),
+                        accuracy_rotations,
+                        accuracy_translations_angst,
+                        estimated_resolution,
+                        overall_fourier_completeness,
                         init_nodel_num_particles,
                         jobdir,
                     )
@@ -1,12 +1,17 @@
 from __future__ import annotations
 
 import argparse
+import json
+import logging
+import os
 from math import ceil
 from pathlib import Path
 from typing import List
 
 import starfile
 
+logger = logging.getLogger("relion._parser.combine_star_files")
+
 
 def write_empty_particles_file(file_to_write, optics_dataframe, particles_dataframe):
     """Write a particles star file with no particles, ready for appending to"""
@@ -22,6 +27,57 @@ def write_empty_particles_file(file_to_write, optics_dataframe, particles_datafr
             optics_file.write(f"_{particles_loop_tag}\n")
 
 
+def _is_particle_line(line) -> bool:
+    # particle rows are the only lines starting with a number
+    split_line = line.split()
+    return len(split_line) > 0 and split_line[0][:1].isdigit()
+
+
+def _read_star_file_header(file_to_read: Path, output_dir: Path) -> dict:
+    """Read the tables from the first lines of a particles star file"""
+    # Make a temporary star file to get the table headings from
+    with open(file_to_read, "r") as full_starfile, open(
+        output_dir / ".particles_tmp.star", "w"
+    ) as tmp_starfile:
+        for line_counter in range(50):
+            line = full_starfile.readline()
+            if not line:
+                break
+            tmp_starfile.write(line)
+
+    star_dictionary = starfile.read(output_dir / ".particles_tmp.star")
+    (output_dir / ".particles_tmp.star").unlink()
+    return star_dictionary
+
+
+def _find_optics(star_file: Path) -> List[str]:
+    with open(star_file, "r") as added_starfile:
+        while True:
+            optics_line = added_starfile.readline()
+            if not optics_line:
+                raise IndexError(f"Cannot find optics group in {star_file}")
+            if optics_line.startswith("opticsGroup"):
+                return optics_line.split()
+
+
+def _check_optics_match(reference_optics: List[str], new_optics: List[str]):
+    if len(new_optics) != len(reference_optics):
+        raise IndexError(
+            "Cannot combine star files with different length optics tables."
+        )
+    for optics_label in range(len(reference_optics)):
+        ref_value = reference_optics[optics_label]
+        new_value = new_optics[optics_label]
+        if ref_value[0].isdigit() and new_value[0].isdigit():
+            ref_value = float(ref_value)
+            new_value = float(new_value)
+        if ref_value != new_value:
+            print(ref_value, new_value)
+            raise IndexError(
+                "Cannot combine star files with different values in optics tables."
+            )
+
+
 def combine_star_files(files_to_process: List[Path], output_dir: Path):
     """Combines any number of particle star files into a single file.
 
@@ -37,23 +93,8 @@ def combine_star_files(files_to_process: List[Path], output_dir: Path):
         files_to_process = files_to_process[1:]
 
     # Make a temporary star file to get the table headings from
-    reference_optics = None
-    with open(files_to_process[0], "r") as full_starfile, open(
-        output_dir / ".particles_tmp.star", "w"
-    ) as tmp_starfile:
-        for line_counter in range(50):
-            line = full_starfile.readline()
-            if line.startswith("opticsGroup"):
-                reference_optics = line.split()
-            if not line:
-                break
-            tmp_starfile.write(line)
-
-    star_dictionary = starfile.read(output_dir / ".particles_tmp.star")
-    (output_dir / ".particles_tmp.star").unlink()
-
-    if not reference_optics:
-        raise IndexError(f"Cannot find optics group in {files_to_process[0]}")
+    star_dictionary = _read_star_file_header(files_to_process[0], output_dir)
+    reference_optics = _find_optics(files_to_process[0])
 
     write_empty_particles_file(
         output_dir / ".particles_all_tmp.star",
@@ -65,30 +106,7 @@ def combine_star_files(files_to_process: List[Path], output_dir: Path):
     # Add the remaining files using append mode for speed and memory efficiency
     for split_file in files_to_process:
         # Check that the files have the same optics tables
-        with open(split_file, "r") as added_starfile:
-            while True:
-                optics_line = added_starfile.readline()
-                if not optics_line:
-                    raise IndexError(f"Cannot find optics group in {split_file}")
-                if optics_line.startswith("opticsGroup"):
-                    new_optics = optics_line.split()
-                    break
-
-        if len(new_optics) != len(reference_optics):
-            raise IndexError(
-                "Cannot combine star files with different length optics tables."
-            )
-        for optics_label in range(len(reference_optics)):
-            ref_value = reference_optics[optics_label]
-            new_value = new_optics[optics_label]
-            if ref_value[0].isdigit() and new_value[0].isdigit():
-                ref_value = float(ref_value)
-                new_value = float(new_value)
-            if ref_value != new_value:
-                print(ref_value, new_value)
-                raise IndexError(
-                    "Cannot combine star files with different values in optics tables."
-                )
+        _check_optics_match(reference_optics, _find_optics(split_file))
 
         # Add the particles lines to the final star file
         file_particles_count = 0
@@ -99,8 +117,7 @@ def combine_star_files(files_to_process: List[Path], output_dir: Path):
                 particle_line = added_starfile.readline()
                 if not particle_line:
                     break
-                particle_split_line = particle_line.split()
-                if len(particle_split_line) > 0 and particle_split_line[0][0].isdigit():
+                if _is_particle_line(particle_line):
                     file_particles_count += 1
                     total_particles += 1
                     particles_file.write(particle_line)
@@ -195,6 +212,175 @@ def split_star_file(
     )
 
 
+class ParticlesStore:
+    """An append-only particles_all.star with an index of its contents.
+
+    The index is kept next to the star file (in .particles_all_index.json) and
+    records the number of particles, the optics values, the size of the header
+    and which particles have already been written to split files. Particles are
+    only ever appended to particles_all.star, and split files are only extended
+    at the end unless the split size changes.
+    """
+
+    index_version = 1
+
+    def __init__(self, output_dir: Path, file_name: str = "particles_all.star"):
+        self.star_file = output_dir / file_name
+        self.index_file = output_dir / f".{Path(file_name).stem}_index.json"
+        self.output_dir = output_dir
+        self._index = self._load_index()
+
+    @property
+    def particle_count(self) -> int:
+        return self._index["particles"]
+
+    def _load_index(self) -> dict:
+        if not self.star_file.exists():
+            return {
+                "version": self.index_version,
+                "particles": 0,
+                "header_size": 0,
+                "size": 0,
+                "optics": None,
+                "split_size": None,
+                "split_particles": 0,
+                "split_end": 0,
+            }
+        try:
+            with open(self.index_file) as index_file:
+                index = json.load(index_file)
+            if (
+                index.get("version") == self.index_version
+                and index["size"] == self.star_file.stat().st_size
+            ):
+                return index
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+        return self._build_index()
+
+    def _build_index(self) -> dict:
+        # read through an existing star file once to find its contents
+        index = {
+            "version": self.index_version,
+            "particles": 0,
+            "header_size": None,
+            "size": 0,
+            "optics": None,
+            "split_size": None,
+            "split_particles": 0,
+            "split_end": 0,
+        }
+        with open(self.star_file, "rb") as full_starfile:
+            for line in full_starfile:
+                if line.startswith(b"opticsGroup") and index["optics"] is None:
+                    index["optics"] = line.decode().split()
+                if _is_particle_line(line):
+                    if index["header_size"] is None:
+                        index["header_size"] = index["size"]
+                    index["particles"] += 1
+                index["size"] += len(line)
+        if index["header_size"] is None:
+            index["header_size"] = index["size"]
+        self._index = index
+        self._save_index()
+        return index
+
+    def _save_index(self):
+        tmp_index_file = self.index_file.with_suffix(".tmp")
+        with open(tmp_index_file, "w") as index_file:
+            json.dump(self._index, index_file)
+        tmp_index_file.rename(self.index_file)
+
+    def append(self, file_to_add: Path) -> int:
+        """Append the particles of a star file, returning how many were added"""
+        new_optics = _find_optics(file_to_add)
+        if self._index["optics"] is None:
+            # a new store takes its header from the first file added
+            star_dictionary = _read_star_file_header(file_to_add, self.output_dir)
+            write_empty_particles_file(
+                self.star_file,
+                star_dictionary["optics"],
+                star_dictionary["particles"],
+            )
+            self._index["optics"] = new_optics
+            header_size = self.star_file.stat().st_size
+            self._index["header_size"] = self._index["size"] = header_size
+        else:
+            _check_optics_match(self._index["optics"], new_optics)
+
+        added_particles = 0
+        with open(file_to_add, "rb") as added_starfile, open(
+            self.star_file, "ab+"
+        ) as particles_file:
+            particles_file.seek(-1, os.SEEK_END)
+            if particles_file.read(1) != b"\n":
+                particles_file.write(b"\n")
+                self._index["size"] += 1
+            for line in added_starfile:
+                if not _is_particle_line(line):
+                    continue
+                if not line.endswith(b"\n"):
+                    line += b"\n"
+                particles_file.write(line)
+                self._index["size"] += len(line)
+                added_particles += 1
+        self._index["particles"] += added_particles
+        self._save_index()
+        logger.info(f"Adding {file_to_add} with {added_particles} particles")
+        return added_particles
+
+    def _split_file(self, split: int) -> Path:
+        return self.output_dir / f"particles_split{split}.star"
+
+    def split(self, split_size: int):
+        """Write the particles into particles_split<n>.star files of split_size"""
+        index = self._index
+        number_of_splits = ceil(index["particles"] / split_size)
+        previous_splits = ceil(index["split_particles"] / split_size)
+        if index["split_size"] != split_size or not all(
+            self._split_file(split).exists() for split in range(1, previous_splits + 1)
+        ):
+            # the split boundaries have changed so all the splits are rewritten
+            index["split_particles"] = 0
+            index["split_end"] = index["header_size"]
+            previous_splits = 0
+        with open(self.star_file, "rb") as full_starfile:
+            header = full_starfile.read(index["header_size"])
+            full_starfile.seek(index["split_end"])
+            split = max(previous_splits, 1)
+            in_split = index["split_particles"] - (split - 1) * split_size
+            split_file = None
+            try:
+                for line in full_starfile:
+                    if not _is_particle_line(line):
+                        index["split_end"] += len(line)
+                        continue
+                    if split_file is None or in_split == split_size:
+                        if split_file is not None:
+                            split_file.close()
+                        if in_split == split_size:
+                            split += 1
+                            in_split = 0
+                        if in_split:
+                            split_file = open(self._split_file(split), "ab")
+                        else:
+                            split_file = open(self._split_file(split), "wb")
+                            split_file.write(header)
+                    split_file.write(line)
+                    in_split += 1
+                    index["split_particles"] += 1
+                    index["split_end"] += len(line)
+            finally:
+                if split_file is not None:
+                    split_file.close()
+        index["split_size"] = split_size
+        self._save_index()
+        logger.info(
+            f"Split {index['particles']} particles into "
+            f"{number_of_splits} files with {split_size} particles in each."
+        )
+
+
 def create_parser():
     parser = argparse.ArgumentParser()
 
@@ -44,7 +44,12 @@ class Cryolo(JobType):
         particles_per_micrograph = {}
         first_mic = ""
         coords = {}
+        # particle files are found by a recursive search so a new file in any of
+        # the searched directories has to cause the job to be reloaded
+        self._track(self._basepath / jobdir / star_location)
         for star_file in (self._basepath / jobdir / star_location).glob("**/*"):
+            if star_file.is_dir():
+                self._track(star_file)
             if (
                 star_file.is_file()
                 and "gain" not in str(star_file)
@@ -67,12 +72,12 @@ class Cryolo(JobType):
         if info_table is None:
             logger.debug(f"_rlnJobOptionVariable not found in file {jobfile}")
             return []
-        variables = self.parse_star_file("_rlnJobOptionVariable", jobfile, info_table)
-        inmicindex = variables.index(input_tag)
+        job_options = self.parse_star_loop(
+            ["_rlnJobOptionVariable", "_rlnJobOptionValue"], jobfile, info_table
+        )
+        inmicindex = job_options["_rlnJobOptionVariable"].index(input_tag)
         ctffilename = pathlib.Path(
-            self.parse_star_file("_rlnJobOptionValue", jobfile, info_table)[
-                inmicindex
-            ].replace("'", "")
+            job_options["_rlnJobOptionValue"][inmicindex].replace("'", "")
         )
         ctffile = self._read_star_file_from_proj_dir(
             ctffilename.parts[0], ctffilename.relative_to(ctffilename.parts[0])
@@ -125,6 +130,7 @@ class Cryolo(JobType):
         )
 
     def _get_particle_info(self, jobdir, star_file):
+        self._track(star_file)
         if self._particle_cache.get(jobdir) is None:
             self._particle_cache[jobdir] = {}
         if self._particle_cache[jobdir].get(star_file):
@@ -153,9 +159,10 @@ class Cryolo(JobType):
             logger.debug(f"_rlnCoordinateX not found in file {file}")
             return []
 
-        all_particles = self.parse_star_file("_rlnCoordinateX", file, info_table)
-        ys = self.parse_star_file("_rlnCoordinateY", file, info_table)
-        coords = [(x, y) for x, y in zip(all_particles, ys)]
+        coordinates = self.parse_star_loop(
+            ["_rlnCoordinateX", "_rlnCoordinateY"], file, info_table
+        )
+        coords = list(zip(*coordinates.values()))
         try:
             self._particle_cache[jobdir][star_file] = ParticleCacheRecord(
                 coords,
@@ -73,36 +73,50 @@ class CTFFind(JobType):
         if info_table is None:
             return []
 
-        astigmatism = self.parse_star_file("_rlnCtfAstigmatism", file, info_table)
-        defocus_u = self.parse_star_file("_rlnDefocusU", file, info_table)
-        defocus_v = self.parse_star_file("_rlnDefocusV", file, info_table)
-        defocus_angle = self.parse_star_file("_rlnDefocusAngle", file, info_table)
-        max_resolution = self.parse_star_file("_rlnCtfMaxResolution", file, info_table)
-        fig_of_merit = self.parse_star_file("_rlnCtfFigureOfMerit", file, info_table)
-
-        micrograph_name = self.parse_star_file("_rlnMicrographName", file, info_table)
-        ctf_img_path = self.parse_star_file("_rlnCtfImage", file, info_table)
+        columns = self.parse_star_loop(
+            [
+                "_rlnCtfAstigmatism",
+                "_rlnDefocusU",
+                "_rlnDefocusV",
+                "_rlnDefocusAngle",
+                "_rlnCtfMaxResolution",
+                "_rlnCtfFigureOfMerit",
+                "_rlnMicrographName",
+                "_rlnCtfImage",
+            ],
+            file,
+            info_table,
+        )
 
         info_table = self._find_table_from_column_name("_rlnAmplitudeContrast", file)
 
         amp_contrast = self.parse_star_file("_rlnAmplitudeContrast", file, info_table)
 
         micrograph_list = []
-        for j in range(len(micrograph_name)):
+        for (
+            astigmatism,
+            defocus_u,
+            defocus_v,
+            defocus_angle,
+            max_resolution,
+            fig_of_merit,
+            micrograph_name,
+            ctf_img_path,
+        ) in self.star_loop_rows(columns):
             plot_path = (
-                str(self._basepath.parent / ctf_img_path[j])
+                str(self._basepath.parent / ctf_img_path)
                 .split(":")[0]
                 .replace(".ctf", ".jpeg")
             )
             micrograph_list.append(
                 CTFMicrograph(
-                    str(self._basepath.parent / micrograph_name[j]),
-                    astigmatism[j],
-                    defocus_u[j],
-                    defocus_v[j],
-                    defocus_angle[j],
-                    max_resolution[j],
-                    fig_of_merit[j],
+                    str(self._basepath.parent / micrograph_name),
+                    astigmatism,
+                    defocus_u,
+                    defocus_v,
+                    defocus_angle,
+                    max_resolution,
+                    fig_of_merit,
                     amp_contrast[0],
                     plot_path,
                 )
@@ -1,10 +1,14 @@
 from __future__ import annotations
 
 import collections.abc
+import logging
 import os
 
+import numpy as np
 from gemmi import cif
 
+logger = logging.getLogger("relion._parser.jobtype")
+
 
 class JobType(collections.abc.Mapping):
     def __eq__(self, other):
@@ -18,6 +22,11 @@ class JobType(collections.abc.Mapping):
     def __init__(self, path):
         self._basepath = path
         self._jobcache = {}
+        # signatures of the files read to load each cached job
+        self._job_inputs = {}
+        self._tracking = None
+        # optional persistent store of parsed results (see relion._parser.parse_cache)
+        self._parse_cache = None
 
     def __iter__(self):
         return iter(self.jobs)
@@ -48,25 +57,73 @@ class JobType(collections.abc.Mapping):
                 raise KeyError(
                     f"no job directory present for {key} in {self._basepath}"
                 )
-            self._jobcache[key] = self._load_job_directory(key)
+            stored = self._parse_cache.get(self, key) if self._parse_cache else None
+            if stored is not None:
+                self._jobcache[key], self._job_inputs[key] = stored
+                return self._jobcache[key]
+            self._tracking = self._job_inputs[key] = {}
+            try:
+                # new or removed files in the job directory change its signature
+                self._track(job_path)
+                self._jobcache[key] = self._load_job_directory(key)
+            finally:
+                self._tracking = None
+            if self._parse_cache:
+                self._parse_cache.put(
+                    self, key, self._jobcache[key], self._job_inputs[key]
+                )
         return self._jobcache[key]
 
     def __setitem__(self, key, new_value):
         if not isinstance(key, str):
             raise KeyError(f"Invalid argument {key!r}, expected string")
         self._jobcache[key] = new_value
+        self._job_inputs.pop(key, None)
+
+    @staticmethod
+    def _file_signature(path):
+        try:
+            stat = os.stat(path)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def _track(self, path):
+        # record the state of a file used to load the job currently being loaded
+        if self._tracking is not None:
+            self._tracking[os.fspath(path)] = self._file_signature(path)
+
+    def refresh(self):
+        """
+        Forget the cached results of any job for which a file read while loading
+        it has since been created, modified, replaced or removed. Jobs that have
+        not changed keep their results and are not read again.
+        """
+        for key in list(self._jobcache):
+            inputs = self._job_inputs.get(key)
+            if inputs is None:
+                # results that were set directly are kept as they are
+                continue
+            if any(
+                self._file_signature(path) != signature
+                for path, signature in inputs.items()
+            ):
+                del self._jobcache[key]
+                del self._job_inputs[key]
 
     def _load_job_directory(self, jobdir, **kwargs):
         raise NotImplementedError("Load job directory not implemented")
 
     def _read_star_file(self, job_num, file_name):
         full_path = self._basepath / job_num / file_name
+        self._track(full_path)
         gemmi_readable_path = os.fspath(full_path)
         star_doc = cif.read_file(gemmi_readable_path)
         return star_doc
 
     def _read_star_file_from_proj_dir(self, job_num, file_name):
         full_path = self._basepath.parent / job_num / file_name
+        self._track(full_path)
         gemmi_readable_path = os.fspath(full_path)
         star_doc = cif.read_file(gemmi_readable_path)
         return star_doc
@@ -79,6 +136,55 @@ class JobType(collections.abc.Mapping):
             print("Warning - no values found for", loop_name)
         return values_list
 
+    def parse_star_loop(self, loop_names, star_doc, block_number, dtypes=None):
+        """
+        Read several columns of a data block at once. Returns a dictionary from
+        column name to a list of the string values in that column, or to a numpy
+        array for columns that have a type given in dtypes. Columns that are not
+        found give empty lists, as in parse_star_file.
+        """
+        dtypes = dtypes or {}
+        data_block = star_doc[block_number]
+        columns = {}
+        loops = {}
+        for loop_name in loop_names:
+            column = data_block.find_loop(loop_name)
+            loop = column.get_loop()
+            if loop is not None:
+                loops.setdefault(loop.tags[0], (loop, []))[1].append(
+                    (loop_name, column)
+                )
+                continue
+            columns[loop_name] = list(column)
+            if not columns[loop_name]:
+                logger.warning(f"No values found for {loop_name}")
+        for loop, loop_columns in loops.values():
+            width = loop.width()
+            # flattening the whole loop only pays off when enough of it is needed
+            if 3 * len(loop_columns) >= width:
+                values = list(loop.values)
+                tags = list(loop.tags)
+                for loop_name, column in loop_columns:
+                    columns[loop_name] = values[tags.index(column.tag) :: width]
+            else:
+                for loop_name, column in loop_columns:
+                    columns[loop_name] = list(column)
+        for loop_name, dtype in dtypes.items():
+            if loop_name in columns:
+                columns[loop_name] = np.array(columns[loop_name], dtype=dtype)
+        return {loop_name: columns[loop_name] for loop_name in loop_names}
+
+    @staticmethod
+    def star_loop_rows(columns):
+        """
+        Iterate over the rows of columns read by parse_star_loop. Raises an
+        IndexError if any column is empty or the columns differ in length.
+        """
+        lengths = {loop_name: len(values) for loop_name, values in columns.items()}
+        if 0 in lengths.values() or len(set(lengths.values())) > 1:
+            raise IndexError(f"Columns do not have matching rows: {lengths}")
+        return zip(*columns.values())
+
     def parse_star_file_pair(self, key, star_doc, block_number):
         data_block = star_doc[block_number]
         value = data_block.find_pair(key)[-1]
@@ -87,7 +193,7 @@ class JobType(collections.abc.Mapping):
     @staticmethod
     def _find_table_from_column_name(cname, star_doc):
         for block_index, block in enumerate(star_doc):
-            if list(block.find_loop(cname)):
+            if len(block.find_loop(cname)):
                 return block_index
         return None
 
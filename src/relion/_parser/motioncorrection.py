@@ -1,11 +1,15 @@
 from __future__ import annotations
 
 import logging
+import os
 from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 
 import numpy as np
 import plotly.express as px
+from gemmi import cif
 
 from relion._parser.jobtype import JobType
 
@@ -51,19 +55,71 @@ MCMicrographDrift = namedtuple(
     ],
 )
 
+MCMicrographDrift.__doc__ = "Shifts of each frame of a movie, as numpy arrays."
+
 MCDriftCacheRecord = namedtuple(
     "MCDriftCacheRecord",
     [
         "data",
         "file_size",
         "movie_name",
+        "movie_creation_time",
     ],
 )
 
 
+def accumulated_motion(
+    x_shifts, y_shifts, cutoff_frame: int
+) -> Tuple[float, float, float]:
+    """
+    Total, early and late motion from the shifts of each frame of a movie.
+    Motion onto frames before cutoff_frame is early, and the rest is late.
+    """
+    steps = np.hypot(np.diff(x_shifts), np.diff(y_shifts))
+    early_steps = max(cutoff_frame - 1, 0)
+    return (
+        float(steps.sum()),
+        float(steps[:early_steps].sum()),
+        float(steps[early_steps:].sum()),
+    )
+
+
+def _drift_shifts(drift_star_file) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    try:
+        star_doc = cif.read_file(os.fspath(drift_star_file))
+    except (FileNotFoundError, OSError, RuntimeError, ValueError):
+        return None
+    for block in star_doc:
+        x_shifts = block.find_loop("_rlnMicrographShiftX")
+        if len(x_shifts):
+            return (
+                np.array(x_shifts, dtype=float),
+                np.array(block.find_loop("_rlnMicrographShiftY"), dtype=float),
+            )
+    return None
+
+
+def write_drift_plot(drift_star_file, plot_file) -> bool:
+    """Write a plotly json scatter plot of the shifts in a drift star file"""
+    shifts = _drift_shifts(drift_star_file)
+    if shifts is None:
+        return False
+    try:
+        px.scatter(x=shifts[0], y=shifts[1]).write_json(os.fspath(plot_file))
+    except FileNotFoundError:
+        return False
+    return True
+
+
 class MotionCorr(JobType):
-    def __init__(self, path):
+    # more drift plots than this are written in a pool of processes
+    parallel_plot_threshold = 50
+
+    def __init__(self, path, drift_cache=None):
         super().__init__(path)
+        self._drift_cache = drift_cache or {}
+        # modification times of the drift files of plots known to be up to date
+        self._plotted: Dict[str, int] = {}
 
     def __eq__(self, other):
         if isinstance(other, MotionCorr):  # check this
@@ -90,92 +146,223 @@ class MotionCorr(JobType):
             logger.debug(f"_rlnAccumMotionTotal not found in file {file}")
             return []
 
-        accum_motion_total = self.parse_star_file(
-            "_rlnAccumMotionTotal", file, info_table
+        columns = self.parse_star_loop(
+            [
+                "_rlnMicrographName",
+                "_rlnAccumMotionTotal",
+                "_rlnAccumMotionEarly",
+                "_rlnAccumMotionLate",
+            ],
+            file,
+            info_table,
         )
-        accum_motion_late = self.parse_star_file(
-            "_rlnAccumMotionLate", file, info_table
-        )
-        accum_motion_early = self.parse_star_file(
-            "_rlnAccumMotionEarly", file, info_table
-        )
-        micrograph_name = self.parse_star_file("_rlnMicrographName", file, info_table)
 
-        micrograph_list = []
-        for j in range(len(micrograph_name)):
+        frame_counts = []
+        drift_plots = []
+        movie_creation_times = []
+        for micrograph_name in columns["_rlnMicrographName"]:
             (
                 number_of_frames,
                 drift_plot_full_path,
-                movie_name,
-            ) = self.collect_drift_data(micrograph_name[j], jobdir)
-            if movie_name:
-                try:
-                    movie_creation_time = (
-                        (self._basepath.parent / movie_name).resolve().stat().st_ctime
-                    )
-                except FileNotFoundError:
-                    logger.debug(
-                        f"failed to find movie {self._basepath.parent / movie_name} so using default timestamp"
-                    )
-                    movie_creation_time = None
-            else:
-                movie_creation_time = None
-            micrograph_list.append(
-                MCMicrograph(
-                    str(self._basepath.parent / micrograph_name[j]),
-                    str(self._basepath.parent / micrograph_name[j]).replace(
-                        ".mrc", ".jpeg"
-                    ),
-                    j + 1,
-                    accum_motion_total[j],
-                    accum_motion_early[j],
-                    accum_motion_late[j],
-                    float(accum_motion_total[j]) / number_of_frames,
-                    movie_creation_time,
-                    drift_plot_full_path,
+                _,
+                movie_creation_time,
+            ) = self.collect_drift_data(micrograph_name, jobdir)
+            frame_counts.append(number_of_frames)
+            drift_plots.append(drift_plot_full_path)
+            movie_creation_times.append(movie_creation_time)
+        average_motion_per_frame = np.array(
+            columns["_rlnAccumMotionTotal"], dtype=float
+        ) / np.array(frame_counts, dtype=float)
+
+        return [
+            MCMicrograph(
+                str(self._basepath.parent / micrograph_name),
+                str(self._basepath.parent / micrograph_name).replace(".mrc", ".jpeg"),
+                j + 1,
+                accum_motion_total,
+                accum_motion_early,
+                accum_motion_late,
+                float(average_motion),
+                movie_creation_time,
+                drift_plot_full_path,
+            )
+            for j, (
+                micrograph_name,
+                accum_motion_total,
+                accum_motion_early,
+                accum_motion_late,
+                average_motion,
+                movie_creation_time,
+                drift_plot_full_path,
+            ) in enumerate(
+                zip(
+                    *columns.values(),
+                    average_motion_per_frame,
+                    movie_creation_times,
+                    drift_plots,
                 )
             )
-        return micrograph_list
+        ]
+
+    @staticmethod
+    def _drift_star_file(mic_name, jobdir):
+        return mic_name.split(jobdir + "/")[-1].replace("mrc", "star")
+
+    def _drift_plot_path(self, mic_name) -> Path:
+        return (
+            self._basepath.parent
+            / Path(mic_name).parent
+            / (Path(mic_name).stem + "_drift_plot.json")
+        )
+
+    def _movie_creation_time(self, movie_name):
+        if not movie_name:
+            return None
+        try:
+            return (self._basepath.parent / movie_name).resolve().stat().st_ctime
+        except FileNotFoundError:
+            logger.debug(
+                f"failed to find movie {self._basepath.parent / movie_name} so using default timestamp"
+            )
+            return None
 
     def collect_drift_data(self, mic_name, jobdir):
-        drift_star_file_path = mic_name.split(jobdir + "/")[-1].replace("mrc", "star")
+        """
+        Find the number of frames and the movie of a micrograph from its drift
+        star file, and the creation time of the movie. The path at which the drift
+        plot is written by write_drift_plots is also given, but the shifts
+        themselves are only read by drift.
+        """
+        drift_star_file_path = self._drift_star_file(mic_name, jobdir)
+        # drift files are written once per micrograph so when a job is reloaded
+        # only those that are new (or have changed size) need to be read again
+        self._track(self._basepath / jobdir / drift_star_file_path)
+        job_drift_cache = self._drift_cache.setdefault(jobdir, {})
+        cached = job_drift_cache.get(drift_star_file_path)
+        if cached:
+            try:
+                if (
+                    cached.file_size
+                    == (self._basepath / jobdir / drift_star_file_path).stat().st_size
+                ):
+                    return (*cached.data, cached.movie_name, cached.movie_creation_time)
+            except FileNotFoundError:
+                return 1, "", "", None
         try:
             drift_star_file = self._read_star_file(jobdir, drift_star_file_path)
         except (FileNotFoundError, OSError, RuntimeError, ValueError):
-            return 1, "", ""
-        try:
-            info_table = self._find_table_from_column_name(
-                "_rlnMicrographFrameNumber", drift_star_file
-            )
-            movie_table = 0
-        except (FileNotFoundError, OSError, RuntimeError, ValueError):
-            return 1, "", ""
+            return 1, "", "", None
+        info_table = self._find_table_from_column_name(
+            "_rlnMicrographFrameNumber", drift_star_file
+        )
         if info_table is None:
             logger.debug(
                 f"_rlnMicrographFrameNumber or _rlnMicrographMovieName not found in file {drift_star_file}"
             )
-            return 1, "", ""
-        deltaxs = self.parse_star_file(
-            "_rlnMicrographShiftX", drift_star_file, info_table
-        )
-        deltays = self.parse_star_file(
-            "_rlnMicrographShiftY", drift_star_file, info_table
+            return 1, "", "", None
+        number_of_frames = len(
+            drift_star_file[info_table].find_loop("_rlnMicrographShiftX")
         )
         movie_name = self.parse_star_file_pair(
-            "_rlnMicrographMovieName", drift_star_file, movie_table
+            "_rlnMicrographMovieName", drift_star_file, 0
         )
+        movie_creation_time = self._movie_creation_time(movie_name)
+        drift_plot_full_path = str(self._drift_plot_path(mic_name))
         try:
-            fig = px.scatter(
-                x=np.array(deltaxs, dtype=float), y=np.array(deltays, dtype=float)
-            )
-            drift_plot_name = Path(mic_name).stem + "_drift_plot.json"
-            drift_plot_full_path = (
-                self._basepath.parent / Path(mic_name).parent / drift_plot_name
+            job_drift_cache[drift_star_file_path] = MCDriftCacheRecord(
+                (number_of_frames, drift_plot_full_path),
+                (self._basepath / jobdir / drift_star_file_path).stat().st_size,
+                movie_name,
+                movie_creation_time,
             )
-            fig.write_json(drift_plot_full_path)
         except FileNotFoundError:
-            return 1, "", ""
-        return len(deltaxs), str(drift_plot_full_path), movie_name
+            return 1, "", "", None
+        return number_of_frames, drift_plot_full_path, movie_name, movie_creation_time
+
+    def drift(self, jobdir, mic_name) -> Optional[MCMicrographDrift]:
+        """Read the shifts of each frame of a micrograph from its drift star file"""
+        try:
+            drift_star_file = self._read_star_file(
+                jobdir, self._drift_star_file(mic_name, jobdir)
+            )
+        except (FileNotFoundError, OSError, RuntimeError, ValueError):
+            return None
+        info_table = self._find_table_from_column_name(
+            "_rlnMicrographFrameNumber", drift_star_file
+        )
+        if info_table is None:
+            return None
+        columns = self.parse_star_loop(
+            [
+                "_rlnMicrographFrameNumber",
+                "_rlnMicrographShiftX",
+                "_rlnMicrographShiftY",
+            ],
+            drift_star_file,
+            info_table,
+            dtypes={
+                "_rlnMicrographFrameNumber": int,
+                "_rlnMicrographShiftX": float,
+                "_rlnMicrographShiftY": float,
+            },
+        )
+        return MCMicrographDrift(*columns.values())
+
+    def write_drift_plots(self, jobs=None, max_workers=None) -> List[str]:
+        """
+        Write the drift plot of each micrograph of the given jobs, or of all jobs.
+        Plots which are newer than their drift star file are kept, so this can be
+        called again whenever new micrographs have been found. Many plots are
+        written in parallel in a pool of processes.
+        Returns the paths of the plots that were written.
+        """
+        to_write = []
+        for job in jobs or self.jobs:
+            for micrograph in self[job]:
+                if not micrograph.drift_plot_full_path:
+                    continue
+                drift_star_file = (
+                    self._basepath
+                    / job
+                    / self._drift_star_file(micrograph.micrograph_name, job)
+                )
+                plot_file = micrograph.drift_plot_full_path
+                try:
+                    drift_time = drift_star_file.stat().st_mtime_ns
+                except FileNotFoundError:
+                    continue
+                if self._plotted.get(plot_file) == drift_time:
+                    continue
+                try:
+                    if os.stat(plot_file).st_mtime_ns >= drift_time:
+                        self._plotted[plot_file] = drift_time
+                        continue
+                except FileNotFoundError:
+                    pass
+                to_write.append((drift_star_file, plot_file, drift_time))
+
+        if len(to_write) > self.parallel_plot_threshold and max_workers != 1:
+            with ProcessPoolExecutor(max_workers=max_workers) as pool:
+                written = list(
+                    pool.map(
+                        write_drift_plot,
+                        [drift_star_file for drift_star_file, _, _ in to_write],
+                        [plot_file for _, plot_file, _ in to_write],
+                        chunksize=16,
+                    )
+                )
+        else:
+            written = [
+                write_drift_plot(drift_star_file, plot_file)
+                for drift_star_file, plot_file, _ in to_write
+            ]
+
+        written_plots = []
+        for (_, plot_file, drift_time), success in zip(to_write, written):
+            if success:
+                self._plotted[plot_file] = drift_time
+                written_plots.append(plot_file)
+        return written_plots
 
     @staticmethod
     def for_cache(mcmicrograph):
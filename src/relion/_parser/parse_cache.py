@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import functools
+import hashlib
+import importlib
+import inspect
+import json
+import logging
+import os
+import pathlib
+import sqlite3
+from contextlib import closing
+
+import numpy as np
+
+logger = logging.getLogger("relion._parser.parse_cache")
+
+# bump when the layout of the cache tables changes
+SCHEMA_VERSION = 2
+
+
+@functools.lru_cache(maxsize=None)
+def _code_version(parser_class) -> str:
+    # results are only reused if none of the code that produced them has changed
+    code = hashlib.sha256()
+    for cls in parser_class.__mro__:
+        if cls.__module__.startswith("relion."):
+            try:
+                code.update(inspect.getsource(inspect.getmodule(cls)).encode())
+            except (OSError, TypeError):
+                code.update(cls.__qualname__.encode())
+    code.update(inspect.getsource(inspect.getmodule(_code_version)).encode())
+    return code.hexdigest()
+
+
+def _to_json(value):
+    # JSON has no tuples and only string keys, so these are tagged to be rebuilt
+    if isinstance(value, tuple) and hasattr(value, "_fields"):
+        cls = type(value)
+        return {
+            "namedtuple": f"{cls.__module__}:{cls.__qualname__}",
+            "values": [_to_json(v) for v in value],
+        }
+    if isinstance(value, tuple):
+        return {"tuple": [_to_json(v) for v in value]}
+    if isinstance(value, list):
+        return [_to_json(v) for v in value]
+    if isinstance(value, dict):
+        return {"dict": [[_to_json(k), _to_json(v)] for k, v in value.items()]}
+    if isinstance(value, np.generic):
+        return value.item()
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    raise TypeError(f"Cannot store {type(value).__name__} in the parse cache")
+
+
+@functools.lru_cache(maxsize=None)
+def _namedtuple(name: str):
+    # only result types defined by this package are rebuilt
+    module_name, _, qualname = name.partition(":")
+    if not module_name.startswith("relion."):
+        raise ValueError(f"Not a result type: {name}")
+    cls = importlib.import_module(module_name)
+    for attribute in qualname.split("."):
+        cls = getattr(cls, attribute)
+    if not (isinstance(cls, type) and issubclass(cls, tuple)):
+        raise ValueError(f"Not a result type: {name}")
+    return cls
+
+
+def _from_json(value):
+    if isinstance(value, list):
+        return [_from_json(v) for v in value]
+    if not isinstance(value, dict):
+        return value
+    if "tuple" in value:
+        return tuple(_from_json(v) for v in value["tuple"])
+    if "dict" in value:
+        return {_from_json(k): _from_json(v) for k, v in value["dict"]}
+    return _namedtuple(value["namedtuple"])(*(_from_json(v) for v in value["values"]))
+
+
+class ParseCache:
+    """
+    Persistent store of the results parsed from Relion job directories, kept in
+    a sqlite database (by default in the .relion_cache directory of a project).
+    Results for a job are stored together with the path, size, modification
+    time and inode of every file that was read to produce them, and are only
+    returned while all of those files are unchanged and the parser code is the
+    same as when they were stored.
+    Results are stored as JSON, as the cache is kept in a directory which other
+    users can write to, and reading it must not run any code.
+    """
+
+    def __init__(self, db_path):
+        self._db_path = pathlib.Path(db_path)
+        self._usable = True
+        try:
+            self._db_path.parent.mkdir(parents=True, exist_ok=True)
+            with closing(self._connect()) as conn, conn:
+                if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                    conn.execute("DROP TABLE IF EXISTS job_results")
+                    conn.execute(
+                        "CREATE TABLE job_results ("
+                        "parser TEXT NOT NULL, "
+                        "job_path TEXT NOT NULL, "
+                        "code_version TEXT NOT NULL, "
+                        "inputs TEXT NOT NULL, "
+                        "results TEXT NOT NULL, "
+                        "PRIMARY KEY (parser, job_path))"
+                    )
+                    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        except (OSError, sqlite3.Error):
+            logger.warning(
+                f"Could not set up the parse cache at {self._db_path}", exc_info=True
+            )
+            self._usable = False
+
+    def _connect(self):
+        return sqlite3.connect(self._db_path, timeout=10)
+
+    @staticmethod
+    def _key(parser, job):
+        return (
+            f"{type(parser).__module__}.{type(parser).__qualname__}",
+            os.fspath(parser._basepath / job),
+        )
+
+    def get(self, parser, job):
+        """
+        Return the stored (results, inputs) of a job if they are still valid,
+        otherwise None
+        """
+        if not self._usable:
+            return None
+        try:
+            with closing(self._connect()) as conn:
+                row = conn.execute(
+                    "SELECT code_version, inputs, results FROM job_results "
+                    "WHERE parser = ? AND job_path = ?",
+                    self._key(parser, job),
+                ).fetchone()
+        except sqlite3.Error:
+            logger.debug(f"Could not read from {self._db_path}", exc_info=True)
+            return None
+        if row is None or row[0] != _code_version(type(parser)):
+            return None
+        inputs = {
+            path: tuple(signature) if signature is not None else None
+            for path, signature in json.loads(row[1]).items()
+        }
+        if any(
+            parser._file_signature(path) != signature
+            for path, signature in inputs.items()
+        ):
+            return None
+        try:
+            return _from_json(json.loads(row[2])), inputs
+        except Exception:
+            logger.debug(f"Could not read stored results for {job}", exc_info=True)
+            return None
+
+    def put(self, parser, job, results, inputs):
+        """Store the results of a job and the signatures of the files they came from"""
+        if not self._usable:
+            return
+        try:
+            with closing(self._connect()) as conn, conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO job_results VALUES (?, ?, ?, ?, ?)",
+                    (
+                        *self._key(parser, job),
+                        _code_version(type(parser)),
+                        json.dumps(inputs),
+                        json.dumps(_to_json(results)),
+                    ),
+                )
+        except (sqlite3.Error, TypeError, ValueError):
+            logger.debug(f"Could not write to {self._db_path}", exc_info=True)
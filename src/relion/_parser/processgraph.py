@@ -36,52 +36,50 @@ class ProcessGraph(Graph):
         return self._node_list[index]
 
     def get_by_name(self, name):
-        for i, j in enumerate(self):
-            if j.name == name:
-                return self._node_list[i]
+        self._lookup()
+        named = self._named.get(name)
+        if named:
+            return named[0]
         return None
 
     def extend(self, other):
         if not isinstance(other, ProcessGraph):
             raise ValueError("Can only extend a ProcessGraph with another ProcessGraph")
         self._node_list.extend(other._node_list)
-
-    def index(self, node):
-        return self._node_list.index(node)
-
-    def link_from_to(self, from_node, to_node):
-        self[self.index(from_node)].link_to(to_node)
+        self._invalidate()
 
     def node_explore(self, node, explored):
         if not isinstance(node, ProcessNode):
             raise ValueError(
                 f"ProcessGraph.node_explore must be called with a ProcessNode (not {type(node)}: {node}) as the starting point; a string or similar is insufficient"
             )
-        if node not in explored:
-            explored.append(node)
-        for next_node in node:
-            self.node_explore(next_node, explored)
+        self._explore(node, explored)
 
     def add_node(self, new_node):
         if isinstance(new_node, ProcessNode):
             self._node_list.append(new_node)
+            self._invalidate()
         else:
             raise ValueError("Attempted to add a node that was not a ProcessNode")
 
     def merge(self, other):
-        node_names = [p._path for p in self]
-        other_names = [p._path for p in other]
-        if len(set(node_names).intersection(set(other_names))) > 0:
-            for new_node in other:
-                if new_node._path not in self:
-                    self.add_node(new_node)
-                else:
-                    for next_node in new_node:
-                        if next_node._path not in self[self.index(new_node._path)]:
-                            self[self.index(new_node._path)].link_to(next_node)
-            return True
-        else:
+        nodes_by_path = {}
+        for p in self:
+            nodes_by_path.setdefault(str(p._path), p)
+        if not nodes_by_path.keys() & {str(p._path) for p in other}:
             return False
+        for new_node in other:
+            existing = nodes_by_path.get(str(new_node._path))
+            if existing is None:
+                self.add_node(new_node)
+                nodes_by_path[str(new_node._path)] = new_node
+            else:
+                linked = {str(n._path) for n in existing}
+                for next_node in new_node:
+                    if str(next_node._path) not in linked:
+                        existing.link_to(next_node)
+                        linked.add(str(next_node._path))
+        return True
 
     def split_connected(self):
         if len(self._node_list) == 0:
@@ -131,3 +129,4 @@ class ProcessGraph(Graph):
 
     def wipe(self):
         self._node_list = []
+        self._invalidate()
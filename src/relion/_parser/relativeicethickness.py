@@ -75,6 +75,7 @@ class RelativeIceThickness(JobType):
         return micrograph_list
 
     def csv_to_dict(self, file_path):
+        self._track(file_path)
         with open(file_path, newline="") as csvfile:
             list_row_dicts = list(csv.DictReader(csvfile))
             combi_dict = {}
@@ -15,12 +15,13 @@ try:
     from graphviz import Digraph
 except ImportError:
     pass
-import calendar
 import copy
 import datetime
 
 from relion._parser.processgraph import ProcessGraph
 from relion._parser.processnode import ProcessNode
+from relion._parser.schedule_log import ScheduleLogIndex
+from relion.node import Node
 
 
 def _max_class(ini_model_dir: Path) -> int:
@@ -36,6 +37,31 @@ def _max_class(ini_model_dir: Path) -> int:
     return int(counts.most_common(1)[0][0])
 
 
+def _copy_unlinked(node: ProcessNode) -> ProcessNode:
+    # copy a node and its environment without following its links to other nodes
+    node_copy = copy.copy(node)
+    node_copy._out = []
+    node_copy._in = []
+    node_copy._completed = []
+    node_copy._link_traffic = copy.deepcopy(node._link_traffic)
+    node_copy._share_traffic = copy.deepcopy(node._share_traffic)
+    node_copy._append_traffic = copy.deepcopy(node._append_traffic)
+    node_copy.environment = node.environment.copy()
+    return node_copy
+
+
+def _copy_linked(nodes: list) -> dict:
+    # copy nodes along with the links between them, keyed by the id of the original
+    originals = {id(node): node for node in nodes}
+    copies = {nid: _copy_unlinked(node) for nid, node in originals.items()}
+    for nid, node_copy in copies.items():
+        original = originals[nid]
+        node_copy._out = [copies[id(n)] for n in original._out if id(n) in copies]
+        node_copy._in = [copies[id(n)] for n in original._in if id(n) in copies]
+    Node._link_version += 1
+    return copies
+
+
 class RelionPipeline:
     def __init__(self, origin, graphin=ProcessGraph("nodes", []), locklist=None):
         self.origin = origin
@@ -49,6 +75,7 @@ class RelionPipeline:
         self._jobs_collapsed = False
         self.locklist = locklist or []
         self.preprocess = []
+        self._schedule_logs = ScheduleLogIndex()
 
     def __iter__(self):
         if not self._jobs_collapsed:
@@ -121,7 +148,7 @@ class RelionPipeline:
         self._nodes.extend(file_nodes)
         self._nodes.extend(job_nodes)
         binding_pairs = [
-            (ProcessNode(p1), ProcessNode(p2))
+            (pathlib.PurePosixPath(p1), pathlib.PurePosixPath(p2))
             for p1, p2 in zip(
                 self._request_star_values(
                     star_doc_from_path, "_rlnPipeLineEdgeFromNode"
@@ -135,7 +162,7 @@ class RelionPipeline:
         ]
         binding_pairs.extend(
             [
-                (ProcessNode(p1), ProcessNode(p2))
+                (pathlib.PurePosixPath(p1), pathlib.PurePosixPath(p2))
                 for p1, p2 in zip(
                     self._request_star_values(
                         star_doc_from_path,
@@ -148,40 +175,38 @@ class RelionPipeline:
                 )
             ]
         )
+        nodes_by_path = {}
+        for node in self._nodes:
+            nodes_by_path.setdefault(str(node._path), node)
+
+        def _pipeline_node(path):
+            try:
+                return nodes_by_path[str(path)]
+            except KeyError:
+                raise ValueError(f"{path} is not a node in {star_path}")
+
         for f, t in binding_pairs:
-            self._nodes[self._nodes.index(f._path)].link_to(
-                self._nodes[self._nodes.index(t._path)]
-            )
-            if str(f._path.parent.parent) == "Select" and f._path.name.startswith(
+            from_node = _pipeline_node(f)
+            from_node.link_to(_pipeline_node(t))
+            if str(f.parent.parent) == "Select" and f.name.startswith(
                 "particles_split"
             ):
-                self._nodes[self._nodes.index(f._path)].environment[
-                    "batch_number"
-                ] = f._path.stem.replace("particles_split", "")
-                self._nodes[self._nodes.index(f._path)].environment["inject"] = [
-                    ("batch_number", "batch_number")
-                ]
-                self._nodes[self._nodes.index(f._path)].propagate(
-                    ("batch_number", "batch_number")
+                from_node.environment["batch_number"] = f.stem.replace(
+                    "particles_split", ""
                 )
-                self._nodes[self._nodes.index(f._path)].propagate(("inject", "inject"))
-            if str(f._path.parent.parent) == "InitialModel" and "class" in f._path.name:
-                self._nodes[self._nodes.index(f._path)].environment[
-                    "init_model_class_num"
-                ] = int(f._path.stem.split("class")[-1].split("_")[0])
-                self._nodes[self._nodes.index(f._path)].propagate(
-                    ("init_model_class_num", "init_model_class_num")
+                from_node.environment["inject"] = [("batch_number", "batch_number")]
+                from_node.propagate(("batch_number", "batch_number"))
+                from_node.propagate(("inject", "inject"))
+            if str(f.parent.parent) == "InitialModel" and "class" in f.name:
+                from_node.environment["init_model_class_num"] = int(
+                    f.stem.split("class")[-1].split("_")[0]
                 )
-            elif (
-                str(f._path.parent.parent) == "InitialModel"
-                and "initial" in f._path.name
-            ):
-                self._nodes[self._nodes.index(f._path)].environment[
-                    "init_model_class_num"
-                ] = _max_class(Path(star_path).parent / f._path.parent)
-                self._nodes[self._nodes.index(f._path)].propagate(
-                    ("init_model_class_num", "init_model_class_num")
+                from_node.propagate(("init_model_class_num", "init_model_class_num"))
+            elif str(f.parent.parent) == "InitialModel" and "initial" in f.name:
+                from_node.environment["init_model_class_num"] = _max_class(
+                    Path(star_path).parent / f.parent
                 )
+                from_node.propagate(("init_model_class_num", "init_model_class_num"))
         self._nodes._split_connected(self._connected, self.origin, self.origins)
         self._set_job_nodes(star_doc_from_path)
 
@@ -229,15 +254,72 @@ class RelionPipeline:
             node.environment["status"] = None
 
     def _set_job_nodes(self, star_doc):
-        self._job_nodes = copy.deepcopy(self._nodes)
-        file_nodes = self._load_file_nodes_from_star(star_doc)
-        for fnode in file_nodes:
-            if str(
-                fnode._path.parent.parent
-            ) == "Select" and fnode._path.name.startswith("particles_split"):
-                self._job_nodes.remove_node(fnode._path, advance=True)
+        # project the file and job graph onto the jobs: each file node is removed in
+        # turn (in the order they appear in the star file) and the jobs that wrote it
+        # are linked to the jobs that read it, as ProcessGraph.remove_node would do
+        file_paths = {
+            str(pathlib.PurePosixPath(p))
+            for p in self._request_star_values(star_doc, "_rlnPipeLineNodeName")
+        }
+        members = {}
+        for node in self._nodes:
+            members.setdefault(id(node), node)
+        positions = {nid: i for i, nid in enumerate(members)}
+        out_links = {
+            nid: dict.fromkeys(id(c) for c in node._out if id(c) in members)
+            for nid, node in members.items()
+        }
+        in_links = {
+            nid: [
+                id(p) for p in node._in if id(p) in members and nid in out_links[id(p)]
+            ]
+            for nid, node in members.items()
+        }
+        job_copies = {
+            nid: _copy_unlinked(node)
+            for nid, node in members.items()
+            if str(node._path) not in file_paths
+        }
+        # propagated values received by file nodes from upstream file nodes
+        file_propagation = {}
+        for nid, node in members.items():
+            if nid in job_copies:
+                continue
+            if nid in file_propagation:
+                released = True
+                store = {**node.environment.propagate.store, **file_propagation[nid]}
             else:
-                self._job_nodes.remove_node(fnode._path)
+                released = node.environment.propagate.released
+                store = node.environment.propagate.store
+            advance = str(
+                node._path.parent.parent
+            ) == "Select" and node._path.name.startswith("particles_split")
+            if released:
+                for cid in out_links[nid]:
+                    if cid in job_copies:
+                        job_copies[cid].environment.update_prop(store)
+                        if advance:
+                            job_copies[cid].environment.update(store)
+                    else:
+                        file_propagation.setdefault(cid, {}).update(store)
+            behind = sorted(set(in_links[nid]), key=positions.get)
+            for pid in behind:
+                out_links[pid].pop(nid, None)
+            for cid in out_links[nid]:
+                if nid in in_links[cid]:
+                    in_links[cid].remove(nid)
+            for pid in behind:
+                for cid in out_links[nid]:
+                    if cid not in out_links[pid]:
+                        out_links[pid][cid] = None
+                        in_links[cid].append(pid)
+        for nid, node in job_copies.items():
+            node._out = [job_copies[cid] for cid in out_links[nid]]
+            node._in = [job_copies[pid] for pid in in_links[nid]]
+            for next_node in node._out:
+                node._link_traffic.setdefault(next_node.nodeid, {})
+        Node._link_version += 1
+        self._job_nodes = ProcessGraph("job nodes", list(job_copies.values()))
         self._job_nodes._split_connected(
             self._connected_jobs, self.origin, self.job_origins
         )
@@ -250,8 +332,9 @@ class RelionPipeline:
         self._job_nodes.node_explore(
             self._job_nodes[self._job_nodes.index(self.origin)], ordered_graph
         )
+        copies = _copy_linked(list(self._job_nodes) + ordered_graph)
         self._jobtype_nodes = ProcessGraph(
-            "job type nodes", copy.deepcopy(ordered_graph)
+            "job type nodes", [copies[id(node)] for node in ordered_graph]
         )
         for node in self._jobtype_nodes:
             node.environment["job"] = node._path.name
@@ -355,13 +438,18 @@ class RelionPipeline:
         digraph.render(basepath / "Pipeline" / "relion_pipeline_jobs.gv")
 
     def collect_cluster_info(self, basepath: pathlib.Path):
-        # preload schedule log files
+        # bring the schedule log index up to date
         logs = {
-            "preproc": self._get_log(basepath / "pipeline_PREPROCESS.log"),
-            "class2d": self._get_log(basepath / "pipeline_CLASS2D.log"),
-            "inimodel": self._get_log(basepath / "pipeline_INIMODEL.log"),
-            "class3d": self._get_log(basepath / "pipeline_CLASS3D.log"),
-            "ibgroup": self._get_log(basepath / "pipeline_ICEBREAKER_GROUP.log"),
+            "preproc": basepath / "pipeline_PREPROCESS.log",
+            "class2d": basepath / "pipeline_CLASS2D.log",
+            "inimodel": basepath / "pipeline_INIMODEL.log",
+            "class3d": basepath / "pipeline_CLASS3D.log",
+            "ibgroup": basepath / "pipeline_ICEBREAKER_GROUP.log",
+        }
+        logs = {
+            sched: log_path
+            for sched, log_path in logs.items()
+            if self._schedule_logs.update(log_path)
         }
         with ThreadPoolExecutor(max_workers=10) as pool:
             lock = RLock()
@@ -427,7 +515,7 @@ class RelionPipeline:
         job: str,
         basepath: pathlib.Path,
         lock: RLock,
-        schedule_log: Optional[list] = None,
+        schedule_log: Optional[pathlib.Path] = None,
     ):
         try:
             with open(basepath / job._path / "run.out") as logfile:
@@ -483,33 +571,13 @@ class RelionPipeline:
             mic_counts = None
         return cluster_ids, t, mic_counts
 
-    def _get_job_times(self, log: list, job_path: pathlib.Path) -> list:
-        times = []
-        for lindex, line in enumerate(log):
-            if "Executing" in line and str(job_path) in line:
-                split_line = log[lindex - 1].split()
-                time_split = split_line[4].split(":")
-                dtime = datetime.datetime(
-                    year=int(split_line[5]),
-                    month=list(calendar.month_abbr).index(split_line[2]),
-                    day=int(split_line[3]),
-                    hour=int(time_split[0]),
-                    minute=int(time_split[1]),
-                    second=int(time_split[2]),
-                )
-                times.append(dtime)
-        return times
-
-    @staticmethod
-    def _get_log(log_path):
-        try:
-            with open(log_path) as f:
-                log = f.readlines()
-            return log
-        except FileNotFoundError:
-            return []
+    def _get_job_times(self, log: pathlib.Path, job_path: pathlib.Path) -> list:
+        return self._schedule_logs.job_times(log, job_path)
 
     def collect_job_times(self, schedule_logs, preproc_log=None):
+        schedule_logs = list(schedule_logs)
+        for log in schedule_logs:
+            self._schedule_logs.update(log)
         for job in self._job_nodes:
             jtime, jcount = self._lookup_job_time(schedule_logs, job)
             job.environment["start_time_stamp"] = jtime
@@ -561,27 +629,7 @@ class RelionPipeline:
             node.environment["end_time"] = just_seconds(datetime.timedelta(seconds=rt))
 
     def _lookup_job_time(self, schedule_logs, job):
-        time = None
-        jobcount = 0
-        for log in schedule_logs:
-            with open(log, "r") as slf:
-                lines = slf.readlines()
-                for lindex, line in enumerate(lines):
-                    if "Executing" in line and str(job._path) in line:
-                        split_line = lines[lindex - 1].split()
-                        time_split = split_line[4].split(":")
-                        dtime = datetime.datetime(
-                            year=int(split_line[5]),
-                            month=list(calendar.month_abbr).index(split_line[2]),
-                            day=int(split_line[3]),
-                            hour=int(time_split[0]),
-                            minute=int(time_split[1]),
-                            second=int(time_split[2]),
-                        )
-                        if time is None or dtime > time:
-                            time = dtime
-                        jobcount += 1
-        return time, jobcount
+        return self._schedule_logs.latest_job_time(schedule_logs, job._path)
 
     @property
     def current_jobs(self):
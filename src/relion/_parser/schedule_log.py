@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import calendar
+import datetime
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+_job_path_pattern = re.compile(r"[\w-]+/job\d+")
+
+
+def _schedule_time(line: str) -> datetime.datetime:
+    # the line before an "Executing" line holds the time the job was started at
+    split_line = line.split()
+    time_split = split_line[4].split(":")
+    return datetime.datetime(
+        year=int(split_line[5]),
+        month=list(calendar.month_abbr).index(split_line[2]),
+        day=int(split_line[3]),
+        hour=int(time_split[0]),
+        minute=int(time_split[1]),
+        second=int(time_split[2]),
+    )
+
+
+class _ScheduleLog:
+    def __init__(self):
+        self.file_id = None
+        self.offset = 0
+        self.previous_line = None
+        self.has_lines = False
+        self.job_times: Dict[str, List[datetime.datetime]] = {}
+
+
+class ScheduleLogIndex:
+    """
+    Index of the jobs executed by Relion schedulers (pipeline_*.log files).
+    Each log is only read once: a byte offset is kept per log so that later
+    updates only parse lines appended since the previous update.
+    """
+
+    def __init__(self):
+        self._logs: Dict[str, _ScheduleLog] = {}
+
+    def update(self, log_path) -> bool:
+        """
+        Read any new complete lines in a schedule log. Returns False if the log
+        does not exist or is empty.
+        """
+        key = os.fspath(log_path)
+        try:
+            with open(log_path, "rb") as log_file:
+                stat = os.fstat(log_file.fileno())
+                log = self._logs.get(key)
+                if (
+                    log is None
+                    or log.file_id != (stat.st_dev, stat.st_ino)
+                    or stat.st_size < log.offset
+                ):
+                    # new, replaced or truncated log: start again from the beginning
+                    log = self._logs[key] = _ScheduleLog()
+                    log.file_id = (stat.st_dev, stat.st_ino)
+                log_file.seek(log.offset)
+                for raw_line in log_file:
+                    if not raw_line.endswith(b"\n"):
+                        # leave a partially written line for the next update
+                        break
+                    log.offset += len(raw_line)
+                    self._index_line(log, raw_line.decode(errors="replace"))
+        except FileNotFoundError:
+            self._logs.pop(key, None)
+            return False
+        return log.has_lines
+
+    @staticmethod
+    def _index_line(log: _ScheduleLog, line: str):
+        previous_line = log.previous_line
+        log.previous_line = line
+        log.has_lines = True
+        if "Executing" not in line or previous_line is None:
+            return
+        try:
+            dtime = _schedule_time(previous_line)
+        except (IndexError, ValueError):
+            return
+        for job_path in dict.fromkeys(_job_path_pattern.findall(line)):
+            log.job_times.setdefault(job_path, []).append(dtime)
+
+    def job_times(self, log_path, job_path) -> List[datetime.datetime]:
+        """Start times of a job in a single schedule log, in the order they were logged"""
+        log = self._logs.get(os.fspath(log_path))
+        if log is None:
+            return []
+        return list(log.job_times.get(str(job_path), []))
+
+    def latest_job_time(
+        self, log_paths, job_path
+    ) -> Tuple[Optional[datetime.datetime], int]:
+        """The latest start time of a job across schedule logs, and how many times it was started"""
+        latest = None
+        count = 0
+        for log_path in log_paths:
+            times = self.job_times(log_path, job_path)
+            if times:
+                count += len(times)
+                if latest is None or max(times) > latest:
+                    latest = max(times)
+        return latest, count
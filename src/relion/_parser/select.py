@@ -72,6 +72,7 @@ class Select(JobType):
         names = self.parse_star_file("_rlnReferenceImage", file, info_table)
 
         class2d_job_string = self._get_class2d_job_string(jobdir, "job.star")
+        self._track(self._basepath / jobdir / "RELION_JOB_EXIT_SUCCESS")
         select_mod_time = (
             (self._basepath / jobdir / "RELION_JOB_EXIT_SUCCESS").stat().st_mtime
         )
@@ -1,109 +1,221 @@
 from __future__ import annotations
 
+import collections
+import functools
 import json
 import logging
 import os
+import pathlib
+import threading
+from typing import Counter, Dict, List, Optional, Tuple
 
 import gemmi
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
 import plotly.express as px
 
 logger = logging.getLogger("relion.cryolo_relion_it.icebreaker_histogram")
 
+ice_column = "_rlnHelicalTubeID"
+x_label = "Relative estimated ice thickness"
+
 
 def create_json_histogram(working_directory, version: float = 3.1):
-    data = _get_data(working_directory, version=version)
-    if data is None:
-        return None
-
-    df = pd.DataFrame(data, columns=["Relative estimated ice thickness"])
-    fig = px.histogram(
-        df,
-        x="Relative estimated ice thickness",
-        title="Histogram of Icebreaker estimated ice thickness <br>Total number of particles = "
-        + str(len(data)),
-    )
-    if version == 4:
-        full_json_path_object = (
-            working_directory
-            / "IceBreaker"
-            / "Icebreaker_group_batch_1"
-            / "ice_hist.json"
-        )
-    else:
-        full_json_path_object = (
-            working_directory
-            / "External"
-            / "Icebreaker_group_batch_001"
-            / "ice_hist.json"
-        )
-    fig.write_json(
-        os.fspath(full_json_path_object)
-    )  # This plotly version doesn't support Path objects with write_json()
-    return full_json_path_object
+    histograms = create_histograms(working_directory, version=version)
+    return histograms[0] if histograms else None
 
 
 def create_pdf_histogram(working_directory, version: float = 3.1):
-    data = _get_data(working_directory, version=version)
-    if data is None:
-        return None
-
-    plt.hist(x=data, bins="auto", rwidth=0.9)
-    plt.xlabel("Relative estimated ice thickness")
-    plt.ylabel("Number of particles")
-    plt.title("Histogram of Icebreaker estimated ice thickness")
-    plt.legend(["Total number of particles = " + str(len(data))])
-    if version == 4:
-        full_pdf_path_object = (
-            working_directory
-            / "IceBreaker"
-            / "Icebreaker_group_batch_1"
-            / "ice_hist.pdf"
-        )
-    else:
-        full_pdf_path_object = (
-            working_directory
-            / "External"
-            / "Icebreaker_group_batch_001"
-            / "ice_hist.pdf"
-        )
-    plt.savefig(
-        os.fspath(full_pdf_path_object)
-    )  # This matplotlib version doesn't support Path objects with savefig()
-    return full_pdf_path_object
+    histograms = create_histograms(working_directory, version=version)
+    return histograms[1] if histograms else None
 
 
-def _get_data(working_directory, version: float = 3.1):
-    data = []
-    if version == 4:
-        icebreaker_paths = list(
-            (working_directory / "IceBreaker").glob("Icebreaker_group*")
-        )
-    else:
-        icebreaker_paths = list(
-            (working_directory / "External").glob("Icebreaker_group*")
-        )
-    if not len(icebreaker_paths):
-        return None
-    passed = []
-    for ibpath in icebreaker_paths:
-        particles_file = ibpath / "particles.star"
-        if particles_file.is_file():
-            passed.append(True)
-            current_data = extract_ice_column(particles_file)
-            if not current_data:
-                logger.debug(f"No ice thickness data extracted for {particles_file}.")
-            else:
-                data.extend(current_data)
+def create_histograms(
+    working_directory, version: float = 3.1
+) -> Optional[Tuple[pathlib.Path, pathlib.Path]]:
+    """
+    Write the JSON and PDF histograms of the ice thickness of the particles in
+    the Icebreaker grouping jobs, returning their paths, or None if any of the
+    jobs has not written its particles yet. Only rows appended since the last
+    call are read, and the histograms are only drawn again if they changed.
+    """
+    return _histogram(pathlib.Path(working_directory), version).write()
+
+
+@functools.lru_cache(maxsize=16)
+def _histogram(working_directory: pathlib.Path, version: float) -> IceHistogram:
+    return IceHistogram(working_directory, version=version)
+
+
+class _ParticleFileTail:
+    """Counts the ice thickness values in a particles STAR file as rows are appended"""
+
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        self.counts: Counter[float] = collections.Counter()
+        self._reset()
+
+    def _reset(self, inode: Optional[int] = None):
+        self.counts.clear()
+        self._inode = inode
+        self._offset = 0
+        self._size = -1
+        self._block = ""
+        self._in_loop = False
+        self._tags: List[str] = []
+        self._column: Optional[int] = None
+
+    def update(self) -> bool:
+        """Read any new rows, returning whether the counts changed"""
+        stat = self.path.stat()
+        if stat.st_ino != self._inode or stat.st_size < self._offset:
+            # the file was replaced, so its rows are counted again
+            changed = bool(self.counts)
+            self._reset(stat.st_ino)
+        else:
+            changed = False
+        if stat.st_size == self._offset:
+            return changed
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read(stat.st_size - self._offset)
+        end = data.rfind(b"\n") + 1
+        if stat.st_size == self._size:
+            # a last line without a newline is complete once the file stops growing
+            end = len(data)
+        self._size = stat.st_size
+        self._offset += end
+        return self._add_lines(data[:end].decode().splitlines()) or changed
+
+    def _add_lines(self, lines: List[str]) -> bool:
+        values = []
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("data_"):
+                self._block = line[len("data_") :]
+                self._in_loop = False
+            elif line.startswith("loop_"):
+                self._in_loop = True
+                self._tags = []
+                self._column = None
+            elif line.startswith("_"):
+                if self._in_loop and self._block == "particles":
+                    self._tags.append(line.split()[0].lower())
+                    if self._tags[-1] == ice_column.lower():
+                        self._column = len(self._tags) - 1
+            elif self._in_loop and self._column is not None:
+                fields = line.split()
+                if len(fields) > self._column:
+                    values.append(fields[self._column])
+        if not values:
+            return False
+        self.counts.update(np.asarray(values, dtype=float).tolist())
+        return True
+
+
+class IceHistogram:
+    """
+    Keeps running counts of the ice thickness values of the particles in the
+    Icebreaker grouping jobs of a project, for drawing as histograms.
+    Instances are cached and shared between threads, so updates are serialised.
+    """
+
+    def __init__(self, working_directory: pathlib.Path, version: float = 3.1):
+        self.working_directory = working_directory
+        self.version = version
+        self._files: Dict[pathlib.Path, _ParticleFileTail] = {}
+        self._revision = 0
+        self._written_revision: Optional[int] = None
+        self._lock = threading.RLock()
+        if version == 4:
+            self.job_directory = working_directory / "IceBreaker"
+            output_directory = self.job_directory / "Icebreaker_group_batch_1"
         else:
-            logger.debug(f"Icebreaker {particles_file} not found.")
-            passed.append(False)
+            self.job_directory = working_directory / "External"
+            output_directory = self.job_directory / "Icebreaker_group_batch_001"
+        self.json_path = output_directory / "ice_hist.json"
+        self.pdf_path = output_directory / "ice_hist.pdf"
+
+    def update(self) -> bool:
+        """
+        Read the rows added to the particle files of the grouping jobs,
+        returning False if any of them has not been written yet
+        """
+        with self._lock:
+            icebreaker_paths = list(self.job_directory.glob("Icebreaker_group*"))
+            if not icebreaker_paths:
+                return False
+            passed = True
+            for ibpath in icebreaker_paths:
+                particles_file = ibpath / "particles.star"
+                if not particles_file.is_file():
+                    logger.debug(f"Icebreaker {particles_file} not found.")
+                    passed = False
+                    continue
+                if particles_file not in self._files:
+                    self._files[particles_file] = _ParticleFileTail(particles_file)
+                if self._files[particles_file].update():
+                    self._revision += 1
+            return passed
+
+    @property
+    def counts(self) -> Counter[float]:
+        counts: Counter[float] = collections.Counter()
+        for particle_file in self._files.values():
+            counts.update(particle_file.counts)
+        return counts
 
-    if all(passed):
-        return data
+    def write(self) -> Optional[Tuple[pathlib.Path, pathlib.Path]]:
+        with self._lock:
+            if not self.update():
+                return None
+            if (
+                self._revision != self._written_revision
+                or not self.json_path.is_file()
+                or not self.pdf_path.is_file()
+            ):
+                counts = self.counts
+                values = np.array(sorted(counts), dtype=float)
+                weights = np.array([counts[v] for v in values], dtype=int)
+                # numpy cannot choose bins for weighted data, so choose them from all values
+                bins = np.histogram_bin_edges(np.repeat(values, weights), bins="auto")
+                self._write_json(values, weights, bins)
+                self._write_pdf(values, weights, bins)
+                self._written_revision = self._revision
+            return self.json_path, self.pdf_path
+
+    def _write_json(self, values: np.ndarray, weights: np.ndarray, bins: np.ndarray):
+        df = pd.DataFrame({x_label: values, "count": weights})
+        fig = px.histogram(
+            df,
+            x=x_label,
+            y="count",
+            histfunc="sum",
+            title="Histogram of Icebreaker estimated ice thickness <br>Total number of particles = "
+            + str(weights.sum()),
+        )
+        fig.update_traces(
+            xbins={"start": bins[0], "end": bins[-1], "size": bins[1] - bins[0]}
+        )
+        fig.update_yaxes(title="count")
+        fig.write_json(
+            os.fspath(self.json_path)
+        )  # This plotly version doesn't support Path objects with write_json()
 
-    return None
+    def _write_pdf(self, values: np.ndarray, weights: np.ndarray, bins: np.ndarray):
+        fig, ax = plt.subplots()
+        ax.hist(x=values, weights=weights, bins=bins, rwidth=0.9)
+        ax.set_xlabel(x_label)
+        ax.set_ylabel("Number of particles")
+        ax.set_title("Histogram of Icebreaker estimated ice thickness")
+        ax.legend(["Total number of particles = " + str(weights.sum())])
+        fig.savefig(
+            os.fspath(self.pdf_path)
+        )  # This matplotlib version doesn't support Path objects with savefig()
+        plt.close(fig)
 
 
 def extract_ice_column(icebreaker_star_file_path):
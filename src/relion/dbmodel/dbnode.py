@@ -18,9 +18,10 @@ class DBNode(Node):
             table._last_update[self.name] = 0
             self._append_sent[table] = {a: set() for a in table._append}
 
-        self._sent = [[] for _ in self.tables]
-        self._unsent = [[] for _ in self.tables]
-        self._all_sent = [[] for _ in self.tables]
+        # dicts are used as insertion ordered sets of primary keys
+        self._sent = [{} for _ in self.tables]
+        self._unsent = [{} for _ in self.tables]
+        self._all_sent = [{} for _ in self.tables]
 
     def __eq__(self, other):
         if isinstance(other, DBNode):
@@ -82,9 +83,8 @@ class DBNode(Node):
                 self.environment,
             )
             if pid is not None:
-                self._unsent[i].append(pid)
-                if pid in self._sent[i]:
-                    self._sent[i].remove(pid)
+                self._unsent[i][pid] = None
+                self._sent[i].pop(pid, None)
 
     def _do_check(self):
         try:
@@ -122,33 +122,30 @@ class DBNode(Node):
             return {}
         messages = {msg_type: [] for msg_type in constructors.keys()}
         for tab_index, ids in enumerate(self._unsent):
-            for pid in ids:
+            if not ids:
+                continue
+            table = self.tables[tab_index]
+            append_sent = self._append_sent[table]
+            if table._append:
+                rows = table.get_rows_by_primary_keys(ids)
+            else:
+                rows = [None] * len(ids)
+            for pid, row in zip(ids, rows):
                 for msg_type, constructor in constructors.items():
                     unsent_appended = {}
-                    for acol in self.tables[tab_index]._append:
-                        row = self.tables[tab_index].get_row_by_primary_key(pid)
+                    for acol in table._append:
                         try:
                             unsent_appended[acol] = [
-                                e
-                                for e in row[acol]
-                                if e
-                                not in self._append_sent[self.tables[tab_index]][acol]
+                                e for e in row[acol] if e not in append_sent[acol]
                             ]
                         except TypeError:
-                            if (
-                                row[acol]
-                                not in self._append_sent[self.tables[tab_index]][acol]
-                            ):
+                            if row[acol] not in append_sent[acol]:
                                 unsent_appended[acol] = [row[acol]]
                         if unsent_appended.get(acol):
                             if isinstance(row[acol], list):
-                                self._append_sent[self.tables[tab_index]][acol].update(
-                                    set(row[acol])
-                                )
+                                append_sent[acol].update(set(row[acol]))
                             else:
-                                self._append_sent[self.tables[tab_index]][acol].add(
-                                    row[acol]
-                                )
+                                append_sent[acol].add(row[acol])
                         # if there are no new values in the append but there has been a change such that
                         # the pid has ended up in _unsent then send one message to pick up the changes
                         elif row[acol]:
@@ -158,14 +155,14 @@ class DBNode(Node):
                                 unsent_appended[acol] = [row[acol]]
                     if pid in self._all_sent[tab_index]:
                         message = constructor(
-                            self.tables[tab_index],
+                            table,
                             pid,
                             resend=True,
                             unsent_appended=unsent_appended,
                         )
                     else:
                         message = constructor(
-                            self.tables[tab_index],
+                            table,
                             pid,
                             unsent_appended=unsent_appended,
                         )
@@ -177,9 +174,9 @@ class DBNode(Node):
                         raise TypeError(
                             f"message must be a dictionary or list but was {type(message)}: {message}"
                         )
-                self._unsent[tab_index].remove(pid)
-                self._sent[tab_index].append(pid)
-                self._all_sent[tab_index].append(pid)
+                self._sent[tab_index][pid] = None
+                self._all_sent[tab_index][pid] = None
+            ids.clear()
         need_to_pop = []
         for key, value in messages.items():
             if not value:
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import bisect
 import functools
 import itertools
 import re
@@ -25,17 +26,21 @@ class Table:
         self._tab = {c: [] for c in self.columns}
         self._primary_key = primary_key
         self._last_update = {self: 0}
-        if unique is None:
-            self._unique = None
-        else:
-            if isinstance(unique, str):
-                self._unique = [unique]
-            else:
-                self._unique = unique
         self._unique = self._make_list(unique, default=None)
         self._counters = self._make_list(counters, default=[])
         self._append = self._make_list(append, default=[])
         self._required = self._make_list(required, default=[])
+        # hash indexes mapping column value -> ascending list of row indices for the
+        # primary key and each unique column, and the combination of unique column
+        # values -> row indices for the (possibly composite) unique key
+        self._indexed = [self._primary_key]
+        for u in self._unique or []:
+            if u not in self._indexed:
+                self._indexed.append(u)
+        self._index = {c: {} for c in self._indexed}
+        self._unique_index = {}
+        # row indices holding unhashable values, which cannot go into the hash indexes
+        self._unhashable = {c: set() for c in self._indexed}
 
     def __getitem__(self, key):
         return self._tab[key]
@@ -48,6 +53,92 @@ class Table:
             return elem
         return [elem]
 
+    @staticmethod
+    def _add_to_index(index, key, row_index):
+        indices = index.setdefault(key, [])
+        if not indices or indices[-1] < row_index:
+            indices.append(row_index)
+        else:
+            bisect.insort(indices, row_index)
+
+    @staticmethod
+    def _remove_from_index(index, key, row_index):
+        indices = index[key]
+        indices.remove(row_index)
+        if not indices:
+            del index[key]
+
+    def _unique_key(self, row_index):
+        return tuple(self._tab[u][row_index] for u in self._unique)
+
+    def _index_row(self, row_index):
+        for c in self._indexed:
+            try:
+                self._add_to_index(self._index[c], self._tab[c][row_index], row_index)
+            except TypeError:
+                self._unhashable[c].add(row_index)
+        if self._unique:
+            try:
+                self._add_to_index(
+                    self._unique_index, self._unique_key(row_index), row_index
+                )
+            except TypeError:
+                pass
+
+    def _unindex_row(self, row_index):
+        for c in self._indexed:
+            if row_index in self._unhashable[c]:
+                self._unhashable[c].discard(row_index)
+            else:
+                self._remove_from_index(
+                    self._index[c], self._tab[c][row_index], row_index
+                )
+        if self._unique:
+            try:
+                self._remove_from_index(
+                    self._unique_index, self._unique_key(row_index), row_index
+                )
+            except (TypeError, KeyError):
+                pass
+
+    def _append_row(self, values):
+        for c in self.columns:
+            self._tab[c].append(values[c])
+        self._index_row(len(self._tab[self._primary_key]) - 1)
+
+    def _set_value(self, column, row_index, value):
+        if column in self._index:
+            self._unindex_row(row_index)
+            self._tab[column][row_index] = value
+            self._index_row(row_index)
+        else:
+            self._tab[column][row_index] = value
+
+    def _find(self, key, value):
+        # ascending list of the indices of rows where column key is equal to value
+        if key in self._index:
+            try:
+                indices = list(self._index[key].get(value, []))
+            except TypeError:
+                pass
+            else:
+                if self._unhashable[key]:
+                    indices = sorted(
+                        set(indices).union(
+                            i
+                            for i in self._unhashable[key]
+                            if self._tab[key][i] == value
+                        )
+                    )
+                return indices
+        return [i for i, element in enumerate(self._tab[key]) if element == value]
+
+    def _contains_primary_key(self, value):
+        try:
+            return value in self._index[self._primary_key]
+        except TypeError:
+            return value in self._tab[self._primary_key]
+
     def add_row(self, row):
         for req in self._required:
             if row.get(req) is None:
@@ -58,29 +149,35 @@ class Table:
         unique_check = self._unique_check(row)
 
         prim_key_arg = unique_check or row.get(self._primary_key)
-        if unique_check is None or prim_key_arg not in self._tab[self._primary_key]:
+        existing = prim_key_arg is not None and self._contains_primary_key(prim_key_arg)
+        if unique_check is None or not existing:
             try:
                 for counter in self._counters:
                     row[counter] = len(self._tab[counter]) + 1
             except TypeError:
                 pass
         else:
+            index = self._find(self._primary_key, prim_key_arg)[0]
             for counter in self._counters:
-                index = self._tab[self._primary_key].index(prim_key_arg)
                 row[counter] = self._tab[counter][index]
 
         # if no primary key is specified and the uniqueness check has not returned one then add the row
         # with a new primary key id
-        if prim_key_arg is None or prim_key_arg not in self._tab[self._primary_key]:
+        if not existing:
             modified = True
-            for c in self.columns:
-                if c == self._primary_key:
-                    self._tab[c].append(prim_key_arg or next(WrapperID))
-                else:
-                    self._tab[c].append(row.get(c))
+            self._append_row(
+                {
+                    c: (
+                        prim_key_arg or next(WrapperID)
+                        if c == self._primary_key
+                        else row.get(c)
+                    )
+                    for c in self.columns
+                }
+            )
         # otherwise use existing primary key
         else:
-            index = self._tab[self._primary_key].index(prim_key_arg)
+            index = self._find(self._primary_key, prim_key_arg)[0]
             for c in self.columns:
                 if c != self._primary_key:
                     row_value = row.get(c)
@@ -90,27 +187,21 @@ class Table:
                         # then combine them as sets and cast back to list for json serialisation,
                         # otherwise add the new value as an item to the set and cast to list
                         if c in self._append:
-                            if row_value is not None:
-                                if not isinstance(self._tab[c][index], list):
-                                    if self._tab[c][index] is None:
-                                        self._tab[c][index] = []
-                                    else:
-                                        self._tab[c][index] = [self._tab[c][index]]
-                                curr_as_set = set(self._tab[c][index])
-                                curr_orig = set(self._tab[c][index])
-                                if isinstance(row_value, (list, set, tuple)):
-                                    curr_as_set |= set(row_value)
-                                    self._tab[c][index] = list(curr_as_set)
-                                else:
-                                    curr_as_set.add(row_value)
-                                    self._tab[c][index] = list(curr_as_set)
-                                if curr_orig.symmetric_difference(
-                                    set(self._tab[c][index])
-                                ):
-                                    modified = True
+                            current = self._tab[c][index]
+                            if not isinstance(current, list):
+                                current = [] if current is None else [current]
+                            curr_as_set = set(current)
+                            curr_orig = set(current)
+                            if isinstance(row_value, (list, set, tuple)):
+                                curr_as_set |= set(row_value)
+                            else:
+                                curr_as_set.add(row_value)
+                            self._set_value(c, index, list(curr_as_set))
+                            if curr_orig.symmetric_difference(curr_as_set):
+                                modified = True
                         else:
                             modified = True
-                            self._tab[c][index] = row_value
+                            self._set_value(c, index, row_value)
 
         if modified:
             if prim_key_arg is None:
@@ -122,44 +213,32 @@ class Table:
 
     # check if the row being added has already existing values for the columns marked as unique
     def _unique_check(self, in_values):
-        try:
-            unique_indices = []
-            for u in self._unique:
-                if in_values.get(u) in self._tab[u]:
-                    indices = [
-                        i
-                        for i, element in enumerate(self._tab[u])
-                        if element == in_values.get(u)
-                    ]
-                    if isinstance(indices, list):
-                        unique_indices.append(indices)
-                    else:
-                        unique_indices.append([indices])
-                else:
-                    break
-            else:
-                for i1, ui1 in enumerate(unique_indices):
-                    for i2, ui2 in enumerate(unique_indices):
-                        if i1 != i2:
-                            if set(ui1).isdisjoint(ui2):
-                                return None
-                overlap_list = unique_indices[0]
-                for i in range(len(unique_indices) - 1):
-                    curr_overlap = set(unique_indices[i]).intersection(
-                        unique_indices[i + 1]
-                    )
-                    overlap_list = list(set(overlap_list).intersection(curr_overlap))
-                if not overlap_list:
-                    return None
-                return self._tab[self._primary_key][overlap_list[0]]
+        if not self._unique:
             return None
+        key = tuple(in_values.get(u) for u in self._unique)
+        try:
+            indices = self._unique_index.get(key)
+            hashable = True
         except TypeError:
+            indices = None
+            hashable = False
+        if indices:
+            return self._tab[self._primary_key][indices[0]]
+        if hashable and not any(self._unhashable[u] for u in self._unique):
             return None
+        # fall back to intersecting the matches of each unique column
+        overlap = None
+        for u, value in zip(self._unique, key):
+            matches = set(self._find(u, value))
+            overlap = matches if overlap is None else overlap & matches
+            if not overlap:
+                return None
+        return self._tab[self._primary_key][min(overlap)]
 
     def get_row_index(self, key, value):
         if value is None:
             return None
-        indices = [i for i, element in enumerate(self._tab[key]) if element == value]
+        indices = self._find(key, value)
         if indices:
             if len(indices) == 1:
                 return indices[0]
@@ -171,6 +250,11 @@ class Table:
         row_index = self.get_row_index(self._primary_key, value)
         return {c: self._tab[c][row_index] for c in self.columns}
 
+    def get_rows_by_primary_keys(self, values):
+        row_indices = [self._find(self._primary_key, v)[0] for v in values]
+        selected = [[self._tab[c][i] for i in row_indices] for c in self.columns]
+        return [dict(zip(self.columns, row)) for row in zip(*selected)]
+
 
 def to_snake_case(camel_case):
     return re.sub(r"(?<!^)(?=[A-Z])", "_", camel_case).lower()
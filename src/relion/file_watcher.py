@@ -0,0 +1,367 @@
+"""
+Follow the files arriving in a directory tree, such as the movies of a session,
+without walking the whole tree each time the directory is checked.
+"""
+
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import errno
+import fnmatch
+import logging
+import os
+import pathlib
+import struct
+import sys
+import time
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+logger = logging.getLogger("relion.file_watcher")
+
+
+def _matches(parts: Tuple[str, ...], pattern: Tuple[str, ...]) -> bool:
+    """Match the parts of a relative path against a glob pattern as pathlib does"""
+    if not pattern:
+        return not parts
+    if pattern[0] == "**":
+        return any(
+            _matches(parts[skipped:], pattern[1:]) for skipped in range(len(parts) + 1)
+        )
+    return (
+        bool(parts)
+        and fnmatch.fnmatchcase(parts[0], pattern[0])
+        and _matches(parts[1:], pattern[1:])
+    )
+
+
+class _Directory:
+    __slots__ = ("mtime", "device_inode", "subdirectories", "files")
+
+    def __init__(self, device_inode: Tuple[int, int]):
+        self.mtime: Optional[int] = None
+        self.device_inode = device_inode
+        self.subdirectories: Set[str] = set()
+        self.files: Set[str] = set()
+
+
+class PollingWatcher:
+    """
+    Follows the files below a directory which match a glob pattern (relative to
+    the directory, as for pathlib.Path.glob), and optionally end in a suffix.
+    The number of these files and the most recent modification time are kept
+    up to date by calling update.
+
+    Each update checks the modification time of every known directory, and only
+    lists the directories which have changed, so files are found without
+    walking the whole tree. Files modified in place do not change their
+    directory, so the modification time of a file is that of when it was found.
+    """
+
+    def __init__(self, path, pattern: str = "**/*", suffix: str = ""):
+        self.path = pathlib.Path(path)
+        self.pattern = tuple(pathlib.PurePosixPath(pattern).parts)
+        self.suffix = suffix
+        # modification times of the matching files
+        self._files: Dict[str, float] = {}
+        self._latest_mtime: Optional[float] = None
+        self._directories: Dict[str, _Directory] = {}
+        self._device_inodes: Set[Tuple[int, int]] = set()
+
+    @property
+    def file_count(self) -> int:
+        return len(self._files)
+
+    @property
+    def latest_mtime(self) -> Optional[float]:
+        """The most recent modification time of the files, or None if there are none"""
+        if self._latest_mtime is None and self._files:
+            self._latest_mtime = max(self._files.values())
+        return self._latest_mtime
+
+    @property
+    def files(self) -> List[str]:
+        return list(self._files)
+
+    def update(self):
+        """Find the files which have been added or removed since the last update"""
+        self._poll()
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _poll(self):
+        if not self._directories:
+            self._add_directory(os.fspath(self.path))
+        for directory in list(self._directories):
+            if directory not in self._directories:
+                # removed along with its parent
+                continue
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except (FileNotFoundError, NotADirectoryError):
+                self._remove_directory(directory)
+                continue
+            if mtime != self._directories[directory].mtime:
+                self._scan_directory(directory)
+
+    def _wanted(self, path: str) -> bool:
+        return path.endswith(self.suffix) and _matches(
+            pathlib.PurePath(os.path.relpath(path, self.path)).parts, self.pattern
+        )
+
+    def _add_directory(self, directory: str):
+        try:
+            stat = os.stat(directory)
+        except (FileNotFoundError, NotADirectoryError):
+            return
+        device_inode = (stat.st_dev, stat.st_ino)
+        if device_inode in self._device_inodes:
+            # symbolic links can lead back to a directory which is already followed
+            return
+        self._device_inodes.add(device_inode)
+        self._directories[directory] = _Directory(device_inode)
+        self._directory_added(directory)
+        self._scan_directory(directory)
+
+    def _directory_added(self, directory: str):
+        """Called when a new directory is found, before it is listed"""
+
+    def _remove_directory(self, directory: str):
+        removed = self._directories.pop(directory, None)
+        if removed is None:
+            return
+        self._device_inodes.discard(removed.device_inode)
+        for subdirectory in removed.subdirectories:
+            self._remove_directory(subdirectory)
+        for file in removed.files:
+            self._forget_file(file)
+
+    def _scan_directory(self, directory: str):
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+            entries = list(os.scandir(directory))
+        except (FileNotFoundError, NotADirectoryError):
+            self._remove_directory(directory)
+            return
+        subdirectories = set()
+        files = set()
+        for entry in entries:
+            try:
+                is_directory = entry.is_dir()
+            except OSError:
+                continue
+            if is_directory:
+                subdirectories.add(entry.path)
+            else:
+                files.add(entry.path)
+
+        record = self._directories[directory]
+        record.mtime = mtime
+        known_subdirectories = record.subdirectories
+        record.subdirectories = subdirectories
+        for removed in known_subdirectories - subdirectories:
+            self._remove_directory(removed)
+        for removed in record.files - files:
+            self._remove_file(removed)
+        for added in files - record.files:
+            self._file_changed(added)
+        for added in subdirectories - known_subdirectories:
+            self._add_directory(added)
+
+    def _file_changed(self, file: str):
+        if not self._wanted(file):
+            return
+        try:
+            mtime = os.stat(file).st_mtime
+        except (FileNotFoundError, NotADirectoryError):
+            self._remove_file(file)
+            return
+        self._directories[os.path.dirname(file)].files.add(file)
+        self._files[file] = mtime
+        if self._latest_mtime is not None and mtime > self._latest_mtime:
+            self._latest_mtime = mtime
+
+    def _remove_file(self, file: str):
+        directory = self._directories.get(os.path.dirname(file))
+        if directory is not None:
+            directory.files.discard(file)
+        self._forget_file(file)
+
+    def _forget_file(self, file: str):
+        mtime = self._files.pop(file, None)
+        if mtime is not None and mtime == self._latest_mtime:
+            # work out the new latest time when it is next asked for
+            self._latest_mtime = None
+
+
+class _InotifyEvents:
+    """Minimal bindings to the Linux inotify interface in the C library"""
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = os.O_NONBLOCK
+    IN_CLOEXEC = 0o2000000
+
+    watch_mask = (
+        IN_CLOSE_WRITE
+        | IN_MOVED_FROM
+        | IN_MOVED_TO
+        | IN_CREATE
+        | IN_DELETE
+        | IN_DELETE_SELF
+        | IN_MOVE_SELF
+    )
+    _header = struct.Struct("iIII")
+
+    def __init__(self):
+        self._libc = self.libc()
+        if self._libc is None:
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self.fd = self._libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "could not start inotify")
+
+    @staticmethod
+    def libc():
+        if not sys.platform.startswith("linux"):
+            return None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            libc.inotify_init1
+        except (OSError, AttributeError):
+            return None
+        libc.inotify_add_watch.argtypes = [
+            ctypes.c_int,
+            ctypes.c_char_p,
+            ctypes.c_uint32,
+        ]
+        return libc
+
+    def add_watch(self, path: str) -> int:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), self.watch_mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"could not watch {path}")
+        return wd
+
+    def read(self) -> Iterator[Tuple[int, int, str]]:
+        """The watch descriptor, mask and name of each event waiting to be read"""
+        while True:
+            try:
+                buffer = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, _, length = self._header.unpack_from(buffer, offset)
+                offset += self._header.size
+                name = buffer[offset : offset + length].rstrip(b"\0")
+                offset += length
+                yield wd, mask, os.fsdecode(name)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class InotifyWatcher(PollingWatcher):
+    """
+    Follows the files below a directory as PollingWatcher does, using inotify
+    events to find new and removed files as they appear. Events are not raised
+    for changes made on other hosts of a network file system, so the directory
+    times are also checked every resync_interval seconds, and whenever events
+    have been lost or a directory could not be watched.
+    """
+
+    resync_interval = 300
+
+    def __init__(self, path, pattern: str = "**/*", suffix: str = ""):
+        self._inotify = _InotifyEvents()
+        self._watches: Dict[int, str] = {}
+        self._unwatched = False
+        self._last_resync = 0.0
+        super().__init__(path, pattern=pattern, suffix=suffix)
+
+    @staticmethod
+    def available() -> bool:
+        return _InotifyEvents.libc() is not None
+
+    def update(self):
+        if (
+            not self._directories
+            or self._unwatched
+            or time.time() - self._last_resync > self.resync_interval
+        ):
+            self._unwatched = False
+            self._last_resync = time.time()
+            self._poll()
+        for wd, mask, name in self._inotify.read():
+            if mask & _InotifyEvents.IN_Q_OVERFLOW:
+                logger.warning(f"Lost file events for {self.path}, checking again")
+                self._poll()
+                continue
+            directory = self._watches.get(wd)
+            if directory is None:
+                continue
+            if mask & _InotifyEvents.IN_IGNORED:
+                del self._watches[wd]
+                continue
+            if mask & (_InotifyEvents.IN_DELETE_SELF | _InotifyEvents.IN_MOVE_SELF):
+                self._remove_directory(directory)
+                continue
+            if directory not in self._directories:
+                continue
+            path = os.path.join(directory, name)
+            if mask & _InotifyEvents.IN_ISDIR:
+                if mask & (_InotifyEvents.IN_CREATE | _InotifyEvents.IN_MOVED_TO):
+                    self._directories[directory].subdirectories.add(path)
+                    self._add_directory(path)
+                else:
+                    self._directories[directory].subdirectories.discard(path)
+                    self._remove_directory(path)
+            elif mask & (_InotifyEvents.IN_DELETE | _InotifyEvents.IN_MOVED_FROM):
+                self._remove_file(path)
+            else:
+                self._file_changed(path)
+
+    def _directory_added(self, directory: str):
+        try:
+            self._watches[self._inotify.add_watch(directory)] = directory
+        except OSError as e:
+            logger.warning(f"{e}, so looking for changes by polling")
+            self._unwatched = True
+
+    def close(self):
+        self._inotify.close()
+
+
+def watch_directory(
+    path, pattern: str = "**/*", suffix: str = "", backend: str = "poll"
+) -> PollingWatcher:
+    """
+    Follow the files below a directory which match a glob pattern.
+    The backend is "poll", "inotify", or "auto" to use inotify where available.
+    Polling is the default as inotify misses files written by other hosts of a
+    network file system until the next resync.
+    """
+    if backend == "inotify" or (backend == "auto" and InotifyWatcher.available()):
+        try:
+            return InotifyWatcher(path, pattern=pattern, suffix=suffix)
+        except OSError as e:
+            if backend == "inotify":
+                raise
+            logger.warning(f"Could not use inotify ({e}), so polling instead")
+    return PollingWatcher(path, pattern=pattern, suffix=suffix)
@@ -14,6 +14,10 @@ class Node:
     and child nodes are kept in _in and _out.
     """
 
+    # incremented whenever any link between nodes is made or removed so that
+    # graphs can tell when their cached structure is out of date
+    _link_version = 0
+
     def __init__(self, name, independent=False, **kwargs):
         self._name = name
         self.nodeid = str(uuid.uuid4())[:8]
@@ -123,6 +127,7 @@ class Node:
         if next_node not in self._out:
             self._out.append(next_node)
             next_node._in.append(self)
+            Node._link_version += 1
             if traffic is None:
                 self._link_traffic[next_node.nodeid] = {}
             else:
@@ -151,16 +156,17 @@ class Node:
         """
         if next_node in self._out:
             self._out.remove(next_node)
-
-    def _is_child_checker(self, possible_child, checks):
-        if self == possible_child:
-            checks.extend([True])
-        for child in self:
-            checks.extend(child._is_child_checker(possible_child, checks=checks))
-        return checks
+            Node._link_version += 1
 
     def _is_child(self, possible_child):
-        if True in self._is_child_checker(possible_child, checks=[]):
-            return True
-        else:
-            return False
+        explored = set()
+        to_check = [self]
+        while to_check:
+            node = to_check.pop()
+            if id(node) in explored:
+                continue
+            explored.add(id(node))
+            if node == possible_child:
+                return True
+            to_check.extend(node)
+        return False
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import copy
 import functools
 
 
@@ -173,6 +174,21 @@ class Environment:
     def reset(self):
         self.iterate = Iterate(["__do not iterate__"])
 
+    def copy(self):
+        # a copy that shares no containers with this Environment, without the cost
+        # of a deepcopy of every value; escalated values still come from the same
+        # parent environment
+        env = copy.copy(self)
+        env.base = {key: copy.copy(value) for key, value in self.base.items()}
+        env.temp = dict(self.temp)
+        env.propagate = copy.copy(self.propagate)
+        env.propagate.store = dict(self.propagate.store)
+        env.escalate = copy.copy(self.escalate)
+        env.iterate = copy.copy(self.iterate)
+        env.iterate.store = copy.copy(self.iterate.store)
+        env.iterate.appended = list(self.iterate.appended)
+        return env
+
 
 @functools.singledispatch
 def set_base(base, env: Environment):
@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+import collections
+
 from relion.node import Node
 
 try:
@@ -12,13 +14,14 @@ class Graph(Node):
     def __init__(self, name, node_list, auto_connect=False):
         super().__init__(name)
         self._node_list = node_list
+        self._mutations = 0
+        self._lookup_key = None
+        self._structure_key = None
         try:
             self.origins = self.find_origins()
         except IndexError:
             self.origins = []
         self._call_returns = {}
-        self._called_nodes = []
-        self._traversed = []
         if auto_connect:
             self._check_connections()
 
@@ -60,8 +63,6 @@ class Graph(Node):
             for node in self.origins:
                 node._completed = self._completed
         self.traverse()
-        self._traversed = []
-        self._called_nodes = []
         for node in self.nodes:
             node.environment.reset()
             node._completed = []
@@ -70,6 +71,64 @@ class Graph(Node):
         else:
             return self._call_returns
 
+    def _invalidate(self):
+        self._mutations += 1
+
+    def _lookup(self):
+        # positions and names of the nodes in the graph are cached until a node is
+        # added to or removed from the graph
+        key = (self._mutations, id(self._node_list), len(self._node_list))
+        if key != self._lookup_key:
+            # nodes are keyed by id as node equality and hashes depend on their links
+            members = {}
+            positions = {}
+            named = {}
+            for i, node in enumerate(self._node_list):
+                if id(node) not in members:
+                    members[id(node)] = node
+                    positions[id(node)] = i
+                named.setdefault(node.name, []).append(node)
+            self._members = members
+            self._positions = positions
+            self._named = named
+            self._lookup_key = key
+        return self._members
+
+    def _structure(self):
+        # the adjacency between the nodes of the graph and their topological order
+        # are additionally invalidated when a link between any nodes is changed
+        members = self._lookup()
+        key = (Node._link_version, self._lookup_key)
+        if key != self._structure_key:
+            self._build_structure(members)
+            self._structure_key = key
+        return members, self._adjacency, self._order
+
+    def _build_structure(self, members):
+        # adjacency is stored as dicts of ordered sets (dicts with None values)
+        # of the ids of child nodes that are also in the graph
+        adjacency = {
+            nid: dict.fromkeys(id(c) for c in node._out if id(c) in members)
+            for nid, node in members.items()
+        }
+        in_degree = dict.fromkeys(members, 0)
+        for children in adjacency.values():
+            for cid in children:
+                in_degree[cid] += 1
+        # Kahn's algorithm; nodes that are part of a cycle never become ready and
+        # are left out of the order
+        ready = collections.deque(nid for nid, d in in_degree.items() if d == 0)
+        order = []
+        while ready:
+            nid = ready.popleft()
+            order.append(members[nid])
+            for cid in adjacency[nid]:
+                in_degree[cid] -= 1
+                if not in_degree[cid]:
+                    ready.append(cid)
+        self._adjacency = adjacency
+        self._order = order
+
     def _check_connections(self):
         for node in self._node_list:
             for i_node in node._in:
@@ -83,26 +142,50 @@ class Graph(Node):
         if not isinstance(other, Graph):
             raise ValueError("Can only extend a ProtoGraph with another Graph")
         self._node_list.extend(other._node_list)
+        self._invalidate()
 
     def index(self, node):
+        self._lookup()
+        position = self._positions.get(id(node))
+        if position is not None:
+            return position
+        for candidate in self._named.get(str(node), []):
+            if candidate == node:
+                return self._positions[id(candidate)]
         return self._node_list.index(node)
 
     def link_from_to(self, from_node, to_node):
         self[self.index(from_node)].link_to(to_node)
 
+    def _explore(self, node, explored):
+        seen = {id(n) for n in explored}
+        # equal nodes always share a name so only those need comparing
+        named = {}
+        for n in explored:
+            named.setdefault(n.name, []).append(n)
+        to_explore = [node]
+        while to_explore:
+            current = to_explore.pop()
+            if id(current) in seen:
+                continue
+            seen.add(id(current))
+            same_name = named.setdefault(current.name, [])
+            if current not in same_name:
+                same_name.append(current)
+                explored.append(current)
+            to_explore.extend(reversed(current._out))
+
     def node_explore(self, node, explored):
         if not isinstance(node, Node):
             raise ValueError(
                 "Graph.node_explore must be called with a ProtoNode as the starting point; a string or similar is insufficient"
             )
-        if node not in explored:
-            explored.append(node)
-        for next_node in node:
-            self.node_explore(next_node, explored)
+        self._explore(node, explored)
 
     def add_node(self, new_node, auto_connect=False):
         if isinstance(new_node, Node):
             self._node_list.append(new_node)
+            self._invalidate()
             if auto_connect:
                 for i_node in new_node._in:
                     if i_node not in self._node_list:
@@ -112,98 +195,88 @@ class Graph(Node):
             raise ValueError("Attempted to add a node that was not a Node")
 
     def remove_node(self, node_name, advance=False):
-        behind_nodes = []
-        for currnode in self._node_list:
-            if currnode.name == str(node_name):
-                if currnode.environment.propagate.released:
-                    for next_node in currnode:
-                        next_node.environment.update_prop(
-                            currnode.environment.propagate.store
-                        )
-                        if advance:
-                            next_node.environment.update(
-                                currnode.environment.propagate.store
-                            )
-            if node_name in currnode:
-                behind_nodes.append(currnode)
-                currnode.unlink_from(node_name)
-            if node_name in currnode._in:
-                currnode._in.remove(node_name)
+        members = self._lookup()
+        node = self[self.index(node_name)]
+        if node.environment.propagate.released:
+            for next_node in node:
+                next_node.environment.update_prop(node.environment.propagate.store)
+                if advance:
+                    next_node.environment.update(node.environment.propagate.store)
+        behind_nodes = sorted(
+            {
+                id(p): p
+                for p in node._in
+                if id(p) in members and any(n is node for n in p._out)
+            }.values(),
+            key=lambda p: self._positions[id(p)],
+        )
         for bnode in behind_nodes:
-            for next_node in self._node_list[self._node_list.index(node_name)]:
+            bnode.unlink_from(node)
+        for next_node in node:
+            if id(next_node) in members:
+                for i, i_node in enumerate(next_node._in):
+                    if i_node is node:
+                        del next_node._in[i]
+                        break
+        for bnode in behind_nodes:
+            for next_node in node:
                 bnode.link_to(next_node)
-        self._node_list.remove(node_name)
+        del self._node_list[self.index(node)]
+        self._invalidate()
 
     def find_origins(self):
-        child_nodes = []
-        for node in self.nodes:
-            child_nodes.extend(node)
-        origins = [p for p in self.nodes if p not in child_nodes]
-        return origins
+        members, adjacency, _ = self._structure()
+        child_ids = set()
+        for children in adjacency.values():
+            child_ids.update(children)
+        return [p for p in self.nodes if id(p) not in child_ids]
 
     def merge(self, other):
-        node_names = [p._name for p in self.nodes]
-        other_names = [p._name for p in other.nodes]
-        if len(set(node_names).intersection(set(other_names))) > 0:
-            for new_node in other.nodes:
-                if new_node not in self.nodes:
-                    self.add_node(new_node)
-                else:
-                    for next_node in new_node:
-                        if next_node not in self.nodes[self.index(new_node)]:
-                            self.nodes[self.index(new_node)].link_to(next_node)
-            return True
-        else:
+        self._lookup()
+        named = {name: list(nodes) for name, nodes in self._named.items()}
+        if not named.keys() & {p.name for p in other.nodes}:
             return False
+        for new_node in other.nodes:
+            existing = next(
+                (n for n in named.get(new_node.name, []) if n == new_node), None
+            )
+            if existing is None and isinstance(new_node, Graph):
+                # graph equality does not depend on the name of the graph
+                existing = next((n for n in self.nodes if n == new_node), None)
+            if existing is None:
+                self.add_node(new_node)
+                named.setdefault(new_node.name, []).append(new_node)
+            else:
+                for next_node in new_node:
+                    if next_node not in existing:
+                        existing.link_to(next_node)
+        return True
 
     def traverse(self):
-        for o in self.origins:
-            self._follow(o, traffic={}, share=[], append=o._can_append)
-
-    def _follow(self, node, traffic, share, append=False):
-        called = False
-        if node not in self.nodes:
-            return
-        if node.nodeid in self._called_nodes:
-            called = True
-        node.environment.update(traffic, can_append_list=append)
-
-        for sh in share:
-            node.environment[sh[1]] = sh[0]
-
-        if (
-            all(n in node._completed for n in node._in)
-            and node.nodeid not in self._called_nodes
-        ):
-            called = True
-
-            self._call_returns[node.nodeid] = node()
-            self._called_nodes.append(node.nodeid)
-
-        for next_node in node:
-            next_node.environment.update_prop(node.environment.propagate)
-            next_traffic = node._link_traffic.get(next_node.nodeid, {})
-            if next_traffic is None:
-                next_traffic = self._call_returns[node.nodeid]
-            next_share = []
-            if node._share_traffic.get(next_node.nodeid) is not None:
-                for sh in node._share_traffic[next_node.nodeid]:
-                    next_share.append((node.environment[sh[0]], sh[1]))
-            if (node.nodeid, next_node.nodeid) not in self._traversed and called:
-                self._traversed.append((node.nodeid, next_node.nodeid))
-                self._follow(
-                    next_node,
-                    next_traffic,
-                    next_share,
-                    append=node._can_append,
-                )
-            elif not called:
-                self._follow(
-                    next_node,
-                    next_traffic,
-                    next_share,
-                    append=node._can_append,
+        members, adjacency, order = self._structure()
+        reached = {id(o) for o in self.origins if id(o) in members}
+        for node in order:
+            if id(node) not in reached:
+                continue
+            called = False
+            if node.nodeid not in self._call_returns and all(
+                n in node._completed for n in node._in
+            ):
+                called = True
+                self._call_returns[node.nodeid] = node()
+            for child_id in adjacency[id(node)]:
+                next_node = members[child_id]
+                reached.add(child_id)
+                next_node.environment.update_prop(node.environment.propagate)
+                next_traffic = node._link_traffic.get(next_node.nodeid, {})
+                if next_traffic is None:
+                    # results are only passed on as traffic once they exist
+                    next_traffic = self._call_returns[node.nodeid] if called else {}
+                next_node.environment.update(
+                    next_traffic, can_append_list=node._can_append
                 )
+                for sh in node._share_traffic.get(next_node.nodeid) or []:
+                    next_node.environment[sh[1]] = node.environment[sh[0]]
 
     def show(self):
         try:
@@ -38,6 +38,7 @@ from pipeliner.project_graph import ProjectGraph
 from pipeliner.utils import touch
 
 from relion.cryolo_relion_it.cryolo_relion_it import RelionItOptions
+from relion.file_watcher import PollingWatcher, watch_directory
 from relion.pipeline.extra_options import generate_extra_options
 from relion.pipeline.options import generate_pipeline_options
 
@@ -98,6 +99,7 @@ class PipelineRunner:
         }
         self._passes: List[Set[str]] = [set(), set()]
         self._num_seen_movies = 0
+        self._movie_watchers: Dict[str, PollingWatcher] = {}
         self._lock = threading.RLock()
         self._extra_options = generate_extra_options
         if self.options.do_second_pass:
@@ -715,14 +717,14 @@ class PipelineRunner:
         )
 
     def _new_movies(self, glob_pattern: str = "") -> bool:
-        num_movies = len(
-            [
-                m
-                for m in self.movies_path.glob(glob_pattern or "**/*")
-                if m.suffix == "." + self.movietype
-            ]
-        )
-        return not num_movies == self._num_seen_movies
+        glob_pattern = glob_pattern or "**/*"
+        if glob_pattern not in self._movie_watchers:
+            self._movie_watchers[glob_pattern] = watch_directory(
+                self.movies_path, pattern=glob_pattern, suffix="." + self.movietype
+            )
+        watcher = self._movie_watchers[glob_pattern]
+        watcher.update()
+        return not watcher.file_count == self._num_seen_movies
 
     def _classification_3d(
         self,
@@ -1402,3 +1404,6 @@ class PipelineRunner:
         if class_thread is not None:
             class_thread.join()
             logger.info("Classification thread stopped")
+        for watcher in self._movie_watchers.values():
+            watcher.close()
+        self._movie_watchers = {}
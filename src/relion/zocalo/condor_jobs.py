@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+try:
+    import htcondor
+except ImportError:
+    htcondor = None
+
+logger = logging.getLogger("relion.zocalo.condor_jobs")
+
+# Configuration for submitting to the GPU pool from the service containers
+condor_config = {
+    "RELEASE_DIR": "/usr",
+    "LOCAL_DIR": "/var",
+    "RUN": "/var/run/condor",
+    "LOG": "/var/log/condor",
+    "LOCK": "/var/lock/condor",
+    "SPOOL": "/var/lib/condor/spool",
+    "EXECUTE": "/var/lib/condor/execute",
+    "BIN": "/usr/bin",
+    "LIB": "/usr/lib64/condor",
+    "INCLUDE": "/usr/include/condor",
+    "SBIN": "/usr/sbin",
+    "LIBEXEC": "/usr/libexec/condor",
+    "SHARE": "/usr/share/condor",
+    "PROCD_ADDRESS": "/var/run/condor/procd_pipe",
+    "JAVA_CLASSPATH_DEFAULT": "/usr/share/condor /usr/share/condor/scimark2lib.jar .",
+    "CONDOR_HOST": "pool-gpu-htcondor-manager.diamond.ac.uk",
+    "COLLECTOR_HOST": "pool-gpu-htcondor-manager.diamond.ac.uk",
+    "ALLOW_READ": "*",
+    "ALLOW_WRITE": "*",
+    "ALLOW_NEGOTIATOR": "*",
+    "ALLOW_DAEMON": "*",
+    "SEC_DEFAULT_AUTHENTICATION_METHODS": "FS_REMOTE, PASSWORD",
+    "SEC_WRITE_AUTHENTICATION_METHODS": "FS_REMOTE, PASSWORD, ANONYMOUS",
+    "SEC_READ_AUTHENTICATION_METHODS": "FS_REMOTE, PASSWORD, ANONYMOUS",
+    "FS_REMOTE_DIR": "/dls/tmp/htcondor",
+}
+
+
+def locate_schedd():
+    """Set up HTCondor for the GPU pool and find its job scheduler"""
+    for key, value in condor_config.items():
+        htcondor.param[key] = value
+    coll = htcondor.Collector(htcondor.param["COLLECTOR_HOST"])
+    schedd_ad = coll.locate(htcondor.DaemonTypes.Schedd)
+    return htcondor.Schedd(schedd_ad)
+
+
+class FinishedCluster(NamedTuple):
+    cluster_id: int
+    state: str
+    data: Any
+
+
+class _TrackedCluster:
+    def __init__(self, data: Any, submitted: float):
+        self.data = data
+        self.submitted = submitted
+
+
+class CondorJobTracker:
+    """
+    Submits jobs to an HTCondor scheduler and follows them until they finish.
+    Once started, a background thread asks for the status of the jobs of all
+    tracked clusters with a single query every poll_interval seconds, and calls
+    on_finished(FinishedCluster) for each cluster which has left the queue
+    (COMPLETED), been removed (REMOVED) or been held (HELD). Held clusters, and
+    those still queued after job_timeout seconds (TIMEOUT), are removed.
+    """
+
+    completed_status = 4
+    removed_status = 3
+    # held, and the status these services have always treated as a failure
+    held_statuses = (5, 12)
+
+    def __init__(
+        self,
+        on_finished: Callable[[FinishedCluster], None],
+        schedd=None,
+        poll_interval: float = 10,
+        job_timeout: float = 1200,
+    ):
+        self.on_finished = on_finished
+        self.poll_interval = poll_interval
+        self.job_timeout = job_timeout
+        self._schedd = schedd
+        self._clusters: Dict[int, _TrackedCluster] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def schedd(self):
+        """The job scheduler, which is located when it is first needed"""
+        if self._schedd is None:
+            self._schedd = locate_schedd()
+        return self._schedd
+
+    @property
+    def outstanding(self) -> List[int]:
+        with self._lock:
+            return list(self._clusters)
+
+    def submit(self, submit_description, itemdata: List[dict], data: Any = None) -> int:
+        """Submit jobs and track their cluster until it finishes, returning its id"""
+        job = self.schedd.submit(submit_description, itemdata=iter(itemdata))
+        cluster_id = job.cluster()
+        with self._lock:
+            self._clusters[cluster_id] = _TrackedCluster(data, time.time())
+        return cluster_id
+
+    def remove(self, cluster_id: int):
+        try:
+            self.schedd.act(htcondor.JobAction.Remove, f"ClusterId == {cluster_id}")
+        except Exception as e:
+            logger.warning(f"Could not remove HTCondor cluster {cluster_id}: {e}")
+
+    def poll(self) -> List[FinishedCluster]:
+        """Check the jobs of all tracked clusters, and report any which have finished"""
+        cluster_ids = self.outstanding
+        if not cluster_ids:
+            return []
+        statuses: Dict[int, List[int]] = {}
+        for ad in self.schedd.query(
+            constraint=" || ".join(f"ClusterId == {c}" for c in cluster_ids),
+            projection=["ClusterId", "JobStatus"],
+        ):
+            statuses.setdefault(int(ad["ClusterId"]), []).append(int(ad["JobStatus"]))
+
+        finished = []
+        now = time.time()
+        with self._lock:
+            tracked_clusters = list(self._clusters.items())
+        for cluster_id, tracked in tracked_clusters:
+            job_statuses = statuses.get(cluster_id, [])
+            if all(status == self.completed_status for status in job_statuses):
+                state = "COMPLETED"
+            elif self.removed_status in job_statuses:
+                state = "REMOVED"
+            elif any(status in self.held_statuses for status in job_statuses):
+                logger.error(f"HTCondor cluster {cluster_id} was held, removing")
+                self.remove(cluster_id)
+                state = "HELD"
+            elif now - tracked.submitted >= self.job_timeout:
+                logger.error(f"HTCondor cluster {cluster_id} timed out, removing")
+                self.remove(cluster_id)
+                state = "TIMEOUT"
+            else:
+                continue
+            with self._lock:
+                self._clusters.pop(cluster_id, None)
+            finished.append(FinishedCluster(cluster_id, state, tracked.data))
+
+        for cluster in finished:
+            self.on_finished(cluster)
+        return finished
+
+    def start(self):
+        """Start polling for finished clusters in a background thread"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._poll_loop, name="HTCondor job poller", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _poll_loop(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.poll()
+            except Exception as e:
+                logger.warning(f"Could not get HTCondor job states: {e}", exc_info=True)
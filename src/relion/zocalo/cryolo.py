@@ -3,14 +3,14 @@ from __future__ import annotations
 import re
 import subprocess
 from pathlib import Path
+from typing import List
 
 import numpy as np
-import workflows.recipe
 from gemmi import cif
 from pydantic import BaseModel, Field, ValidationError
-from workflows.services.common_service import CommonService
 
 from relion.zocalo.spa_relion_service_options import RelionServiceOptions
+from relion.zocalo.worker_pool import PooledService
 
 
 class CryoloParameters(BaseModel):
@@ -31,7 +31,39 @@ class CryoloParameters(BaseModel):
     ctf_values: dict = {}
 
 
-class CrYOLO(CommonService):
+class MockRW:
+    def dummy(self, *args, **kwargs):
+        pass
+
+
+def cryolo_command(
+    cryolo_params: CryoloParameters, job_dir: Path, input_paths: List[str] = None
+) -> List[str]:
+    """
+    Construct a command to run cryolo with the given parameters,
+    optionally picking on several input micrographs at once
+    """
+    command = cryolo_params.cryolo_command.split()
+    command.extend((["--conf", cryolo_params.cryolo_config_file]))
+    command.extend((["-o", str(job_dir)]))
+    command.extend((["--otf"]))
+
+    cryolo_flags = {
+        "cryolo_model_weights": "--weights",
+        "input_path": "-i",
+        "cryolo_threshold": "--threshold",
+        "cryolo_gpus": "--gpu",
+    }
+
+    for k, v in cryolo_params.dict().items():
+        if k == "input_path" and input_paths:
+            command.extend((cryolo_flags[k], *input_paths))
+        elif v and (k in cryolo_flags):
+            command.extend((cryolo_flags[k], str(v)))
+    return command
+
+
+class CrYOLO(PooledService):
     """
     A service that runs crYOLO particle picking
     """
@@ -51,14 +83,7 @@ class CrYOLO(CommonService):
     def initializing(self):
         """Subscribe to a queue. Received messages must be acknowledged."""
         self.log.info("crYOLO service starting")
-        workflows.recipe.wrap_subscribe(
-            self._transport,
-            "cryolo",
-            self.cryolo,
-            acknowledgement=True,
-            log_extender=self.extend_log,
-            allow_non_recipe_messages=True,
-        )
+        self.subscribe_pooled("cryolo", self.cryolo)
 
     def parse_cryolo_output(self, cryolo_stdout: str):
         """
@@ -79,11 +104,41 @@ class CrYOLO(CommonService):
         Main function which interprets received messages, runs cryolo
         and sends messages to the ispyb and image services
         """
+        rw, cryolo_params = self.read_parameters(rw, header, message)
+        if not cryolo_params:
+            return
+
+        # Reset number of particles
+        self.number_of_particles = 0
+
+        # CrYOLO requires running in the project directory or job directory
+        job_dir = Path(re.search(".+/job[0-9]{3}/", cryolo_params.output_path)[0])
+        job_dir.mkdir(parents=True, exist_ok=True)
+
+        # Construct a command to run cryolo with the given parameters
+        command = cryolo_command(cryolo_params, job_dir)
 
-        class MockRW:
-            def dummy(self, *args, **kwargs):
-                pass
+        self.log.info(
+            f"Input: {cryolo_params.input_path} "
+            + f"Output: {cryolo_params.output_path}"
+        )
 
+        # Run cryolo
+        result = subprocess.run(command, cwd=job_dir, capture_output=True)
+
+        # Remove cryosparc file to minimise crashes
+        (job_dir / "CRYOSPARC/cryosparc.star").unlink(missing_ok=True)
+
+        # Read in the stdout from cryolo
+        self.parse_cryolo_output(result.stdout.decode("utf8", "replace"))
+
+        self.send_results(rw, header, cryolo_params, job_dir, command, result)
+
+    def read_parameters(self, rw, header: dict, message: dict):
+        """
+        Validate the parameters of a received message, returning the recipe
+        wrapper to reply with and the parameters, or None if rejected
+        """
         if not rw:
             if (
                 not isinstance(message, dict)
@@ -92,7 +147,7 @@ class CrYOLO(CommonService):
             ):
                 self.log.error("Rejected invalid simple message")
                 self._transport.nack(header)
-                return
+                return rw, None
 
             # Create a wrapper-like object that can be passed to functions
             # as if a recipe wrapper was present.
@@ -104,9 +159,6 @@ class CrYOLO(CommonService):
             rw.send = rw.dummy
             message = message["content"]
 
-        # Reset number of particles
-        self.number_of_particles = 0
-
         try:
             if isinstance(message, dict):
                 cryolo_params = CryoloParameters(
@@ -123,43 +175,22 @@ class CrYOLO(CommonService):
                 f"with exception: {e}"
             )
             rw.transport.nack(header)
-            return
-
-        # CrYOLO requires running in the project directory or job directory
-        job_dir = Path(re.search(".+/job[0-9]{3}/", cryolo_params.output_path)[0])
-        job_dir.mkdir(parents=True, exist_ok=True)
-
-        # Construct a command to run cryolo with the given parameters
-        command = cryolo_params.cryolo_command.split()
-        command.extend((["--conf", cryolo_params.cryolo_config_file]))
-        command.extend((["-o", str(job_dir)]))
-        command.extend((["--otf"]))
-
-        cryolo_flags = {
-            "cryolo_model_weights": "--weights",
-            "input_path": "-i",
-            "cryolo_threshold": "--threshold",
-            "cryolo_gpus": "--gpu",
-        }
-
-        for k, v in cryolo_params.dict().items():
-            if v and (k in cryolo_flags):
-                command.extend((cryolo_flags[k], str(v)))
-
-        self.log.info(
-            f"Input: {cryolo_params.input_path} "
-            + f"Output: {cryolo_params.output_path}"
-        )
-
-        # Run cryolo
-        result = subprocess.run(command, cwd=job_dir, capture_output=True)
-
-        # Remove cryosparc file to minimise crashes
-        (job_dir / "CRYOSPARC/cryosparc.star").unlink(missing_ok=True)
-
-        # Read in the stdout from cryolo
-        self.parse_cryolo_output(result.stdout.decode("utf8", "replace"))
-
+            return rw, None
+        return rw, cryolo_params
+
+    def send_results(
+        self,
+        rw,
+        header: dict,
+        cryolo_params: CryoloParameters,
+        job_dir: Path,
+        command: List[str],
+        result: subprocess.CompletedProcess,
+    ):
+        """
+        Select particles from the cbox file of a micrograph picked by cryolo
+        and send the results on to the other services
+        """
         # Read in the cbox file for particle selection and finding sizes
         try:
             cbox_file = cif.read_file(
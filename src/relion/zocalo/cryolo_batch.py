@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import re
+import subprocess
+import time
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Tuple
+
+import workflows.recipe
+from gemmi import cif
+from workflows.services.common_service import CommonService
+
+from relion.zocalo.cryolo import CrYOLO, CryoloParameters, cryolo_command
+
+
+class CryoloPredictor:
+    """
+    Backend that picks particles on a batch of micrographs with crYOLO.
+    One predictor is kept for the lifetime of the service, so any backend
+    that loads the model itself only does so once.
+    This default backend runs cryolo_predict.py once for each batch,
+    so that the model is loaded once per batch rather than per micrograph.
+    """
+
+    def predict(
+        self, cryolo_params: CryoloParameters, input_paths: List[str], job_dir: Path
+    ) -> subprocess.CompletedProcess:
+        command = cryolo_command(cryolo_params, job_dir, input_paths=input_paths)
+        return subprocess.run(command, cwd=job_dir, capture_output=True)
+
+
+class PendingMicrograph(NamedTuple):
+    rw: object
+    header: dict
+    cryolo_params: CryoloParameters
+    received: float
+
+
+class CrYOLOBatch(CrYOLO, CommonService):
+    """
+    A crYOLO service which keeps a predictor loaded and picks on batches of
+    micrographs. Micrographs are held until batch_size of them have arrived
+    for the same job and model, or the first of them has waited for
+    batch_wait seconds. Messages are only acknowledged once their batch is run.
+    """
+
+    # Human readable service name
+    _service_name = "CrYOLOBatch"
+
+    # Logger name
+    _logger_name = "relion.zocalo.cryolo_batch"
+
+    # Size and time limits of a batch of micrographs
+    batch_size: int = 8
+    batch_wait: float = 10
+
+    # Backend used to run the predictions
+    predictor: CryoloPredictor = None
+
+    def initializing(self):
+        """Subscribe to a queue. Received messages must be acknowledged."""
+        self.log.info("crYOLO batch service starting")
+        if self.predictor is None:
+            self.predictor = CryoloPredictor()
+        self._pending: Dict[Tuple, List[PendingMicrograph]] = {}
+        workflows.recipe.wrap_subscribe(
+            self._transport,
+            "cryolo",
+            self.cryolo,
+            acknowledgement=True,
+            log_extender=self.extend_log,
+            allow_non_recipe_messages=True,
+            prefetch_count=self.batch_size,
+        )
+        self._register_idle(1, self.flush_expired)
+
+    @staticmethod
+    def _batch_key(cryolo_params: CryoloParameters, job_dir: Path) -> Tuple:
+        # micrographs can only be picked together with the same command options
+        return tuple(
+            cryolo_command(cryolo_params, job_dir, input_paths=["<batch>"])
+        ) + (str(job_dir),)
+
+    def cryolo(self, rw, header: dict, message: dict):
+        """
+        Add a received micrograph to the batch for its job,
+        and run any batches which are ready
+        """
+        rw, cryolo_params = self.read_parameters(rw, header, message)
+        if not cryolo_params:
+            return
+
+        job_dir = Path(re.search(".+/job[0-9]{3}/", cryolo_params.output_path)[0])
+        job_dir.mkdir(parents=True, exist_ok=True)
+        key = self._batch_key(cryolo_params, job_dir)
+        self._pending.setdefault(key, []).append(
+            PendingMicrograph(rw, header, cryolo_params, time.time())
+        )
+        if len(self._pending[key]) >= self.batch_size:
+            self.flush(key)
+        self.flush_expired()
+
+    def flush_expired(self):
+        """Run all batches whose first micrograph has waited for batch_wait"""
+        expiry_time = time.time() - self.batch_wait
+        for key in [
+            key
+            for key, pending in self._pending.items()
+            if pending[0].received <= expiry_time
+        ]:
+            self.flush(key)
+
+    def flush_all(self):
+        """Run all waiting batches, regardless of their size or age"""
+        for key in list(self._pending):
+            self.flush(key)
+
+    def flush(self, key: Tuple):
+        """Pick particles on a batch of micrographs and send on the results"""
+        batch = self._pending.pop(key, [])
+        if not batch:
+            return
+        job_dir = Path(key[-1])
+        input_paths = [pending.cryolo_params.input_path for pending in batch]
+        self.log.info(f"Running crYOLO on {len(batch)} micrographs in {job_dir}")
+        sent = 0
+        try:
+            result = self.predictor.predict(
+                batch[0].cryolo_params, input_paths, job_dir
+            )
+
+            # Remove cryosparc file to minimise crashes
+            (job_dir / "CRYOSPARC/cryosparc.star").unlink(missing_ok=True)
+
+            for pending in batch:
+                # The output log covers the whole batch, so count each micrograph's picks
+                self.number_of_particles = self.count_star_particles(
+                    Path(pending.cryolo_params.output_path)
+                )
+                self.send_results(
+                    pending.rw,
+                    pending.header,
+                    pending.cryolo_params,
+                    job_dir,
+                    cryolo_command(pending.cryolo_params, job_dir),
+                    result,
+                )
+                sent += 1
+        except Exception as e:
+            self.log.error(f"crYOLO batch in {job_dir} failed: {e}", exc_info=True)
+            # Messages whose results were not sent have not been acknowledged
+            for pending in batch[sent:]:
+                pending.rw.transport.nack(pending.header)
+
+    @staticmethod
+    def count_star_particles(star_path: Path) -> int:
+        """Number of particle coordinates in a cryolo output star file"""
+        try:
+            coords_block = cif.read_file(str(star_path)).sole_block()
+        except (FileNotFoundError, OSError, RuntimeError, ValueError):
+            return 0
+        return len(coords_block.find_loop("_rlnCoordinateX"))
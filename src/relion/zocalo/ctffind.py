@@ -5,11 +5,10 @@ import subprocess
 from pathlib import Path
 from typing import Optional
 
-import workflows.recipe
 from pydantic import BaseModel, Field, ValidationError, validator
-from workflows.services.common_service import CommonService
 
 from relion.zocalo.spa_relion_service_options import RelionServiceOptions
+from relion.zocalo.worker_pool import PooledService
 
 
 class CTFParameters(BaseModel):
@@ -43,7 +42,7 @@ class CTFParameters(BaseModel):
         return experiment
 
 
-class CTFFind(CommonService):
+class CTFFind(PooledService):
     """
     A service for CTF estimating micrographs with CTFFind
     """
@@ -67,14 +66,7 @@ class CTFFind(CommonService):
     def initializing(self):
         """Subscribe to a queue. Received messages must be acknowledged."""
         self.log.info("CTFFind service starting")
-        workflows.recipe.wrap_subscribe(
-            self._transport,
-            "ctffind",
-            self.ctf_find,
-            acknowledgement=True,
-            log_extender=self.extend_log,
-            allow_non_recipe_messages=True,
-        )
+        self.subscribe_pooled("ctffind", self.ctf_find)
 
     def parse_ctf_output(self, ctf_stdout: str):
         """
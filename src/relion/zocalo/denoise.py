@@ -1,9 +1,6 @@
 from __future__ import annotations
 
-import datetime
 import string
-import subprocess
-import time
 from collections import ChainMap
 from pathlib import Path
 from typing import Optional
@@ -13,6 +10,8 @@ import workflows.recipe
 from pydantic import BaseModel, Field, ValidationError, validator
 from workflows.services.common_service import CommonService
 
+from relion.zocalo.condor_jobs import CondorJobTracker, FinishedCluster
+
 
 class DenoiseParameters(BaseModel):
     volume: str = Field(..., min_length=1)
@@ -73,6 +72,11 @@ class ChainMapWithReplacement(ChainMap):
         return v
 
 
+class MockRW:
+    def dummy(self, *args, **kwargs):
+        pass
+
+
 class Denoise(CommonService):
     """
     A service for denoising cryoEM tomograms using Topaz
@@ -84,9 +88,17 @@ class Denoise(CommonService):
     # Logger name
     _logger_name = "relion.zocalo.denoise"
 
+    # Messages are acknowledged once their job has run on the cluster,
+    # so several volumes can be waiting at once
+    prefetch_count = 20
+
     def initializing(self):
-        """Subscribe to a queue. Received messages must be acknowledged."""
+        """Subscribe to a queue, and start following submitted jobs"""
         self.log.info("Denoise service starting")
+        self.condor_jobs = CondorJobTracker(
+            on_finished=self.job_finished, job_timeout=20 * 60
+        )
+        self.condor_jobs.start()
         workflows.recipe.wrap_subscribe(
             self._transport,
             "denoise",
@@ -94,13 +106,14 @@ class Denoise(CommonService):
             acknowledgement=True,
             log_extender=self.extend_log,
             allow_non_recipe_messages=True,
+            prefetch_count=self.prefetch_count,
         )
 
-    def denoise(self, rw, header: dict, message: dict):
-        class MockRW:
-            def dummy(self, *args, **kwargs):
-                pass
+    def in_shutdown(self):
+        if getattr(self, "condor_jobs", None):
+            self.condor_jobs.stop()
 
+    def denoise(self, rw, header: dict, message: dict):
         if not rw:
             if (
                 not isinstance(message, dict)
@@ -178,39 +191,6 @@ class Denoise(CommonService):
         self.log.info(f"Running Topaz {command}")
         self.log.info(f"Input: {d_params.volume} Output: {denoised_full_path}")
 
-        # Set-up condor config
-        htcondor.param["RELEASE_DIR"] = "/usr"
-        htcondor.param["LOCAL_DIR"] = "/var"
-        htcondor.param["RUN"] = "/var/run/condor"
-        htcondor.param["LOG"] = "/var/log/condor"
-        htcondor.param["LOCK"] = "/var/lock/condor"
-        htcondor.param["SPOOL"] = "/var/lib/condor/spool"
-        htcondor.param["EXECUTE"] = "/var/lib/condor/execute"
-        htcondor.param["BIN"] = "/usr/bin"
-        htcondor.param["LIB"] = "/usr/lib64/condor"
-        htcondor.param["INCLUDE"] = "/usr/include/condor"
-        htcondor.param["SBIN"] = "/usr/sbin"
-        htcondor.param["LIBEXEC"] = "/usr/libexec/condor"
-        htcondor.param["SHARE"] = "/usr/share/condor"
-        htcondor.param["PROCD_ADDRESS"] = "/var/run/condor/procd_pipe"
-        htcondor.param[
-            "JAVA_CLASSPATH_DEFAULT"
-        ] = "/usr/share/condor /usr/share/condor/scimark2lib.jar ."
-        htcondor.param["CONDOR_HOST"] = "pool-gpu-htcondor-manager.diamond.ac.uk"
-        htcondor.param["COLLECTOR_HOST"] = "pool-gpu-htcondor-manager.diamond.ac.uk"
-        htcondor.param["ALLOW_READ"] = "*"
-        htcondor.param["ALLOW_WRITE"] = "*"
-        htcondor.param["ALLOW_NEGOTIATOR"] = "*"
-        htcondor.param["ALLOW_DAEMON"] = "*"
-        htcondor.param["SEC_DEFAULT_AUTHENTICATION_METHODS"] = "FS_REMOTE, PASSWORD"
-        htcondor.param[
-            "SEC_WRITE_AUTHENTICATION_METHODS"
-        ] = "FS_REMOTE, PASSWORD, ANONYMOUS"
-        htcondor.param[
-            "SEC_READ_AUTHENTICATION_METHODS"
-        ] = "FS_REMOTE, PASSWORD, ANONYMOUS"
-        htcondor.param["FS_REMOTE_DIR"] = "/dls/tmp/htcondor"
-
         output_file = str(Path(d_params.volume).with_suffix("")) + "_denoise_iris_out"
         error_file = str(Path(d_params.volume).with_suffix("")) + "_denoise_iris_error"
         log_file = str(Path(d_params.volume).with_suffix("")) + "_denoise_iris_log"
@@ -235,7 +215,8 @@ class Denoise(CommonService):
             )
         except Exception:
             self.log.warn("Couldn't connect submitter")
-            return None
+            rw.transport.nack(header)
+            return
 
         itemdata = [
             {
@@ -249,35 +230,36 @@ class Denoise(CommonService):
             }
         ]
 
-        coll = htcondor.Collector(htcondor.param["COLLECTOR_HOST"])
-        schedd_ad = coll.locate(htcondor.DaemonTypes.Schedd)
-        schedd = htcondor.Schedd(schedd_ad)
-        job = schedd.submit(at_job, itemdata=iter(itemdata))
-        cluster_id = job.cluster()
+        try:
+            cluster_id = self.condor_jobs.submit(
+                at_job,
+                itemdata,
+                data=(rw, header, d_params.volume, denoised_full_path),
+            )
+        except Exception as e:
+            self.log.error(f"Could not submit to Iris: {e}")
+            rw.transport.nack(header)
+            return
+        # The message is finished by condor_job_finished once the job completes
         self.log.info(f"Submitting to Iris, ID: {str(cluster_id)}")
 
-        res = 1
-        start_time = datetime.datetime.now()
-        while res:
-            try:
-                res = schedd.query(
-                    constraint="ClusterId=={}".format(cluster_id),
-                    projection=["JobStatus"],
-                )[0]["JobStatus"]
-            except IndexError:
-                break
-            if res == 12:
-                schedd.act(htcondor.JobAction.Remove, f"ClusterId == {cluster_id}")
-                return subprocess.CompletedProcess(args="", returncode=res)
-            time.sleep(10)
-            if (datetime.datetime.now() - start_time).seconds > 20 * 60:
-                # Abort if duration over 20 minutes
-                schedd.act(htcondor.JobAction.Remove, f"ClusterId == {cluster_id}")
-                rw.transport.nack(header)
-                return
+    def job_finished(self, cluster: FinishedCluster):
+        """Pass a finished job from the polling thread to the service thread"""
+        self._transport_interceptor(self.condor_job_finished)(None, cluster)
+
+    def condor_job_finished(self, header, cluster: FinishedCluster):
+        """Forward the denoised volume to the images service"""
+        rw, message_header, volume, denoised_full_path = cluster.data
+        if cluster.state != "COMPLETED":
+            self.log.error(
+                f"Denoising of {volume} failed, Iris job {cluster.cluster_id} "
+                f"finished with state {cluster.state}"
+            )
+            rw.transport.nack(message_header)
+            return
 
         # Forward results to images service
-        self.log.info(f"Sending to images service {d_params.volume}")
+        self.log.info(f"Sending to images service {volume}")
         if isinstance(rw, MockRW):
             rw.transport.send(
                 destination="images",
@@ -309,6 +291,5 @@ class Denoise(CommonService):
                 },
             )
 
-        self.log.info(f"Done denoising for {d_params.volume}")
-        rw.transport.ack(header)
-        return subprocess.CompletedProcess(args="", returncode=0)
+        self.log.info(f"Done denoising for {volume}")
+        rw.transport.ack(message_header)
@@ -1,19 +1,19 @@
 from __future__ import annotations
 
+import functools
 import re
 from pathlib import Path
 
 import mrcfile
 import numpy as np
-import workflows.recipe
 from gemmi import cif
 from pydantic import BaseModel, Field, ValidationError
-from workflows.services.common_service import CommonService
 
 from relion.zocalo.spa_relion_service_options import (
     RelionServiceOptions,
     update_relion_options,
 )
+from relion.zocalo.worker_pool import PooledService
 
 
 class ExtractParameters(BaseModel):
@@ -40,7 +40,168 @@ class ExtractParameters(BaseModel):
     relion_options: RelionServiceOptions
 
 
-class Extract(CommonService):
+@functools.lru_cache(maxsize=8)
+def _background_kernels(extract_width: int, bg_radius: float):
+    """
+    Background region of a box and the matrices to fit a plane to it,
+    which are the same for every particle with the same box size
+    """
+    # Distance of each pixel from the centre, compared to background radius
+    grid_indexes = np.meshgrid(
+        np.arange(2 * extract_width),
+        np.arange(2 * extract_width),
+    )
+    distance_from_centre = np.sqrt(
+        (grid_indexes[0] - extract_width + 0.5) ** 2
+        + (grid_indexes[1] - extract_width + 0.5) ** 2
+    )
+    bg_region = distance_from_centre > bg_radius
+
+    # Least squares fit of a*x + b*y + c to the background from the normal equation
+    positions_matrix = np.stack(
+        (
+            np.ones(np.count_nonzero(bg_region)),
+            grid_indexes[0][bg_region],
+            grid_indexes[1][bg_region],
+        ),
+        axis=1,
+    )
+    fit_matrix = np.dot(
+        np.linalg.inv(np.dot(positions_matrix.transpose(), positions_matrix)),
+        positions_matrix.transpose(),
+    )
+    # Positions across the full box to evaluate the fitted planes on
+    plane_positions = np.stack(
+        (
+            np.ones(4 * extract_width**2),
+            np.reshape(grid_indexes[0], 4 * extract_width**2),
+            np.reshape(grid_indexes[1], 4 * extract_width**2),
+        ),
+        axis=1,
+    )
+    for kernel in (bg_region, fit_matrix, plane_positions):
+        kernel.setflags(write=False)
+    return bg_region, fit_matrix, plane_positions
+
+
+def _gather_boxes(
+    image: np.ndarray, pixel_x: np.ndarray, pixel_y: np.ndarray, extract_width: int
+) -> np.ndarray:
+    """Cut out the boxes around a set of particles, padding any at the edges"""
+    box = 2 * extract_width
+    boxes = np.empty((len(pixel_x), box, box), dtype=image.dtype)
+    inside = (
+        (pixel_x >= extract_width)
+        & (pixel_x + extract_width <= image.shape[1])
+        & (pixel_y >= extract_width)
+        & (pixel_y + extract_width <= image.shape[0])
+    )
+    if np.all(image.shape[:2] >= np.array([box, box])):
+        windows = np.lib.stride_tricks.sliding_window_view(image, (box, box))
+        boxes[inside] = windows[
+            pixel_y[inside] - extract_width, pixel_x[inside] - extract_width
+        ]
+    else:
+        inside[:] = False
+    for particle in np.flatnonzero(~inside):
+        x_left = pixel_x[particle] - extract_width
+        x_right = pixel_x[particle] + extract_width
+        y_top = pixel_y[particle] - extract_width
+        y_bot = pixel_y[particle] + extract_width
+        particle_subimage = image[
+            max(y_top, 0) : min(y_bot, image.shape[0]),
+            max(x_left, 0) : min(x_right, image.shape[1]),
+        ]
+        boxes[particle] = np.pad(
+            particle_subimage,
+            (
+                (max(y_bot - image.shape[0], 0), max(-y_top, 0)),
+                (max(-x_left, 0), max(x_right - image.shape[1], 0)),
+            ),
+            mode="edge",
+        )
+    return boxes
+
+
+def extract_particle_stack(
+    image: np.ndarray,
+    particles_x,
+    particles_y,
+    boxsize: int,
+    small_boxsize: int,
+    bg_radius: float,
+    downscale: bool = False,
+    invert_contrast: bool = True,
+    norm: bool = True,
+    chunk_size: int = 256,
+) -> np.ndarray:
+    """
+    Extract, downscale and normalise the particle images at the given coordinates,
+    returning them as a float32 stack.
+    Particles are processed together in chunks of chunk_size, so that the
+    background fit and Fourier cropping are set up once per box size.
+    Raises numpy.linalg.LinAlgError if no plane can be fit to the background.
+    """
+    # Pixel locations are from bottom left, need to flip the image later
+    pixel_x = np.round(np.array(particles_x, dtype=float)).astype(int)
+    pixel_y = np.round(np.array(particles_y, dtype=float)).astype(int)
+
+    extract_width = round(boxsize / 2)
+    output_width = round(small_boxsize / 2) if downscale else extract_width
+    bg_region, fit_matrix, plane_positions = _background_kernels(
+        output_width, bg_radius
+    )
+    output_stack = np.empty(
+        (len(pixel_x), 2 * output_width, 2 * output_width), dtype=np.float32
+    )
+    if downscale:
+        # Fourier cropping keeps the central small_boxsize frequencies
+        deltax = 2 * extract_width - small_boxsize
+        crop = (
+            slice(None),
+            slice(deltax // 2, 2 * extract_width - deltax // 2),
+            slice(deltax // 2, 2 * extract_width - deltax // 2),
+        )
+
+    for start in range(0, len(pixel_x), chunk_size):
+        boxes = _gather_boxes(
+            image,
+            pixel_x[start : start + chunk_size],
+            pixel_y[start : start + chunk_size],
+            extract_width,
+        )
+
+        # Flip all the values on inversion
+        if invert_contrast:
+            np.negative(boxes, out=boxes)
+
+        # Downscale the image size
+        if downscale:
+            boxes_ft = np.fft.fftshift(np.fft.fft2(boxes), axes=(1, 2))
+            boxes = np.real(np.fft.ifft2(np.fft.ifftshift(boxes_ft[crop], axes=(1, 2))))
+
+        # Fit background to a plane and subtract the plane from the image
+        # (one particle at a time, as a matrix product would round differently)
+        background = boxes[:, bg_region].astype(np.float64)
+        for particle in range(len(boxes)):
+            theta = np.dot(fit_matrix, background[particle])
+            boxes[particle] -= np.reshape(
+                np.dot(plane_positions, theta), boxes.shape[1:]
+            )
+
+        # Background normalisation
+        if norm:
+            # Standardise the values using the background
+            background = np.ascontiguousarray(boxes[:, bg_region])
+            bg_mean = np.mean(background, axis=1)[:, np.newaxis, np.newaxis]
+            bg_std = np.std(background, axis=1)[:, np.newaxis, np.newaxis]
+            boxes = (boxes - bg_mean) / bg_std
+
+        output_stack[start : start + chunk_size] = boxes
+    return output_stack
+
+
+class Extract(PooledService):
     """
     A service for extracting particles from cryolo autopicking
     """
@@ -57,14 +218,7 @@ class Extract(CommonService):
     def initializing(self):
         """Subscribe to a queue. Received messages must be acknowledged."""
         self.log.info("Extract service starting")
-        workflows.recipe.wrap_subscribe(
-            self._transport,
-            "extract",
-            self.extract,
-            acknowledgement=True,
-            log_extender=self.extend_log,
-            allow_non_recipe_messages=True,
-        )
+        self.subscribe_pooled("extract", self.extract)
 
     def extract(self, rw, header: dict, message: dict):
         class MockRW:
@@ -228,154 +382,29 @@ class Extract(CommonService):
         # Extraction
         with mrcfile.open(extract_params.micrographs_file) as input_micrograph:
             input_micrograph_image = np.array(input_micrograph.data, dtype=np.float32)
-        image_size = np.shape(input_micrograph_image)
-        output_mrc_stack = []
-
-        for particle in range(len(particles_x)):
-            # Pixel locations are from bottom left, need to flip the image later
-            pixel_location_x = round(float(particles_x[particle]))
-            pixel_location_y = round(float(particles_y[particle]))
-
-            # Extract the particle image and pad the edges if it is not square
-            x_left_pad = 0
-            x_right_pad = 0
-            y_top_pad = 0
-            y_bot_pad = 0
-
-            extract_width = round(extract_params.relion_options.boxsize / 2)
-
-            x_left = pixel_location_x - extract_width
-            if x_left < 0:
-                x_left_pad = -x_left
-                x_left = 0
-            x_right = pixel_location_x + extract_width
-            if x_right >= image_size[1]:
-                x_right_pad = x_right - image_size[1]
-                x_right = image_size[1]
-            y_top = pixel_location_y - extract_width
-            if y_top < 0:
-                y_top_pad = -y_top
-                y_top = 0
-            y_bot = pixel_location_y + extract_width
-            if y_bot >= image_size[0]:
-                y_bot_pad = y_bot - image_size[0]
-                y_bot = image_size[0]
-
-            particle_subimage = input_micrograph_image[y_top:y_bot, x_left:x_right]
-            particle_subimage = np.pad(
-                particle_subimage,
-                ((y_bot_pad, y_top_pad), (x_left_pad, x_right_pad)),
-                mode="edge",
+        if extract_params.downscale and len(particles_x):
+            extract_params.relion_options.pixel_size_downscaled = (
+                extract_params.pixel_size
+                * extract_params.relion_options.boxsize
+                / extract_params.relion_options.small_boxsize
             )
-
-            # Flip all the values on inversion
-            if extract_params.invert_contrast:
-                particle_subimage = -1 * particle_subimage
-
-            # Downscale the image size
-            if extract_params.downscale:
-                extract_params.relion_options.pixel_size_downscaled = (
-                    extract_params.pixel_size
-                    * extract_params.relion_options.boxsize
-                    / extract_params.relion_options.small_boxsize
-                )
-                subimage_ft = np.fft.fftshift(np.fft.fft2(particle_subimage))
-                deltax = (
-                    subimage_ft.shape[0] - extract_params.relion_options.small_boxsize
-                )
-                deltay = (
-                    subimage_ft.shape[1] - extract_params.relion_options.small_boxsize
-                )
-                particle_subimage = np.real(
-                    np.fft.ifft2(
-                        np.fft.ifftshift(
-                            subimage_ft[
-                                deltax // 2 : subimage_ft.shape[0] - deltax // 2,
-                                deltay // 2 : subimage_ft.shape[1] - deltay // 2,
-                            ]
-                        )
-                    )
-                )
-                extract_width = round(extract_params.relion_options.small_boxsize / 2)
-
-            # Distance of each pixel from the centre, compared to background radius
-            grid_indexes = np.meshgrid(
-                np.arange(2 * extract_width),
-                np.arange(2 * extract_width),
-            )
-            distance_from_centre = np.sqrt(
-                (grid_indexes[0] - extract_width + 0.5) ** 2
-                + (grid_indexes[1] - extract_width + 0.5) ** 2
-            )
-            bg_region = (
-                distance_from_centre
-                > np.ones(np.shape(particle_subimage)) * extract_params.bg_radius
-            )
-
-            # Fit background to a plane and subtract the plane from the image
-            positions = [grid_indexes[0][bg_region], grid_indexes[1][bg_region]]
-            # needs to create a matrix of the correct shape for  a*x + b*y + c plane fit
-            if not len(positions[0]) == len(positions[1]):
-                self.log.warning(
-                    f"Particle image {particle} in {extract_params.micrographs_file} is not square"
-                )
-                continue
-            data_size = len(positions[0])
-            positions_matrix = np.hstack(
-                (
-                    np.reshape(positions[0], (data_size, 1)),
-                    np.reshape(positions[1], (data_size, 1)),
-                )
-            )
-            # this ones for c
-            positions_matrix = np.hstack((np.ones((data_size, 1)), positions_matrix))
-            values = particle_subimage[bg_region]
-            # normal equation
-            try:
-                theta = np.dot(
-                    np.dot(
-                        np.linalg.inv(
-                            np.dot(positions_matrix.transpose(), positions_matrix)
-                        ),
-                        positions_matrix.transpose(),
-                    ),
-                    values,
-                )
-            except np.linalg.LinAlgError:
-                self.log.warning(
-                    f"Could not fit image plane for particle {particle} in {extract_params.micrographs_file}"
-                )
-                continue
-            # now we need the full grid across the image
-            positions_matrix = np.hstack(
-                (
-                    np.reshape(grid_indexes[0], (4 * extract_width**2, 1)),
-                    np.reshape(grid_indexes[1], (4 * extract_width**2, 1)),
-                )
-            )
-            positions_matrix = np.hstack(
-                (np.ones((4 * extract_width**2, 1)), positions_matrix)
+        try:
+            output_mrc_stack = extract_particle_stack(
+                input_micrograph_image,
+                particles_x,
+                particles_y,
+                boxsize=extract_params.relion_options.boxsize,
+                small_boxsize=extract_params.relion_options.small_boxsize,
+                bg_radius=extract_params.bg_radius,
+                downscale=extract_params.downscale,
+                invert_contrast=extract_params.invert_contrast,
+                norm=extract_params.norm,
             )
-            plane = np.reshape(
-                np.dot(positions_matrix, theta), (2 * extract_width, 2 * extract_width)
+        except np.linalg.LinAlgError:
+            self.log.warning(
+                f"Could not fit image plane for particles in {extract_params.micrographs_file}"
             )
-
-            particle_subimage -= plane
-
-            # Background normalisation
-            if extract_params.norm:
-                # Standardise the values using the background
-                bg_mean = np.mean(particle_subimage[bg_region])
-                bg_std = np.std(particle_subimage[bg_region])
-                particle_subimage = (particle_subimage - bg_mean) / bg_std
-
-            # Add to output stack
-            if len(output_mrc_stack):
-                output_mrc_stack = np.append(
-                    output_mrc_stack, [particle_subimage], axis=0
-                )
-            else:
-                output_mrc_stack = np.array([particle_subimage], dtype=np.float32)
+            output_mrc_stack = np.empty((0, 0, 0), dtype=np.float32)
 
         # Produce the mrc file of the extracted particles
         if extract_params.downscale:
@@ -389,7 +418,7 @@ class Extract(CommonService):
         self.log.info(f"Extracted {particle_count} particles")
         if particle_count > 0:
             with mrcfile.new(str(output_mrc_file), overwrite=True) as mrc:
-                mrc.set_data(output_mrc_stack.astype(np.float32))
+                mrc.set_data(output_mrc_stack)
                 mrc.header.mx = box_len
                 mrc.header.my = box_len
                 mrc.header.mz = 1
@@ -7,12 +7,11 @@ import subprocess
 from pathlib import Path
 from typing import Literal, Optional
 
-import workflows.recipe
 from pydantic import BaseModel, Field, ValidationError
-from workflows.services.common_service import CommonService
 
 from relion.cryolo_relion_it import icebreaker_histogram
 from relion.zocalo.spa_relion_service_options import RelionServiceOptions
+from relion.zocalo.worker_pool import PooledService
 
 
 class IceBreakerParameters(BaseModel):
@@ -30,7 +29,7 @@ class IceBreakerParameters(BaseModel):
     relion_options: RelionServiceOptions
 
 
-class IceBreaker(CommonService):
+class IceBreaker(PooledService):
     """
     A service that runs the IceBreaker micrographs job
     """
@@ -54,14 +53,7 @@ class IceBreaker(CommonService):
     def initializing(self):
         """Subscribe to a queue. Received messages must be acknowledged."""
         self.log.info("IceBreaker service starting")
-        workflows.recipe.wrap_subscribe(
-            self._transport,
-            "icebreaker",
-            self.icebreaker,
-            acknowledgement=True,
-            log_extender=self.extend_log,
-            allow_non_recipe_messages=True,
-        )
+        self.subscribe_pooled("icebreaker", self.icebreaker)
 
     def parse_icebreaker_output(self, icebreaker_stdout: str):
         """
@@ -319,15 +311,12 @@ class IceBreaker(CommonService):
                 icebreaker_params.output_path
             )
             try:
-                pdf_file_path = icebreaker_histogram.create_pdf_histogram(
-                    project_dir,
-                    version=4,
-                )
-                json_file_path = icebreaker_histogram.create_json_histogram(
+                histograms = icebreaker_histogram.create_histograms(
                     project_dir,
                     version=4,
                 )
-                if pdf_file_path and json_file_path:
+                if histograms:
+                    json_file_path, pdf_file_path = histograms
                     attachment_list = [
                         {
                             "ispyb_command": "add_program_attachment",
@@ -11,7 +11,8 @@ from typing import Any, Callable, Dict, NamedTuple, Protocol
 import PIL.Image
 import workflows.recipe
 from importlib_metadata import entry_points
-from workflows.services.common_service import CommonService
+
+from relion.zocalo.worker_pool import PooledService
 
 logger = logging.getLogger("relion.zocalo.images")
 
@@ -27,7 +28,7 @@ class PluginInterface(NamedTuple):
     message: Dict[str, Any]
 
 
-class Images(CommonService):
+class Images(PooledService):
     """
     A service that generates images and thumbnails.
     Plugin functions can be registered under the entry point
@@ -58,12 +59,8 @@ class Images(CommonService):
                 for e in entry_points(group="zocalo.services.images.plugins")
             }
         )
-        workflows.recipe.wrap_subscribe(
-            self._transport,
-            "images",
-            self.image_call,
-            acknowledgement=True,
-            log_extender=self.extend_log,
+        self.subscribe_pooled(
+            "images", self.image_call, allow_non_recipe_messages=False
         )
 
     def image_call(self, rw, header, message):
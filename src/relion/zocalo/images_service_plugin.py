@@ -1,17 +1,296 @@
 from __future__ import annotations
 
+import io
 import logging
+import os
+import struct
+import threading
 import time
+import zlib
+from collections import OrderedDict
 from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
 
 import mrcfile
 import numpy as np
 import PIL.Image
-from PIL import ImageDraw, ImageEnhance, ImageFilter
+from PIL import ImageColor, ImageDraw, ImageEnhance, ImageFilter
 
 logger = logging.getLogger("relion.zocalo.images_service_plugin")
 
 
+class _SharedResults:
+    """
+    Results of recent work, shared between the threads of the images service.
+    Results are kept for lifetime seconds, up to a total of size results,
+    and failures (None or False) are not kept.
+    While one thread works out the result for a key, other threads asking
+    for the same key wait for it rather than repeating the work.
+    """
+
+    def __init__(self, lifetime: float, size: int):
+        self.lifetime = lifetime
+        self.size = size
+        self._results: OrderedDict[tuple, Tuple[float, Any]] = OrderedDict()
+        self._in_progress: Dict[tuple, threading.Event] = {}
+        self._lock = threading.Lock()
+
+    def get(
+        self,
+        key: tuple,
+        compute: Callable[[], Any],
+        still_valid: Callable[[Any], bool] = lambda result: True,
+    ):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._results and (
+                    now - next(iter(self._results.values()))[0] > self.lifetime
+                ):
+                    self._results.popitem(last=False)
+                if key in self._results:
+                    result = self._results[key][1]
+                    if still_valid(result):
+                        return result
+                    del self._results[key]
+                in_progress = self._in_progress.get(key)
+                if in_progress is None:
+                    self._in_progress[key] = threading.Event()
+                    break
+            in_progress.wait()
+
+        try:
+            result = compute()
+            if result is not None and result is not False:
+                with self._lock:
+                    self._results[key] = (time.monotonic(), result)
+                    while len(self._results) > self.size:
+                        self._results.popitem(last=False)
+            return result
+        finally:
+            with self._lock:
+                self._in_progress.pop(key).set()
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+
+# Micrographs are decoded once for the jpeg and picked particle images
+_micrograph_images = _SharedResults(lifetime=60, size=4)
+# Repeated requests for the same images are answered with the earlier outputs
+_recent_outputs = _SharedResults(lifetime=60, size=500)
+
+
+def _file_key(filepath: Path) -> tuple:
+    """Identify a version of a file, so results are not reused if it changes"""
+    stat = filepath.stat()
+    return (str(filepath.absolute()), stat.st_mtime_ns, stat.st_size)
+
+
+def _outputs_exist(outputs) -> bool:
+    if isinstance(outputs, list):
+        return all(Path(output).is_file() for output in outputs)
+    return Path(outputs).is_file()
+
+
+def _intensity_limits(
+    data: np.ndarray, clip_sigma: Optional[float] = 3
+) -> Tuple[float, float]:
+    """
+    The range of values to scale to 8-bit greyscale, within clip_sigma
+    standard deviations of the mean if this is given
+    """
+    data = np.asarray(data, dtype=np.float32)
+    low, high = data.min(), data.max()
+    if clip_sigma:
+        mean = np.mean(data)
+        sdev = np.std(data)
+        low = max(low, mean - clip_sigma * sdev)
+        high = min(high, mean + clip_sigma * sdev)
+    return low, high
+
+
+def _scale_to_uint8(
+    data: np.ndarray,
+    clip_sigma: Optional[float] = 3,
+    limits: Optional[Tuple[float, float]] = None,
+) -> np.ndarray:
+    """
+    Scale image data to the range of 8-bit greyscale, after clipping to the
+    given limits, or to within clip_sigma standard deviations of the mean
+    """
+    data = np.asarray(data, dtype=np.float32)
+    low, high = limits or _intensity_limits(data, clip_sigma)
+    data = np.clip(data, low, high)
+    data -= low
+    data *= 255 / (high - low)
+    return data.astype("uint8")
+
+
+def _downsample(data: np.ndarray, size: int) -> np.ndarray:
+    """
+    Average blocks of an image, so it is no smaller than size on its longest
+    side, without converting the whole image to floating point first
+    """
+    factor = max(1, max(data.shape) // size)
+    if factor == 1:
+        return np.asarray(data, dtype=np.float32)
+    ny, nx = (length // factor for length in data.shape)
+    blocks = data[: ny * factor, : nx * factor].reshape(ny, factor, nx, factor)
+    return blocks.mean(axis=(1, 3), dtype=np.float32)
+
+
+def _volume_limits(
+    volume: np.ndarray, size: int, clip_sigma: Optional[float] = 3
+) -> Tuple[float, float]:
+    """Intensity limits for all the slices of a volume, from a sample of the slices"""
+    step = max(1, len(volume) // 16)
+    return _intensity_limits(
+        np.stack([_downsample(frame, size) for frame in volume[::step]]), clip_sigma
+    )
+
+
+class _AnimatedPNGWriter:
+    """
+    Writes an animated PNG one frame at a time, so only the current frame is
+    held in memory. Each frame is compressed by PIL as a PNG and its image
+    data chunks are copied into the animation.
+    """
+
+    signature = b"\x89PNG\r\n\x1a\n"
+
+    def __init__(self, outfile, num_frames: int):
+        self.outfile = outfile
+        self.num_frames = num_frames
+        self._partfile = f"{outfile}.part"
+        self._file = open(self._partfile, "wb")
+        self._sequence = 0
+        self._frames = 0
+
+    def _write_chunk(self, chunk_type: bytes, data: bytes):
+        self._file.write(struct.pack(">I", len(data)))
+        self._file.write(chunk_type)
+        self._file.write(data)
+        self._file.write(struct.pack(">I", zlib.crc32(chunk_type + data)))
+
+    def _next_sequence(self) -> bytes:
+        self._sequence += 1
+        return struct.pack(">I", self._sequence - 1)
+
+    def add_frame(self, im: PIL.Image.Image):
+        png = io.BytesIO()
+        im.save(png, format="PNG")
+        png = png.getvalue()
+        chunks = []
+        offset = len(self.signature)
+        while offset < len(png):
+            (length,) = struct.unpack_from(">I", png, offset)
+            chunk_type = png[offset + 4 : offset + 8]
+            chunks.append((chunk_type, png[offset + 8 : offset + 8 + length]))
+            offset += length + 12
+        if not self._frames:
+            self._file.write(self.signature)
+            self._write_chunk(b"IHDR", chunks[0][1])
+            # the number of frames, shown in a continuous loop
+            self._write_chunk(b"acTL", struct.pack(">II", self.num_frames, 0))
+        self._write_chunk(
+            b"fcTL",
+            self._next_sequence()
+            + struct.pack(">IIIIHHBB", im.width, im.height, 0, 0, 0, 1000, 0, 0),
+        )
+        for chunk_type, data in chunks:
+            if chunk_type != b"IDAT":
+                continue
+            if self._frames:
+                self._write_chunk(b"fdAT", self._next_sequence() + data)
+            else:
+                self._write_chunk(b"IDAT", data)
+        self._frames += 1
+
+    def close(self):
+        self._write_chunk(b"IEND", b"")
+        self._file.close()
+        os.replace(self._partfile, self.outfile)
+
+    def discard(self):
+        self._file.close()
+        os.remove(self._partfile)
+
+
+def _micrograph_image(filepath: Path, mrc: mrcfile.mrcfile.MrcFile) -> np.ndarray:
+    """The clipped 8-bit image of a micrograph, decoded once for all outputs"""
+
+    def decode():
+        image = _scale_to_uint8(mrc.data)
+        image.flags.writeable = False
+        return image
+
+    return _micrograph_images.get(_file_key(filepath), decode)
+
+
+def _save(im: PIL.Image.Image, outfile, **kwargs) -> bool:
+    try:
+        im.save(outfile, **kwargs)
+    except FileNotFoundError:
+        logger.error(f"Trying to save to file {outfile} but directory does not exist")
+        return False
+    return True
+
+
+default_outline_colour = "#f58a07"
+low_confidence_colour = "#07a4f5"
+
+Colour = Union[str, Tuple[int, int, int]]
+
+
+def confidence_colours(
+    confidences: Sequence[float],
+    low: Colour = low_confidence_colour,
+    high: Colour = default_outline_colour,
+) -> List[Tuple[int, int, int]]:
+    """Colour each particle between low and high by its confidence from 0 to 1"""
+    low_rgb = np.array(ImageColor.getrgb(low) if isinstance(low, str) else low)
+    high_rgb = np.array(ImageColor.getrgb(high) if isinstance(high, str) else high)
+    weights = np.clip(np.asarray(confidences, dtype=float), 0, 1)[:, np.newaxis]
+    colours = np.rint(low_rgb + weights * (high_rgb - low_rgb)).astype(int)
+    return [tuple(colour) for colour in colours.tolist()]
+
+
+def particle_overlay(
+    image: np.ndarray,
+    coords: Sequence[Tuple[float, float]],
+    radius: float,
+    contrast_factor: float = 6,
+    colours: Union[Colour, Sequence[Colour]] = default_outline_colour,
+) -> PIL.Image.Image:
+    """
+    Draw circles around particle coordinates on an 8-bit micrograph, after
+    increasing its contrast and blurring it. Colours can be a single colour,
+    or a list with one colour for each particle.
+    The micrograph is filtered in greyscale before it is converted to colour,
+    which gives the same image as filtering each colour channel separately
+    in a third of the time. Drawing the circles takes much less time than
+    either filter.
+    """
+    with PIL.Image.fromarray(image, mode="L") as grey_image:
+        enhanced = ImageEnhance.Contrast(grey_image).enhance(contrast_factor)
+        fim = enhanced.filter(ImageFilter.BLUR).convert(mode="RGB")
+    if isinstance(colours, (str, tuple)):
+        colours = [colours] * len(coords)
+    dim = ImageDraw.Draw(fim)
+    for (x, y), colour in zip(coords, colours):
+        dim.ellipse(
+            [
+                (float(x) - radius, float(y) - radius),
+                (float(x) + radius, float(y) + radius),
+            ],
+            width=8,
+            outline=tuple(colour) if isinstance(colour, list) else colour,
+        )
+    return fim
+
+
 def mrc_to_jpeg(plugin_params):
     filename = plugin_params.parameters("file")
     allframes = plugin_params.parameters("all_frames")
@@ -23,72 +302,51 @@ def mrc_to_jpeg(plugin_params):
         logger.error(f"File {filepath} not found")
         return False
     start = time.perf_counter()
+    outfile = filepath.with_suffix(".jpeg")
+
+    def render():
+        with mrcfile.mmap(filepath, mode="r") as mrc:
+            if mrc.data.ndim == 2:
+                im = PIL.Image.fromarray(_micrograph_image(filepath, mrc), mode="L")
+                return outfile if _save(im, outfile) else False
+            if mrc.data.ndim != 3:
+                return outfile
+            if not allframes:
+                im = PIL.Image.fromarray(
+                    _scale_to_uint8(mrc.data[0], clip_sigma=None), mode="L"
+                )
+                return outfile if _save(im, outfile) else False
+            outfiles = []
+            for i, frame in enumerate(mrc.data):
+                im = PIL.Image.fromarray(
+                    _scale_to_uint8(frame, clip_sigma=None), mode="L"
+                )
+                frame_outfile = str(outfile).replace(".jpeg", f"_{i+1}.jpeg")
+                if not _save(im, frame_outfile):
+                    return False
+                outfiles.append(frame_outfile)
+            return outfiles or outfile
+
     try:
-        with mrcfile.open(filepath) as mrc:
-            data = mrc.data
+        result = _recent_outputs.get(
+            ("mrc_to_jpeg", _file_key(filepath), bool(allframes)),
+            render,
+            still_valid=_outputs_exist,
+        )
     except ValueError:
         logger.error(
             f"File {filepath} could not be opened. It may be corrupted or not in mrc format"
         )
         return False
-    outfile = filepath.with_suffix(".jpeg")
-    outfiles = []
-    if len(data.shape) == 2:
-        mean = np.mean(data)
-        sdev = np.std(data)
-        sigma_min = mean - 3 * sdev
-        sigma_max = mean + 3 * sdev
-        data = np.ndarray.copy(data)
-        data[data < sigma_min] = sigma_min
-        data[data > sigma_max] = sigma_max
-        data = data - data.min()
-        data = data * 255 / data.max()
-        data = data.astype("uint8")
-        im = PIL.Image.fromarray(data, mode="L")
-        try:
-            im.save(outfile)
-        except FileNotFoundError:
-            logger.error(
-                f"Trying to save to file {outfile} but directory does not exist"
-            )
-            return False
-    elif len(data.shape) == 3:
-        if allframes:
-            for i, frame in enumerate(data):
-                frame = frame - frame.min()
-                frame = frame * 255 / frame.max()
-                frame = frame.astype("uint8")
-                im = PIL.Image.fromarray(frame, mode="L")
-                frame_outfile = str(outfile).replace(".jpeg", f"_{i+1}.jpeg")
-                try:
-                    im.save(frame_outfile)
-                except FileNotFoundError:
-                    logger.error(
-                        f"Trying to save to file {frame_outfile} but directory does not exist"
-                    )
-                    return False
-                outfiles.append(frame_outfile)
-        else:
-            data = data - data[0].min()
-            data = data * 255 / data[0].max()
-            data = data.astype("uint8")
-            im = PIL.Image.fromarray(data[0], mode="L")
-            try:
-                im.save(outfile)
-            except FileNotFoundError:
-                logger.error(
-                    f"Trying to save to file {outfile} but directory does not exist"
-                )
-                return False
+    if not result:
+        return False
     timing = time.perf_counter() - start
 
     logger.info(
         f"Converted mrc to jpeg {filename} -> {outfile} in {timing:.1f} seconds",
         extra={"image-processing-time": timing},
     )
-    if outfiles:
-        return outfiles
-    return outfile
+    return result
 
 
 def picked_particles(plugin_params):
@@ -111,10 +369,49 @@ def picked_particles(plugin_params):
         logger.error(f"File {basefilename} not found")
         return False
     radius = (diam / pixel_size) // 2
+    if plugin_params.parameters("confidences"):
+        colours = confidence_colours(plugin_params.parameters("confidences"))
+    else:
+        colours = plugin_params.parameters(
+            "outline_colours", default=default_outline_colour
+        )
+    particle_count = len(coords) if coords and coords[0] else 0
+    if not isinstance(colours, (str, tuple)) and len(colours) != particle_count:
+        logger.warning(
+            f"{len(colours)} colours given for {particle_count} particles "
+            f"in {basefilename}, so using the default colour"
+        )
+        colours = default_outline_colour
     start = time.perf_counter()
+
+    def render():
+        with mrcfile.mmap(basefilename, mode="r") as mrc:
+            data = _micrograph_image(Path(basefilename), mrc)
+        if not (coords and coords[0]):
+            logger.warning(f"No coordinates provided for {basefilename}")
+        fim = particle_overlay(
+            data,
+            coords if coords and coords[0] else [],
+            radius,
+            contrast_factor=contrast_factor,
+            colours=colours,
+        )
+        return outfile if _save(fim, outfile) else False
+
     try:
-        with mrcfile.open(basefilename) as mrc:
-            data = mrc.data
+        result = _recent_outputs.get(
+            (
+                "picked_particles",
+                _file_key(Path(basefilename)),
+                str(outfile),
+                tuple(tuple(coord) for coord in coords or []),
+                radius,
+                contrast_factor,
+                str(colours),
+            ),
+            render,
+            still_valid=_outputs_exist,
+        )
     except ValueError:
         logger.error(
             f"File {basefilename} could not be opened. It may be corrupted or not in mrc format"
@@ -123,46 +420,14 @@ def picked_particles(plugin_params):
     except FileNotFoundError:
         logger.error(f"File {basefilename} could not be opened")
         return False
-    mean = np.mean(data)
-    sdev = np.std(data)
-    sigma_min = mean - 3 * sdev
-    sigma_max = mean + 3 * sdev
-    data = np.ndarray.copy(data)
-    data[data < sigma_min] = sigma_min
-    data[data > sigma_max] = sigma_max
-    data = data - data.min()
-    data = data * 255 / data.max()
-    data = data.astype("uint8")
-    with PIL.Image.fromarray(data).convert(mode="RGB") as bim:
-        enhancer = ImageEnhance.Contrast(bim)
-        enhanced = enhancer.enhance(contrast_factor)
-        fim = enhanced.filter(ImageFilter.BLUR)
-        dim = ImageDraw.Draw(fim)
-        if coords and coords[0]:
-            for x, y in coords:
-                dim.ellipse(
-                    [
-                        (float(x) - radius, float(y) - radius),
-                        (float(x) + radius, float(y) + radius),
-                    ],
-                    width=8,
-                    outline="#f58a07",
-                )
-        else:
-            logger.warning(f"No coordinates provided for {basefilename}")
-        try:
-            fim.save(outfile)
-        except FileNotFoundError:
-            logger.error(
-                f"Trying to save to file {outfile} but directory does not exist"
-            )
-            return False
+    if not result:
+        return False
     timing = time.perf_counter() - start
     logger.info(
         f"Particle picker image {outfile} saved in {timing:.1f} seconds",
         extra={"image-processing-time": timing},
     )
-    return outfile
+    return result
 
 
 def mrc_central_slice(plugin_params):
@@ -175,43 +440,42 @@ def mrc_central_slice(plugin_params):
         logger.error(f"File {filepath} not found")
         return False
     start = time.perf_counter()
+    outfile = str(filepath.with_suffix("")) + "_thumbnail.jpeg"
+
+    def render():
+        with mrcfile.mmap(filepath, mode="r") as mrc:
+            if mrc.data.ndim != 3:
+                logger.error(
+                    f"File {filepath} is not 3-dimensional. Cannot extract central slice"
+                )
+                return False
+
+            # Extract central slice, only reading this from the file
+            central_slice_index = int(mrc.data.shape[0] / 2)
+            central_slice_data = _scale_to_uint8(
+                _downsample(mrc.data[central_slice_index, :, :], 512)
+            )
+
+        # Write as jpeg
+        im = PIL.Image.fromarray(central_slice_data, mode="L")
+        im.thumbnail((512, 512))
+        if not _save(im, outfile):
+            return False
+        Path(outfile).chmod(0o740)
+        return outfile
+
     try:
-        with mrcfile.open(filepath) as mrc:
-            data = mrc.data
+        result = _recent_outputs.get(
+            ("mrc_central_slice", _file_key(filepath)),
+            render,
+            still_valid=_outputs_exist,
+        )
     except ValueError:
         logger.error(
             f"File {filepath} could not be opened. It may be corrupted or not in mrc format"
         )
         return False
-    outfile = str(filepath.with_suffix("")) + "_thumbnail.jpeg"
-    if len(data.shape) != 3:
-        logger.error(
-            f"File {filepath} is not 3-dimensional. Cannot extract central slice"
-        )
-        return False
-
-    # Extract central slice
-    total_slices = data.shape[0]
-    central_slice_index = int(total_slices / 2)
-    central_slice_data = data[central_slice_index, :, :]
-
-    # Write as jpeg
-    mean = np.mean(central_slice_data)
-    sdev = np.std(central_slice_data)
-    sigma_min = mean - 3 * sdev
-    sigma_max = mean + 3 * sdev
-    central_slice_data = np.ndarray.copy(central_slice_data)
-    central_slice_data[central_slice_data < sigma_min] = sigma_min
-    central_slice_data[central_slice_data > sigma_max] = sigma_max
-    central_slice_data = central_slice_data - central_slice_data.min()
-    central_slice_data = central_slice_data * 255 / central_slice_data.max()
-    central_slice_data = central_slice_data.astype("uint8")
-    im = PIL.Image.fromarray(central_slice_data, mode="L")
-    im.thumbnail((512, 512))
-    try:
-        im.save(outfile)
-    except FileNotFoundError:
-        logger.error(f"Trying to save to file {outfile} but directory does not exist")
+    if not result:
         return False
     timing = time.perf_counter() - start
 
@@ -219,9 +483,7 @@ def mrc_central_slice(plugin_params):
         f"Converted mrc to jpeg {filename} -> {outfile} in {timing:.1f} seconds",
         extra={"image-processing-time": timing},
     )
-
-    Path(outfile).chmod(0o740)
-    return outfile
+    return result
 
 
 def mrc_to_apng(plugin_params):
@@ -238,45 +500,52 @@ def mrc_to_apng(plugin_params):
         logger.error(f"File {filepath} not found")
         return False
     start = time.perf_counter()
+    outfile = str(filepath.with_suffix("")) + "_movie.png"
+
+    def render():
+        with mrcfile.mmap(filepath, mode="r") as mrc:
+            if mrc.data.ndim != 3:
+                logger.error(f"File {filepath} is not a 3D volume")
+                return False
+            # Frames are scaled together, and written as they are read
+            limits = _volume_limits(mrc.data, 512)
+            try:
+                writer = _AnimatedPNGWriter(outfile, num_frames=len(mrc.data))
+            except FileNotFoundError:
+                logger.error(
+                    f"Trying to save to file {outfile} but directory does not exist"
+                )
+                return False
+            try:
+                for frame in mrc.data:
+                    im = PIL.Image.fromarray(
+                        _scale_to_uint8(_downsample(frame, 512), limits=limits),
+                        mode="L",
+                    )
+                    im.thumbnail((512, 512))
+                    writer.add_frame(im)
+            except BaseException:
+                writer.discard()
+                raise
+            writer.close()
+        Path(outfile).chmod(0o740)
+        return outfile
+
     try:
-        with mrcfile.open(filepath) as mrc:
-            data = mrc.data
+        result = _recent_outputs.get(
+            ("mrc_to_apng", _file_key(filepath)),
+            render,
+            still_valid=_outputs_exist,
+        )
     except ValueError:
         logger.error(
             f"File {filepath} could not be opened. It may be corrupted or not in mrc format"
         )
         return False
-    outfile = str(filepath.with_suffix("")) + "_movie.png"
-
-    if len(data.shape) == 3:
-        images_to_append = []
-        for frame in data:
-            mean = np.mean(frame)
-            sdev = np.std(frame)
-            sigma_min = mean - 3 * sdev
-            sigma_max = mean + 3 * sdev
-            frame = np.ndarray.copy(frame)
-            frame[frame < sigma_min] = sigma_min
-            frame[frame > sigma_max] = sigma_max
-            frame = frame - frame.min()
-            frame = frame * 255 / frame.max()
-            frame = frame.astype("uint8")
-            im = PIL.Image.fromarray(frame, mode="L")
-            im.thumbnail((512, 512))
-            images_to_append.append(im)
-        try:
-            im.save(outfile, save_all=True, append_images=images_to_append)
-        except FileNotFoundError:
-            logger.error(
-                f"Trying to save to file {outfile} but directory does not exist"
-            )
-            return False
-    else:
-        logger.error(f"File {filepath} is not a 3D volume")
+    if not result:
+        return False
     timing = time.perf_counter() - start
     logger.info(
         f"Converted mrc to apng {filename} -> {outfile} in {timing:.1f} seconds"
     )
-
-    Path(outfile).chmod(0o740)
-    return outfile
+    return result
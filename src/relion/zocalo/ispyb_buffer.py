@@ -1,13 +1,14 @@
 from __future__ import annotations
 
-# import datetime
+import datetime
 import logging
-from typing import NamedTuple, Optional
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
 
 import ispyb.sqlalchemy
 import sqlalchemy.exc
-
-# from sqlalchemy import delete
+from sqlalchemy import delete, or_, select
 
 logger = logging.getLogger("relion.zocalo.ispybsvc_buffer")
 
@@ -17,7 +18,47 @@ class BufferResult(NamedTuple):
     value: Optional[int]
 
 
-def evict(*, session):
+class ReferenceCache:
+    """Least recently used store of the buffer entries seen by this process.
+
+    Buffer entries are written once for each uuid, so entries stored or
+    loaded here can be looked up again without a database query.
+    """
+
+    def __init__(self, size: int = 50000):
+        self.size = size
+        self._references: OrderedDict[Tuple[int, int], int] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, program: int, uuid: int) -> Optional[int]:
+        with self._lock:
+            reference = self._references.get((int(program), int(uuid)))
+            if reference is not None:
+                self._references.move_to_end((int(program), int(uuid)))
+            return reference
+
+    def put(self, program: int, uuid: int, reference: int):
+        with self._lock:
+            self._references[(int(program), int(uuid))] = reference
+            self._references.move_to_end((int(program), int(uuid)))
+            while len(self._references) > self.size:
+                self._references.popitem(last=False)
+
+    def forget(self, programs: Iterable[int]):
+        programs = {int(program) for program in programs}
+        with self._lock:
+            for key in [key for key in self._references if key[0] in programs]:
+                del self._references[key]
+
+    def clear(self):
+        with self._lock:
+            self._references.clear()
+
+
+cache = ReferenceCache()
+
+
+def evict(*, session, finished_days: int = 30, recorded_days: int = 60) -> int:
     """Throw away buffered information after a certain time.
 
     This needs to be run periodically to ensure the buffer tables don't
@@ -27,36 +68,33 @@ def evict(*, session):
     information is only of limited use after that program has completed. We
     give 30 days to deal with transient database and service problems and any
     messages stuck in the DLQ.
-    """
 
-    # Not quite clear yet how we should do this. SQLAlchemy vs stored procedure.
-    # Suggested SQL something along the lines of
-
-    # DELETE zb
-    # FROM zc_ZocaloBuffer zb
-    # JOIN AutoProcProgram app
-    # WHERE app.autoProcProgramId = zb.AutoProcProgramId
-    # AND (DATE(app.processingEndTime) < DATE_SUB(CURDATE(), INTERVAL 30 DAY)
-    #      OR DATE(app.recordTimeStamp) < DATE_SUB(CURDATE(), INTERVAL 60 DAY))
-
-    # (
-    #     delete(ispyb.sqlalchemy.ZcZocaloBuffer)
-    #     .where(
-    #         ispyb.sqlalchemy.AutoProcProgram.autoProcProgramId
-    #         == ispyb.sqlalchemy.ZcZocaloBuffer.AutoProcProgramID
-    #     )
-    #     .where(
-    #         (
-    #             ispyb.sqlalchemy.AutoProcProgram.processingEndTime
-    #             < datetime.datetime.now() - datetime.timedelta(days=30)
-    #         )
-    #         | (
-    #             ispyb.sqlalchemy.AutoProcProgram.recordTimeStamp
-    #             < datetime.datetime.now() - datetime.timedelta(days=60)
-    #         )
-    #     )
-    # )
-    # session.commit()
+    Returns the number of entries removed.
+    """
+    now = datetime.datetime.now()
+    expired_programs = select(ispyb.sqlalchemy.AutoProcProgram.autoProcProgramId).where(
+        or_(
+            ispyb.sqlalchemy.AutoProcProgram.processingEndTime
+            < now - datetime.timedelta(days=finished_days),
+            ispyb.sqlalchemy.AutoProcProgram.recordTimeStamp
+            < now - datetime.timedelta(days=recorded_days),
+        )
+    )
+    expired_entries = select(ispyb.sqlalchemy.ZcZocaloBuffer.AutoProcProgramID).where(
+        ispyb.sqlalchemy.ZcZocaloBuffer.AutoProcProgramID.in_(expired_programs)
+    )
+    programs = {row[0] for row in session.execute(expired_entries.distinct())}
+    if not programs:
+        return 0
+    result = session.execute(
+        delete(ispyb.sqlalchemy.ZcZocaloBuffer)
+        .where(ispyb.sqlalchemy.ZcZocaloBuffer.AutoProcProgramID.in_(programs))
+        .execution_options(synchronize_session=False)
+    )
+    session.commit()
+    cache.forget(programs)
+    logger.info(f"evicted {result.rowcount} buffer entries of {len(programs)} programs")
+    return result.rowcount
 
 
 def load(*, session, program: int, uuid: int) -> BufferResult:
@@ -65,6 +103,10 @@ def load(*, session, program: int, uuid: int) -> BufferResult:
     Given an AutoProcProgramID and a client-defined unique reference (uuid)
     retrieve a reference value from the database if possible.
     """
+    cached = cache.get(program, uuid)
+    if cached is not None:
+        logger.info(f"buffer lookup for {program}.{uuid} succeeded (={cached})")
+        return BufferResult(success=True, value=cached)
     query = (
         session.query(ispyb.sqlalchemy.ZcZocaloBuffer)
         .filter(ispyb.sqlalchemy.ZcZocaloBuffer.AutoProcProgramID == program)
@@ -75,6 +117,7 @@ def load(*, session, program: int, uuid: int) -> BufferResult:
         logger.info(
             f"buffer lookup for {program}.{uuid} succeeded (={result.Reference})"
         )
+        cache.put(program, uuid, result.Reference)
         return BufferResult(success=True, value=result.Reference)
     except sqlalchemy.exc.NoResultFound:
         logger.info(f"buffer lookup for {program}.{uuid} failed")
@@ -99,3 +142,64 @@ def store(*, session, program: int, uuid: int, reference: int):
     session.merge(entry)
     logger.info(f"buffering value {reference} for {program}.{uuid}")
     session.commit()
+    cache.put(program, uuid, reference)
+
+
+def load_many(*, session, program: int, uuids: Iterable[int]) -> Dict[int, int]:
+    """Load several entries of one program from the zc_ZocaloBuffer table.
+
+    Entries which are not in the local cache are read with a single query.
+    Returns a dictionary from uuid to reference for the entries that were found.
+    """
+    results = {}
+    missing = set()
+    for uuid in uuids:
+        cached = cache.get(program, uuid)
+        if cached is None:
+            missing.add(int(uuid))
+        else:
+            results[int(uuid)] = cached
+    requested = len(results) + len(missing)
+    if missing:
+        query = (
+            session.query(ispyb.sqlalchemy.ZcZocaloBuffer)
+            .filter(ispyb.sqlalchemy.ZcZocaloBuffer.AutoProcProgramID == program)
+            .filter(ispyb.sqlalchemy.ZcZocaloBuffer.UUID.in_(missing))
+        )
+        for entry in query.all():
+            results[entry.UUID] = entry.Reference
+            cache.put(program, entry.UUID, entry.Reference)
+    logger.info(
+        f"buffer lookup for {program} found {len(results)} of {requested} entries"
+    )
+    return results
+
+
+def store_many(*, session, program: int, references: Dict[int, int]):
+    """Write several entries of one program into the zc_ZocaloBuffer table.
+
+    Existing entries are found with a single query and updated, and the others
+    are added. Unlike store this does not commit, so that the entries can be
+    committed together with the rows they refer to. Once they are committed,
+    pass them to remember so that they can be looked up locally.
+    """
+    existing = session.query(ispyb.sqlalchemy.ZcZocaloBuffer).filter(
+        ispyb.sqlalchemy.ZcZocaloBuffer.AutoProcProgramID == program,
+        ispyb.sqlalchemy.ZcZocaloBuffer.UUID.in_(list(references)),
+    )
+    new_references = dict(references)
+    for entry in existing:
+        entry.Reference = new_references.pop(entry.UUID)
+    session.add_all(
+        ispyb.sqlalchemy.ZcZocaloBuffer(
+            AutoProcProgramID=program, UUID=uuid, Reference=reference
+        )
+        for uuid, reference in new_references.items()
+    )
+    logger.info(f"buffering {len(references)} values for {program}")
+
+
+def remember(*, program: int, references: Dict[int, int]):
+    """Add committed entries to the local cache"""
+    for uuid, reference in references.items():
+        cache.put(program, uuid, reference)
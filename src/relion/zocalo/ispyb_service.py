@@ -1,11 +1,13 @@
 from __future__ import annotations
 
+import json
 import os.path
 import string
 import time
 from collections import ChainMap
 from datetime import datetime
 from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
 
 import ispyb
 import ispyb.sqlalchemy as models
@@ -38,6 +40,16 @@ class MovieParams(BaseModel):
     timestamp: float = None
 
 
+class BulkInsert(NamedTuple):
+    command: str
+    message: dict
+    full_parameters: Callable
+    program_id: Optional[int]
+    lookups: Dict[str, int]
+    buffer_store: Optional[int]
+    store_result: Optional[str]
+
+
 def lookup_command(command, refclass):
     return getattr(refclass, "do_" + command, None)
 
@@ -55,6 +67,23 @@ class EMISPyB(CommonService):
     ispyb = None
     _ispyb_sessionmaker = None
 
+    # Seconds between clean ups of the buffer table
+    buffer_eviction_interval = 3600
+    _last_buffer_eviction = 0
+
+    # Commands which only add a row, and can be inserted in bulk,
+    # with the method making the row and the name of its primary key
+    bulk_inserts = {
+        "insert_motion_correction": ("_motion_correction_values", "motionCorrectionId"),
+        "insert_relative_ice_thickness": (
+            "_relative_ice_thickness_values",
+            "relativeIceThicknessId",
+        ),
+        "insert_ctf": ("_ctf_values", "ctfId"),
+        "insert_particle_picker": ("_particle_picker_values", "particlePickerId"),
+        "insert_tomogram": ("_tomogram_values", "tomogramId"),
+    }
+
     def initializing(self):
         """Subscribe the ISPyB connector queue. Received messages must be
         acknowledged. Prepare ISPyB database connection."""
@@ -65,15 +94,7 @@ class EMISPyB(CommonService):
                 ispyb.sqlalchemy.url(), connect_args={"use_pure": True}
             )
         )
-        try:
-            self.log.info("Cleaning up ISPyB buffer table...")
-            with self._ispyb_sessionmaker() as session:
-                buffer.evict(session=session)
-        except Exception as e:
-            self.log.warning(
-                f"Encountered exception {e!r} while cleaning up ISPyB buffer table",
-                exc_info=True,
-            )
+        self.evict_buffer()
         self.log.info("ISPyB service ready")
         workflows.recipe.wrap_subscribe(
             self._transport,
@@ -84,9 +105,25 @@ class EMISPyB(CommonService):
             allow_non_recipe_messages=True,
         )
 
+    def evict_buffer(self):
+        """Remove old entries from the ISPyB buffer table"""
+        self._last_buffer_eviction = time.time()
+        try:
+            self.log.info("Cleaning up ISPyB buffer table...")
+            with self._ispyb_sessionmaker() as session:
+                buffer.evict(session=session)
+        except Exception as e:
+            self.log.warning(
+                f"Encountered exception {e!r} while cleaning up ISPyB buffer table",
+                exc_info=True,
+            )
+
     def receive_msg(self, rw, header, message):
         """Do something with ISPyB."""
 
+        if time.time() - self._last_buffer_eviction > self.buffer_eviction_interval:
+            self.evict_buffer()
+
         if header.get("redelivered") == "true":
             # A redelivered message may just have been processed in a parallel instance,
             # which was connected to a different database server in the DB cluster. If
@@ -358,6 +395,221 @@ class EMISPyB(CommonService):
         )
         return {"success": True, "return_value": result}
 
+    @staticmethod
+    def _step_parameters(rw, message, current_command):
+        """Parameter lookup function for one command of a multipart message"""
+
+        def step_parameters(parameter, replace_variables=True):
+            """Slight change in behaviour compared to 'parameters' in a direct call:
+            If the value is defined in the command list item then this takes
+            precedence. Otherwise we check the original message content. Finally,
+            we look in the parameters dictionary of the recipe step for the
+            multipart_message command.
+            String replacement rules apply as usual."""
+            if parameter in current_command:
+                base_value = current_command[parameter]
+            elif isinstance(message, dict) and parameter in message:
+                base_value = message[parameter]
+            else:
+                base_value = rw.recipe_step["parameters"].get(parameter)
+            if (
+                not replace_variables
+                or not base_value
+                or not isinstance(base_value, str)
+                or "$" not in base_value
+            ):
+                return base_value
+            for key in sorted(rw.environment, key=len, reverse=True):
+                if "${" + key + "}" in base_value:
+                    base_value = base_value.replace(
+                        "${" + key + "}", str(rw.environment[key])
+                    )
+                # Replace longest keys first, as the following replacement is
+                # not well-defined when one key is a prefix of another:
+                if "$" + key in base_value:
+                    base_value = base_value.replace("$" + key, str(rw.environment[key]))
+            return base_value
+
+        return step_parameters
+
+    def _bulk_insert_plan(self, rw, message, command) -> Optional[BulkInsert]:
+        """
+        Work out the row to add for a command of a multipart message, if it is
+        a command which can be inserted in bulk, either directly or through
+        a buffer command
+        """
+        if not isinstance(command, dict):
+            return None
+        insert_command, lookups, buffer_store = command, {}, None
+        if command.get("ispyb_command") == "buffer":
+            insert_command = command.get("buffer_command")
+            lookups = command.get("buffer_lookup") or {}
+            buffer_store = command.get("buffer_store")
+            if not isinstance(insert_command, dict) or not isinstance(lookups, dict):
+                return None
+        if insert_command.get("ispyb_command") not in self.bulk_inserts:
+            return None
+
+        parameters = self._step_parameters(rw, message, command)
+        program_id = parameters("program_id")
+        if lookups or buffer_store:
+            try:
+                program_id = int(program_id)
+                lookups = {entry: int(uuid) for entry, uuid in lookups.items()}
+                buffer_store = int(buffer_store) if buffer_store else None
+            except (TypeError, ValueError):
+                return None
+
+        insert_message = dict(insert_command)
+
+        def full_parameters(param):
+            return insert_message.get(param) or parameters(param)
+
+        if (
+            insert_command["ispyb_command"] == "insert_motion_correction"
+            and full_parameters("movie_id") is None
+        ):
+            # the movie has to be looked up or added first
+            return None
+        return BulkInsert(
+            insert_command["ispyb_command"],
+            insert_message,
+            full_parameters,
+            program_id,
+            lookups,
+            buffer_store,
+            command.get("store_result"),
+        )
+
+    def _insert_in_bulk(self, rw, message, commands: list, session):
+        """
+        Insert the rows of the leading commands of a multipart message which
+        only add rows. Commands are inserted in groups by table, and all their
+        rows and buffer entries are committed in a single transaction.
+        Buffer lookups are made in one query, and can refer to rows added by
+        earlier commands in the same group.
+        Returns the number of commands inserted and the result of the last of
+        them, or False if the inserts failed.
+        """
+        plans: List[BulkInsert] = []
+        for command in commands:
+            plan = self._bulk_insert_plan(rw, message, command)
+            if plan is None:
+                break
+            plans.append(plan)
+        if not plans:
+            return 0, True
+
+        # Buffered references which are already in the database
+        references: Dict[Tuple[int, int], int] = {}
+        lookups_by_program: Dict[int, set] = {}
+        for plan in plans:
+            lookups_by_program.setdefault(plan.program_id, set()).update(
+                plan.lookups.values()
+            )
+        for program_id, uuids in lookups_by_program.items():
+            if uuids:
+                for uuid, reference in buffer.load_many(
+                    session=session, program=program_id, uuids=uuids
+                ).items():
+                    references[(program_id, uuid)] = reference
+
+        # Stop before the first command with references which can not be
+        # resolved yet, or which uses the stored result of an earlier command
+        stored: set = set()
+        stored_results: List[str] = []
+        for position, plan in enumerate(plans):
+            if any(
+                (plan.program_id, uuid) not in references
+                and (plan.program_id, uuid) not in stored
+                for uuid in plan.lookups.values()
+            ) or any(
+                "$" + name in json.dumps(commands[position], default=str)
+                for name in stored_results
+            ):
+                plans = plans[:position]
+                break
+            if plan.buffer_store:
+                stored.add((plan.program_id, plan.buffer_store))
+            if plan.store_result:
+                stored_results.append(plan.store_result)
+        if not plans:
+            return 0, True
+
+        self.log.info(f"Inserting {len(plans)} ISPyB commands in bulk")
+        rows: Dict[int, object] = {}
+        try:
+            waiting = list(range(len(plans)))
+            while waiting:
+                # Add all rows whose references are known, grouped by table
+                ready = [
+                    position
+                    for position in waiting
+                    if all(
+                        (plans[position].program_id, uuid) in references
+                        for uuid in plans[position].lookups.values()
+                    )
+                ]
+                tables: Dict[str, list] = {}
+                for position in ready:
+                    plan = plans[position]
+                    for entry, uuid in plan.lookups.items():
+                        plan.message[entry] = references[(plan.program_id, uuid)]
+                    builder, _ = self.bulk_inserts[plan.command]
+                    rows[position] = getattr(self, builder)(plan.full_parameters)
+                    tables.setdefault(plan.command, []).append(rows[position])
+                for table_rows in tables.values():
+                    session.add_all(table_rows)
+                session.flush()
+
+                for position in ready:
+                    plan = plans[position]
+                    if plan.buffer_store:
+                        references[(plan.program_id, plan.buffer_store)] = getattr(
+                            rows[position], self.bulk_inserts[plan.command][1]
+                        )
+                waiting = [position for position in waiting if position not in ready]
+
+            buffer_stores: Dict[int, Dict[int, int]] = {}
+            for plan in plans:
+                if plan.buffer_store:
+                    program_stores = buffer_stores.setdefault(plan.program_id, {})
+                    program_stores[plan.buffer_store] = references[
+                        (plan.program_id, plan.buffer_store)
+                    ]
+            for program_id, program_references in buffer_stores.items():
+                buffer.store_many(
+                    session=session, program=program_id, references=program_references
+                )
+            session.commit()
+            for program_id, program_references in buffer_stores.items():
+                buffer.remember(program=program_id, references=program_references)
+        except sqlalchemy.exc.SQLAlchemyError as e:
+            session.rollback()
+            self.log.error(
+                "Inserting ISPyB entries in bulk caused exception '%s'.",
+                e,
+                exc_info=True,
+            )
+            return 0, False
+
+        result = None
+        for position, plan in enumerate(plans):
+            result = {
+                "success": True,
+                "return_value": getattr(
+                    rows[position], self.bulk_inserts[plan.command][1]
+                ),
+            }
+            if plan.store_result:
+                rw.environment[plan.store_result] = result["return_value"]
+                self.log.debug(
+                    "Storing result '%s' in environment variable '%s'",
+                    result["return_value"],
+                    plan.store_result,
+                )
+        return len(plans), result
+
     def do_multipart_message(self, rw, message, **kwargs):
         """The multipart_message command allows the recipe or client to specify a
         multi-stage operation. With this you can process a list of API calls.
@@ -382,6 +634,27 @@ class EMISPyB(CommonService):
             self.log.error("Received multipart message containing no commands")
             return False
 
+        # Leading commands which only add rows are inserted together
+        if not (isinstance(message, dict) and "step_message" in message):
+            inserted, result = self._insert_in_bulk(
+                rw, message, commands, session=kwargs["session"]
+            )
+            if not result:
+                return result
+            if inserted:
+                del commands[:inserted]
+                if not commands:
+                    self.log.debug("and done.")
+                    return result
+                self.log.debug("Checkpointing remaining %d steps", len(commands))
+                if isinstance(message, dict):
+                    checkpoint_dictionary = message
+                else:
+                    checkpoint_dictionary = {}
+                checkpoint_dictionary["checkpoint"] = step - 1 + inserted
+                checkpoint_dictionary["ispyb_command_list"] = commands
+                return {"checkpoint": True, "return_value": checkpoint_dictionary}
+
         current_command = commands[0]
         command = current_command.get("ispyb_command")
         if not command:
@@ -403,37 +676,7 @@ class EMISPyB(CommonService):
 
         # Create a parameter lookup function specific to this step of the
         # multipart message
-        def step_parameters(parameter, replace_variables=True):
-            """Slight change in behaviour compared to 'parameters' in a direct call:
-            If the value is defined in the command list item then this takes
-            precedence. Otherwise we check the original message content. Finally,
-            we look in the parameters dictionary of the recipe step for the
-            multipart_message command.
-            String replacement rules apply as usual."""
-            if parameter in current_command:
-                base_value = current_command[parameter]
-            elif isinstance(message, dict) and parameter in message:
-                base_value = message[parameter]
-            else:
-                base_value = rw.recipe_step["parameters"].get(parameter)
-            if (
-                not replace_variables
-                or not base_value
-                or not isinstance(base_value, str)
-                or "$" not in base_value
-            ):
-                return base_value
-            for key in sorted(rw.environment, key=len, reverse=True):
-                if "${" + key + "}" in base_value:
-                    base_value = base_value.replace(
-                        "${" + key + "}", str(rw.environment[key])
-                    )
-                # Replace longest keys first, as the following replacement is
-                # not well-defined when one key is a prefix of another:
-                if "$" + key in base_value:
-                    base_value = base_value.replace("$" + key, str(rw.environment[key]))
-            return base_value
-
+        step_parameters = self._step_parameters(rw, message, current_command)
         kwargs["parameters"] = step_parameters
 
         # If this step previously checkpointed then override the message passed
@@ -572,28 +815,35 @@ class EMISPyB(CommonService):
             if not program_id:
                 self.log.error("Invalid buffer call: program_id is undefined")
                 return False
-            for entry in list(message["buffer_lookup"]):
-                buffer_result = buffer.load(
-                    session=session,
-                    program=program_id,
-                    uuid=message["buffer_lookup"][entry],
+            try:
+                lookups = {
+                    entry: int(uuid) for entry, uuid in message["buffer_lookup"].items()
+                }
+            except (TypeError, ValueError):
+                self.log.error(
+                    "Invalid buffer call: buffer_lookup references must be integers"
                 )
-                if buffer_result.success:
+                return False
+            references = buffer.load_many(
+                session=session, program=program_id, uuids=lookups.values()
+            )
+            for entry, uuid in lookups.items():
+                if uuid in references:
                     # resolve value and continue
-                    message["buffer_command"][entry] = buffer_result.value
+                    message["buffer_command"][entry] = references[uuid]
                     del message["buffer_lookup"][entry]
                     self.log.debug(
-                        f"Successfully resolved buffer reference {entry!r} to {buffer_result.value!r}"
+                        f"Successfully resolved buffer reference {entry!r} to {references[uuid]!r}"
                     )
-                    continue
 
+            if message["buffer_lookup"]:
                 if message["buffer_expiry_time"] < time.time():
                     self.log.warning(
-                        f"Buffer call could not be resolved: entry {entry} not found for program {program_id}"
+                        f"Buffer call could not be resolved: entries {list(message['buffer_lookup'])} not found for program {program_id}"
                     )
                     return False
 
-                # value can not yet be resolved, put request back in the queue
+                # values can not yet be resolved, put request back in the queue
                 return {"checkpoint": True, "return_value": message, "delay": 20}
 
         # Run the actual command
@@ -749,6 +999,28 @@ class EMISPyB(CommonService):
             )
             return False
 
+    def _motion_correction_values(self, full_parameters, movie_id=None):
+        return models.MotionCorrection(
+            dataCollectionId=full_parameters("dcid"),
+            movieId=full_parameters("movie_id") or movie_id,
+            autoProcProgramId=full_parameters("program_id"),
+            imageNumber=full_parameters("image_number"),
+            firstFrame=full_parameters("first_frame"),
+            lastFrame=full_parameters("last_frame"),
+            dosePerFrame=full_parameters("dose_per_frame"),
+            doseWeight=full_parameters("dose_weight"),
+            totalMotion=full_parameters("total_motion"),
+            averageMotionPerFrame=full_parameters("average_motion_per_frame"),
+            driftPlotFullPath=full_parameters("drift_plot_full_path"),
+            micrographFullPath=full_parameters("micrograph_full_path"),
+            micrographSnapshotFullPath=full_parameters("micrograph_snapshot_full_path"),
+            patchesUsedX=full_parameters("patches_used_x"),
+            patchesUsedY=full_parameters("patches_used_y"),
+            fftFullPath=full_parameters("fft_full_path"),
+            fftCorrectedFullPath=full_parameters("fft_corrected_full_path"),
+            comments=full_parameters("comments"),
+        )
+
     def do_insert_motion_correction(self, parameters, session, message=None, **kwargs):
         if message is None:
             message = {}
@@ -771,28 +1043,7 @@ class EMISPyB(CommonService):
                 )
                 movie_id = movie_values["return_value"]
 
-            values = models.MotionCorrection(
-                dataCollectionId=full_parameters("dcid"),
-                movieId=full_parameters("movie_id") or movie_id,
-                autoProcProgramId=full_parameters("program_id"),
-                imageNumber=full_parameters("image_number"),
-                firstFrame=full_parameters("first_frame"),
-                lastFrame=full_parameters("last_frame"),
-                dosePerFrame=full_parameters("dose_per_frame"),
-                doseWeight=full_parameters("dose_weight"),
-                totalMotion=full_parameters("total_motion"),
-                averageMotionPerFrame=full_parameters("average_motion_per_frame"),
-                driftPlotFullPath=full_parameters("drift_plot_full_path"),
-                micrographFullPath=full_parameters("micrograph_full_path"),
-                micrographSnapshotFullPath=full_parameters(
-                    "micrograph_snapshot_full_path"
-                ),
-                patchesUsedX=full_parameters("patches_used_x"),
-                patchesUsedY=full_parameters("patches_used_y"),
-                fftFullPath=full_parameters("fft_full_path"),
-                fftCorrectedFullPath=full_parameters("fft_corrected_full_path"),
-                comments=full_parameters("comments"),
-            )
+            values = self._motion_correction_values(full_parameters, movie_id=movie_id)
             session.add(values)
             session.commit()
             self.log.info(
@@ -807,6 +1058,17 @@ class EMISPyB(CommonService):
             )
             return False
 
+    def _relative_ice_thickness_values(self, full_parameters):
+        return models.RelativeIceThickness(
+            motionCorrectionId=full_parameters("motion_correction_id"),
+            autoProcProgramId=full_parameters("program_id"),
+            minimum=full_parameters("minimum"),
+            q1=full_parameters("q1"),
+            median=full_parameters("median"),
+            q3=full_parameters("q3"),
+            maximum=full_parameters("maximum"),
+        )
+
     def do_insert_relative_ice_thickness(
         self, parameters, session, message=None, **kwargs
     ):
@@ -819,15 +1081,7 @@ class EMISPyB(CommonService):
             return message.get(param) or parameters(param)
 
         try:
-            values = models.RelativeIceThickness(
-                motionCorrectionId=full_parameters("motion_correction_id"),
-                autoProcProgramId=full_parameters("program_id"),
-                minimum=full_parameters("minimum"),
-                q1=full_parameters("q1"),
-                median=full_parameters("median"),
-                q3=full_parameters("q3"),
-                maximum=full_parameters("maximum"),
-            )
+            values = self._relative_ice_thickness_values(full_parameters)
             session.add(values)
             session.commit()
             return {"success": True, "return_value": values.relativeIceThicknessId}
@@ -839,6 +1093,28 @@ class EMISPyB(CommonService):
             )
             return False
 
+    def _ctf_values(self, full_parameters):
+        return models.CTF(
+            ctfId=full_parameters("ctf_id"),
+            motionCorrectionId=full_parameters("motion_correction_id"),
+            autoProcProgramId=full_parameters("program_id"),
+            boxSizeX=full_parameters("box_size_x"),
+            boxSizeY=full_parameters("box_size_y"),
+            minResolution=full_parameters("min_resolution"),
+            maxResolution=full_parameters("max_resolution"),
+            minDefocus=full_parameters("min_defocus"),
+            maxDefocus=full_parameters("max_defocus"),
+            defocusStepSize=full_parameters("defocus_step_size"),
+            astigmatism=full_parameters("astigmatism"),
+            astigmatismAngle=full_parameters("astigmatism_angle"),
+            estimatedResolution=full_parameters("estimated_resolution"),
+            estimatedDefocus=full_parameters("estimated_defocus"),
+            amplitudeContrast=full_parameters("amplitude_contrast"),
+            ccValue=full_parameters("cc_value"),
+            fftTheoreticalFullPath=full_parameters("fft_theoretical_full_path"),
+            comments=full_parameters("comments"),
+        )
+
     def do_insert_ctf(self, parameters, session, message=None, **kwargs):
         if message is None:
             message = {}
@@ -849,26 +1125,7 @@ class EMISPyB(CommonService):
             return message.get(param) or parameters(param)
 
         try:
-            values = models.CTF(
-                ctfId=full_parameters("ctf_id"),
-                motionCorrectionId=full_parameters("motion_correction_id"),
-                autoProcProgramId=full_parameters("program_id"),
-                boxSizeX=full_parameters("box_size_x"),
-                boxSizeY=full_parameters("box_size_y"),
-                minResolution=full_parameters("min_resolution"),
-                maxResolution=full_parameters("max_resolution"),
-                minDefocus=full_parameters("min_defocus"),
-                maxDefocus=full_parameters("max_defocus"),
-                defocusStepSize=full_parameters("defocus_step_size"),
-                astigmatism=full_parameters("astigmatism"),
-                astigmatismAngle=full_parameters("astigmatism_angle"),
-                estimatedResolution=full_parameters("estimated_resolution"),
-                estimatedDefocus=full_parameters("estimated_defocus"),
-                amplitudeContrast=full_parameters("amplitude_contrast"),
-                ccValue=full_parameters("cc_value"),
-                fftTheoreticalFullPath=full_parameters("fft_theoretical_full_path"),
-                comments=full_parameters("comments"),
-            )
+            values = self._ctf_values(full_parameters)
             session.add(values)
             session.commit()
             self.log.info(f"Created CTF record {values.ctfId} for DCID {dcid}")
@@ -881,6 +1138,17 @@ class EMISPyB(CommonService):
             )
             return False
 
+    def _particle_picker_values(self, full_parameters):
+        return models.ParticlePicker(
+            particlePickerId=full_parameters("particle_picker_id"),
+            programId=full_parameters("program_id"),
+            firstMotionCorrectionId=full_parameters("motion_correction_id"),
+            particlePickingTemplate=full_parameters("particle_picking_template"),
+            particleDiameter=full_parameters("particle_diameter"),
+            numberOfParticles=full_parameters("number_of_particles"),
+            summaryImageFullPath=full_parameters("summary_image_full_path"),
+        )
+
     def do_insert_particle_picker(self, parameters, session, message=None, **kwargs):
         if message is None:
             message = {}
@@ -891,15 +1159,7 @@ class EMISPyB(CommonService):
             return message.get(param) or parameters(param)
 
         try:
-            values = models.ParticlePicker(
-                particlePickerId=full_parameters("particle_picker_id"),
-                programId=full_parameters("program_id"),
-                firstMotionCorrectionId=full_parameters("motion_correction_id"),
-                particlePickingTemplate=full_parameters("particle_picking_template"),
-                particleDiameter=full_parameters("particle_diameter"),
-                numberOfParticles=full_parameters("number_of_particles"),
-                summaryImageFullPath=full_parameters("summary_image_full_path"),
-            )
+            values = self._particle_picker_values(full_parameters)
             session.add(values)
             session.commit()
             self.log.info(
@@ -1089,6 +1349,30 @@ class EMISPyB(CommonService):
             )
             return False
 
+    def _tomogram_values(self, full_parameters):
+        return models.Tomogram(
+            dataCollectionId=full_parameters("dcid"),
+            autoProcProgramId=full_parameters("program_id"),
+            volumeFile=full_parameters("volume_file"),
+            stackFile=full_parameters("stack_file"),
+            sizeX=full_parameters("size_x"),
+            sizeY=full_parameters("size_y"),
+            sizeZ=full_parameters("size_z"),
+            pixelSpacing=full_parameters("pixel_spacing"),
+            residualErrorMean=full_parameters("residual_error_mean"),
+            residualErrorSD=full_parameters("residual_error_sd"),
+            xAxisCorrection=full_parameters("x_axis_correction"),
+            tiltAngleOffset=full_parameters("tilt_angle_offset"),
+            zShift=full_parameters("z_shift"),
+            fileDirectory=full_parameters("file_directory"),
+            centralSliceImage=full_parameters("central_slice_image"),
+            tomogramMovie=full_parameters("tomogram_movie"),
+            xyShiftPlot=full_parameters("xy_shift_plot"),
+            projXY=full_parameters("proj_xy"),
+            projXZ=full_parameters("proj_xz"),
+            globalAlignmentQuality=full_parameters("alignment_quality"),
+        )
+
     def do_insert_tomogram(self, parameters, session, message=None, **kwargs):
         if message is None:
             message = {}
@@ -1099,28 +1383,7 @@ class EMISPyB(CommonService):
             return message.get(param) or parameters(param)
 
         try:
-            values = models.Tomogram(
-                dataCollectionId=full_parameters("dcid"),
-                autoProcProgramId=full_parameters("program_id"),
-                volumeFile=full_parameters("volume_file"),
-                stackFile=full_parameters("stack_file"),
-                sizeX=full_parameters("size_x"),
-                sizeY=full_parameters("size_y"),
-                sizeZ=full_parameters("size_z"),
-                pixelSpacing=full_parameters("pixel_spacing"),
-                residualErrorMean=full_parameters("residual_error_mean"),
-                residualErrorSD=full_parameters("residual_error_sd"),
-                xAxisCorrection=full_parameters("x_axis_correction"),
-                tiltAngleOffset=full_parameters("tilt_angle_offset"),
-                zShift=full_parameters("z_shift"),
-                fileDirectory=full_parameters("file_directory"),
-                centralSliceImage=full_parameters("central_slice_image"),
-                tomogramMovie=full_parameters("tomogram_movie"),
-                xyShiftPlot=full_parameters("xy_shift_plot"),
-                projXY=full_parameters("proj_xy"),
-                projXZ=full_parameters("proj_xz"),
-                globalAlignmentQuality=full_parameters("alignment_quality"),
-            )
+            values = self._tomogram_values(full_parameters)
             session.add(values)
             session.commit()
             return {"success": True, "return_value": values.tomogramId}
@@ -5,20 +5,19 @@ import re
 import string
 import subprocess
 from collections import ChainMap
-from math import hypot
 from pathlib import Path
 from typing import Optional
 
 import plotly.express as px
-import workflows.recipe
 from gemmi import cif
 from pydantic import BaseModel, Field, ValidationError, validator
-from workflows.services.common_service import CommonService
 
+from relion._parser.motioncorrection import accumulated_motion
 from relion.zocalo.spa_relion_service_options import (
     RelionServiceOptions,
     update_relion_options,
 )
+from relion.zocalo.worker_pool import PooledService
 
 
 class MotionCorrParameters(BaseModel):
@@ -88,7 +87,12 @@ class ChainMapWithReplacement(ChainMap):
         return v
 
 
-class MotionCorr(CommonService):
+class MockRW:
+    def dummy(self, *args, **kwargs):
+        pass
+
+
+class MotionCorr(PooledService):
     """
     A service for motion correcting cryoEM movies using MotionCor2
     """
@@ -105,18 +109,14 @@ class MotionCorr(CommonService):
     # Values to extract for ISPyB
     x_shift_list = []
     y_shift_list = []
+    message_state = ("x_shift_list", "y_shift_list")
 
     def initializing(self):
         """Subscribe to a queue. Received messages must be acknowledged."""
         self.log.info("Motion correction service starting")
-        workflows.recipe.wrap_subscribe(
-            self._transport,
-            "motioncorr",
-            self.motion_correction,
-            acknowledgement=True,
-            log_extender=self.extend_log,
-            allow_non_recipe_messages=True,
-        )
+        # Messages waiting for jobs run elsewhere, by job ID
+        self.submitted_jobs = {}
+        self.subscribe_pooled("motioncorr", self.motion_correction)
 
     def parse_mc2_stdout(self, mc_stdout: str):
         """
@@ -172,10 +172,6 @@ class MotionCorr(CommonService):
         return result
 
     def motion_correction(self, rw, header: dict, message: dict):
-        class MockRW:
-            def dummy(self, *args, **kwargs):
-                pass
-
         if not rw:
             if (
                 not isinstance(message, dict)
@@ -347,6 +343,25 @@ class MotionCorr(CommonService):
             # Run Relion motion correction
             result = self.relion_motioncorr(command, mc_params.mrc_out)
 
+        if isinstance(result, int):
+            # The job has been submitted to run elsewhere with the returned ID,
+            # and will be finished by finish_submitted_job once it completes
+            self.submitted_jobs[result] = (rw, header, mc_params, command)
+            return
+        self.finish_motion_correction(rw, header, mc_params, command, result)
+
+    def finish_submitted_job(self, job_id: int, result):
+        """Process the result of a motion correction job which ran elsewhere"""
+        if job_id not in self.submitted_jobs:
+            self.log.error(f"No movie is waiting for motion correction job {job_id}")
+            return
+        rw, header, mc_params, command = self.submitted_jobs.pop(job_id)
+        self.finish_motion_correction(rw, header, mc_params, command, result)
+
+    def finish_motion_correction(
+        self, rw, header: dict, mc_params: MotionCorrParameters, command: list, result
+    ):
+        """Check the motion correction result and send on to the next services"""
         # Adjust the pixel size based on the binning
         if mc_params.motion_corr_binning:
             mc_params.pixel_size *= mc_params.motion_corr_binning
@@ -386,27 +401,12 @@ class MotionCorr(CommonService):
             return
 
         # Extract results for ispyb
-        total_motion = 0
-        early_motion = 0
-        late_motion = 0
         cutoff_frame = round(
             mc_params.dose_motionstats_cutoff / mc_params.dose_per_frame
         )
-        for i in range(1, len(self.x_shift_list)):
-            total_motion += hypot(
-                self.x_shift_list[i] - self.x_shift_list[i - 1],
-                self.y_shift_list[i] - self.y_shift_list[i - 1],
-            )
-            if i < cutoff_frame:
-                early_motion += hypot(
-                    self.x_shift_list[i] - self.x_shift_list[i - 1],
-                    self.y_shift_list[i] - self.y_shift_list[i - 1],
-                )
-            else:
-                late_motion += hypot(
-                    self.x_shift_list[i] - self.x_shift_list[i - 1],
-                    self.y_shift_list[i] - self.y_shift_list[i - 1],
-                )
+        total_motion, early_motion, late_motion = accumulated_motion(
+            self.x_shift_list, self.y_shift_list, cutoff_frame
+        )
         average_motion_per_frame = total_motion / len(self.x_shift_list)
 
         # Extract results for ispyb
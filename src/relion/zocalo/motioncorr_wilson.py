@@ -1,17 +1,16 @@
 from __future__ import annotations
 
-import json
 import os
 import string
 import subprocess
-import time
 from collections import ChainMap
 from pathlib import Path
 
-import yaml
+import requests
 from workflows.services.common_service import CommonService
 
 from relion.zocalo.motioncorr import MotionCorr
+from relion.zocalo.slurm_jobs import FinishedJob, SlurmJobTracker
 
 # To get the required image run
 # singularity pull docker://gcr.io/diamond-pubreg/em/motioncorr:version
@@ -68,6 +67,10 @@ class MotionCorrWilson(MotionCorr, CommonService):
     # Logger name
     _logger_name = "relion.zocalo.motioncorr_wilson"
 
+    # Messages are acknowledged once their job has run on the cluster,
+    # so several movies can be waiting at once
+    prefetch_count = 20
+
     def parse_mc2_output_file(self, mc_output_file):
         """
         Read the file containing the output of MotionCor2 to determine
@@ -93,17 +96,30 @@ class MotionCorrWilson(MotionCorr, CommonService):
                 if "x Shift" in line:
                     frames_line = True
 
-    def motioncor2(self, command: list, mrc_out: Path):
-        """Submit MotionCor2 jobs to the Wilson cluster via the RestAPI"""
+    def initializing(self):
+        """Subscribe to a queue, and start following submitted jobs"""
+        super().initializing()
         try:
-            # Get the configuration and token for the restAPI
-            with open(os.environ["SLURM_RESTAPI_CONFIG"], "r") as f:
-                slurm_rest = yaml.safe_load(f)
-            user = slurm_rest["user"]  # "k8s-em"
-            with open(slurm_rest["user_token"], "r") as f:
-                slurm_token = f.read().strip()
-        except (KeyError, FileNotFoundError):
+            self.slurm_jobs = SlurmJobTracker.from_config_file(
+                os.environ["SLURM_RESTAPI_CONFIG"], on_finished=self.job_finished
+            )
+        except (KeyError, FileNotFoundError, AssertionError):
             self.log.error("Unable to load slurm restAPI config file and token")
+            self.slurm_jobs = None
+            return
+        self.slurm_jobs.start()
+
+    def in_shutdown(self):
+        super().in_shutdown()
+        if getattr(self, "slurm_jobs", None):
+            self.slurm_jobs.stop()
+
+    def motioncor2(self, command: list, mrc_out: Path):
+        """
+        Submit MotionCor2 jobs to the Wilson cluster via the RestAPI.
+        Returns the job ID once submitted, as the job is finished when it completes.
+        """
+        if not self.slurm_jobs:
             return subprocess.CompletedProcess(
                 args="",
                 returncode=1,
@@ -111,13 +127,10 @@ class MotionCorrWilson(MotionCorr, CommonService):
                 stderr="No restAPI config or token".encode("utf8"),
             )
 
-        # Construct the json for submission and save it
-        mc_output_file = f"{mrc_out}.out"
-        mc_error_file = f"{mrc_out}.err"
-        submission_file = f"{mrc_out}.json"
+        # Construct the json for submission
         slurm_files = {
-            "standard_output": mc_output_file,
-            "standard_error": mc_error_file,
+            "standard_output": f"{mrc_out}.out",
+            "standard_error": f"{mrc_out}.err",
             "current_working_directory": str(Path(mrc_out).parent),
         }
         slurm_json_job = dict(slurm_json_template["job"], **slurm_files)
@@ -129,96 +142,42 @@ class MotionCorrWilson(MotionCorr, CommonService):
             + " ".join(command)
             + slurm_tmp_cleanup,
         }
-        with open(submission_file, "w") as f:
-            json.dump(slurm_json, f)
-
-        # Command to submit jobs to the restAPI
-        slurm_submit_command = (
-            f'curl -H "X-SLURM-USER-NAME:{user}" -H "X-SLURM-USER-TOKEN:{slurm_token}" '
-            '-H "Content-Type: application/json" -X POST '
-            f'{slurm_rest["url"]}/slurm/{slurm_rest["api_version"]}/job/submit '
-            f"-d @{submission_file}"
-        )
-        slurm_submission_json = subprocess.run(
-            slurm_submit_command, capture_output=True, shell=True
-        )
+
         try:
-            # Extract the job id from the submission response to use in the next query
-            slurm_response = slurm_submission_json.stdout.decode("utf8", "replace")
-            job_id = json.loads(slurm_response)["job_id"]
-        except (json.JSONDecodeError, KeyError):
+            job_id = self.slurm_jobs.submit(slurm_json, data=str(mrc_out))
+        except (requests.RequestException, ValueError) as e:
             self.log.error(
-                f"Unable to submit job to {slurm_rest['url']}. The restAPI returned "
-                f"{slurm_submission_json.stdout.decode('utf8', 'replace')}"
+                f"Unable to submit job to {self.slurm_jobs.api.url}. "
+                f"The restAPI returned {e}"
             )
             return subprocess.CompletedProcess(
                 args="",
                 returncode=1,
-                stdout=slurm_submission_json.stdout,
-                stderr=slurm_submission_json.stderr,
+                stdout="".encode("utf8"),
+                stderr=str(e).encode("utf8"),
             )
-        self.log.info(f"Submitted MotionCorr job {job_id} to Wilson. Waiting...")
+        self.log.info(f"Submitted MotionCorr job {job_id} to Wilson")
+        return job_id
+
+    def job_finished(self, job: FinishedJob):
+        """Pass a finished job from the polling thread to the service thread"""
+        self._transport_interceptor(self.slurm_job_finished)(None, job)
+
+    def slurm_job_finished(self, header, job: FinishedJob):
+        """Read in the MotionCor output of a finished job then clean up the files"""
+        if job.job_id not in self.submitted_jobs:
+            self.log.error(f"No movie is waiting for Wilson job {job.job_id}")
+            if header:
+                self._transport.nack(header)
+            return
+        mrc_out = job.data
+        mc_output_file = f"{mrc_out}.out"
+        mc_error_file = f"{mrc_out}.err"
+        slurm_job_state = job.job_state
+        self.log.info(f"Job {job.job_id} has finished with state {slurm_job_state}")
 
-        # Command to get the status of the submitted job from the restAPI
-        slurm_status_command = (
-            f'curl -H "X-SLURM-USER-NAME:{user}" -H "X-SLURM-USER-TOKEN:{slurm_token}" '
-            '-H "Content-Type: application/json" -X GET '
-            f'{slurm_rest["url"]}/slurm/{slurm_rest["api_version"]}/job/{job_id}'
-        )
-        slurm_job_state = "PENDING"
-
-        # Wait until the job has a status indicating it has finished
-        loop_counter = 0
-        while slurm_job_state in (
-            "PENDING",
-            "CONFIGURING",
-            "RUNNING",
-            "COMPLETING",
-        ):
-            if loop_counter < 5:
-                time.sleep(5)
-            else:
-                time.sleep(30)
-            loop_counter += 1
-
-            # Call the restAPI to find out the job state
-            slurm_status_json = subprocess.run(
-                slurm_status_command, capture_output=True, shell=True
-            )
-            try:
-                slurm_response = slurm_status_json.stdout.decode("utf8", "replace")
-                slurm_job_state = json.loads(slurm_response)["jobs"][0]["job_state"]
-            except (json.JSONDecodeError, KeyError):
-                print(slurm_status_command)
-                self.log.error(
-                    f"Unable to get status for job {job_id}. The restAPI returned "
-                    f"{slurm_status_json.stdout.decode('utf8', 'replace')}"
-                )
-                return subprocess.CompletedProcess(
-                    args="",
-                    returncode=1,
-                    stdout=slurm_status_json.stdout,
-                    stderr=slurm_status_json.stderr,
-                )
-
-            if loop_counter >= 60:
-                slurm_cancel_command = (
-                    f'curl -H "X-SLURM-USER-NAME:{user}" '
-                    f'-H "X-SLURM-USER-TOKEN:{slurm_token}" '
-                    '-H "Content-Type: application/json" -X DELETE '
-                    f'{slurm_rest["url"]}/slurm/{slurm_rest["api_version"]}/job/{job_id}'
-                )
-                subprocess.run(slurm_cancel_command, capture_output=True, shell=True)
-                self.log.error("Timeout running motion correction")
-                return subprocess.CompletedProcess(
-                    args="",
-                    returncode=1,
-                    stdout="".encode("utf8"),
-                    stderr="Timeout running motion correction".encode("utf8"),
-                )
-
-        # Read in the MotionCor output then clean up the files
-        self.log.info(f"Job {job_id} has finished!")
+        self.x_shift_list = []
+        self.y_shift_list = []
         try:
             self.parse_mc2_output_file(mc_output_file)
             with open(mc_output_file, "r") as mc_stdout:
@@ -234,22 +193,16 @@ class MotionCorrWilson(MotionCorr, CommonService):
         if self.x_shift_list and self.y_shift_list:
             Path(mc_output_file).unlink()
             Path(mc_error_file).unlink()
-            Path(submission_file).unlink()
         else:
             self.log.error(f"Reading shifts from {mc_output_file} failed")
             slurm_job_state = "FAILED"
 
-        if slurm_job_state == "COMPLETED":
-            return subprocess.CompletedProcess(
-                args="",
-                returncode=0,
-                stdout=stdout.encode("utf8"),
-                stderr=stderr.encode("utf8"),
-            )
-        else:
-            return subprocess.CompletedProcess(
+        self.finish_submitted_job(
+            job.job_id,
+            subprocess.CompletedProcess(
                 args="",
-                returncode=1,
+                returncode=0 if slurm_job_state == "COMPLETED" else 1,
                 stdout=stdout.encode("utf8"),
                 stderr=stderr.encode("utf8"),
-            )
+            ),
+        )
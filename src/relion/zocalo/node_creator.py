@@ -1,11 +1,14 @@
 from __future__ import annotations
 
+import contextlib
 import datetime
 import json
 import os
 import re
+import threading
+import time
 from pathlib import Path
-from typing import Optional
+from typing import Dict, List, NamedTuple, Optional, Tuple
 
 import workflows.recipe
 from pipeliner.api.api_utils import (
@@ -20,7 +23,11 @@ from pipeliner.project_graph import ProjectGraph
 from pydantic import BaseModel, Field, ValidationError
 from workflows.services.common_service import CommonService
 
-from relion.zocalo.spa_output_files import create_output_files
+from relion.zocalo.spa_output_files import (
+    close_output_files,
+    create_output_files,
+    flush_output_files,
+)
 from relion.zocalo.spa_relion_service_options import (
     RelionServiceOptions,
     generate_service_options,
@@ -118,9 +125,47 @@ class NodeCreatorParameters(BaseModel):
     results: Optional[dict] = None
 
 
+class MockRW:
+    def dummy(self, *args, **kwargs):
+        pass
+
+
+class PendingNode(NamedTuple):
+    rw: object
+    header: dict
+    job_info: NodeCreatorParameters
+    received: float
+
+
+# The pipeliner resolves all project paths against the current directory, so
+# the pipeline step still changes the working directory of the whole process.
+# The lock only stops two threads of one process using different projects at
+# once. It does nothing for other processes, and other threads of this process
+# see the changed directory while a project is being updated.
+_project_dir_lock = threading.RLock()
+
+
+@contextlib.contextmanager
+def in_project_dir(project_dir: Path):
+    """
+    Work in a project directory, and go back to where we were afterwards.
+    Only code which does not depend on the working directory may run on other
+    threads meanwhile.
+    """
+    with _project_dir_lock:
+        previous_dir = os.getcwd()
+        os.chdir(project_dir)
+        try:
+            yield
+        finally:
+            os.chdir(previous_dir)
+
+
 class NodeCreator(CommonService):
     """
-    A service for setting up pipeliner jobs
+    A service for setting up pipeliner jobs.
+    Messages for the same job are collected for up to coalesce_window seconds,
+    then the job and the project pipeline are updated once for all of them.
     """
 
     # Human readable service name
@@ -132,9 +177,14 @@ class NodeCreator(CommonService):
     # Values to extract for ISPyB
     shift_list = []
 
+    # Time to collect messages for, and the most messages to hold at once
+    coalesce_window: float = 2
+    max_pending: int = 200
+
     def initializing(self):
         """Subscribe to a queue. Received messages must be acknowledged."""
         self.log.info("Relion node creator service starting")
+        self._pending: Dict[Tuple[Path, str], List[PendingNode]] = {}
         workflows.recipe.wrap_subscribe(
             self._transport,
             "node_creator",
@@ -142,13 +192,16 @@ class NodeCreator(CommonService):
             acknowledgement=True,
             log_extender=self.extend_log,
             allow_non_recipe_messages=True,
+            prefetch_count=self.max_pending,
         )
+        self._register_idle(1, self.flush_expired)
 
-    def node_creator(self, rw, header: dict, message: dict):
-        class MockRW:
-            def dummy(self, *args, **kwargs):
-                pass
+    def in_shutdown(self):
+        self.flush_all()
+        close_output_files()
 
+    def node_creator(self, rw, header: dict, message: dict):
+        """Hold a received message until the other messages for its job arrive"""
         if not rw:
             if (
                 not isinstance(message, dict)
@@ -191,22 +244,122 @@ class NodeCreator(CommonService):
         self.log.info(
             f"Received job {job_info.job_type} with output file {job_info.output_file}"
         )
-        start_time = datetime.datetime.now()
-
-        # Find the job directory and make sure we are in the processing directory
-        job_dir = Path(re.search(".+/job[0-9]{3}", job_info.output_file)[0])
-        project_dir = job_dir.parent.parent
-        os.chdir(project_dir)
-
-        if not (project_dir / "default_pipeline.star").exists():
-            self.log.info("No existing project found, so creating one")
-            PipelinerProject(make_new_project=True)
-
         if not pipeline_spa_jobs.get(job_info.job_type):
             self.log.error(f"Unknown job type {job_info.job_type}")
             rw.transport.nack(header)
             return
 
+        job_dir = Path(re.search(".+/job[0-9]{3}", job_info.output_file)[0])
+        self._pending.setdefault((job_dir, job_info.job_type), []).append(
+            PendingNode(rw, header, job_info, time.time())
+        )
+        if sum(len(pending) for pending in self._pending.values()) >= self.max_pending:
+            self.flush_all()
+        else:
+            self.flush_expired()
+
+    def flush_expired(self):
+        """Update all jobs whose first message has waited for coalesce_window"""
+        expiry_time = time.time() - self.coalesce_window
+        self.flush(
+            [
+                key
+                for key, pending in self._pending.items()
+                if pending[0].received <= expiry_time
+            ]
+        )
+
+    def flush_all(self):
+        """Update all jobs with messages waiting, regardless of their age"""
+        self.flush(list(self._pending))
+
+    def flush(self, keys: List[Tuple[Path, str]]):
+        """
+        Update the given jobs from their waiting messages,
+        then update the pipeline of each project once
+        """
+        projects: Dict[Path, list] = {}
+        for key in keys:
+            batch = self._pending.pop(key, [])
+            if batch:
+                projects.setdefault(key[0].parent.parent, []).append((key, batch))
+
+        for project_dir, jobs in projects.items():
+            start_time = datetime.datetime.now()
+            prepared_jobs = []
+            # Batches which prepare_job has already rejected
+            rejected: List[List[PendingNode]] = []
+            try:
+                with in_project_dir(project_dir):
+                    if not (project_dir / "default_pipeline.star").exists():
+                        self.log.info("No existing project found, so creating one")
+                        PipelinerProject(make_new_project=True)
+
+                    for (job_dir, job_type), batch in jobs:
+                        prepared_job = self.prepare_job(project_dir, job_dir, batch)
+                        if prepared_job:
+                            prepared_jobs.append((job_dir, batch, *prepared_job))
+                        else:
+                            rejected.append(batch)
+                    if not prepared_jobs:
+                        continue
+
+                    # Create the node and default_pipeline.star files in the project
+                    self.update_pipeline(prepared_jobs)
+            except Exception as e:
+                self.log.error(
+                    f"Could not update the pipeline in {project_dir}: {e}",
+                    exc_info=True,
+                )
+                for _, batch in jobs:
+                    if not any(batch is failed for failed in rejected):
+                        for pending in batch:
+                            pending.rw.transport.nack(pending.header)
+                continue
+
+            end_time = datetime.datetime.now()
+            self.log.info(
+                f"Processed outputs from "
+                f"{sum(len(job[1]) for job in prepared_jobs)} messages "
+                f"for {len(prepared_jobs)} jobs in {project_dir}, "
+                f"in {(end_time - start_time).total_seconds()} seconds."
+            )
+            for _, batch, *_ in prepared_jobs:
+                for pending in batch:
+                    pending.rw.transport.ack(pending.header)
+
+    def update_pipeline(self, prepared_jobs: list):
+        """
+        Add the prepared jobs to the project pipeline.
+        Must be run from within the project directory.
+        """
+        with ProjectGraph(read_only=False) as project:
+            for job_dir, batch, pipeliner_job, relion_commands in prepared_jobs:
+                process = project.add_job(
+                    pipeliner_job,
+                    as_status=("Succeeded" if batch[-1].job_info.success else "Failed"),
+                    do_overwrite=True,
+                )
+                # Add the job commands to the process .CCPEM_pipeliner_jobinfo file
+                if not (job_dir / ".CCPEM_pipeliner_jobinfo").exists():
+                    process.update_jobinfo_file(
+                        action="Run", command_list=relion_commands
+                    )
+            # Generate the default_pipeline.star file
+            project.check_process_completion()
+            # Copy the default_pipeline.star file
+            default_pipeline = Path("default_pipeline.star").read_bytes()
+            for job_dir, *_ in prepared_jobs:
+                (job_dir / "default_pipeline.star").write_bytes(default_pipeline)
+
+    def prepare_job(self, project_dir: Path, job_dir: Path, batch: List[PendingNode]):
+        """
+        Write the job files and outputs for the messages of one job.
+        Must be run from within the project directory.
+        Returns the pipeliner job and its commands, or None if the job failed.
+        """
+        job_info = batch[-1].job_info
+        job_star = f"{job_info.job_type.replace('.', '_')}_job.star"
         try:
             # Get the options for this job out of the RelionServiceOptions
             pipeline_options = generate_service_options(
@@ -238,7 +391,7 @@ class NodeCreator(CommonService):
                 pipeline_options["fn_in_raw"] = job_info.input_file
 
             # If this is a new job we need a job.star
-            if not Path(f"{job_info.job_type.replace('.', '_')}_job.star").is_file():
+            if not Path(job_star).is_file():
                 self.log.info(f"Generating options for new job: {job_info.job_type}")
                 write_default_jobstar(job_info.job_type)
                 params = job_default_parameters_dict(job_info.job_type)
@@ -254,22 +407,17 @@ class NodeCreator(CommonService):
                     }
                 )
                 params = _params
-                edit_jobstar(
-                    f"{job_info.job_type.replace('.', '_')}_job.star",
-                    params,
-                    f"{job_info.job_type.replace('.', '_')}_job.star",
-                )
+                edit_jobstar(job_star, params, job_star)
         except IndexError:
             self.log.error(f"Unknown job type: {job_info.job_type}")
-            rw.transport.nack(header)
-            return
+            for pending in batch:
+                pending.rw.transport.nack(pending.header)
+            return None
 
         # Copy the job.star file
-        (job_dir / "job.star").write_bytes(
-            Path(f"{job_info.job_type.replace('.', '_')}_job.star").read_bytes()
-        )
+        (job_dir / "job.star").write_bytes(Path(job_star).read_bytes())
 
-        # Mark the job completion status
+        # Mark the job completion status from the latest message
         for exit_file in job_dir.glob("PIPELINER_JOB_EXIT_*"):
             exit_file.unlink()
         if job_info.success:
@@ -278,21 +426,14 @@ class NodeCreator(CommonService):
             (job_dir / FAIL_FILE).touch()
 
         # Get the files and directories relative to the project if possible
-        relative_job_dir = (
-            job_dir.relative_to(project_dir)
-            if job_dir.is_relative_to(project_dir)
-            else job_dir
-        )
-        relative_input_file = (
-            Path(job_info.input_file).relative_to(project_dir)
-            if Path(job_info.input_file).is_relative_to(project_dir)
-            else job_info.input_file
-        )
-        relative_output_file = (
-            Path(job_info.output_file).relative_to(project_dir)
-            if Path(job_info.output_file).is_relative_to(project_dir)
-            else job_info.output_file
-        )
+        def relative_to_project(path):
+            return (
+                Path(path).relative_to(project_dir)
+                if Path(path).is_relative_to(project_dir)
+                else path
+            )
+
+        relative_job_dir = relative_to_project(job_dir)
 
         # Load this job as a pipeliner job to create the nodes
         pipeliner_job = read_job(f"{job_dir}/job.star")
@@ -304,34 +445,34 @@ class NodeCreator(CommonService):
         with open(job_dir / "run.out", "w") as f:
             f.write(job_info.stdout)
         with open(job_dir / "run.err", "a") as f:
-            if job_info.stderr:
-                f.write(f"{job_info.stderr}\n")
+            f.write(
+                "".join(f"{p.job_info.stderr}\n" for p in batch if p.job_info.stderr)
+            )
         with open(job_dir / "note.txt", "a") as f:
-            f.write(f"{job_info.command}\n")
+            f.write("".join(f"{p.job_info.command}\n" for p in batch))
 
-        if job_info.success:
-            # Write the output files which Relion produces
+        # Write the output files which Relion produces for all successful messages
+        existing_nodes = [node.name for node in pipeliner_job.output_nodes]
+        for pending in batch:
+            if not pending.job_info.success:
+                continue
             extra_output_nodes = create_output_files(
-                job_type=job_info.job_type,
+                job_type=pending.job_info.job_type,
                 job_dir=relative_job_dir,
-                input_file=relative_input_file,
-                output_file=relative_output_file,
-                relion_options=job_info.relion_options,
-                results=job_info.results,
+                input_file=relative_to_project(pending.job_info.input_file),
+                output_file=relative_to_project(pending.job_info.output_file),
+                relion_options=pending.job_info.relion_options,
+                results=pending.job_info.results,
             )
-            if extra_output_nodes:
-                # Add any extra nodes if they are not already present
-                existing_nodes = []
-                for node in pipeliner_job.output_nodes:
-                    existing_nodes.append(node.name)
-                for node in extra_output_nodes.keys():
-                    if f"{relative_job_dir}/{node}" not in existing_nodes:
-                        pipeliner_job.add_output_node(
-                            node,
-                            extra_output_nodes[node][0],
-                            extra_output_nodes[node][1],
-                        )
+            # Add any extra nodes if they are not already present
+            for node, (node_type, node_kwds) in (extra_output_nodes or {}).items():
+                if f"{relative_job_dir}/{node}" not in existing_nodes:
+                    pipeliner_job.add_output_node(node, node_type, node_kwds)
+                    existing_nodes.append(f"{relative_job_dir}/{node}")
+        # The metadata and results display are read from the output files
+        flush_output_files()
 
+        if job_info.success:
             # Save the metadata file
             metadata_dict = pipeliner_job.gather_metadata()
             with open(job_dir / "job_metadata.json", "w") as metadata_file:
@@ -347,26 +488,4 @@ class NodeCreator(CommonService):
                 for results_obj in results_displays:
                     results_obj.write_displayobj_file(outdir=str(job_dir))
 
-        # Create the node and default_pipeline.star files in the project directory
-        with ProjectGraph(read_only=False) as project:
-            process = project.add_job(
-                pipeliner_job,
-                as_status=("Succeeded" if job_info.success else "Failed"),
-                do_overwrite=True,
-            )
-            # Add the job commands to the process .CCPEM_pipeliner_jobinfo file
-            if not (job_dir / ".CCPEM_pipeliner_jobinfo").exists():
-                process.update_jobinfo_file(action="Run", command_list=relion_commands)
-            # Generate the default_pipeline.star file
-            project.check_process_completion()
-            # Copy the default_pipeline.star file
-            (job_dir / "default_pipeline.star").write_bytes(
-                Path("default_pipeline.star").read_bytes()
-            )
-
-        end_time = datetime.datetime.now()
-        self.log.info(
-            f"Processed outputs from job {job_info.job_type}, "
-            f"in {(end_time - start_time).total_seconds()} seconds."
-        )
-        rw.transport.ack(header)
+        return pipeliner_job, relion_commands
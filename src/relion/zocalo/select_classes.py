@@ -1,11 +1,9 @@
 from __future__ import annotations
 
-import io
 import json
 import re
 import shutil
 import subprocess
-from contextlib import redirect_stdout
 from pathlib import Path
 
 import numpy as np
@@ -14,7 +12,7 @@ from gemmi import cif
 from pydantic import BaseModel, Field, ValidationError
 from workflows.services.common_service import CommonService
 
-from relion._parser.combine_star_files import combine_star_files, split_star_file
+from relion._parser.combine_star_files import ParticlesStore
 from relion.zocalo.spa_relion_service_options import RelionServiceOptions
 
 
@@ -67,19 +65,6 @@ class SelectClasses(CommonService):
             allow_non_recipe_messages=True,
         )
 
-    def parse_combiner_output(self, combiner_stdout: str):
-        """
-        Read the output logs of the star file combination
-        """
-        for line in combiner_stdout.split("\n"):
-            if line.startswith("Adding") and "particles_all.star" in line:
-                line_split = line.split()
-                self.previous_total_count = int(line_split[3])
-
-            if line.startswith("Combined"):
-                line_split = line.split()
-                self.total_count = int(line_split[6])
-
     def select_classes(self, rw, header: dict, message: dict):
         class MockRW:
             def dummy(self, *args, **kwargs):
@@ -304,13 +289,16 @@ class SelectClasses(CommonService):
         combine_star_dir = Path(
             project_dir / f"Select/job{autoselect_params.combine_star_job_number:03}"
         )
+        # New particles are appended to particles_all.star, which keeps an index
         files_to_combine = [select_dir / autoselect_params.particles_file]
         if (combine_star_dir / "particles_all.star").exists():
-            files_to_combine.append(combine_star_dir / "particles_all.star")
+            files_to_combine.insert(0, combine_star_dir / "particles_all.star")
         else:
             combine_star_dir.mkdir(parents=True, exist_ok=True)
             Path(project_dir / "Select/Best_particles").symlink_to(combine_star_dir)
-            self.previous_total_count = 0
+        particles_store = ParticlesStore(combine_star_dir)
+        self.previous_total_count = particles_store.particle_count
+        self.total_count = particles_store.particle_count
 
         if not (
             combine_star_dir / f".done_{autoselect_params.particles_file}"
@@ -330,18 +318,13 @@ class SelectClasses(CommonService):
                 "stderr": "",
             }
 
-            # Call the combining function and redirect prints to an io object
-            combine_result = io.StringIO()
-            with redirect_stdout(combine_result):
-                try:
-                    combine_star_files(files_to_combine, combine_star_dir)
-                    (
-                        combine_star_dir / f".done_{autoselect_params.particles_file}"
-                    ).touch()
-                    combine_node_creator_params["success"] = True
-                except (IndexError, KeyError):
-                    combine_node_creator_params["success"] = False
-            self.parse_combiner_output(combine_result.getvalue())
+            try:
+                particles_store.append(select_dir / autoselect_params.particles_file)
+                (combine_star_dir / f".done_{autoselect_params.particles_file}").touch()
+                combine_node_creator_params["success"] = True
+            except (IndexError, KeyError):
+                combine_node_creator_params["success"] = False
+            self.total_count = particles_store.particle_count
 
             # Send combination job to node creator
             self.log.info("Sending combine_star_files_job (combine) to node creator")
@@ -361,23 +344,6 @@ class SelectClasses(CommonService):
                 self.log.error("Star file combination failed")
                 rw.transport.nack(header)
                 return
-        else:
-            # If combination isn't run the number of particles needs to be found
-            self.total_count = 0
-            self.previous_total_count = 0
-            with open(combine_star_dir / "particles_all.star", "r") as particles_file:
-                while True:
-                    particle_line = particles_file.readline()
-                    if not particle_line:
-                        break
-                    particle_split_line = particle_line.split()
-                    if (
-                        len(particle_split_line) > 0
-                        and particle_split_line[0][0].isdigit()
-                    ):
-                        self.total_count += 1
-                        self.previous_total_count += 1
-
         # Create a file containing all selected classes
         if not (combine_star_dir / autoselect_params.classes_file).is_file():
             add_header = True
@@ -447,19 +413,11 @@ class SelectClasses(CommonService):
             "stderr": "",
         }
 
-        # Call the combining function and redirect prints to an io object
-        split_result = io.StringIO()
-        with redirect_stdout(split_result):
-            try:
-                split_star_file(
-                    file_to_process=combine_star_dir / "particles_all.star",
-                    output_dir=combine_star_dir,
-                    split_size=next_batch_size,
-                )
-                split_node_creator_params["success"] = True
-            except (IndexError, KeyError):
-                split_node_creator_params["success"] = False
-        self.parse_combiner_output(split_result.getvalue())
+        try:
+            particles_store.split(next_batch_size)
+            split_node_creator_params["success"] = True
+        except (IndexError, KeyError):
+            split_node_creator_params["success"] = False
 
         # Send splitting job to node creator
         self.log.info("Sending combine_star_files_job (split) to node creator")
@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+import requests
+import yaml
+from zocalo.util import slurm
+
+logger = logging.getLogger("relion.zocalo.slurm_jobs")
+
+
+class FinishedJob(NamedTuple):
+    job_id: int
+    job_state: str
+    data: Any
+
+
+class _TrackedJob:
+    def __init__(self, data: Any, submitted: float):
+        self.data = data
+        self.submitted = submitted
+
+
+class SlurmJobTracker:
+    """
+    Submits jobs through the Slurm REST API and follows them until they finish.
+    Requests share one HTTP session, so connections and the user token are reused.
+    Once started, a background thread asks for the states of all jobs with a
+    single request every poll_interval seconds, and calls
+    on_finished(FinishedJob) for each tracked job which Slurm reports has
+    finished. Jobs whose state cannot be found are kept until they finish or
+    reach job_timeout seconds, after which they are cancelled. Each request
+    gives up after request_timeout seconds.
+    """
+
+    running_states = ("PENDING", "CONFIGURING", "RUNNING", "COMPLETING")
+
+    def __init__(
+        self,
+        api: slurm.SlurmRestApi,
+        on_finished: Callable[[FinishedJob], None],
+        poll_interval: float = 5,
+        job_timeout: float = 1800,
+        request_timeout: float = 30,
+    ):
+        self.api = api
+        self.on_finished = on_finished
+        self.poll_interval = poll_interval
+        self.job_timeout = job_timeout
+        self.request_timeout = request_timeout
+        self._jobs: Dict[int, _TrackedJob] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_config_file(cls, config_file, **kwargs) -> "SlurmJobTracker":
+        """Set up from a yaml file giving the url, api_version, user and user_token"""
+        with open(config_file, "r") as f:
+            slurm_rest = yaml.safe_load(f)
+        api = slurm.SlurmRestApi(
+            url=slurm_rest["url"],
+            version=slurm_rest["api_version"],
+            user_name=slurm_rest["user"],
+            user_token=slurm_rest["user_token"],
+        )
+        return cls(api, **kwargs)
+
+    def _endpoint(self, path: str) -> str:
+        return f"slurm/{self.api.version}/{path}"
+
+    @staticmethod
+    def _job_state(job: dict) -> Optional[str]:
+        # newer versions of the API give a list of state flags
+        state = job["job_state"]
+        if isinstance(state, list):
+            return state[0] if state else None
+        return state
+
+    @property
+    def outstanding(self) -> List[int]:
+        with self._lock:
+            return list(self._jobs)
+
+    def submit(self, job_json: dict, data: Any = None) -> int:
+        """
+        Submit a job and track it until it finishes, returning the job id.
+        Raises requests.RequestException or ValueError if submission fails.
+        """
+        response = self.api.post(
+            self._endpoint("job/submit"), json=job_json, timeout=self.request_timeout
+        )
+        try:
+            job_id = int(response.json()["job_id"])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f"Slurm did not return a job id: {response.text}")
+        with self._lock:
+            self._jobs[job_id] = _TrackedJob(data, time.time())
+        return job_id
+
+    def cancel(self, job_id: int):
+        try:
+            self.api.delete(
+                self._endpoint(f"job/{job_id}"), timeout=self.request_timeout
+            )
+        except requests.RequestException as e:
+            logger.warning(f"Could not cancel Slurm job {job_id}: {e}")
+
+    def poll(self) -> List[FinishedJob]:
+        """Check the states of all tracked jobs, and report any which have finished"""
+        if not self.outstanding:
+            return []
+        response = self.api.get(self._endpoint("jobs"), timeout=self.request_timeout)
+        states = {
+            int(job["job_id"]): self._job_state(job)
+            for job in response.json().get("jobs", [])
+        }
+
+        finished = []
+        now = time.time()
+        with self._lock:
+            tracked_jobs = list(self._jobs.items())
+        for job_id, tracked in tracked_jobs:
+            job_state = states.get(job_id)
+            if job_state is None:
+                # jobs can drop out of the list, so look for these individually
+                job_state = self._single_job_state(job_id)
+            if job_state is None or job_state in self.running_states:
+                if now - tracked.submitted < self.job_timeout:
+                    continue
+                logger.error(f"Slurm job {job_id} timed out, cancelling")
+                self.cancel(job_id)
+                job_state = "TIMEOUT"
+            with self._lock:
+                self._jobs.pop(job_id, None)
+            finished.append(FinishedJob(job_id, job_state, tracked.data))
+
+        for job in finished:
+            self.on_finished(job)
+        return finished
+
+    def _single_job_state(self, job_id: int) -> Optional[str]:
+        """The state of a job, or None if it could not be found"""
+        try:
+            response = self.api.get(
+                self._endpoint(f"job/{job_id}"), timeout=self.request_timeout
+            )
+            return self._job_state(response.json()["jobs"][0])
+        except (requests.RequestException, KeyError, IndexError, ValueError) as e:
+            logger.warning(f"Could not get the state of Slurm job {job_id}: {e}")
+            return None
+
+    def start(self):
+        """Start polling for finished jobs in a background thread"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._poll_loop, name="Slurm job poller", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _poll_loop(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.poll()
+            except Exception as e:
+                logger.warning(f"Could not get Slurm job states: {e}", exc_info=True)
@@ -1,8 +1,10 @@
 from __future__ import annotations
 
+import os
 import re
+from collections import OrderedDict
 from pathlib import Path
-from typing import Callable, Dict
+from typing import Callable, Dict, List, Optional
 
 from gemmi import cif
 
@@ -65,6 +67,122 @@ def get_optics_table(
     return output_cif
 
 
+def star_file_header(
+    block_name: str, columns: List[str], output_cif: Optional[cif.Document] = None
+) -> str:
+    """
+    Text which starts a star file ending in a loop with the given columns,
+    so that rows can be appended to it. Any blocks in output_cif come first.
+    """
+    header = output_cif.as_string(cif.Style.Simple) + "\n" if output_cif else ""
+    header += f"data_{block_name}\nloop_\n"
+    return header + "".join(f"_rln{column}\n" for column in columns)
+
+
+class OutputFileWriter:
+    """
+    Appends lines to an output file through a handle which is kept open.
+    Whether the file needs a header is only checked when it is opened.
+    Lines are held until flush, which writes them and syncs the file to disk.
+    If the file ends in a partly written line, from a process which stopped
+    while writing, that line is removed before anything is added.
+    """
+
+    def __init__(self, path: Path, header: Callable[[], str]):
+        self.path = Path(path).absolute()
+        self._header = header
+        self._lines: List[str] = []
+        self._handle = None
+        self._inode: Optional[int] = None
+
+    def add_row(self, values: List[str]):
+        self._lines.append(" ".join(values) + "\n")
+
+    def add_line(self, line: str):
+        self._lines.append(line if line.endswith("\n") else line + "\n")
+
+    def flush(self):
+        if not self._lines:
+            return
+        if not self._is_open():
+            self._open()
+        self._handle.write("".join(self._lines))
+        self._handle.flush()
+        os.fsync(self._handle.fileno())
+        self._lines = []
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+    def _is_open(self) -> bool:
+        """Check the open handle is still for the file at this path"""
+        if self._handle is None:
+            return False
+        try:
+            return os.stat(self.path).st_ino == self._inode
+        except FileNotFoundError:
+            return False
+
+    def _open(self):
+        self.close()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        size = self._remove_partial_line() if self.path.exists() else 0
+        self._handle = open(self.path, "a")
+        self._inode = os.fstat(self._handle.fileno()).st_ino
+        if not size:
+            self._handle.write(self._header())
+
+    def _remove_partial_line(self, chunk_size: int = 4096) -> int:
+        """Truncate the file after its last newline, returning the new size"""
+        with open(self.path, "rb+") as f:
+            end = position = f.seek(0, os.SEEK_END)
+            while position > 0:
+                chunk_start = max(0, position - chunk_size)
+                f.seek(chunk_start)
+                chunk = f.read(position - chunk_start)
+                if position == end and chunk.endswith(b"\n"):
+                    return end
+                newline = chunk.rfind(b"\n")
+                if newline >= 0:
+                    f.truncate(chunk_start + newline + 1)
+                    return chunk_start + newline + 1
+                position = chunk_start
+            f.truncate(0)
+            return 0
+
+
+# Writers for the output files of recent jobs, least recently used first
+_writers: OrderedDict[Path, OutputFileWriter] = OrderedDict()
+max_open_files = 64
+
+
+def output_file_writer(path: Path, header: Callable[[], str]) -> OutputFileWriter:
+    """Get the writer for an output file, opening it if it is not in use"""
+    path = Path(path).absolute()
+    if path not in _writers:
+        _writers[path] = OutputFileWriter(path, header)
+        while len(_writers) > max_open_files:
+            _, writer = _writers.popitem(last=False)
+            writer.flush()
+            writer.close()
+    _writers.move_to_end(path)
+    return _writers[path]
+
+
+def flush_output_files():
+    """Write out the lines added to all output files"""
+    for writer in _writers.values():
+        writer.flush()
+
+
+def close_output_files():
+    flush_output_files()
+    while _writers:
+        _writers.popitem()[1].close()
+
+
 def _import_output_files(
     job_dir: Path,
     input_file: Path,
@@ -73,22 +191,26 @@ def _import_output_files(
     results: dict,
 ):
     """Import jobs save a list of all micrographs"""
-    star_file = job_dir / "movies.star"
-    added_line = [str(output_file), "1"]
+    star_file = output_file_writer(
+        job_dir / "movies.star",
+        lambda: star_file_header(
+            "movies",
+            ["MicrographMovieName", "OpticsGroup"],
+            get_optics_table(relion_options),
+        ),
+    )
+    star_file.add_row([str(output_file), "1"])
 
-    # Read and append to the existing output file, or otherwise create one
-    if not star_file.exists():
-        output_cif = get_optics_table(relion_options)
 
-        data_movies = output_cif.add_new_block("movies")
-        movies_loop = data_movies.init_loop(
-            "_rln", ["MicrographMovieName", "OpticsGroup"]
-        )
-        movies_loop.add_row(added_line)
-        output_cif.write_file(str(star_file), style=cif.Style.Simple)
-    else:
-        with open(star_file, "a") as output_cif:
-            output_cif.write(" ".join(added_line) + "\n")
+def _with_logfile(job_dir: Path, header: Callable[[], str]) -> Callable[[], str]:
+    """Make the logfile which is expected but will not be made with a new file"""
+    logfile = (job_dir / "logfile.pdf").absolute()
+
+    def header_and_logfile():
+        logfile.touch()
+        return header()
+
+    return header_and_logfile
 
 
 def _motioncorr_output_files(
@@ -99,40 +221,34 @@ def _motioncorr_output_files(
     results: dict,
 ):
     """Motion correction saves a list of micrographs and their motion"""
-    star_file = job_dir / "corrected_micrographs.star"
-    added_line = [
-        str(output_file),
-        str(output_file.with_suffix(".star")),
-        "1",
-        str(results["total_motion"]),
-        str(results["early_motion"]),
-        str(results["late_motion"]),
-    ]
-
-    # Read and append to the existing output file, or otherwise create one
-    if not star_file.exists():
-        output_cif = get_optics_table(relion_options)
-
-        data_movies = output_cif.add_new_block("micrographs")
-        movies_loop = data_movies.init_loop(
-            "_rln",
-            [
-                "MicrographName",
-                "MicrographMetadata",
-                "OpticsGroup",
-                "AccumMotionTotal",
-                "AccumMotionEarly",
-                "AccumMotionLate",
-            ],
-        )
-        movies_loop.add_row(added_line)
-        output_cif.write_file(str(star_file), style=cif.Style.Simple)
-    else:
-        with open(star_file, "a") as output_cif:
-            output_cif.write(" ".join(added_line) + "\n")
-
-    # Logfile is expected but will not be made
-    (star_file.parent / "logfile.pdf").touch()
+    star_file = output_file_writer(
+        job_dir / "corrected_micrographs.star",
+        _with_logfile(
+            job_dir,
+            lambda: star_file_header(
+                "micrographs",
+                [
+                    "MicrographName",
+                    "MicrographMetadata",
+                    "OpticsGroup",
+                    "AccumMotionTotal",
+                    "AccumMotionEarly",
+                    "AccumMotionLate",
+                ],
+                get_optics_table(relion_options),
+            ),
+        ),
+    )
+    star_file.add_row(
+        [
+            str(output_file),
+            str(output_file.with_suffix(".star")),
+            "1",
+            str(results["total_motion"]),
+            str(results["early_motion"]),
+            str(results["late_motion"]),
+        ]
+    )
 
 
 def _ctffind_output_files(
@@ -143,50 +259,44 @@ def _ctffind_output_files(
     results: dict,
 ):
     """Ctf estimation saves a list of micrographs and their ctf parameters"""
-    star_file = job_dir / "micrographs_ctf.star"
+    star_file = output_file_writer(
+        job_dir / "micrographs_ctf.star",
+        _with_logfile(
+            job_dir,
+            lambda: star_file_header(
+                "micrographs",
+                [
+                    "MicrographName",
+                    "OpticsGroup",
+                    "CtfImage",
+                    "DefocusU",
+                    "DefocusV",
+                    "CtfAstigmatism",
+                    "DefocusAngle",
+                    "CtfFigureOfMerit",
+                    "CtfMaxResolution",
+                ],
+                get_optics_table(relion_options),
+            ),
+        ),
+    )
 
     # Results needed in the star file are stored in a txt file with the output
     with open(output_file.with_suffix(".txt"), "r") as f:
         ctf_results = f.readlines()[-1].split()
-    added_line = [
-        str(input_file),
-        "1",
-        str(output_file.with_suffix(".ctf")) + ":mrc",
-        ctf_results[1],
-        ctf_results[2],
-        str(abs(float(ctf_results[1]) - float(ctf_results[2]))),
-        ctf_results[3],
-        ctf_results[5],
-        ctf_results[6],
-    ]
-
-    # Read and append to the existing output file, or otherwise create one
-    if not star_file.exists():
-        output_cif = get_optics_table(relion_options)
-
-        data_movies = output_cif.add_new_block("micrographs")
-        movies_loop = data_movies.init_loop(
-            "_rln",
-            [
-                "MicrographName",
-                "OpticsGroup",
-                "CtfImage",
-                "DefocusU",
-                "DefocusV",
-                "CtfAstigmatism",
-                "DefocusAngle",
-                "CtfFigureOfMerit",
-                "CtfMaxResolution",
-            ],
-        )
-        movies_loop.add_row(added_line)
-        output_cif.write_file(str(star_file), style=cif.Style.Simple)
-    else:
-        with open(star_file, "a") as output_cif:
-            output_cif.write(" ".join(added_line) + "\n")
-
-    # Logfile is expected but will not be made
-    (star_file.parent / "logfile.pdf").touch()
+    star_file.add_row(
+        [
+            str(input_file),
+            "1",
+            str(output_file.with_suffix(".ctf")) + ":mrc",
+            ctf_results[1],
+            ctf_results[2],
+            str(abs(float(ctf_results[1]) - float(ctf_results[2]))),
+            ctf_results[3],
+            ctf_results[5],
+            ctf_results[6],
+        ]
+    )
 
 
 def _icebreaker_output_files(
@@ -199,8 +309,7 @@ def _icebreaker_output_files(
 
     if results["icebreaker_type"] != "particles":
         # Micrograph icebreaker jobs need a file listing the completed micrographs
-        with open(job_dir / "done_mics.txt", "a+") as f:
-            f.write(input_file.name + "\n")
+        output_file_writer(job_dir / "done_mics.txt", str).add_line(input_file.name)
 
     if results["icebreaker_type"] == "micrographs":
         # Micrograph jobs save a list of micrographs and their motion
@@ -223,32 +332,18 @@ def _icebreaker_output_files(
             + "_flattened.mrc"
         )
     elif results["icebreaker_type"] == "summary":
-        csv_file = job_dir / "five_figs_test.csv"
-        if not csv_file.exists():
-            with open(csv_file, "w") as f:
-                f.write("path,min,q1,q2=median,q3,max\n")
-        with open(csv_file, "a+") as f:
-            f.write(f"{input_file}," + ",".join(results["summary"]) + "\n")
+        output_file_writer(
+            job_dir / "five_figs_test.csv", lambda: "path,min,q1,q2=median,q3,max\n"
+        ).add_line(f"{input_file}," + ",".join(results["summary"]))
         return
     else:
         # Nothing to do for particles job
         return
 
-    # Read and append to the existing output file, or otherwise create one
-    added_line = [
-        file_to_add,
-        str(input_file.with_suffix(".star")),
-        "1",
-        str(results["total_motion"]),
-        str(results["early_motion"]),
-        str(results["late_motion"]),
-    ]
-    if not star_file.exists():
-        output_cif = cif.Document()
-
-        data_movies = output_cif.add_new_block("micrographs")
-        movies_loop = data_movies.init_loop(
-            "_rln",
+    output_file_writer(
+        star_file,
+        lambda: star_file_header(
+            "micrographs",
             [
                 "MicrographName",
                 "MicrographMetadata",
@@ -257,12 +352,17 @@ def _icebreaker_output_files(
                 "AccumMotionEarly",
                 "AccumMotionLate",
             ],
-        )
-        movies_loop.add_row(added_line)
-        output_cif.write_file(str(star_file), style=cif.Style.Simple)
-    else:
-        with open(star_file, "a") as output_cif:
-            output_cif.write(" ".join(added_line) + "\n")
+        ),
+    ).add_row(
+        [
+            file_to_add,
+            str(input_file.with_suffix(".star")),
+            "1",
+            str(results["total_motion"]),
+            str(results["early_motion"]),
+            str(results["late_motion"]),
+        ]
+    )
 
 
 def _cryolo_output_files(
@@ -273,26 +373,12 @@ def _cryolo_output_files(
     results: dict,
 ):
     """Cryolo jobs save a list of micrographs and files with particle coordinates"""
-    star_file = job_dir / "autopick.star"
-    added_line = [str(input_file), str(output_file)]
-
-    # Read and append to the existing output file, or otherwise create one
-    if not star_file.exists():
-        output_cif = cif.Document()
-
-        data_movies = output_cif.add_new_block("coordinate_files")
-        movies_loop = data_movies.init_loop(
-            "_rln",
-            [
-                "MicrographName",
-                "MicrographCoordinates",
-            ],
-        )
-        movies_loop.add_row(added_line)
-        output_cif.write_file(str(star_file), style=cif.Style.Simple)
-    else:
-        with open(star_file, "a") as output_cif:
-            output_cif.write(" ".join(added_line) + "\n")
+    output_file_writer(
+        job_dir / "autopick.star",
+        lambda: star_file_header(
+            "coordinate_files", ["MicrographName", "MicrographCoordinates"]
+        ),
+    ).add_row([str(input_file), str(output_file)])
 
 
 def _extract_output_files(
@@ -303,27 +389,26 @@ def _extract_output_files(
     results: dict,
 ):
     """Extract jobs save a list of particle coordinates"""
-    star_file = job_dir / "particles.star"
-
-    # Read and append to the existing output file, or otherwise create one
-    if not star_file.exists():
-        output_cif = get_optics_table(
-            relion_options, particle=True, im_size=results["box_size"]
+    with open(output_file, "r") as added_cif:
+        added_lines = added_cif.readlines()
+    particles_file = output_file.absolute()
+
+    def header():
+        # Take the particle columns from the star file of this micrograph
+        particles_block = cif.read_file(str(particles_file)).find_block("particles")
+        particles_loop = next(item.loop for item in particles_block if item.loop)
+        return star_file_header(
+            "particles",
+            [tag[len("_rln") :] for tag in particles_loop.tags],
+            get_optics_table(
+                relion_options, particle=True, im_size=results["box_size"]
+            ),
         )
 
-        particles_cif = cif.read_file(str(output_file))
-        data_particles = particles_cif.find_block("particles")
-        output_cif.add_copied_block(data_particles)
-        output_cif.write_file(str(star_file), style=cif.Style.Simple)
-
-    else:
-        with open(output_file, "r") as added_cif:
-            added_lines = added_cif.readlines()
-
-        with open(star_file, "a") as output_cif:
-            for new_row in added_lines:
-                if new_row[:1].isdigit():
-                    output_cif.write(new_row)
+    star_file = output_file_writer(job_dir / "particles.star", header)
+    for new_row in added_lines:
+        if new_row[:1].isdigit():
+            star_file.add_line(new_row)
 
 
 def _select_output_files(
@@ -1,12 +1,14 @@
 from __future__ import annotations
 
 import ast
+import copy
 import os.path
 import subprocess
 import time
 from pathlib import Path
 from typing import List, Optional, Union
 
+import numpy as np
 import plotly.express as px
 import workflows.recipe
 import workflows.transport
@@ -75,6 +77,31 @@ class TomoParameters(BaseModel):
         return v
 
 
+def read_aln_file(aln_file) -> np.ndarray:
+    """
+    Read the global alignment table of an AreTomo .aln file, with one row for
+    each tilt and the columns SEC, ROT, GMAG, TX, TY, SMEAN, SFIT, SCALE, BASE, TILT
+    """
+    with open(aln_file) as f:
+        # local alignments of patches follow the global table
+        global_alignment = f.read().split("# Local Alignment")[0]
+    rows = [
+        line
+        for line in global_alignment.splitlines()
+        if line.strip() and not line.lstrip().startswith("#")
+    ]
+    if not rows:
+        return np.empty((0, 10))
+    return np.loadtxt(rows, ndmin=2)
+
+
+class MockRW:
+    transport: workflows.transport.common_transport.CommonTransport
+
+    def dummy(self, *args, **kwargs):
+        pass
+
+
 class TomoAlign(CommonService):
     """
     A service for grouping and aligning tomography tilt-series with Newstack and AreTomo
@@ -105,9 +132,13 @@ class TomoAlign(CommonService):
     stack_name: str | None = None
     alignment_quality: float | None = None
 
+    # Messages which can be waiting for AreTomo jobs running elsewhere
+    prefetch_count = 1
+
     def initializing(self):
         """Subscribe to a queue. Received messages must be acknowledged."""
         self.log.info("TomoAlign service starting")
+        self.submitted_jobs = {}
         workflows.recipe.wrap_subscribe(
             self._transport,
             "tomo_align",
@@ -115,6 +146,7 @@ class TomoAlign(CommonService):
             acknowledgement=True,
             log_extender=self.extend_log,
             allow_non_recipe_messages=True,
+            prefetch_count=self.prefetch_count,
         )
 
     def parse_tomo_output(self, tomo_stdout: str):
@@ -128,9 +160,6 @@ class TomoAlign(CommonService):
 
     def extract_from_aln(self, tomo_parameters):
         tomo_aln_file = None
-        x_shift = []
-        y_shift = []
-        self.refined_tilts = []
         aln_files = list(Path(self.alignment_output_dir).glob("*.aln"))
 
         file_name = Path(tomo_parameters.stack_file).stem
@@ -138,29 +167,18 @@ class TomoAlign(CommonService):
             if file_name in str(aln_file):
                 tomo_aln_file = aln_file
 
-        with open(tomo_aln_file) as f:
-            lines = f.readlines()
-            for line in lines:
-                if not line.startswith("#"):
-                    line_split = line.split()
-                    if self.rot is None:
-                        self.rot = float(line_split[1])
-                    if self.mag is None:
-                        self.mag = float(line_split[2])
-                    x_shift.append(float(line_split[3]))
-                    y_shift.append(float(line_split[4]))
-                    self.refined_tilts.append(float(line_split[9]))
-        fig = px.scatter(x=x_shift, y=y_shift)
+        alignment = read_aln_file(tomo_aln_file)
+        if len(alignment):
+            if self.rot is None:
+                self.rot = float(alignment[0, 1])
+            if self.mag is None:
+                self.mag = float(alignment[0, 2])
+        self.refined_tilts = alignment[:, 9].tolist()
+        fig = px.scatter(x=alignment[:, 3], y=alignment[:, 4])
         fig.write_json(self.plot_path)
         return tomo_aln_file  # not needed anywhere atm
 
     def tomo_align(self, rw, header: dict, message: dict):
-        class MockRW:
-            transport: workflows.transport.common_transport.CommonTransport
-
-            def dummy(self, *args, **kwargs):
-                pass
-
         if not rw:
             print(
                 "Incoming message is not a recipe message. Simple messages can be valid"
@@ -219,28 +237,19 @@ class TomoAlign(CommonService):
         self.log.info(f"Input list {tomo_params.input_file_list}")
         tomo_params.input_file_list.sort(key=_tilt)
 
+        # Keep one file for each tilt angle, the first one created
         tilt_dict: dict = {}
         for tilt in tomo_params.input_file_list:
             if not Path(tilt[0]).is_file():
                 self.log.warning(f"File not found {tilt[0]}")
                 rw.transport.nack(header)
-            if tilt[1] not in tilt_dict:
-                tilt_dict[tilt[1]] = []
-            tilt_dict[tilt[1]].append(tilt[0])
-
-        values_to_remove = []
-        for item in tilt_dict:
-            values = tilt_dict[item]
-            if len(values) > 1:
-                # sort by age and remove oldest ones
-                values.sort(key=os.path.getctime)
-                values_to_remove = values[1:]
-
-        for tilt in tomo_params.input_file_list:
-            if tilt[0] in values_to_remove:
-                index = tomo_params.input_file_list.index(tilt)
-                self.log.warning(f"Removing: {values_to_remove}")
-                tomo_params.input_file_list.remove(tomo_params.input_file_list[index])
+            kept_tilt = tilt_dict.setdefault(tilt[1], tilt)
+            if kept_tilt is not tilt:
+                if os.path.getctime(tilt[0]) < os.path.getctime(kept_tilt[0]):
+                    tilt_dict[tilt[1]] = tilt
+                    tilt = kept_tilt
+                self.log.warning(f"Removing: {tilt[0]}")
+        tomo_params.input_file_list = list(tilt_dict.values())
 
         self.alignment_output_dir = str(Path(tomo_params.stack_file).parent)
         self.stack_name = str(Path(tomo_params.stack_file).stem)
@@ -287,6 +296,34 @@ class TomoAlign(CommonService):
             )
 
         aretomo_result = self.aretomo(tomo_params)
+        if isinstance(aretomo_result, int):
+            # The job has been submitted to run elsewhere with the returned ID,
+            # and the alignment is finished by finish_submitted_job once it
+            # completes. The values found for this tilt series are kept on a
+            # copy of the service.
+            alignment = copy.copy(self)
+            alignment.rot_centre_z_list = list(self.rot_centre_z_list)
+            self.submitted_jobs[aretomo_result] = (
+                alignment,
+                rw,
+                header,
+                tomo_params,
+            )
+            return
+        self.finish_tomo_align(rw, header, tomo_params, aretomo_result)
+
+    def finish_submitted_job(self, job_id: int, result):
+        """Process the result of an AreTomo job which ran elsewhere"""
+        if job_id not in self.submitted_jobs:
+            self.log.error(f"No tilt series is waiting for AreTomo job {job_id}")
+            return
+        alignment, rw, header, tomo_params = self.submitted_jobs.pop(job_id)
+        alignment.finish_tomo_align(rw, header, tomo_params, result)
+
+    def finish_tomo_align(
+        self, rw, header: dict, tomo_params: TomoParameters, aretomo_result
+    ):
+        """Check the AreTomo result and send on to the next services"""
         if aretomo_result.returncode:
             self.log.error(
                 f"AreTomo failed with exitcode {aretomo_result.returncode}:\n"
@@ -375,29 +412,33 @@ class TomoAlign(CommonService):
                             int(item.replace(",", "").strip()) for item in numbers[1:]
                         ]
 
-        im_diff = 0
         # TiltImageAlignment (one per movie)
-        for im, movie in enumerate(tomo_params.input_file_list):
-            if im in missing_indices:
-                im_diff += 1
-            else:
-                try:
-                    ispyb_command_list.append(
-                        {
-                            "ispyb_command": "insert_tilt_image_alignment",
-                            "psd_file": None,  # should be in ctf table but useful, so we will insert
-                            "refined_magnification": str(self.mag),
-                            "refined_tilt_angle": str(self.refined_tilts[im - im_diff])
-                            if self.refined_tilts
-                            else None,
-                            "refined_tilt_axis": str(self.rot),
-                            "path": movie[0],
-                        }
-                    )
-                except IndexError as e:
-                    self.log.error(
-                        f"{e} - Dark images haven't been accounted for properly"
-                    )
+        missing = set(missing_indices)
+        aligned_movies = [
+            movie[0]
+            for im, movie in enumerate(tomo_params.input_file_list)
+            if im not in missing
+        ]
+        refined_tilts: List[Optional[str]] = [None] * len(aligned_movies)
+        if self.refined_tilts:
+            refined_tilts = [str(tilt) for tilt in self.refined_tilts]
+            if len(aligned_movies) > len(refined_tilts):
+                self.log.error(
+                    f"{len(aligned_movies)} images but {len(refined_tilts)} tilts"
+                    " - Dark images haven't been accounted for properly"
+                )
+                aligned_movies = aligned_movies[: len(refined_tilts)]
+        ispyb_command_list.extend(
+            {
+                "ispyb_command": "insert_tilt_image_alignment",
+                "psd_file": None,  # should be in ctf table but useful, so we will insert
+                "refined_magnification": str(self.mag),
+                "refined_tilt_angle": refined_tilt,
+                "refined_tilt_axis": str(self.rot),
+                "path": movie,
+            }
+            for movie, refined_tilt in zip(aligned_movies, refined_tilts)
+        )
 
         ispyb_parameters = {
             "ispyb_command": "multipart_message",
@@ -1,14 +1,13 @@
 from __future__ import annotations
 
-import datetime
 import subprocess
 import tarfile
-import time
 from pathlib import Path
 
 import htcondor
 from workflows.services.common_service import CommonService
 
+from relion.zocalo.condor_jobs import CondorJobTracker, FinishedCluster
 from relion.zocalo.tomo_align import TomoAlign
 
 
@@ -20,6 +19,22 @@ class TomoAlignIris(TomoAlign, CommonService):
     # Logger name
     _logger_name = "relion.zocalo.tomo_align_iris"
 
+    # Messages are acknowledged once their job has run on the cluster,
+    # so several tilt series can be waiting at once
+    prefetch_count = 20
+
+    def initializing(self):
+        """Subscribe to a queue, and start following submitted jobs"""
+        self.condor_jobs = CondorJobTracker(
+            on_finished=self.job_finished, job_timeout=20 * 60
+        )
+        self.condor_jobs.start()
+        super().initializing()
+
+    def in_shutdown(self):
+        if getattr(self, "condor_jobs", None):
+            self.condor_jobs.stop()
+
     def parse_tomo_output(self, tomo_output_file):
         tomo_file = open(tomo_output_file, "r")
         lines = tomo_file.readlines()
@@ -34,7 +49,7 @@ class TomoAlignIris(TomoAlign, CommonService):
 
     def aretomo(self, tomo_parameters):
         """
-        Run AreTomo on output of Newstack
+        Submit AreTomo on output of Newstack to Iris, returning the job ID
         """
         args = [
             "./AreTomo_1.3.0_Cuda112_09292022",
@@ -97,39 +112,6 @@ class TomoAlignIris(TomoAlign, CommonService):
             f"Output file: {tomo_parameters.aretomo_output_file}"
         )
 
-        # Set-up condor config
-        htcondor.param["RELEASE_DIR"] = "/usr"
-        htcondor.param["LOCAL_DIR"] = "/var"
-        htcondor.param["RUN"] = "/var/run/condor"
-        htcondor.param["LOG"] = "/var/log/condor"
-        htcondor.param["LOCK"] = "/var/lock/condor"
-        htcondor.param["SPOOL"] = "/var/lib/condor/spool"
-        htcondor.param["EXECUTE"] = "/var/lib/condor/execute"
-        htcondor.param["BIN"] = "/usr/bin"
-        htcondor.param["LIB"] = "/usr/lib64/condor"
-        htcondor.param["INCLUDE"] = "/usr/include/condor"
-        htcondor.param["SBIN"] = "/usr/sbin"
-        htcondor.param["LIBEXEC"] = "/usr/libexec/condor"
-        htcondor.param["SHARE"] = "/usr/share/condor"
-        htcondor.param["PROCD_ADDRESS"] = "/var/run/condor/procd_pipe"
-        htcondor.param[
-            "JAVA_CLASSPATH_DEFAULT"
-        ] = "/usr/share/condor /usr/share/condor/scimark2lib.jar ."
-        htcondor.param["CONDOR_HOST"] = "pool-gpu-htcondor-manager.diamond.ac.uk"
-        htcondor.param["COLLECTOR_HOST"] = "pool-gpu-htcondor-manager.diamond.ac.uk"
-        htcondor.param["ALLOW_READ"] = "*"
-        htcondor.param["ALLOW_WRITE"] = "*"
-        htcondor.param["ALLOW_NEGOTIATOR"] = "*"
-        htcondor.param["ALLOW_DAEMON"] = "*"
-        htcondor.param["SEC_DEFAULT_AUTHENTICATION_METHODS"] = "FS_REMOTE, PASSWORD"
-        htcondor.param[
-            "SEC_WRITE_AUTHENTICATION_METHODS"
-        ] = "FS_REMOTE, PASSWORD, ANONYMOUS"
-        htcondor.param[
-            "SEC_READ_AUTHENTICATION_METHODS"
-        ] = "FS_REMOTE, PASSWORD, ANONYMOUS"
-        htcondor.param["FS_REMOTE_DIR"] = "/dls/tmp/htcondor"
-
         output_file = self.alignment_output_dir + "/" + self.stack_name + "_iris_out"
         error_file = self.alignment_output_dir + "/" + self.stack_name + "_iris_error"
         log_file = self.alignment_output_dir + "/" + self.stack_name + "_iris_log"
@@ -152,7 +134,9 @@ class TomoAlignIris(TomoAlign, CommonService):
             )
         except Exception:
             self.log.warn("Couldn't connect submitter")
-            return subprocess.CompletedProcess(args="", returncode=1)
+            return subprocess.CompletedProcess(
+                args="", returncode=1, stderr=b"Couldn't connect submitter"
+            )
 
         if tomo_parameters.out_imod:
             itemdata = [
@@ -176,38 +160,56 @@ class TomoAlignIris(TomoAlign, CommonService):
                     "initial_dir": self.alignment_output_dir,
                 }
             ]
-        coll = htcondor.Collector(htcondor.param["COLLECTOR_HOST"])
-        schedd_ad = coll.locate(htcondor.DaemonTypes.Schedd)
-        schedd = htcondor.Schedd(schedd_ad)
-        job = schedd.submit(at_job, itemdata=iter(itemdata))
-        cluster_id = job.cluster()
+        try:
+            cluster_id = self.condor_jobs.submit(at_job, itemdata)
+        except Exception as e:
+            self.log.error(f"Could not submit to Iris: {e}")
+            return subprocess.CompletedProcess(
+                args="", returncode=1, stderr=str(e).encode("utf8")
+            )
         self.log.info(f"Submitting to Iris, ID: {str(cluster_id)}")
+        return cluster_id
+
+    def job_finished(self, cluster: FinishedCluster):
+        """Pass a finished job from the polling thread to the service thread"""
+        self._transport_interceptor(self.condor_job_finished)(None, cluster)
 
-        res = 1
-        start_time = datetime.datetime.now()
-        while res:
-            try:
-                res = schedd.query(
-                    constraint="ClusterId=={}".format(cluster_id),
-                    projection=["JobStatus"],
-                )[0]["JobStatus"]
-            except IndexError:
-                break
-            if res == 12:
-                schedd.act(htcondor.JobAction.Remove, f"ClusterId == {cluster_id}")
-                return subprocess.CompletedProcess(args="", returncode=res)
-            time.sleep(10)
-            if (datetime.datetime.now() - start_time).seconds > 20 * 60:
-                # Abort if duration over 20 minutes
-                schedd.act(htcondor.JobAction.Remove, f"ClusterId == {cluster_id}")
-                return subprocess.CompletedProcess(args="", returncode=5)
+    def condor_job_finished(self, header, cluster: FinishedCluster):
+        """Read in the AreTomo output of a finished job then finish the alignment"""
+        if cluster.cluster_id not in self.submitted_jobs:
+            self.log.error(
+                f"No tilt series is waiting for Iris job {cluster.cluster_id}"
+            )
+            if header:
+                self._transport.nack(header)
+            return
+        alignment, _, _, tomo_parameters = self.submitted_jobs[cluster.cluster_id]
+        if cluster.state != "COMPLETED":
+            self.finish_submitted_job(
+                cluster.cluster_id,
+                subprocess.CompletedProcess(
+                    args="",
+                    returncode=1,
+                    stderr=f"Iris job {cluster.cluster_id} finished with state "
+                    f"{cluster.state}".encode("utf8"),
+                ),
+            )
+            return
 
         if tomo_parameters.tilt_cor:
-            self.parse_tomo_output(output_file)
+            alignment.parse_tomo_output(
+                alignment.alignment_output_dir
+                + "/"
+                + alignment.stack_name
+                + "_iris_out"
+            )
 
-        tar_imod_dir = str(Path(self.imod_directory).with_suffix(".tar.gz"))
-        file = tarfile.open(tar_imod_dir)
-        file.extractall(self.alignment_output_dir)
-        file.close()
+        if tomo_parameters.out_imod:
+            tar_imod_dir = str(Path(alignment.imod_directory).with_suffix(".tar.gz"))
+            file = tarfile.open(tar_imod_dir)
+            file.extractall(alignment.alignment_output_dir)
+            file.close()
 
-        return subprocess.CompletedProcess(args="", returncode=0)
+        self.finish_submitted_job(
+            cluster.cluster_id, subprocess.CompletedProcess(args="", returncode=0)
+        )
@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import copy
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+import workflows.recipe
+from workflows.services.common_service import CommonService
+
+# Transport calls which are held back until a message has been fully handled
+_deferred_calls = (
+    "send",
+    "raw_send",
+    "broadcast",
+    "raw_broadcast",
+    "ack",
+    "nack",
+    "transaction_begin",
+    "transaction_abort",
+    "transaction_commit",
+)
+
+_Call = Tuple[str, tuple, dict]
+
+
+class _DeferredTransaction(int):
+    """Stand-in for a transaction id handed out before the transaction exists"""
+
+
+class PooledTransport:
+    """
+    Wraps the transport of a pooled service. Calls made from the main service
+    thread go straight to the transport. Calls made while a worker handles a
+    message are recorded, and are played back in their original order once the
+    handler has returned, so that the outputs and acknowledgement of a message
+    reach the broker together. All transport use is serialised with a lock.
+    """
+
+    def __init__(self, transport):
+        self._transport = transport
+        self._lock = threading.RLock()
+        self._recording = threading.local()
+
+    def __getattr__(self, name):
+        attribute = getattr(self._transport, name)
+        if name not in _deferred_calls or not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            calls = getattr(self._recording, "calls", None)
+            if calls is None:
+                with self._lock:
+                    return attribute(*args, **kwargs)
+            calls.append((name, args, kwargs))
+            if name == "transaction_begin":
+                return _DeferredTransaction(len(calls))
+
+        return call
+
+    def record(self) -> List[_Call]:
+        """Start recording the calls made by the current thread"""
+        self._recording.calls = []
+        return self._recording.calls
+
+    def stop_recording(self):
+        self._recording.calls = None
+
+    def replay(self, calls: List[_Call], header: Optional[dict] = None):
+        """
+        Make the recorded calls of one message. Unless the handler managed its
+        own transactions, the calls are made in a single transaction on the
+        subscription the message arrived on.
+        """
+        if not calls:
+            return
+        with self._lock:
+            if any(name.startswith("transaction_") for name, _, _ in calls):
+                transactions = {}
+                for position, (name, args, kwargs) in enumerate(calls, start=1):
+                    args = tuple(
+                        (
+                            transactions.get(arg, arg)
+                            if isinstance(arg, _DeferredTransaction)
+                            else arg
+                        )
+                        for arg in args
+                    )
+                    if isinstance(kwargs.get("transaction"), _DeferredTransaction):
+                        kwargs = {
+                            **kwargs,
+                            "transaction": transactions[kwargs["transaction"]],
+                        }
+                    result = getattr(self._transport, name)(*args, **kwargs)
+                    if name == "transaction_begin":
+                        transactions[position] = result
+                return
+
+            subscription_id = header.get("subscription") if header else None
+            transaction = self._transport.transaction_begin(
+                subscription_id=subscription_id
+            )
+            try:
+                for name, args, kwargs in calls:
+                    getattr(self._transport, name)(
+                        *args, **{**kwargs, "transaction": transaction}
+                    )
+            except BaseException:
+                self._transport.transaction_abort(transaction)
+                raise
+            self._transport.transaction_commit(transaction)
+
+
+class PooledService(CommonService):
+    """
+    A service which can handle several messages at once in a pool of worker
+    threads. Up to `concurrency` messages are handled at a time. This is set on the class or with the
+    RELION_SERVICE_CONCURRENCY environment variable, and defaults to one,
+    which handles messages one by one on the main service thread.
+    The number of unacknowledged messages fetched from the broker is set by
+    `prefetch_count`, which defaults to `concurrency`. Services whose handlers
+    acknowledge messages later, once work running elsewhere finishes, set it
+    higher so that several messages can be waiting at once.
+
+    Each message is handled on a shallow copy of the service, so attributes
+    set by a handler are kept apart from those of other messages. Mutable
+    attributes which a handler changes in place are named in message_state,
+    and each copy is given its own copy of these. The outputs
+    and acknowledgement of a message are only sent once its handler returns.
+    If a handler raises an exception the outputs are dropped and the message
+    is rejected.
+    """
+
+    concurrency: int = 1
+    prefetch_count: Optional[int] = None
+    message_state: Tuple[str, ...] = ()
+
+    def subscribe_pooled(
+        self, channel: str, callback: Callable, allow_non_recipe_messages: bool = True
+    ):
+        """Subscribe to a queue, handling messages in the worker pool"""
+        self.concurrency = int(
+            os.getenv("RELION_SERVICE_CONCURRENCY", self.concurrency)
+        )
+        if self.concurrency > 1 and not isinstance(self._transport, PooledTransport):
+            self._transport = PooledTransport(self._transport)
+        workflows.recipe.wrap_subscribe(
+            self._transport,
+            channel,
+            self.pooled(callback),
+            acknowledgement=True,
+            log_extender=self.extend_log,
+            allow_non_recipe_messages=allow_non_recipe_messages,
+            prefetch_count=self.prefetch_count or self.concurrency,
+        )
+
+    def pooled(self, callback: Callable) -> Callable:
+        """Wrap a message handler so that it runs in the worker pool"""
+        if self.concurrency <= 1:
+            return callback
+
+        def submit(rw, header: dict, message):
+            if getattr(self, "_worker_pool", None) is None:
+                self._worker_pool = ThreadPoolExecutor(
+                    max_workers=self.concurrency,
+                    thread_name_prefix=f"{self._service_name} worker",
+                )
+            self._worker_pool.submit(
+                self._handle_in_worker, callback.__name__, rw, header, message
+            )
+
+        return submit
+
+    def _handle_in_worker(self, handler_name: str, rw, header: dict, message):
+        worker = copy.copy(self)
+        for name in self.message_state:
+            setattr(worker, name, copy.copy(getattr(self, name)))
+        calls = self._transport.record()
+        try:
+            getattr(worker, handler_name)(rw, header, message)
+        except Exception as e:
+            self.log.error(f"Uncaught exception handling message: {e}", exc_info=True)
+            calls[:] = [("nack", (header,), {})]
+        finally:
+            self._transport.stop_recording()
+        try:
+            self._transport.replay(calls, header)
+        except Exception as e:
+            self.log.error(f"Could not send results of message: {e}", exc_info=True)
+
+    def in_shutdown(self):
+        """Finish handling any messages which are in progress"""
+        if getattr(self, "_worker_pool", None) is not None:
+            self._worker_pool.shutdown(wait=True)
+            self._worker_pool = None
@@ -16,6 +16,7 @@ import zocalo.util.symlink
 import zocalo.wrapper
 
 import relion
+from relion import file_watcher
 from relion.cryolo_relion_it import cryolo_relion_it, dls_options, icebreaker_histogram
 from relion.cryolo_relion_it.cryolo_relion_it import RelionItOptions
 from relion.dbmodel.modeltables import (
@@ -181,6 +182,7 @@ class RelionWrapper(zocalo.wrapper.BaseWrapper):
                 "images_particles": images_particles_msgs,
             },
             version=self.params.get("relion_version", 3),
+            parse_cache=True,
         )
 
         while not relion_prj.origin_present() or (
@@ -199,6 +201,9 @@ class RelionWrapper(zocalo.wrapper.BaseWrapper):
 
         time_of_last_ib_hist_warning = 0
 
+        # movies are followed as they arrive rather than globbing the image directory
+        movie_watcher = file_watcher.watch_directory(self.params["image_directory"])
+
         while (
             self._relion_subthread.is_alive() or preprocess_check.is_file()
         ) and False not in [
@@ -216,7 +221,7 @@ class RelionWrapper(zocalo.wrapper.BaseWrapper):
 
             if pathlib.Path(self.params["stop_file"]).is_file():
                 logger.info("Stop file encountered")
-                relion_prj.load()
+                relion_prj.load(clear_cache=False)
                 for job_path in relion_prj._job_nodes:
                     (
                         self.results_directory
@@ -228,7 +233,9 @@ class RelionWrapper(zocalo.wrapper.BaseWrapper):
                 logger.info("Instructed Relion to stop. Terminating main loop.")
                 break
 
-            relion_prj.load()
+            relion_prj.load(clear_cache=False)
+            # Drift plots are not written while the project is parsed
+            relion_prj.motioncorrection.write_drift_plots()
 
             # Should only return results that have not previously been sent
 
@@ -298,15 +305,12 @@ class RelionWrapper(zocalo.wrapper.BaseWrapper):
             ):
                 attachment_list = []
                 try:
-                    pdf_file_path = icebreaker_histogram.create_pdf_histogram(
+                    histograms = icebreaker_histogram.create_histograms(
                         self.working_directory,
                         version=self.params.get("relion_version", 3.1),
                     )
-                    json_file_path = icebreaker_histogram.create_json_histogram(
-                        self.working_directory,
-                        version=self.params.get("relion_version", 3.1),
-                    )
-                    if should_send_icebreaker and pdf_file_path and json_file_path:
+                    if should_send_icebreaker and histograms:
+                        json_file_path, pdf_file_path = histograms
                         attachment_list.append(
                             ispyb_attachment(json_file_path, "Graph")
                         )
@@ -326,14 +330,8 @@ class RelionWrapper(zocalo.wrapper.BaseWrapper):
                         time_of_last_ib_hist_warning = ib_hist_warning_time
 
             # if Relion has been running too long stop loop of preprocessing jobs
-            try:
-                most_recent_movie = max(
-                    p.stat().st_mtime
-                    for p in pathlib.Path(self.params["image_directory"]).glob("**/*")
-                )
-            # if a file vanishes for some reason make sure that there is no crash and no exit
-            except FileNotFoundError:
-                most_recent_movie = time.time()
+            movie_watcher.update()
+            most_recent_movie = movie_watcher.latest_mtime or relion_started
 
             # check if all imported files have been motion corrected
             # if they have then get the time stamp of the motion correction job
@@ -407,6 +405,7 @@ class RelionWrapper(zocalo.wrapper.BaseWrapper):
                     )
                     success = False
 
+        movie_watcher.close()
         if not icebreaker_particles_star_file_found:
             logger.warning("No particles.star file found for Icebreaker grouping.")
         logger.info("Done.")
@@ -1,5 +1,9 @@
 from __future__ import annotations
 
+import collections
+import json
+import threading
+
 import gemmi
 
 from relion.cryolo_relion_it import icebreaker_histogram
@@ -104,3 +108,92 @@ def test_create_pdf_histogram_creates_a_file(tmp_path):
 
     icebreaker_histogram.create_pdf_histogram(tmp_path)
     assert icebreaker_dir.joinpath("ice_hist.pdf").is_file()
+
+
+def write_particles(particles_file, ice_values):
+    out_doc = gemmi.cif.Document()
+    optics_block = out_doc.add_new_block("optics")
+    optics_loop = optics_block.init_loop("", ["_rlnOpticsGroup", "_rlnImagePixelSize"])
+    optics_loop.add_row(["1", "1.0"])
+    particles_block = out_doc.add_new_block("particles")
+    loop = particles_block.init_loop(
+        "", ["_rlnCoordinateX", "_rlnHelicalTubeID", "_rlnOpticsGroup"]
+    )
+    for i, value in enumerate(ice_values):
+        loop.add_row([str(i), str(value), "1"])
+    out_doc.write_file(str(particles_file))
+
+
+def test_histograms_follow_appended_rows(tmp_path):
+    icebreaker_dir = tmp_path / "IceBreaker" / "Icebreaker_group_batch_1"
+    icebreaker_dir.mkdir(parents=True)
+    particles_file = icebreaker_dir / "particles.star"
+    write_particles(particles_file, [5, 7, 5])
+
+    assert icebreaker_histogram.create_histograms(tmp_path, version=4) == (
+        icebreaker_dir / "ice_hist.json",
+        icebreaker_dir / "ice_hist.pdf",
+    )
+    histogram = icebreaker_histogram._histogram(tmp_path, 4)
+    assert histogram.counts == {5: 2, 7: 1}
+
+    with open(particles_file, "a") as f:
+        f.write("3 8 1\n4 5 ")
+    icebreaker_histogram.create_histograms(tmp_path, version=4)
+    assert histogram.counts == {5: 2, 7: 1, 8: 1}
+    with open(particles_file, "a") as f:
+        f.write("1\n")
+    icebreaker_histogram.create_histograms(tmp_path, version=4)
+    assert histogram.counts == collections.Counter(
+        icebreaker_histogram.extract_ice_column(particles_file)
+    )
+    figure = json.loads((icebreaker_dir / "ice_hist.json").read_text())
+    assert "Total number of particles = 5" in figure["layout"]["title"]["text"]
+
+    # a rewritten file replaces the counts of the old one
+    particles_file.unlink()
+    write_particles(particles_file, [9])
+    icebreaker_histogram.create_histograms(tmp_path, version=4)
+    assert histogram.counts == {9: 1}
+
+
+def test_histograms_are_only_drawn_when_counts_change(tmp_path, monkeypatch):
+    icebreaker_dir = tmp_path / "External" / "Icebreaker_group_batch_001"
+    icebreaker_dir.mkdir(parents=True)
+    write_particles(icebreaker_dir / "particles.star", [5])
+    drawn = []
+
+    def write_pdf(self, values, weights, bins):
+        drawn.append(weights.sum())
+        self.pdf_path.touch()
+
+    monkeypatch.setattr(icebreaker_histogram.IceHistogram, "_write_pdf", write_pdf)
+
+    icebreaker_histogram.create_json_histogram(tmp_path)
+    icebreaker_histogram.create_pdf_histogram(tmp_path)
+    assert drawn == [1]
+
+    with open(icebreaker_dir / "particles.star", "a") as f:
+        f.write("1 6 1\n")
+    icebreaker_histogram.create_json_histogram(tmp_path)
+    icebreaker_histogram.create_pdf_histogram(tmp_path)
+    assert drawn == [1, 2]
+
+
+def test_histogram_counts_rows_once_across_threads(tmp_path):
+    icebreaker_dir = tmp_path / "IceBreaker" / "Icebreaker_group_batch_1"
+    icebreaker_dir.mkdir(parents=True)
+    write_particles(icebreaker_dir / "particles.star", [5, 7, 5] * 100)
+    histogram = icebreaker_histogram.IceHistogram(tmp_path, version=4)
+    barrier = threading.Barrier(8)
+
+    def update():
+        barrier.wait()
+        histogram.update()
+
+    threads = [threading.Thread(target=update) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert histogram.counts == {5: 200, 7: 100}
@@ -79,3 +79,32 @@ def test_correct_inserts_on_ctf_table(ctf_table):
 
 def test_boolean_db_node(mc_db_node):
     assert mc_db_node
+
+
+class MCOptions(NamedTuple):
+    motioncor_doseperframe: float = 1
+    motioncor_patches_x: int = 5
+    motioncor_patches_y: int = 5
+
+
+def _record_message(table, primary_key, resend=False, unsent_appended=None):
+    return {"id": primary_key, "resend": resend}
+
+
+def test_db_node_messages_only_include_new_or_changed_rows():
+    node = DBNode("MCTable", [modeltables.MotionCorrectionTable()])
+    for i in range(3):
+        node.environment.update({"micrograph_full_path": f"mic{i}.mrc"})
+        node.insert(i + 1, MCOptions())
+    messages = node.message({"ispyb": _record_message})
+    ids = [m["id"] for m in messages["ispyb"]]
+    assert len(ids) == 3
+    assert not any(m["resend"] for m in messages["ispyb"])
+    assert node.message({"ispyb": _record_message}) == {}
+
+    node.environment.update({"micrograph_full_path": "mic1.mrc", "total_motion": 2})
+    node.insert(4, MCOptions())
+    messages = node.message({"ispyb": _record_message})
+    assert messages == {"ispyb": [{"id": ids[1], "resend": True}]}
+    assert list(node._sent[0]) == [ids[0], ids[2], ids[1]]
+    assert not node._unsent[0]
@@ -371,3 +371,69 @@ def test_get_row_by_primary_key(fake_table, unique_value):
 def test_motion_correction_table_has_correct_columns():
     mctab = MotionCorrectionTable()
     assert "motion_correction_id" in mctab.columns
+
+
+def test_indexes_follow_overwritten_unique_values(fake_table, unique_value):
+    base_id = next(WrapperID)
+    fake_table.add_row({"unique_value": unique_value, "comment": "first insert"})
+    fake_table.add_row(
+        {
+            "primary_id": base_id + 1,
+            "unique_value": unique_value + 1,
+            "comment": "moved",
+        }
+    )
+    assert fake_table._tab["unique_value"] == [unique_value + 1]
+    assert fake_table.get_row_index("unique_value", unique_value) is None
+    assert fake_table.get_row_index("unique_value", unique_value + 1) == 0
+    pid_insert = fake_table.add_row(
+        {"unique_value": unique_value + 1, "comment": "moved again"}
+    )
+    assert pid_insert == base_id + 1
+    assert fake_table._tab["comment"] == ["moved again"]
+    pid_insert = fake_table.add_row({"unique_value": unique_value, "comment": "new"})
+    assert pid_insert == base_id + 2
+    assert fake_table.get_row_by_primary_key(base_id + 2)["comment"] == "new"
+
+
+def test_composite_unique_key_lookup(fake_double_unique_table, unique_value):
+    base_id = next(WrapperID)
+    for i in range(3):
+        for j in range(3):
+            fake_double_unique_table.add_row(
+                {
+                    "unique_value_01": unique_value + i,
+                    "unique_value_02": unique_value + j,
+                    "comment": "first insert",
+                }
+            )
+    pid_insert = fake_double_unique_table.add_row(
+        {
+            "unique_value_01": unique_value + 1,
+            "unique_value_02": unique_value + 2,
+            "comment": "second insert",
+        }
+    )
+    assert pid_insert == base_id + 6
+    assert fake_double_unique_table._tab["comment"].count("second insert") == 1
+    assert fake_double_unique_table.get_row_index(
+        "unique_value_01", unique_value + 1
+    ) == [3, 4, 5]
+
+
+def test_unhashable_unique_values_are_still_matched(fake_table):
+    base_id = next(WrapperID)
+    fake_table.add_row({"unique_value": [1, 2], "comment": "first insert"})
+    pid_insert = fake_table.add_row({"unique_value": [1, 2], "comment": "new insert"})
+    assert pid_insert == base_id + 1
+    assert fake_table._tab["comment"] == ["new insert"]
+    assert fake_table.get_row_index("unique_value", [1, 2]) == 0
+
+
+def test_get_rows_by_primary_keys(fake_table, unique_value):
+    base_id = next(WrapperID)
+    for i in range(3):
+        fake_table.add_row({"unique_value": unique_value + i, "comment": f"row {i}"})
+    rows = fake_table.get_rows_by_primary_keys([base_id + 3, base_id + 1])
+    assert [r["comment"] for r in rows] == ["row 2", "row 0"]
+    assert rows[0] == fake_table.get_row_by_primary_key(base_id + 3)
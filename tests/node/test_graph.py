@@ -197,3 +197,47 @@ def test_process_graph_show_all_nodes(mock_Digraph, graph):
     ]
     mock_Digraph.return_value.edge.assert_has_calls(edgecalls)
     mock_Digraph.return_value.render.assert_called_once()
+
+
+def test_calling_a_long_chain_does_not_hit_the_recursion_limit():
+    chain = [Node(f"N{i}") for i in range(5000)]
+    for n01, n02 in zip(chain, chain[1:]):
+        n01.link_to(n02, traffic={"from": n01.name})
+    graph = Graph("chain", list(reversed(chain)))
+    assert graph.find_origins()[0] is chain[0]
+    graph()
+    assert len(graph._call_returns) == len(chain)
+    explored = []
+    graph.node_explore(chain[0], explored)
+    assert len(explored) == len(chain)
+
+
+def test_node_is_called_after_all_parents_have_sent_traffic():
+    called_with = {}
+
+    class RecordingNode(Node):
+        def func(self, *args, **kwargs):
+            called_with[self.name] = dict(self.environment.base)
+
+    node_A = RecordingNode("A")
+    node_B = RecordingNode("B")
+    node_C = RecordingNode("C")
+    node_A.link_to(node_B, traffic={"a": 1})
+    node_A.link_to(node_C, traffic={"a": 2})
+    node_B.link_to(node_C, traffic={"b": 3})
+    graph = Graph("G", [node_C, node_B, node_A])
+    graph()
+    assert called_with["B"] == {"a": 1}
+    assert called_with["C"] == {"a": 2, "b": 3}
+
+
+def test_graph_structure_is_updated_when_nodes_are_linked(graph, next_node_01):
+    assert graph.find_origins() == [graph[0]]
+    new_node = Node("D")
+    graph.add_node(new_node)
+    assert graph.find_origins() == [graph[0], new_node]
+    new_node.link_to(next_node_01)
+    assert graph.find_origins() == [graph[0], new_node]
+    next_node_01.link_to(new_node)
+    assert graph.find_origins() == [graph[0]]
+    assert graph.index(new_node) == 3
@@ -2,6 +2,7 @@ from __future__ import annotations
 
 from unittest import mock
 
+import pytest
 import starfile
 
 from relion._parser import combine_star_files
@@ -138,3 +139,83 @@ def test_main(mock_split, mock_combine, mock_sysargv, tmp_path):
     )
     mock_split.assert_called_once()
     mock_split.assert_called_with(tmp_path / "particles_all.star", tmp_path, 2, 1)
+
+
+def _write_particles_file(file_to_write, particles):
+    with open(file_to_write, "w") as particles_file:
+        particles_file.write(
+            "data_optics\n\nloop_\n_column1\n_column2\nopticsGroup1 1\n\n"
+            "data_particles\n\nloop_\n_column1\n_column2\n"
+        )
+        for particle in particles:
+            particles_file.write(f"{particle} a\n")
+
+
+def _read_particles(file_to_read):
+    with open(file_to_read) as particles_file:
+        return [int(line.split()[0]) for line in particles_file if line[0].isdigit()]
+
+
+def test_particles_store_appends_and_extends_trailing_split(tmp_path, capsys):
+    """Particles are appended once and only the last split file is extended"""
+    _write_particles_file(tmp_path / "particles1.star", range(1, 4))
+    _write_particles_file(tmp_path / "particles2.star", range(4, 8))
+
+    store = combine_star_files.ParticlesStore(tmp_path)
+    assert store.particle_count == 0
+    assert store.append(tmp_path / "particles1.star") == 3
+    store.split(2)
+    first_split_mtime = (tmp_path / "particles_split1.star").stat().st_mtime_ns
+
+    # a new store picks up the counts from the index
+    store = combine_star_files.ParticlesStore(tmp_path)
+    assert store.particle_count == 3
+    assert store.append(tmp_path / "particles2.star") == 4
+    assert store.particle_count == 7
+    store.split(2)
+
+    assert (tmp_path / ".particles_all_index.json").is_file()
+    particles = starfile.read(tmp_path / "particles_all.star")["particles"]
+    assert list(particles["column1"]) == list(range(1, 8))
+    for split, expected in enumerate(([1, 2], [3, 4], [5, 6], [7]), start=1):
+        split_data = starfile.read(tmp_path / f"particles_split{split}.star")
+        assert list(split_data["optics"].loc[0]) == ["opticsGroup1", 1]
+        assert list(split_data["particles"]["column1"]) == expected
+    assert not (tmp_path / "particles_split5.star").exists()
+    assert (tmp_path / "particles_split1.star").stat().st_mtime_ns == first_split_mtime
+
+    # changing the split size rewrites the splits
+    store.split(5)
+    assert _read_particles(tmp_path / "particles_split1.star") == [1, 2, 3, 4, 5]
+    assert _read_particles(tmp_path / "particles_split2.star") == [6, 7]
+    # progress is logged rather than printed by the services using the store
+    assert capsys.readouterr().out == ""
+
+
+def test_particles_store_indexes_existing_file(tmp_path):
+    """A particles_all.star without an index is read once to build one"""
+    _write_particles_file(tmp_path / "particles_all.star", range(1, 6))
+    _write_particles_file(tmp_path / "particles_new.star", range(6, 8))
+
+    store = combine_star_files.ParticlesStore(tmp_path)
+    assert store.particle_count == 5
+    store.append(tmp_path / "particles_new.star")
+    assert combine_star_files.ParticlesStore(tmp_path).particle_count == 7
+
+    # a file changed behind the index is read again
+    _write_particles_file(tmp_path / "particles_all.star", range(1, 3))
+    assert combine_star_files.ParticlesStore(tmp_path).particle_count == 2
+
+
+def test_particles_store_rejects_different_optics(tmp_path):
+    _write_particles_file(tmp_path / "particles_all.star", range(1, 3))
+    with open(tmp_path / "particles_new.star", "w") as particles_file:
+        particles_file.write(
+            "data_optics\n\nloop_\n_column1\n_column2\nopticsGroup1 2\n\n"
+            "data_particles\n\nloop_\n_column1\n_column2\n3 a\n"
+        )
+
+    store = combine_star_files.ParticlesStore(tmp_path)
+    with pytest.raises(IndexError):
+        store.append(tmp_path / "particles_new.star")
+    assert combine_star_files.ParticlesStore(tmp_path).particle_count == 2
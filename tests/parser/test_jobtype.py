@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import os
+
+import pytest
+
+from relion._parser.ctffind import CTFFind
+
+
+def _write_ctf_star(star_path, micrographs):
+    rows = "\n".join(
+        f"MotionCorr/job002/Movies/{mic}.mrc CtfFind/job003/Movies/{mic}.ctf:mrc "
+        "1000.0 1100.0 45.0 50.0 4.0 0.1"
+        for mic in micrographs
+    )
+    star_path.write_text(
+        "data_optics\nloop_\n_rlnOpticsGroup\n_rlnAmplitudeContrast\n1 0.1\n\n"
+        "data_micrographs\nloop_\n_rlnMicrographName\n_rlnCtfImage\n_rlnDefocusU\n"
+        "_rlnDefocusV\n_rlnDefocusAngle\n_rlnCtfAstigmatism\n_rlnCtfMaxResolution\n"
+        f"_rlnCtfFigureOfMerit\n{rows}\n"
+    )
+
+
+@pytest.fixture
+def ctffind(tmp_path):
+    for job in ("job003", "job004"):
+        (tmp_path / "CtfFind" / job).mkdir(parents=True)
+        _write_ctf_star(
+            tmp_path / "CtfFind" / job / "micrographs_ctf.star", ["FoilHole_1"]
+        )
+    return CTFFind(tmp_path / "CtfFind")
+
+
+def test_refresh_only_reloads_jobs_with_changed_files(ctffind, tmp_path):
+    job03 = ctffind["job003"]
+    job04 = ctffind["job004"]
+    assert len(job03) == len(job04) == 1
+    ctffind.refresh()
+    assert ctffind["job003"] is job03
+    assert ctffind["job004"] is job04
+
+    star_path = tmp_path / "CtfFind" / "job003" / "micrographs_ctf.star"
+    _write_ctf_star(star_path, ["FoilHole_1", "FoilHole_2"])
+    # make sure the change is seen even on file systems with coarse timestamps
+    os.utime(star_path, ns=(0, 0))
+    ctffind.refresh()
+    assert ctffind["job004"] is job04
+    assert [m.micrograph_name for m in ctffind["job003"]] == [
+        str(tmp_path / "MotionCorr/job002/Movies/FoilHole_1.mrc"),
+        str(tmp_path / "MotionCorr/job002/Movies/FoilHole_2.mrc"),
+    ]
+
+
+def test_refresh_reloads_a_job_when_a_missing_file_appears(ctffind, tmp_path):
+    (tmp_path / "CtfFind" / "job005").mkdir()
+    assert ctffind["job005"] == []
+    ctffind.refresh()
+    assert ctffind["job005"] == []
+    _write_ctf_star(
+        tmp_path / "CtfFind" / "job005" / "micrographs_ctf.star", ["FoilHole_1"]
+    )
+    ctffind.refresh()
+    assert len(ctffind["job005"]) == 1
+
+
+def test_refresh_keeps_results_that_were_set_directly(ctffind):
+    ctffind["job003"] = ["result"]
+    ctffind.refresh()
+    assert ctffind["job003"] == ["result"]
+
+
+def test_parse_star_loop_reads_columns_with_and_without_types(ctffind, tmp_path):
+    star_doc = ctffind._read_star_file("job003", "micrographs_ctf.star")
+    columns = ctffind.parse_star_loop(
+        ["_rlnDefocusU", "_rlnMicrographName", "_rlnNotAColumn"],
+        star_doc,
+        1,
+        dtypes={"_rlnDefocusU": float},
+    )
+    assert list(columns) == ["_rlnDefocusU", "_rlnMicrographName", "_rlnNotAColumn"]
+    assert columns["_rlnDefocusU"].tolist() == [1000.0]
+    assert columns["_rlnMicrographName"] == ["MotionCorr/job002/Movies/FoilHole_1.mrc"]
+    assert columns["_rlnNotAColumn"] == []
+    # reading the whole loop at once matches reading it column by column
+    names = list(star_doc[1].find_loop("_rlnCtfImage").get_loop().tags)
+    columns = ctffind.parse_star_loop(names, star_doc, 1)
+    for name in names:
+        assert columns[name] == ctffind.parse_star_file(name, star_doc, 1)
+
+
+def test_star_loop_rows_rejects_missing_columns(ctffind):
+    star_doc = ctffind._read_star_file("job003", "micrographs_ctf.star")
+    columns = ctffind.parse_star_loop(
+        ["_rlnDefocusU", "_rlnMicrographName"], star_doc, 1
+    )
+    assert list(ctffind.star_loop_rows(columns)) == [
+        ("1000.0", "MotionCorr/job002/Movies/FoilHole_1.mrc")
+    ]
+    columns = ctffind.parse_star_loop(["_rlnDefocusU", "_rlnNotAColumn"], star_doc, 1)
+    with pytest.raises(IndexError):
+        ctffind.star_loop_rows(columns)
@@ -1,5 +1,8 @@
 from __future__ import annotations
 
+import json
+import os
+import pathlib
 import sys
 from pprint import pprint
 from typing import NamedTuple
@@ -7,6 +10,7 @@ from typing import NamedTuple
 import pytest
 
 import relion
+from relion._parser.motioncorrection import MotionCorr, accumulated_motion
 
 
 class Options(NamedTuple):
@@ -116,3 +120,80 @@ def test_invalid_input(invalid_input):
     except TypeError:
         early_motion = False
     assert early_motion is False
+
+
+@pytest.fixture
+def motioncorr_job(tmp_path):
+    """A motion correction job with drift files for two micrographs"""
+    job_dir = tmp_path / "MotionCorr" / "job002"
+    (job_dir / "Movies").mkdir(parents=True)
+    (tmp_path / "Movies").mkdir()
+    rows = []
+    for movie, shifts in (("a", [(0, 0), (3, 4), (3, 4), (6, 8)]), ("b", [(0, 0)])):
+        (tmp_path / f"Movies/{movie}.tiff").touch()
+        rows.append(f"MotionCorr/job002/Movies/{movie}.mrc 1 30.0 12.0 18.0")
+        (job_dir / f"Movies/{movie}.star").write_text(
+            "data_general\n\n"
+            f"_rlnMicrographMovieName Movies/{movie}.tiff\n\n"
+            "data_global_shift\n\nloop_\n_rlnMicrographFrameNumber #1\n"
+            "_rlnMicrographShiftX #2\n_rlnMicrographShiftY #3\n"
+            + "".join(
+                f"{frame} {x} {y}\n" for frame, (x, y) in enumerate(shifts, start=1)
+            )
+        )
+    (job_dir / "corrected_micrographs.star").write_text(
+        "data_micrographs\n\nloop_\n_rlnMicrographName #1\n_rlnOpticsGroup #2\n"
+        "_rlnAccumMotionTotal #3\n_rlnAccumMotionEarly #4\n_rlnAccumMotionLate #5\n"
+        + "\n".join(rows)
+        + "\n"
+    )
+    return tmp_path
+
+
+def test_loading_micrographs_does_not_write_drift_plots(motioncorr_job):
+    micrographs = MotionCorr(motioncorr_job / "MotionCorr")["job002"]
+
+    assert [m.average_motion_per_frame for m in micrographs] == [7.5, 30.0]
+    plot = motioncorr_job / "MotionCorr/job002/Movies/a_drift_plot.json"
+    assert micrographs[0].drift_plot_full_path == str(plot)
+    assert not plot.exists()
+    assert micrographs[0].micrograph_timestamp == pytest.approx(
+        (motioncorr_job / "Movies/a.tiff").stat().st_ctime
+    )
+
+
+def test_drift_is_read_when_asked_for(motioncorr_job):
+    motioncorr = MotionCorr(motioncorr_job / "MotionCorr")
+    drift = motioncorr.drift("job002", motioncorr["job002"][0].micrograph_name)
+
+    assert list(drift.frame) == [1, 2, 3, 4]
+    assert list(drift.deltaX) == [0, 3, 3, 6]
+    assert accumulated_motion(drift.deltaX, drift.deltaY, cutoff_frame=3) == (
+        10.0,
+        5.0,
+        5.0,
+    )
+
+
+@pytest.mark.parametrize("parallel_plot_threshold", [0, 50])
+def test_drift_plots_are_only_written_when_out_of_date(
+    motioncorr_job, parallel_plot_threshold
+):
+    motioncorr = MotionCorr(motioncorr_job / "MotionCorr")
+    motioncorr.parallel_plot_threshold = parallel_plot_threshold
+    plots = [m.drift_plot_full_path for m in motioncorr["job002"]]
+
+    assert motioncorr.write_drift_plots(max_workers=2) == plots
+    assert json.loads(pathlib.Path(plots[0]).read_text())["data"][0]["x"] == [
+        0,
+        3,
+        3,
+        6,
+    ]
+    assert motioncorr.write_drift_plots() == []
+    # a new parser checks the modification times of the existing plots
+    assert MotionCorr(motioncorr_job / "MotionCorr").write_drift_plots() == []
+
+    drift_file = motioncorr_job / "MotionCorr/job002/Movies/b.star"
+    os.utime(drift_file, ns=(0, os.stat(plots[1]).st_mtime_ns + 10**9))
+    assert motioncorr.write_drift_plots() == [plots[1]]
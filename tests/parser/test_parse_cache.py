@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+from unittest import mock
+
+import numpy as np
+import pytest
+
+from relion._parser import parse_cache
+from relion._parser.class2D import Class2DParticleClass
+from relion._parser.ctffind import CTFFind
+from relion._parser.parse_cache import ParseCache
+
+
+@pytest.fixture
+def ctf_job(tmp_path):
+    job_path = tmp_path / "CtfFind" / "job003"
+    job_path.mkdir(parents=True)
+    (job_path / "micrographs_ctf.star").write_text(
+        "data_optics\nloop_\n_rlnOpticsGroup\n_rlnAmplitudeContrast\n1 0.1\n\n"
+        "data_micrographs\nloop_\n_rlnMicrographName\n_rlnCtfImage\n_rlnDefocusU\n"
+        "_rlnDefocusV\n_rlnDefocusAngle\n_rlnCtfAstigmatism\n_rlnCtfMaxResolution\n"
+        "_rlnCtfFigureOfMerit\nMotionCorr/job002/Movies/FoilHole_1.mrc "
+        "CtfFind/job003/Movies/FoilHole_1.ctf:mrc 1000.0 1100.0 45.0 50.0 4.0 0.1\n"
+    )
+    return job_path
+
+
+def _ctffind(tmp_path, cache):
+    ctffind = CTFFind(tmp_path / "CtfFind")
+    ctffind._parse_cache = cache
+    return ctffind
+
+
+def test_results_are_reused_by_a_new_parser(tmp_path, ctf_job):
+    cache = ParseCache(tmp_path / ".relion_cache" / "parse_cache.sqlite")
+    results = _ctffind(tmp_path, cache)["job003"]
+    assert len(results) == 1
+    with mock.patch.object(CTFFind, "_load_job_directory") as load:
+        assert _ctffind(tmp_path, cache)["job003"] == results
+        load.assert_not_called()
+        # a second cache object on the same file also sees the stored results
+        second_cache = ParseCache(tmp_path / ".relion_cache" / "parse_cache.sqlite")
+        assert _ctffind(tmp_path, second_cache)["job003"] == results
+        load.assert_not_called()
+
+
+def test_results_are_not_reused_if_a_file_has_changed(tmp_path, ctf_job):
+    cache = ParseCache(tmp_path / ".relion_cache" / "parse_cache.sqlite")
+    _ctffind(tmp_path, cache)["job003"]
+    star_path = ctf_job / "micrographs_ctf.star"
+    star_path.write_text(star_path.read_text().replace("4.0", "5.0"))
+    os.utime(star_path, ns=(0, 0))
+    results = _ctffind(tmp_path, cache)["job003"]
+    assert results[0].max_resolution == "5.0"
+    with mock.patch.object(CTFFind, "_load_job_directory") as load:
+        assert _ctffind(tmp_path, cache)["job003"] == results
+        load.assert_not_called()
+
+
+def test_results_are_not_reused_if_the_parser_code_has_changed(tmp_path, ctf_job):
+    cache = ParseCache(tmp_path / ".relion_cache" / "parse_cache.sqlite")
+    _ctffind(tmp_path, cache)["job003"]
+    with mock.patch.object(parse_cache, "_code_version", return_value="changed"):
+        with mock.patch.object(CTFFind, "_load_job_directory", return_value=[]):
+            assert _ctffind(tmp_path, cache)["job003"] == []
+
+
+def test_cache_with_an_old_schema_is_recreated(tmp_path, ctf_job):
+    db_path = tmp_path / ".relion_cache" / "parse_cache.sqlite"
+    db_path.parent.mkdir()
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("CREATE TABLE job_results (parser TEXT)")
+    cache = ParseCache(db_path)
+    assert len(_ctffind(tmp_path, cache)["job003"]) == 1
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == (
+            parse_cache.SCHEMA_VERSION
+        )
+        assert conn.execute("SELECT COUNT(*) FROM job_results").fetchone()[0] == 1
+
+
+def test_results_are_stored_as_json():
+    results = [
+        Class2DParticleClass(
+            (1, 20), "Class2D/job008/run_it025_classes.mrcs", 0.5, 1.2, 0.8, 9.4, 1.0, 8
+        ),
+        {"counts": {(1, 2): np.float64(3.5)}},
+    ]
+    stored = json.loads(json.dumps(parse_cache._to_json(results)))
+    assert parse_cache._from_json(stored) == results
+    assert type(parse_cache._from_json(stored)[0]) is Class2DParticleClass
+    with pytest.raises(TypeError):
+        parse_cache._to_json([object()])
+
+
+def test_stored_results_only_rebuild_result_types(tmp_path, ctf_job):
+    db_path = tmp_path / ".relion_cache" / "parse_cache.sqlite"
+    cache = ParseCache(db_path)
+    _ctffind(tmp_path, cache)["job003"]
+    with sqlite3.connect(db_path) as conn:
+        conn.execute(
+            "UPDATE job_results SET results = ?",
+            (json.dumps([{"namedtuple": "os:system", "values": ["true"]}]),),
+        )
+    with mock.patch.object(os, "system") as system:
+        assert len(_ctffind(tmp_path, cache)["job003"]) == 1
+        system.assert_not_called()
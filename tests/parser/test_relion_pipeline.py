@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import pathlib
 import sys
+import time
 
 import pytest
 
@@ -160,3 +161,83 @@ def test_get_pipeline_jobs_from_preprocess_log_file(dials_data):
         dials_data("relion_tutorial_data", pathlib=True) / "pipeline_PREPROCESS.log"
     )
     assert "MotionCorr/job002" in preproc_jobs
+
+
+def _write_synthetic_pipeline(star_path, n_jobs):
+    # every job writes two files and reads the last three files written before it
+    job_types = ["MotionCorr", "CtfFind", "AutoPick", "Extract", "Class2D", "Select"]
+    processes, files, input_edges, output_edges = [], [], [], []
+    for i in range(1, n_jobs + 1):
+        job_type = "Import" if i == 1 else job_types[i % len(job_types)]
+        job = f"{job_type}/job{i:03d}/"
+        processes.append(f"{job} None 0 2")
+        for f in files[-3:]:
+            input_edges.append(f"{f} {job}")
+        for k in range(2):
+            f = f"{job}out{k}.star"
+            files.append(f)
+            output_edges.append(f"{job} {f}")
+    star_path.write_text(
+        "\n".join(
+            [
+                "data_pipeline_general",
+                f"_rlnPipeLineJobCounter {n_jobs + 1}",
+                "data_pipeline_processes",
+                "loop_",
+                "_rlnPipeLineProcessName",
+                "_rlnPipeLineProcessAlias",
+                "_rlnPipeLineProcessType",
+                "_rlnPipeLineProcessStatus",
+                *processes,
+                "data_pipeline_nodes",
+                "loop_",
+                "_rlnPipeLineNodeName",
+                "_rlnPipeLineNodeType",
+                *(f"{f} 0" for f in files),
+                "data_pipeline_input_edges",
+                "loop_",
+                "_rlnPipeLineEdgeFromNode",
+                "_rlnPipeLineEdgeProcess",
+                *input_edges,
+                "data_pipeline_output_edges",
+                "loop_",
+                "_rlnPipeLineEdgeProcess",
+                "_rlnPipeLineEdgeToNode",
+                *output_edges,
+                "",
+            ]
+        )
+    )
+
+
+def test_load_nodes_from_star_with_large_pipelines(tmp_path):
+    for n_jobs in (500, 2000):
+        star_path = tmp_path / f"default_pipeline_{n_jobs}.star"
+        _write_synthetic_pipeline(star_path, n_jobs)
+        pipeline = RelionPipeline("Import/job001")
+        pipeline.load_nodes_from_star(star_path)
+        assert len(pipeline._job_nodes) == n_jobs
+        assert len(pipeline._nodes) == 3 * n_jobs
+        assert pipeline._job_nodes[-1]._in == [
+            pipeline._job_nodes[-3],
+            pipeline._job_nodes[-2],
+        ]
+
+
+@pytest.mark.benchmark
+def test_load_nodes_from_star_scales_linearly_with_pipeline_size(tmp_path):
+    timings = {}
+    for n_jobs in (2500, 10000):
+        star_path = tmp_path / f"default_pipeline_{n_jobs}.star"
+        _write_synthetic_pipeline(star_path, n_jobs)
+        runs = []
+        for _ in range(3):
+            pipeline = RelionPipeline("Import/job001")
+            start = time.perf_counter()
+            pipeline.load_nodes_from_star(star_path)
+            runs.append(time.perf_counter() - start)
+        timings[n_jobs] = min(runs)
+        assert len(pipeline._job_nodes) == n_jobs
+        assert len(pipeline._nodes) == 3 * n_jobs
+    # four times the jobs and edges should take about four times as long, not sixteen
+    assert timings[10000] < 8 * timings[2500], timings
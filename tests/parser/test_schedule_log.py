@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import datetime
+
+from relion._parser.schedule_log import ScheduleLogIndex
+
+
+def _executing(job, time):
+    return f" + {time:%a %b %d %H:%M:%S %Y}\n ---- Executing {job}/\n"
+
+
+def test_schedule_log_index_finds_all_start_times_of_a_job(tmp_path):
+    log_path = tmp_path / "pipeline_PREPROCESS.log"
+    t01 = datetime.datetime(2021, 3, 4, 10, 1, 2)
+    t02 = datetime.datetime(2021, 3, 4, 10, 6, 2)
+    log_path.write_text(
+        _executing("MotionCorr/job002", t01)
+        + _executing("CtfFind/job003", t01)
+        + _executing("MotionCorr/job002", t02)
+    )
+    index = ScheduleLogIndex()
+    assert index.update(log_path)
+    assert index.job_times(log_path, "MotionCorr/job002") == [t01, t02]
+    assert index.job_times(log_path, "CtfFind/job003") == [t01]
+    assert index.job_times(log_path, "Class2D/job004") == []
+    assert index.latest_job_time([log_path], "MotionCorr/job002") == (t02, 2)
+    assert index.latest_job_time([log_path], "Class2D/job004") == (None, 0)
+
+
+def test_schedule_log_index_only_reads_new_lines_on_update(tmp_path):
+    log_path = tmp_path / "pipeline_PREPROCESS.log"
+    t01 = datetime.datetime(2021, 3, 4, 10, 1, 2)
+    t02 = datetime.datetime(2021, 3, 4, 10, 6, 2)
+    first_entry = _executing("MotionCorr/job002", t01)
+    second_entry = _executing("CtfFind/job003", t02)
+    log_path.write_text(first_entry)
+    index = ScheduleLogIndex()
+    index.update(log_path)
+    with open(log_path, "a") as log_file:
+        log_file.write(second_entry[:10])
+    index.update(log_path)
+    assert index._logs[str(log_path)].offset == len(first_entry)
+    assert index.job_times(log_path, "CtfFind/job003") == []
+    with open(log_path, "a") as log_file:
+        log_file.write(second_entry[10:])
+    index.update(log_path)
+    assert index._logs[str(log_path)].offset == len(first_entry + second_entry)
+    assert index.job_times(log_path, "MotionCorr/job002") == [t01]
+    assert index.job_times(log_path, "CtfFind/job003") == [t02]
+
+
+def test_schedule_log_index_rereads_a_truncated_log(tmp_path):
+    log_path = tmp_path / "pipeline_PREPROCESS.log"
+    t01 = datetime.datetime(2021, 3, 4, 10, 1, 2)
+    t02 = datetime.datetime(2021, 3, 4, 10, 6, 2)
+    log_path.write_text(
+        _executing("MotionCorr/job002", t01) + _executing("MotionCorr/job002", t01)
+    )
+    index = ScheduleLogIndex()
+    index.update(log_path)
+    log_path.write_text(_executing("MotionCorr/job002", t02))
+    index.update(log_path)
+    assert index.job_times(log_path, "MotionCorr/job002") == [t02]
+
+
+def test_schedule_log_index_update_on_a_missing_log(tmp_path):
+    index = ScheduleLogIndex()
+    assert not index.update(tmp_path / "pipeline_PREPROCESS.log")
+    assert index.job_times(tmp_path / "pipeline_PREPROCESS.log", "Import/job001") == []
@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import os
+
+import pytest
+
+from relion import file_watcher
+
+backends = [
+    "poll",
+    pytest.param(
+        "inotify",
+        marks=pytest.mark.skipif(
+            not file_watcher.InotifyWatcher.available(),
+            reason="inotify is not available",
+        ),
+    ),
+]
+
+
+def touch(path, mtime):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.touch()
+    os.utime(path, (mtime, mtime))
+
+
+@pytest.mark.parametrize("backend", backends)
+def test_watcher_follows_added_and_removed_files(tmp_path, backend):
+    touch(tmp_path / "GridSquare_1/Data/movie_1.tiff", 100)
+    touch(tmp_path / "GridSquare_1/Data/movie_1.xml", 400)
+    touch(tmp_path / "GridSquare_1/gain.tiff", 500)
+    watcher = file_watcher.watch_directory(
+        tmp_path, pattern="**/Data/*", suffix=".tiff", backend=backend
+    )
+    watcher.update()
+    assert watcher.file_count == 1
+    assert watcher.latest_mtime == 100
+
+    touch(tmp_path / "GridSquare_1/Data/movie_2.tiff", 300)
+    touch(tmp_path / "GridSquare_2/Data/movie_3.tiff", 200)
+    watcher.update()
+    assert sorted(watcher.files) == [
+        str(tmp_path / "GridSquare_1/Data/movie_1.tiff"),
+        str(tmp_path / "GridSquare_1/Data/movie_2.tiff"),
+        str(tmp_path / "GridSquare_2/Data/movie_3.tiff"),
+    ]
+    assert watcher.latest_mtime == 300
+
+    (tmp_path / "GridSquare_1/Data/movie_2.tiff").unlink()
+    watcher.update()
+    assert watcher.file_count == 2
+    assert watcher.latest_mtime == 200
+    watcher.close()
+
+
+def test_polling_only_lists_changed_directories(tmp_path, monkeypatch):
+    for square in range(3):
+        touch(tmp_path / f"GridSquare_{square}/Data/movie.tiff", 100)
+    watcher = file_watcher.PollingWatcher(tmp_path)
+    watcher.update()
+    assert watcher.file_count == 3
+
+    listed = []
+    scandir = os.scandir
+
+    def recording_scandir(path):
+        listed.append(path)
+        return scandir(path)
+
+    monkeypatch.setattr(file_watcher.os, "scandir", recording_scandir)
+    watcher.update()
+    assert listed == []
+
+    touch(tmp_path / "GridSquare_1/Data/movie_2.tiff", 200)
+    # directory times can be too coarse to see a change made straight away
+    os.utime(tmp_path / "GridSquare_1/Data", (1000, 1000))
+    watcher.update()
+    assert listed == [str(tmp_path / "GridSquare_1/Data")]
+    assert watcher.file_count == 4
+    assert watcher.latest_mtime == 200
+
+
+def test_patterns_match_as_for_glob(tmp_path):
+    for name in ("a.tiff", "Movies/b.tiff", "Movies/Data/c.tiff", "Other/d.tiff"):
+        touch(tmp_path / name, 100)
+    for pattern in ("**/*", "*", "Movies/*", "Movies/**/*.tiff", "*/Data/*"):
+        watcher = file_watcher.PollingWatcher(tmp_path, pattern=pattern)
+        watcher.update()
+        assert sorted(watcher.files) == sorted(
+            str(p) for p in tmp_path.glob(pattern) if p.is_file()
+        )
+
+
+def test_watch_directory_polls_by_default(tmp_path):
+    watcher = file_watcher.watch_directory(tmp_path)
+    assert type(watcher) is file_watcher.PollingWatcher
+    watcher.close()
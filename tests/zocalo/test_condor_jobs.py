@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import subprocess
+import threading
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+import zocalo.configuration
+from workflows.transport.offline_transport import OfflineTransport
+
+from relion.zocalo import condor_jobs
+
+
+class FakeSchedd:
+    """Answers the parts of the HTCondor scheduler interface used by the services"""
+
+    def __init__(self):
+        self.jobs = {}
+        self.queries = []
+        self.removed = []
+
+    def submit(self, description, itemdata):
+        cluster_id = 100 + len(self.jobs)
+        self.jobs[cluster_id] = {"status": 1, "description": description}
+        self.itemdata = list(itemdata)
+        return SimpleNamespace(cluster=lambda: cluster_id)
+
+    def query(self, constraint, projection):
+        self.queries.append(constraint)
+        return [
+            {"ClusterId": cluster_id, "JobStatus": job["status"]}
+            for cluster_id, job in self.jobs.items()
+            if f"ClusterId == {cluster_id}" in constraint.split(" || ")
+            and not job.get("left_queue")
+        ]
+
+    def act(self, action, constraint):
+        self.removed.append(constraint)
+
+
+@pytest.fixture
+def schedd(monkeypatch):
+    if condor_jobs.htcondor is None:
+        monkeypatch.setattr(
+            condor_jobs,
+            "htcondor",
+            SimpleNamespace(JobAction=SimpleNamespace(Remove="Remove")),
+        )
+    return FakeSchedd()
+
+
+def test_condor_job_tracker_polls_all_clusters_together(schedd):
+    finished = []
+    tracker = condor_jobs.CondorJobTracker(on_finished=finished.append, schedd=schedd)
+    cluster_ids = [tracker.submit("description", [{}], data=i) for i in range(4)]
+    assert tracker.outstanding == cluster_ids
+
+    assert tracker.poll() == []
+    schedd.jobs[cluster_ids[0]]["left_queue"] = True
+    schedd.jobs[cluster_ids[1]]["status"] = 5
+    schedd.jobs[cluster_ids[3]]["status"] = 4
+    schedd.queries.clear()
+    expected = [
+        condor_jobs.FinishedCluster(cluster_ids[0], "COMPLETED", 0),
+        condor_jobs.FinishedCluster(cluster_ids[1], "HELD", 1),
+        condor_jobs.FinishedCluster(cluster_ids[3], "COMPLETED", 3),
+    ]
+    assert tracker.poll() == expected
+    assert finished == expected
+    assert schedd.queries == [
+        " || ".join(f"ClusterId == {cluster_id}" for cluster_id in cluster_ids)
+    ]
+    assert schedd.removed == [f"ClusterId == {cluster_ids[1]}"]
+    assert tracker.outstanding == [cluster_ids[2]]
+
+
+def test_condor_job_tracker_removes_clusters_after_timeout(schedd):
+    tracker = condor_jobs.CondorJobTracker(
+        on_finished=lambda cluster: None, schedd=schedd, job_timeout=0
+    )
+    cluster_id = tracker.submit("description", [{}])
+    assert tracker.poll() == [condor_jobs.FinishedCluster(cluster_id, "TIMEOUT", None)]
+    assert schedd.removed == [f"ClusterId == {cluster_id}"]
+
+
+def test_condor_job_tracker_background_polling(schedd):
+    finished = threading.Event()
+    tracker = condor_jobs.CondorJobTracker(
+        on_finished=lambda cluster: finished.set(), schedd=schedd, poll_interval=0.01
+    )
+    tracker.start()
+    try:
+        cluster_id = tracker.submit("description", [{}])
+        schedd.jobs[cluster_id]["left_queue"] = True
+        assert finished.wait(timeout=5)
+    finally:
+        tracker.stop()
+
+
+def test_denoise_does_not_wait_for_jobs(schedd, tmp_path, mocker):
+    """Several volumes can be submitted before any of the jobs finish"""
+    pytest.importorskip("htcondor")
+    from relion.zocalo import denoise
+
+    mock_zc = mock.MagicMock(zocalo.configuration.Configuration)
+    mock_zc.storage = {"zocalo.recipe_directory": tmp_path}
+    transport = OfflineTransport()
+    mocker.spy(transport, "send")
+    mocker.spy(transport, "ack")
+    mocker.spy(transport, "nack")
+
+    service = denoise.Denoise(environment={"config": mock_zc})
+    service.transport = transport
+    service.start()
+    service.condor_jobs._schedd = schedd
+
+    for tomogram, message_id in (("sample1", 1), ("sample2", 2)):
+        service.denoise(
+            None,
+            header={"message-id": message_id, "subscription": mock.sentinel},
+            message={
+                "parameters": {"volume": f"{tmp_path}/{tomogram}.mrc"},
+                "content": "dummy",
+            },
+        )
+    assert list(schedd.jobs) == [100, 101]
+    assert transport.ack.call_count == 0
+
+    # The second job finishes first, and its message is finished on its own
+    schedd.jobs[101]["left_queue"] = True
+    schedd.jobs[100]["status"] = 5
+    service.condor_jobs.on_finished = mock.Mock()
+    finished = service.condor_jobs.poll()
+    for cluster in finished:
+        service.condor_job_finished(None, cluster)
+
+    transport.send.assert_any_call(
+        "images",
+        {
+            "image_command": "mrc_central_slice",
+            "file": f"{tmp_path}/sample2.denoised.mrc",
+        },
+    )
+    assert [c.args[0]["message-id"] for c in transport.ack.call_args_list] == [2]
+    assert [c.args[0]["message-id"] for c in transport.nack.call_args_list] == [1]
+
+
+def test_tomo_align_iris_finishes_each_message_of_a_tilt_series(schedd, tmp_path):
+    """Messages for the same tilt series are each finished by their own job"""
+    pytest.importorskip("htcondor")
+    from relion.zocalo import tomo_align_iris
+
+    mock_zc = mock.MagicMock(zocalo.configuration.Configuration)
+    mock_zc.storage = {"zocalo.recipe_directory": tmp_path}
+    transport = OfflineTransport()
+    transport.send = mock.Mock()
+    transport.ack = mock.Mock()
+    transport.nack = mock.Mock()
+
+    service = tomo_align_iris.TomoAlignIris(environment={"config": mock_zc})
+    service.transport = transport
+    service.start()
+    service.condor_jobs._schedd = schedd
+    service.newstack = mock.Mock(
+        return_value=subprocess.CompletedProcess(args="", returncode=0)
+    )
+    (tmp_path / "stack.aln").write_text("# header\n 0 85 1.0 1 2 0 0 0 0 10\n")
+    (tmp_path / "stack_1_1.0.mrc").touch()
+    (tmp_path / "stack_iris_out").write_text("Rot center Z 100.0 200.0 3.1\n")
+
+    for message_id in (1, 2):
+        service.tomo_align(
+            None,
+            header={"message-id": message_id, "subscription": mock.sentinel},
+            message={
+                "parameters": {
+                    "stack_file": f"{tmp_path}/stack.st",
+                    "input_file_list": str([[f"{tmp_path}/stack_1_1.0.mrc", "1.0"]]),
+                    "pix_size": 1e-10,
+                    "out_imod": 0,
+                },
+                "content": "dummy",
+            },
+        )
+    assert sorted(service.submitted_jobs) == [100, 101]
+
+    schedd.jobs[100]["left_queue"] = True
+    schedd.jobs[101]["left_queue"] = True
+    service.condor_jobs.on_finished = mock.Mock()
+    for cluster in service.condor_jobs.poll():
+        service.condor_job_finished(None, cluster)
+    assert service.submitted_jobs == {}
+    assert sorted(c.args[0]["message-id"] for c in transport.ack.call_args_list) == [
+        1,
+        2,
+    ]
+    transport.nack.assert_not_called()
+
+    # A job which is no longer followed is logged without finishing anything
+    service.condor_job_finished(
+        None, condor_jobs.FinishedCluster(cluster_id=100, state="COMPLETED", data=None)
+    )
+    assert transport.ack.call_count == 2
+    service.condor_jobs.stop()
@@ -0,0 +1,240 @@
+from __future__ import annotations
+
+import subprocess
+from pathlib import Path
+from unittest import mock
+
+import pytest
+import zocalo.configuration
+from workflows.transport.offline_transport import OfflineTransport
+
+from relion.zocalo import cryolo_batch
+
+
+@pytest.fixture
+def mock_zocalo_configuration(tmp_path):
+    mock_zc = mock.MagicMock(zocalo.configuration.Configuration)
+    mock_zc.storage = {
+        "zocalo.recipe_directory": tmp_path,
+    }
+    return mock_zc
+
+
+@pytest.fixture
+def mock_environment(mock_zocalo_configuration):
+    return {"config": mock_zocalo_configuration}
+
+
+@pytest.fixture
+def offline_transport(mocker):
+    transport = OfflineTransport()
+    mocker.spy(transport, "send")
+    mocker.spy(transport, "ack")
+    return transport
+
+
+class FakePredictor(cryolo_batch.CryoloPredictor):
+    """Writes a pick per micrograph number instead of running crYOLO"""
+
+    def __init__(self):
+        self.batches = []
+
+    def predict(self, cryolo_params, input_paths, job_dir):
+        self.batches.append(list(input_paths))
+        for input_path in input_paths:
+            number_of_picks = int(Path(input_path).stem.split("_")[-1])
+            (job_dir / "STAR").mkdir(exist_ok=True)
+            with open(job_dir / f"STAR/{Path(input_path).stem}.star", "w") as f:
+                f.write("data_\n\nloop_\n_rlnCoordinateX\n_rlnCoordinateY\n")
+                for pick in range(number_of_picks):
+                    f.write(f"{pick}.0 {pick}.5\n")
+        return subprocess.CompletedProcess(
+            args=[], returncode=0, stdout=b"stdout", stderr=b"stderr"
+        )
+
+
+def cryolo_message(tmp_path, micrograph, job="job007", weights="sample_weights"):
+    return {
+        "parameters": {
+            "pixel_size": 0.1,
+            "input_path": f"MotionCorr/job002/{micrograph}.mrc",
+            "output_path": str(tmp_path / f"AutoPick/{job}/STAR/{micrograph}.star"),
+            "cryolo_config_file": str(tmp_path / "config.json"),
+            "cryolo_model_weights": weights,
+            "cryolo_threshold": 0.15,
+            "mc_uuid": 0,
+            "picker_uuid": 0,
+            "relion_options": {},
+        },
+        "content": "dummy",
+    }
+
+
+def start_service(mock_environment, offline_transport, batch_size, batch_wait=60):
+    service = cryolo_batch.CrYOLOBatch(environment=mock_environment)
+    service.transport = offline_transport
+    service.predictor = FakePredictor()
+    service.batch_size = batch_size
+    service.batch_wait = batch_wait
+    service.start()
+    return service
+
+
+def test_cryolo_batch_runs_full_batches(mock_environment, offline_transport, tmp_path):
+    """Micrographs are only picked once enough have arrived for a batch"""
+    service = start_service(mock_environment, offline_transport, batch_size=2)
+    header = {"message-id": mock.sentinel, "subscription": mock.sentinel}
+
+    service.cryolo(None, header=header, message=cryolo_message(tmp_path, "mic_3"))
+    assert service.predictor.batches == []
+    assert offline_transport.send.call_count == 0
+
+    service.cryolo(None, header=header, message=cryolo_message(tmp_path, "mic_5"))
+    assert service.predictor.batches == [
+        ["MotionCorr/job002/mic_3.mrc", "MotionCorr/job002/mic_5.mrc"]
+    ]
+    assert offline_transport.ack.call_count == 2
+
+    # Each micrograph gets its own results, with the command for that micrograph
+    for micrograph, number_of_picks in (("mic_3", 3), ("mic_5", 5)):
+        offline_transport.send.assert_any_call(
+            destination="ispyb_connector",
+            message={
+                "parameters": {
+                    "particle_picking_template": "sample_weights",
+                    "number_of_particles": number_of_picks,
+                    "summary_image_full_path": str(
+                        tmp_path / f"AutoPick/job007/STAR/{micrograph}.jpeg"
+                    ),
+                    "ispyb_command": "buffer",
+                    "buffer_lookup": {"motion_correction_id": 0},
+                    "buffer_command": {"ispyb_command": "insert_particle_picker"},
+                    "buffer_store": 0,
+                },
+                "content": {"dummy": "dummy"},
+            },
+        )
+        node_creator_calls = [
+            call.kwargs["message"]["parameters"]
+            for call in offline_transport.send.call_args_list
+            if call.kwargs["destination"] == "node_creator"
+            and call.kwargs["message"]["parameters"]["input_file"]
+            == f"MotionCorr/job002/{micrograph}.mrc"
+        ]
+        assert len(node_creator_calls) == 1
+        assert node_creator_calls[0]["success"]
+        assert node_creator_calls[0]["command"] == (
+            f"cryolo_predict.py --conf {tmp_path}/config.json "
+            f"-o {tmp_path}/AutoPick/job007 --otf "
+            f"-i MotionCorr/job002/{micrograph}.mrc "
+            f"--weights sample_weights --threshold 0.15"
+        )
+
+
+def test_cryolo_batch_flushes_after_waiting(
+    mock_environment, offline_transport, tmp_path
+):
+    """A partial batch is run once its first micrograph has waited long enough"""
+    service = start_service(
+        mock_environment, offline_transport, batch_size=4, batch_wait=10
+    )
+    header = {"message-id": mock.sentinel, "subscription": mock.sentinel}
+
+    with mock.patch("relion.zocalo.cryolo_batch.time.time", return_value=100):
+        service.cryolo(None, header=header, message=cryolo_message(tmp_path, "mic_1"))
+    with mock.patch("relion.zocalo.cryolo_batch.time.time", return_value=105):
+        service.cryolo(None, header=header, message=cryolo_message(tmp_path, "mic_2"))
+        service.flush_expired()
+    assert service.predictor.batches == []
+
+    with mock.patch("relion.zocalo.cryolo_batch.time.time", return_value=110):
+        service.flush_expired()
+    assert service.predictor.batches == [
+        ["MotionCorr/job002/mic_1.mrc", "MotionCorr/job002/mic_2.mrc"]
+    ]
+    assert offline_transport.ack.call_count == 2
+
+    service.flush_expired()
+    assert len(service.predictor.batches) == 1
+
+
+def test_cryolo_batch_groups_by_job_and_model(
+    mock_environment, offline_transport, tmp_path
+):
+    """Micrographs for different jobs or models are never picked together"""
+    service = start_service(mock_environment, offline_transport, batch_size=2)
+    header = {"message-id": mock.sentinel, "subscription": mock.sentinel}
+
+    service.cryolo(None, header=header, message=cryolo_message(tmp_path, "mic_1"))
+    service.cryolo(
+        None, header=header, message=cryolo_message(tmp_path, "mic_2", job="job008")
+    )
+    service.cryolo(
+        None,
+        header=header,
+        message=cryolo_message(tmp_path, "mic_3", weights="other_weights"),
+    )
+    assert service.predictor.batches == []
+
+    service.cryolo(None, header=header, message=cryolo_message(tmp_path, "mic_4"))
+    assert service.predictor.batches == [
+        ["MotionCorr/job002/mic_1.mrc", "MotionCorr/job002/mic_4.mrc"]
+    ]
+
+    service.flush_all()
+    assert sorted(service.predictor.batches[1:]) == [
+        ["MotionCorr/job002/mic_2.mrc"],
+        ["MotionCorr/job002/mic_3.mrc"],
+    ]
+    assert offline_transport.ack.call_count == 4
+
+
+def test_cryolo_predictor_runs_one_command_per_batch(tmp_path):
+    """The default predictor picks all micrographs of a batch in one cryolo run"""
+    cryolo_params = cryolo_batch.CryoloParameters(
+        **cryolo_message(tmp_path, "mic_1")["parameters"]
+    )
+    with mock.patch("relion.zocalo.cryolo_batch.subprocess.run") as mock_subprocess:
+        cryolo_batch.CryoloPredictor().predict(
+            cryolo_params, ["mic_1.mrc", "mic_2.mrc"], tmp_path
+        )
+    mock_subprocess.assert_called_once_with(
+        [
+            "cryolo_predict.py",
+            "--conf",
+            str(tmp_path / "config.json"),
+            "-o",
+            str(tmp_path),
+            "--otf",
+            "-i",
+            "mic_1.mrc",
+            "mic_2.mrc",
+            "--weights",
+            "sample_weights",
+            "--threshold",
+            "0.15",
+        ],
+        cwd=tmp_path,
+        capture_output=True,
+    )
+
+
+def test_cryolo_batch_rejects_messages_of_a_failed_batch(
+    mock_environment, offline_transport, tmp_path, mocker
+):
+    """All the messages of a batch are rejected if the predictor fails"""
+    service = start_service(mock_environment, offline_transport, batch_size=2)
+    mocker.spy(offline_transport, "nack")
+    service.predictor.predict = mock.Mock(side_effect=RuntimeError("no GPU"))
+
+    for message_id, micrograph in ((1, "mic_3"), (2, "mic_5")):
+        service.cryolo(
+            None,
+            header={"message-id": message_id, "subscription": mock.sentinel},
+            message=cryolo_message(tmp_path, micrograph),
+        )
+    assert offline_transport.ack.call_count == 0
+    assert [
+        call.args[0]["message-id"] for call in offline_transport.nack.call_args_list
+    ] == [1, 2]
+    assert service._pending == {}
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import sys
+import time
 from unittest import mock
 
 import numpy as np
@@ -159,3 +160,170 @@ def test_extract_service(mock_mrcfile, mock_environment, offline_transport, tmp_
     assert list(particles_data.find_loop("_rlnCtfBfactor")) == ["0.0"]
     assert list(particles_data.find_loop("_rlnCtfScalefactor")) == ["1.0"]
     assert list(particles_data.find_loop("_rlnPhaseShift")) == ["0.0"]
+
+
+def _extract_per_particle(
+    image,
+    particles_x,
+    particles_y,
+    boxsize,
+    small_boxsize,
+    bg_radius,
+    downscale,
+    invert_contrast,
+    norm,
+):
+    """Extraction one particle at a time, as the service used to do it"""
+    image_size = np.shape(image)
+    output_mrc_stack = []
+    for particle in range(len(particles_x)):
+        pixel_location_x = round(float(particles_x[particle]))
+        pixel_location_y = round(float(particles_y[particle]))
+        extract_width = round(boxsize / 2)
+
+        x_left = max(pixel_location_x - extract_width, 0)
+        x_left_pad = x_left - (pixel_location_x - extract_width)
+        x_right = min(pixel_location_x + extract_width, image_size[1])
+        x_right_pad = pixel_location_x + extract_width - x_right
+        y_top = max(pixel_location_y - extract_width, 0)
+        y_top_pad = y_top - (pixel_location_y - extract_width)
+        y_bot = min(pixel_location_y + extract_width, image_size[0])
+        y_bot_pad = pixel_location_y + extract_width - y_bot
+        particle_subimage = np.pad(
+            image[y_top:y_bot, x_left:x_right],
+            ((y_bot_pad, y_top_pad), (x_left_pad, x_right_pad)),
+            mode="edge",
+        )
+        if invert_contrast:
+            particle_subimage = -1 * particle_subimage
+        if downscale:
+            subimage_ft = np.fft.fftshift(np.fft.fft2(particle_subimage))
+            delta = subimage_ft.shape[0] - small_boxsize
+            particle_subimage = np.real(
+                np.fft.ifft2(
+                    np.fft.ifftshift(
+                        subimage_ft[
+                            delta // 2 : subimage_ft.shape[0] - delta // 2,
+                            delta // 2 : subimage_ft.shape[1] - delta // 2,
+                        ]
+                    )
+                )
+            )
+            extract_width = round(small_boxsize / 2)
+
+        grid_indexes = np.meshgrid(
+            np.arange(2 * extract_width), np.arange(2 * extract_width)
+        )
+        distance_from_centre = np.sqrt(
+            (grid_indexes[0] - extract_width + 0.5) ** 2
+            + (grid_indexes[1] - extract_width + 0.5) ** 2
+        )
+        bg_region = distance_from_centre > bg_radius
+        positions_matrix = np.hstack(
+            (
+                np.ones((np.count_nonzero(bg_region), 1)),
+                np.reshape(grid_indexes[0][bg_region], (-1, 1)),
+                np.reshape(grid_indexes[1][bg_region], (-1, 1)),
+            )
+        )
+        theta = np.dot(
+            np.dot(
+                np.linalg.inv(np.dot(positions_matrix.transpose(), positions_matrix)),
+                positions_matrix.transpose(),
+            ),
+            particle_subimage[bg_region],
+        )
+        positions_matrix = np.hstack(
+            (
+                np.ones((4 * extract_width**2, 1)),
+                np.reshape(grid_indexes[0], (-1, 1)),
+                np.reshape(grid_indexes[1], (-1, 1)),
+            )
+        )
+        particle_subimage -= np.reshape(
+            np.dot(positions_matrix, theta), (2 * extract_width, 2 * extract_width)
+        )
+        if norm:
+            bg_mean = np.mean(particle_subimage[bg_region])
+            bg_std = np.std(particle_subimage[bg_region])
+            particle_subimage = (particle_subimage - bg_mean) / bg_std
+
+        if len(output_mrc_stack):
+            output_mrc_stack = np.append(output_mrc_stack, [particle_subimage], axis=0)
+        else:
+            output_mrc_stack = np.array([particle_subimage], dtype=np.float32)
+    return np.array(output_mrc_stack, dtype=np.float32)
+
+
+@pytest.mark.parametrize("downscale", [True, False])
+@pytest.mark.parametrize("invert_contrast", [True, False])
+@pytest.mark.parametrize("norm", [True, False])
+def test_extract_particle_stack_matches_per_particle_extraction(
+    downscale, invert_contrast, norm
+):
+    """Batched extraction gives exactly the same images as one at a time"""
+    rng = np.random.default_rng(seed=0)
+    image = rng.normal(size=(300, 350)).astype(np.float32)
+    # include particles at each of the edges, which need padding
+    particles_x = [str(x) for x in rng.uniform(0, 350, 50)] + ["2.0", "348.7"]
+    particles_y = [str(y) for y in rng.uniform(0, 300, 50)] + ["297.5", "1.2"]
+    options = {
+        "boxsize": 64,
+        "small_boxsize": 32,
+        "bg_radius": 12 if downscale else 24,
+        "downscale": downscale,
+        "invert_contrast": invert_contrast,
+        "norm": norm,
+    }
+
+    stack = extract.extract_particle_stack(
+        image, particles_x, particles_y, chunk_size=7, **options
+    )
+    expected = _extract_per_particle(image, particles_x, particles_y, **options)
+
+    assert stack.dtype == np.float32
+    assert stack.shape == expected.shape
+    assert stack.tobytes() == expected.tobytes()
+
+
+def _large_micrograph():
+    rng = np.random.default_rng(seed=1)
+    image = rng.normal(size=(2048, 2048)).astype(np.float32)
+    particles_x = rng.uniform(0, 2048, 500)
+    particles_y = rng.uniform(0, 2048, 500)
+    options = {
+        "boxsize": 128,
+        "small_boxsize": 64,
+        "bg_radius": 24,
+        "downscale": True,
+        "invert_contrast": True,
+        "norm": True,
+    }
+    return image, particles_x, particles_y, options
+
+
+def test_extract_particle_stack_large_micrograph():
+    """Batched extraction matches per-particle extraction for a full micrograph"""
+    image, particles_x, particles_y, options = _large_micrograph()
+    stack = extract.extract_particle_stack(image, particles_x, particles_y, **options)
+    expected = _extract_per_particle(image, particles_x, particles_y, **options)
+    assert np.array_equal(stack, expected)
+
+
+@pytest.mark.benchmark
+def test_extract_particle_stack_benchmark():
+    """Batched extraction is faster than per-particle extraction, and identical"""
+    image, particles_x, particles_y, options = _large_micrograph()
+
+    def best_time(extract_stack):
+        runs = []
+        for _ in range(3):
+            start_time = time.perf_counter()
+            stack = extract_stack(image, particles_x, particles_y, **options)
+            runs.append(time.perf_counter() - start_time)
+        return stack, min(runs)
+
+    stack, batch_time = best_time(extract.extract_particle_stack)
+    expected, per_particle_time = best_time(_extract_per_particle)
+    assert stack.tobytes() == expected.tobytes()
+    assert batch_time < per_particle_time, (batch_time, per_particle_time)
@@ -3,15 +3,21 @@ from __future__ import annotations
 import os
 import pathlib
 import sys
+import time
 from typing import Any, Dict, NamedTuple, Protocol
+from unittest import mock
 
 import mrcfile
 import numpy
+import PIL.Image
 import pytest
+from PIL import ImageDraw, ImageEnhance, ImageFilter
 
 import relion
+from relion.zocalo import images_service_plugin
 from relion.zocalo.images_service_plugin import (
     mrc_central_slice,
+    mrc_to_apng,
     mrc_to_jpeg,
     picked_particles,
 )
@@ -57,6 +63,17 @@ def plugin_params_central(jpeg_path):
     return FunctionParameter(rw=None, parameters=params, message={})
 
 
+def plugin_params_apng(mrc_path):
+    def params(key):
+        p = {
+            "parameters": {"images_command": "mrc_to_apng"},
+            "file": mrc_path,
+        }
+        return p.get(key)
+
+    return FunctionParameter(rw=None, parameters=params, message={})
+
+
 def plugin_params_parpick(jpeg_path, outfile):
     def params(key, default=None):
         p = {
@@ -142,6 +159,33 @@ def test_picked_particles_returns_None_when_basefile_does_not_exist(tmp_path):
     assert not picked_particles(plugin_params_parpick(base_mrc_path, out_jpeg_path))
 
 
+@pytest.mark.parametrize("colour_key", ["confidences", "outline_colours"])
+def test_picked_particles_uses_default_colour_for_too_few_colours(tmp_path, colour_key):
+    base_mrc_path = str(tmp_path / "base.mrc")
+    out_jpeg_path = str(tmp_path / "processed.jpeg")
+    with mrcfile.new(base_mrc_path) as mrc:
+        mrc.set_data(numpy.zeros((64, 64), dtype=numpy.float32))
+    plugin_params = plugin_params_parpick(base_mrc_path, out_jpeg_path)
+    parameters = plugin_params.parameters
+    colours = {"confidences": [1.0], "outline_colours": ["#07a4f5"]}
+
+    def params(key, default=None):
+        return colours[key] if key == colour_key else parameters(key, default)
+
+    with mock.patch.object(
+        images_service_plugin,
+        "particle_overlay",
+        wraps=images_service_plugin.particle_overlay,
+    ) as particle_overlay:
+        assert (
+            picked_particles(plugin_params._replace(parameters=params)) == out_jpeg_path
+        )
+    assert (
+        particle_overlay.call_args.kwargs["colours"]
+        == images_service_plugin.default_outline_colour
+    )
+
+
 def test_central_slice_fails_with_2d(proj):
     micrograph_path = proj.motioncorrection["job002"][0].micrograph_name
     assert not mrc_central_slice(plugin_params_central(pathlib.Path(micrograph_path)))
@@ -155,3 +199,155 @@ def test_central_slice_works_with_3d(tmp_path):
     mrc.close()
 
     assert mrc_central_slice(plugin_params_central(pathlib.Path(tmp_mrc_path)))
+
+
+def test_micrograph_is_decoded_once_for_all_images(tmp_path):
+    mrc_path = tmp_path / "micrograph.mrc"
+    jpeg_path = mrc_path.with_suffix(".jpeg")
+    overlay_path = str(tmp_path / "picked.jpeg")
+    with mrcfile.new(mrc_path) as mrc:
+        mrc.set_data(numpy.arange(64, dtype=numpy.float32).reshape(8, 8))
+
+    with mock.patch.object(
+        images_service_plugin,
+        "_scale_to_uint8",
+        wraps=images_service_plugin._scale_to_uint8,
+    ) as scale:
+        assert mrc_to_jpeg(plugin_params(jpeg_path)) == jpeg_path
+        assert (
+            picked_particles(plugin_params_parpick(str(jpeg_path), overlay_path))
+            == overlay_path
+        )
+        # a repeated request reuses the earlier image
+        jpeg_path.touch()
+        assert mrc_to_jpeg(plugin_params(jpeg_path)) == jpeg_path
+    assert scale.call_count == 1
+
+    # images are made again if the micrograph changes
+    with mrcfile.open(mrc_path, mode="r+") as mrc:
+        mrc.set_data(numpy.arange(64, 0, -1, dtype=numpy.float32).reshape(8, 8))
+    with mock.patch.object(
+        images_service_plugin,
+        "_scale_to_uint8",
+        wraps=images_service_plugin._scale_to_uint8,
+    ) as scale:
+        assert mrc_to_jpeg(plugin_params(jpeg_path)) == jpeg_path
+    assert scale.call_count == 1
+
+
+def test_missing_outputs_are_made_again(tmp_path):
+    mrc_path = tmp_path / "tomogram.mrc"
+    with mrcfile.new(mrc_path) as mrc:
+        mrc.set_data(numpy.arange(60, dtype=numpy.int16).reshape(3, 4, 5))
+
+    outfile = mrc_central_slice(plugin_params_central(mrc_path))
+    assert outfile == str(tmp_path / "tomogram_thumbnail.jpeg")
+    pathlib.Path(outfile).unlink()
+    assert mrc_central_slice(plugin_params_central(mrc_path)) == outfile
+    assert pathlib.Path(outfile).is_file()
+
+
+def test_apng_frames_are_scaled_together_and_written_in_order(tmp_path):
+    mrc_path = tmp_path / "tomogram.mrc"
+    volume = numpy.arange(5 * 40 * 60, dtype=numpy.float32).reshape(5, 40, 60)
+    with mrcfile.new(mrc_path) as mrc:
+        mrc.set_data(volume)
+
+    outfile = mrc_to_apng(plugin_params_apng(mrc_path))
+    assert outfile == str(tmp_path / "tomogram_movie.png")
+    assert not pathlib.Path(f"{outfile}.part").exists()
+
+    limits = images_service_plugin._intensity_limits(volume)
+    with PIL.Image.open(outfile) as im:
+        assert im.format == "PNG"
+        assert im.n_frames == 5
+        for index, frame in enumerate(volume):
+            im.seek(index)
+            assert im.size == (60, 40)
+            numpy.testing.assert_array_equal(
+                numpy.asarray(im.convert("L")),
+                images_service_plugin._scale_to_uint8(frame, limits=limits),
+            )
+
+
+def test_large_slices_are_downsampled_before_scaling(tmp_path):
+    mrc_path = tmp_path / "tomogram.mrc"
+    with mrcfile.new(mrc_path) as mrc:
+        mrc.set_data(
+            numpy.arange(3 * 1100 * 1030, dtype=numpy.int16).reshape(3, 1100, 1030)
+        )
+
+    with mock.patch.object(
+        images_service_plugin,
+        "_scale_to_uint8",
+        wraps=images_service_plugin._scale_to_uint8,
+    ) as scale:
+        outfile = mrc_central_slice(plugin_params_central(mrc_path))
+    assert scale.call_args.args[0].shape == (550, 515)
+    with PIL.Image.open(outfile) as im:
+        assert im.size == (479, 512)
+
+
+def _overlay_in_colour(image, coords, radius, contrast_factor, colours):
+    """Make a particle overlay by filtering each colour channel"""
+    with PIL.Image.fromarray(image).convert(mode="RGB") as bim:
+        enhanced = ImageEnhance.Contrast(bim).enhance(contrast_factor)
+        fim = enhanced.filter(ImageFilter.BLUR)
+        dim = ImageDraw.Draw(fim)
+        for (x, y), colour in zip(coords, colours):
+            dim.ellipse(
+                [(x - radius, y - radius), (x + radius, y + radius)],
+                width=8,
+                outline=colour,
+            )
+        return numpy.asarray(fim)
+
+
+def test_confidence_colours():
+    assert images_service_plugin.confidence_colours(
+        [0, 0.5, 1, 2], low=(0, 0, 0), high="#ff8000"
+    ) == [(0, 0, 0), (128, 64, 0), (255, 128, 0), (255, 128, 0)]
+
+
+def _random_particles(particle_count):
+    rng = numpy.random.default_rng(seed=1)
+    image = rng.integers(0, 255, size=(2048, 2048), dtype=numpy.uint8)
+    coords = rng.uniform(-20, 2068, size=(particle_count, 2)).tolist()
+    colours = images_service_plugin.confidence_colours(
+        rng.uniform(0, 1, particle_count)
+    )
+    return image, coords, colours
+
+
+@pytest.mark.parametrize("particle_count", [100, 1000, 10000])
+def test_particle_overlay_matches_filtering_in_colour(particle_count):
+    """Filtering in greyscale gives the same overlay as filtering in colour"""
+    image, coords, colours = _random_particles(particle_count)
+    overlay = images_service_plugin.particle_overlay(
+        image, coords, 24, contrast_factor=6, colours=colours
+    )
+    expected = _overlay_in_colour(image, coords, 24, 6, colours)
+    assert numpy.array_equal(numpy.asarray(overlay), expected)
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("particle_count", [100, 1000, 10000])
+def test_particle_overlay_benchmark(particle_count):
+    """Filtering in greyscale is faster than filtering in colour"""
+    image, coords, colours = _random_particles(particle_count)
+
+    def best_time(draw_overlay):
+        runs = []
+        for _ in range(3):
+            start_time = time.perf_counter()
+            draw_overlay()
+            runs.append(time.perf_counter() - start_time)
+        return min(runs)
+
+    greyscale_time = best_time(
+        lambda: images_service_plugin.particle_overlay(
+            image, coords, 24, contrast_factor=6, colours=colours
+        )
+    )
+    colour_time = best_time(lambda: _overlay_in_colour(image, coords, 24, 6, colours))
+    assert greyscale_time < colour_time, (greyscale_time, colour_time)
@@ -0,0 +1,256 @@
+from __future__ import annotations
+
+import datetime
+from unittest import mock
+
+import ispyb.sqlalchemy as models
+import pytest
+import sqlalchemy
+import sqlalchemy.event
+import sqlalchemy.orm
+import zocalo.configuration
+
+from relion.zocalo import ispyb_buffer, ispyb_service
+
+
+@pytest.fixture(autouse=True)
+def empty_buffer_cache():
+    ispyb_buffer.cache.clear()
+    yield
+    ispyb_buffer.cache.clear()
+
+
+@pytest.fixture
+def session():
+    # The ISPyB models use MySQL types, so make sqlite tables with the same names
+    engine = sqlalchemy.create_engine("sqlite://")
+    metadata = sqlalchemy.MetaData()
+    for model in (
+        models.MotionCorrection,
+        models.CTF,
+        models.RelativeIceThickness,
+        models.ZcZocaloBuffer,
+        models.AutoProcProgram,
+    ):
+        sqlalchemy.Table(
+            model.__tablename__,
+            metadata,
+            *[
+                sqlalchemy.Column(
+                    column.name,
+                    (
+                        sqlalchemy.Integer
+                        if isinstance(column.type, sqlalchemy.Integer)
+                        else column.type.as_generic()
+                    ),
+                    primary_key=column.primary_key,
+                )
+                for column in model.__table__.columns
+            ],
+        )
+    metadata.create_all(engine)
+    with sqlalchemy.orm.Session(engine) as session:
+        session.commits = 0
+        session.statements = []
+
+        @sqlalchemy.event.listens_for(engine, "before_cursor_execute")
+        def record_statements(conn, cursor, statement, *args):
+            session.statements.append(statement)
+
+        @sqlalchemy.event.listens_for(session, "after_commit")
+        def count_commits(session):
+            session.commits += 1
+
+        yield session
+
+
+@pytest.fixture
+def service():
+    mock_zc = mock.MagicMock(zocalo.configuration.Configuration)
+    return ispyb_service.EMISPyB(environment={"config": mock_zc})
+
+
+class RecipeWrapper:
+    def __init__(self):
+        self.environment = {"ispyb_autoprocprogram_id": 42}
+        self.recipe_step = {
+            "parameters": {"program_id": "$ispyb_autoprocprogram_id", "dcid": 7}
+        }
+
+
+def motion_correction(uuid, image_number):
+    return {
+        "ispyb_command": "buffer",
+        "buffer_command": {
+            "ispyb_command": "insert_motion_correction",
+            "movie_id": 100 + image_number,
+            "image_number": image_number,
+        },
+        "buffer_store": uuid,
+    }
+
+
+def ctf(uuid, motion_correction_uuid, defocus):
+    return {
+        "ispyb_command": "buffer",
+        "buffer_lookup": {"motion_correction_id": motion_correction_uuid},
+        "buffer_command": {"ispyb_command": "insert_ctf", "estimated_defocus": defocus},
+        "buffer_store": uuid,
+    }
+
+
+def run_multipart(service, session, commands):
+    return service.do_multipart_message(
+        rw=RecipeWrapper(),
+        message={"ispyb_command_list": commands},
+        session=session,
+        parameters=None,
+    )
+
+
+def test_commands_are_inserted_in_one_transaction(service, session):
+    commands = []
+    for image_number in range(1, 4):
+        commands.append(motion_correction(image_number, image_number))
+        commands.append(ctf(10 + image_number, image_number, 1000 * image_number))
+    commands.append(
+        {
+            "ispyb_command": "insert_relative_ice_thickness",
+            "motion_correction_id": 2,
+            "median": 5,
+            "store_result": "ice_id",
+        }
+    )
+
+    result = run_multipart(service, session, commands)
+
+    assert result["success"]
+    assert session.commits == 1
+    motion_corrections = {
+        row.imageNumber: row for row in session.query(models.MotionCorrection)
+    }
+    assert {row.movieId for row in motion_corrections.values()} == {101, 102, 103}
+    assert {row.autoProcProgramId for row in motion_corrections.values()} == {42}
+    # the buffer lookups resolve to rows added in the same transaction
+    for row in session.query(models.CTF):
+        image_number = row.estimatedDefocus // 1000
+        assert (
+            row.motionCorrectionId
+            == motion_corrections[image_number].motionCorrectionId
+        )
+    buffered = {
+        row.UUID: row.Reference
+        for row in session.query(models.ZcZocaloBuffer)
+        if row.AutoProcProgramID == 42
+    }
+    assert len(buffered) == 6
+    assert buffered[2] == motion_corrections[2].motionCorrectionId
+    ice = session.query(models.RelativeIceThickness).one()
+    assert ice.motionCorrectionId == 2
+    assert result["return_value"] == ice.relativeIceThicknessId
+
+
+def test_unresolved_lookups_are_left_for_later(service, session):
+    session.add(models.ZcZocaloBuffer(AutoProcProgramID=42, UUID=1, Reference=500))
+    session.commit()
+    session.commits = 0
+    commands = [
+        ctf(11, 1, 1000),
+        ctf(12, 2, 2000),
+        motion_correction(2, 2),
+    ]
+    remaining = commands[1:]
+
+    result = run_multipart(service, session, commands)
+
+    # the first command is resolved from the buffer table, the second must wait
+    assert session.commits == 1
+    assert session.query(models.CTF).one().motionCorrectionId == 500
+    assert result["checkpoint"]
+    assert result["return_value"]["checkpoint"] == 1
+    assert result["return_value"]["ispyb_command_list"] == remaining
+
+
+def test_failed_inserts_are_rolled_back(service, session):
+    session.add(models.CTF(ctfId=1, estimatedDefocus=1))
+    session.commit()
+    session.commits = 0
+    commands = [
+        motion_correction(1, 1),
+        {"ispyb_command": "insert_ctf", "ctf_id": 1, "estimated_defocus": 2},
+    ]
+
+    assert run_multipart(service, session, commands) is False
+    assert session.commits == 0
+    assert session.query(models.MotionCorrection).count() == 0
+    assert session.query(models.ZcZocaloBuffer).count() == 0
+
+
+def test_buffer_references_are_resolved_together(service, session):
+    for uuid, reference in ((1, 500), (2, 600)):
+        session.add(
+            models.ZcZocaloBuffer(AutoProcProgramID=42, UUID=uuid, Reference=reference)
+        )
+    session.commit()
+    session.statements.clear()
+    message = {
+        "buffer_lookup": {"motion_correction_id": 1, "ctf_id": 2, "comments": 3},
+        "buffer_command": {"ispyb_command": "insert_ctf"},
+    }
+
+    result = service.do_buffer(
+        rw=RecipeWrapper(),
+        message=message,
+        session=session,
+        parameters=lambda parameter: 42,
+        header={},
+    )
+
+    assert len(session.statements) == 1
+    assert "IN" in session.statements[0]
+    assert result["checkpoint"]
+    assert message["buffer_lookup"] == {"comments": 3}
+    assert message["buffer_command"]["motion_correction_id"] == 500
+    assert message["buffer_command"]["ctf_id"] == 600
+
+
+def test_stored_references_are_cached(service, session):
+    run_multipart(service, session, [motion_correction(1, 1)])
+    reference = session.query(models.MotionCorrection).one().motionCorrectionId
+    session.statements.clear()
+
+    assert ispyb_buffer.load_many(session=session, program=42, uuids=[1]) == {
+        1: reference
+    }
+    assert ispyb_buffer.load(session=session, program="42", uuid=1).value == reference
+    assert session.statements == []
+
+
+def test_evict_removes_entries_of_old_programs(session):
+    now = datetime.datetime.now()
+    session.add_all(
+        [
+            models.AutoProcProgram(
+                autoProcProgramId=1,
+                processingEndTime=now - datetime.timedelta(days=31),
+                recordTimeStamp=now - datetime.timedelta(days=31),
+            ),
+            models.AutoProcProgram(
+                autoProcProgramId=2, recordTimeStamp=now - datetime.timedelta(days=61)
+            ),
+            models.AutoProcProgram(
+                autoProcProgramId=3,
+                processingEndTime=now - datetime.timedelta(days=1),
+                recordTimeStamp=now - datetime.timedelta(days=40),
+            ),
+        ]
+    )
+    for program in (1, 2, 3):
+        ispyb_buffer.store(session=session, program=program, uuid=5, reference=program)
+
+    assert ispyb_buffer.evict(session=session) == 2
+    assert [row.AutoProcProgramID for row in session.query(models.ZcZocaloBuffer)] == [
+        3
+    ]
+    assert ispyb_buffer.cache.get(1, 5) is None
+    assert ispyb_buffer.cache.get(3, 5) == 3
@@ -38,6 +38,7 @@ def mock_environment(mock_zocalo_configuration):
 def offline_transport(mocker):
     transport = OfflineTransport()
     mocker.spy(transport, "send")
+    mocker.spy(transport, "ack")
     return transport
 
 
@@ -84,6 +85,7 @@ def setup_and_run_node_creation(
     service.transport = transport
     service.start()
     service.node_creator(None, header=header, message=test_message)
+    service.flush_all()
 
     # Check that the correct general pipeline files have been made
     assert (project_dir / f"{job_type.replace('.', '_')}_job.star").exists()
@@ -568,6 +570,7 @@ def test_node_creator_failed_job(mock_environment, offline_transport, tmp_path):
     service.transport = offline_transport
     service.start()
     service.node_creator(None, header=header, message=test_message)
+    service.flush_all()
 
     # Check that the correct general pipeline files have been made
     assert (tmp_path / "relion_motioncorr_motioncor2_job.star").exists()
@@ -581,3 +584,160 @@ def test_node_creator_failed_job(mock_environment, offline_transport, tmp_path):
     assert (tmp_path / job_dir / "PIPELINER_JOB_EXIT_FAILED").exists()
     assert (tmp_path / job_dir / "default_pipeline.star").exists()
     assert (tmp_path / job_dir / ".CCPEM_pipeliner_jobinfo").exists()
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="does not run on windows")
+def test_node_creator_coalesces_messages(
+    mock_environment, offline_transport, tmp_path, mocker
+):
+    """
+    Send several motion correction messages for one job, and check the job
+    is only updated once they are flushed together
+    """
+    job_dir = "MotionCorr/job002"
+    with open(tmp_path / "default_pipeline.star", "w") as f:
+        f.write("data_pipeline_general\n\n_rlnPipeLineJobCounter  1")
+
+    service = node_creator.NodeCreator(environment=mock_environment)
+    service.transport = offline_transport
+    service.start()
+    service.coalesce_window = 60
+
+    # Record the micrographs written by the time the job metadata is gathered
+    micrographs_at_metadata = []
+    read_job = node_creator.read_job
+
+    def read_job_recording_outputs(job_file):
+        pipeliner_job = read_job(job_file)
+        gather_metadata = pipeliner_job.gather_metadata
+
+        def gather_metadata_recording_outputs():
+            micrographs_file = cif.read_file(
+                str(tmp_path / job_dir / "corrected_micrographs.star")
+            )
+            micrographs_at_metadata.append(
+                len(
+                    micrographs_file.find_block("micrographs").find_loop(
+                        "_rlnMicrographName"
+                    )
+                )
+            )
+            return gather_metadata()
+
+        pipeliner_job.gather_metadata = gather_metadata_recording_outputs
+        return pipeliner_job
+
+    mocker.patch.object(node_creator, "read_job", read_job_recording_outputs)
+
+    for movie in range(3):
+        output_file = tmp_path / job_dir / f"Movies/sample_{movie}.mrc"
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+        output_file.touch()
+        service.node_creator(
+            None,
+            header={"message-id": movie + 1, "subscription": mock.sentinel},
+            message={
+                "parameters": {
+                    "job_type": "relion.motioncorr.motioncor2",
+                    "input_file": str(
+                        tmp_path / f"Import/job001/Movies/sample_{movie}.mrc"
+                    ),
+                    "output_file": str(output_file),
+                    "relion_options": relion_options,
+                    "command": f"command {movie}",
+                    "stdout": "stdout",
+                    "stderr": "stderr",
+                    "results": {
+                        "total_motion": "10",
+                        "early_motion": "4",
+                        "late_motion": "6",
+                    },
+                },
+                "content": "dummy",
+            },
+        )
+    assert not (tmp_path / job_dir / "job.star").exists()
+    offline_transport.ack.assert_not_called()
+
+    service.flush_all()
+    assert offline_transport.ack.call_count == 3
+    assert micrographs_at_metadata == [3]
+    assert (tmp_path / job_dir / "note.txt").read_text().splitlines() == [
+        "command 0",
+        "command 1",
+        "command 2",
+    ]
+    assert (tmp_path / job_dir / "default_pipeline.star").exists()
+    micrographs_file = cif.read_file(
+        str(tmp_path / job_dir / "corrected_micrographs.star")
+    )
+    assert (
+        len(
+            list(
+                micrographs_file.find_block("micrographs").find_loop(
+                    "_rlnMicrographName"
+                )
+            )
+        )
+        == 3
+    )
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="does not run on windows")
+def test_node_creator_rejects_messages_of_a_failed_project(
+    mock_environment, offline_transport, tmp_path, mocker
+):
+    """A failure in one project does not stop the messages for others being handled"""
+    mocker.spy(offline_transport, "nack")
+    service = node_creator.NodeCreator(environment=mock_environment)
+    service.transport = offline_transport
+    service.start()
+    service.coalesce_window = 60
+
+    for message_id, project in ((1, "broken"), (2, "working")):
+        project_dir = tmp_path / project
+        output_file = project_dir / "MotionCorr/job002/Movies/sample.mrc"
+        output_file.parent.mkdir(parents=True)
+        output_file.touch()
+        with open(project_dir / "default_pipeline.star", "w") as f:
+            f.write("data_pipeline_general\n\n_rlnPipeLineJobCounter  1")
+        service.node_creator(
+            None,
+            header={"message-id": message_id, "subscription": mock.sentinel},
+            message={
+                "parameters": {
+                    "job_type": "relion.motioncorr.motioncor2",
+                    "input_file": str(project_dir / "Import/job001/Movies/sample.mrc"),
+                    "output_file": str(output_file),
+                    "relion_options": relion_options,
+                    "command": "command",
+                    "stdout": "stdout",
+                    "stderr": "stderr",
+                    "results": {
+                        "total_motion": "10",
+                        "early_motion": "4",
+                        "late_motion": "6",
+                    },
+                },
+                "content": "dummy",
+            },
+        )
+
+    prepare_job = service.prepare_job
+
+    def prepare_job_unless_broken(project_dir, job_dir, batch):
+        if project_dir.name == "broken":
+            raise RuntimeError("Cannot write job files")
+        return prepare_job(project_dir, job_dir, batch)
+
+    service.prepare_job = prepare_job_unless_broken
+    service.flush_all()
+
+    assert service._pending == {}
+    assert [c.args[0]["message-id"] for c in offline_transport.nack.call_args_list] == [
+        1
+    ]
+    assert [c.args[0]["message-id"] for c in offline_transport.ack.call_args_list] == [
+        2
+    ]
+    assert (tmp_path / "working/MotionCorr/job002/default_pipeline.star").exists()
@@ -326,6 +326,18 @@ def test_select_classes_service_batch_threshold(
     assert (tmp_path / "Select/job013/particles_split2.star").is_file()
     assert (tmp_path / "Select/job013/particles_batch_100000.star").is_file()
 
+    # The new particles are recorded as added after those already combined
+    node_creator_commands = [
+        call.kwargs["message"]["parameters"]["command"]
+        for call in offline_transport.send.call_args_list
+        if call.kwargs.get("destination") == "node_creator"
+    ]
+    assert (
+        f"combine_star_files {tmp_path}/Select/job013/particles_all.star "
+        f"{tmp_path}/Select/job012/particles.star "
+        f"--output_dir {tmp_path}/Select/job013"
+    ) in node_creator_commands
+
     # Don't bother to check the auto-selection calls here, they are checked above
     # Do check the Murfey 3D calls
     offline_transport.send.assert_any_call(
@@ -524,22 +536,3 @@ def test_select_classes_service_past_maximum(
     # Don't bother to check the auto-selection calls here, they are checked above
     # Do check the Murfey 3D calls
     assert len(offline_transport.send.call_args_list) == 6
-
-
-def test_parse_combiner_output(mock_environment, offline_transport):
-    """
-    Send test lines to the output parser
-    to check the number of particles are being read in
-    """
-    service = select_classes.SelectClasses(environment=mock_environment)
-    service.transport = offline_transport
-    service.start()
-
-    select_classes.SelectClasses.parse_combiner_output(
-        service, "Adding Select/job/particles_all.star with 10 particles"
-    )
-    select_classes.SelectClasses.parse_combiner_output(
-        service, "Combined 2 files into particles_all.star with 20 particles"
-    )
-    assert service.previous_total_count == 10
-    assert service.total_count == 20
@@ -0,0 +1,267 @@
+from __future__ import annotations
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import pytest
+import zocalo.configuration
+from workflows.transport.offline_transport import OfflineTransport
+
+from relion.zocalo import motioncorr_wilson, slurm_jobs, worker_pool
+
+
+class SlurmRestStandIn(BaseHTTPRequestHandler):
+    """Answers the parts of the Slurm REST API used for job submission"""
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, body: dict, status: int = 200):
+        content = json.dumps(body).encode("utf8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _record(self):
+        self.server.requests.append(
+            (
+                self.command,
+                self.path,
+                self.headers.get("X-SLURM-USER-NAME"),
+                self.headers.get("X-SLURM-USER-TOKEN"),
+            )
+        )
+
+    def do_POST(self):
+        self._record()
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        job_id = 100 + len(self.server.jobs)
+        self.server.jobs[job_id] = {"state": "PENDING", "submission": body}
+        self._reply({"job_id": job_id, "errors": []})
+
+    def do_GET(self):
+        self._record()
+        if self.path == "/slurm/v0.0.38/jobs":
+            self._reply(
+                {
+                    "jobs": [
+                        {"job_id": job_id, "job_state": job["state"]}
+                        for job_id, job in self.server.jobs.items()
+                        if not job.get("purged")
+                    ]
+                }
+            )
+            return
+        job_id = int(self.path.split("/")[-1])
+        if job_id in self.server.jobs:
+            self._reply(
+                {
+                    "jobs": [
+                        {
+                            "job_id": job_id,
+                            "job_state": self.server.jobs[job_id]["state"],
+                        }
+                    ]
+                }
+            )
+        else:
+            self._reply({"errors": ["not found"]}, status=404)
+
+    def do_DELETE(self):
+        self._record()
+        self.server.jobs[int(self.path.split("/")[-1])]["state"] = "CANCELLED"
+        self._reply({})
+
+
+@pytest.fixture
+def slurm_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SlurmRestStandIn)
+    server.jobs = {}
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def slurm_config(slurm_server, tmp_path):
+    with open(tmp_path / "token", "w") as f:
+        f.write("sample_token\n")
+    with open(tmp_path / "slurm_rest.yaml", "w") as f:
+        f.write(
+            f"url: http://127.0.0.1:{slurm_server.server_address[1]}\n"
+            f"api_version: v0.0.38\n"
+            f"user: sample_user\n"
+            f"user_token: {tmp_path}/token\n"
+        )
+    return tmp_path / "slurm_rest.yaml"
+
+
+def test_slurm_job_tracker_polls_all_jobs_together(slurm_server, slurm_config):
+    """All outstanding jobs are checked with one request per poll"""
+    finished = []
+    tracker = slurm_jobs.SlurmJobTracker.from_config_file(
+        slurm_config, on_finished=finished.append
+    )
+    job_ids = [tracker.submit({"job": {}, "script": ""}, data=i) for i in range(3)]
+    assert tracker.outstanding == job_ids
+
+    assert tracker.poll() == []
+    slurm_server.jobs[job_ids[0]]["state"] = "COMPLETED"
+    slurm_server.jobs[job_ids[2]]["state"] = ["FAILED"]
+    slurm_server.requests.clear()
+    assert tracker.poll() == [
+        slurm_jobs.FinishedJob(job_ids[0], "COMPLETED", 0),
+        slurm_jobs.FinishedJob(job_ids[2], "FAILED", 2),
+    ]
+    assert finished == [
+        slurm_jobs.FinishedJob(job_ids[0], "COMPLETED", 0),
+        slurm_jobs.FinishedJob(job_ids[2], "FAILED", 2),
+    ]
+    assert slurm_server.requests == [
+        ("GET", "/slurm/v0.0.38/jobs", "sample_user", "sample_token")
+    ]
+    assert tracker.outstanding == [job_ids[1]]
+
+    # A job missing from the list is looked up on its own
+    slurm_server.jobs[job_ids[1]].update(state="COMPLETED", purged=True)
+    assert tracker.poll() == [slurm_jobs.FinishedJob(job_ids[1], "COMPLETED", 1)]
+    assert tracker.outstanding == []
+
+
+def test_slurm_job_tracker_cancels_jobs_after_timeout(slurm_server, slurm_config):
+    tracker = slurm_jobs.SlurmJobTracker.from_config_file(
+        slurm_config, on_finished=lambda job: None, job_timeout=0
+    )
+    job_id = tracker.submit({"job": {}, "script": ""})
+    assert tracker.poll() == [slurm_jobs.FinishedJob(job_id, "TIMEOUT", None)]
+    assert slurm_server.jobs[job_id]["state"] == "CANCELLED"
+
+
+def test_slurm_job_tracker_keeps_jobs_it_cannot_find(slurm_server, slurm_config):
+    """Jobs are only reported once Slurm gives a finished state for them"""
+    tracker = slurm_jobs.SlurmJobTracker.from_config_file(
+        slurm_config, on_finished=lambda job: None
+    )
+    job_id = tracker.submit({"job": {}, "script": ""})
+    # the job is missing from the list, and looking it up fails
+    job = slurm_server.jobs.pop(job_id)
+    assert tracker.poll() == []
+    assert tracker.outstanding == [job_id]
+
+    job.update(state="COMPLETED", purged=True)
+    slurm_server.jobs[job_id] = job
+    assert tracker.poll() == [slurm_jobs.FinishedJob(job_id, "COMPLETED", None)]
+
+
+def test_slurm_job_tracker_background_polling(slurm_server, slurm_config):
+    finished = threading.Event()
+    tracker = slurm_jobs.SlurmJobTracker.from_config_file(
+        slurm_config, on_finished=lambda job: finished.set(), poll_interval=0.01
+    )
+    tracker.start()
+    try:
+        job_id = tracker.submit({"job": {}, "script": ""})
+        slurm_server.jobs[job_id]["state"] = "COMPLETED"
+        assert finished.wait(timeout=5)
+    finally:
+        tracker.stop()
+
+
+def test_motioncorr_wilson_does_not_wait_for_jobs(
+    slurm_server, slurm_config, tmp_path, mocker
+):
+    """Several movies can be submitted before any of the jobs finish"""
+    mock_zc = mock.MagicMock(zocalo.configuration.Configuration)
+    mock_zc.storage = {"zocalo.recipe_directory": tmp_path}
+    transport = OfflineTransport()
+    mocker.spy(transport, "send")
+    mocker.spy(transport, "ack")
+    mocker.spy(transport, "nack")
+    subscribe = mocker.spy(worker_pool.workflows.recipe, "wrap_subscribe")
+    mocker.patch.dict(
+        "os.environ",
+        {"SLURM_RESTAPI_CONFIG": str(slurm_config), "MOTIONCOR2_SIF": "mc2.sif"},
+    )
+
+    service = motioncorr_wilson.MotionCorrWilson(environment={"config": mock_zc})
+    service.transport = transport
+    service.start()
+    assert service.concurrency == 1
+    assert subscribe.call_args.kwargs["prefetch_count"] == 20
+
+    # The second movie is sent twice, and each message waits for its own job
+    for message_id, movie in enumerate(("sample1", "sample2", "sample2"), start=1):
+        service.motion_correction(
+            None,
+            header={"message-id": message_id, "subscription": mock.sentinel},
+            message={
+                "parameters": {
+                    "experiment_type": "tomography",
+                    "pixel_size": 0.1,
+                    "dose_per_frame": 1,
+                    "movie": f"{tmp_path}/Movies/{movie}.tiff",
+                    "mrc_out": f"{tmp_path}/MotionCorr/job002/Movies/{movie}.mrc",
+                    "movie_id": 1,
+                    "mc_uuid": 0,
+                    "picker_uuid": 0,
+                },
+                "content": "dummy",
+            },
+        )
+    assert len(slurm_server.jobs) == 3
+    assert sorted(service.submitted_jobs) == [100, 101, 102]
+    assert transport.send.call_count == 0
+    assert transport.ack.call_count == 0
+
+    # Finish the second job, which writes out the frame shifts
+    mrc_out = tmp_path / "MotionCorr/job002/Movies/sample2.mrc"
+
+    def write_output():
+        with open(f"{mrc_out}.out", "w") as f:
+            f.write("...... Frame (  1) shift:    -3.0      4.0\n")
+            f.write("...... Frame (  2) shift:     3.0     -4.0\n")
+        with open(f"{mrc_out}.err", "w") as f:
+            f.write("")
+
+    write_output()
+    slurm_server.jobs[101]["state"] = "COMPLETED"
+    service.slurm_jobs.on_finished = mock.Mock()
+    finished_jobs = service.slurm_jobs.poll()
+    service.slurm_jobs.on_finished.assert_called_once_with(finished_jobs[0])
+    assert finished_jobs == [slurm_jobs.FinishedJob(101, "COMPLETED", str(mrc_out))]
+
+    service.slurm_job_finished(None, finished_jobs[0])
+    assert [c.args[0]["message-id"] for c in transport.ack.call_args_list] == [2]
+    assert sorted(service.submitted_jobs) == [100, 102]
+    transport.send.assert_any_call(
+        "murfey_feedback",
+        {
+            "register": "motion_corrected",
+            "movie": f"{tmp_path}/Movies/sample2.tiff",
+            "mrc_out": str(mrc_out),
+            "movie_id": 1,
+        },
+    )
+    assert not (tmp_path / "MotionCorr/job002/Movies/sample2.mrc.out").exists()
+
+    # The repeated message is finished by the job submitted for it
+    write_output()
+    slurm_server.jobs[102]["state"] = "COMPLETED"
+    for job in service.slurm_jobs.poll():
+        service.slurm_job_finished(None, job)
+    assert [c.args[0]["message-id"] for c in transport.ack.call_args_list] == [2, 3]
+    assert list(service.submitted_jobs) == [100]
+
+    # A job which is no longer followed is logged without finishing anything
+    service.slurm_job_finished(
+        None, slurm_jobs.FinishedJob(102, "COMPLETED", str(mrc_out))
+    )
+    assert transport.ack.call_count == 2
+    assert transport.nack.call_count == 0
@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+from gemmi import cif
+
+from relion.zocalo import spa_output_files
+from relion.zocalo.spa_relion_service_options import RelionServiceOptions
+
+
+@pytest.fixture(autouse=True)
+def close_writers():
+    yield
+    spa_output_files.close_output_files()
+
+
+def add_motioncorr_rows(job_dir: Path, movies: range):
+    for movie in movies:
+        spa_output_files.create_output_files(
+            job_type="relion.motioncorr.motioncor2",
+            job_dir=job_dir,
+            input_file=Path(f"Import/job001/Movies/sample_{movie}.tiff"),
+            output_file=job_dir / f"Movies/sample_{movie}.mrc",
+            relion_options=RelionServiceOptions(),
+            results={"total_motion": 10, "early_motion": 4, "late_motion": 6},
+        )
+
+
+def micrograph_names(star_file: Path):
+    return list(
+        cif.read_file(str(star_file))
+        .find_block("micrographs")
+        .find_loop("_rlnMicrographName")
+    )
+
+
+def test_rows_are_written_when_flushed(tmp_path):
+    job_dir = tmp_path / "MotionCorr/job002"
+    star_file = job_dir / "corrected_micrographs.star"
+
+    add_motioncorr_rows(job_dir, range(2))
+    assert not star_file.exists()
+
+    spa_output_files.flush_output_files()
+    add_motioncorr_rows(job_dir, range(2, 4))
+    spa_output_files.flush_output_files()
+
+    assert (job_dir / "logfile.pdf").exists()
+    assert micrograph_names(star_file) == [
+        str(job_dir / f"Movies/sample_{movie}.mrc") for movie in range(4)
+    ]
+    optics = cif.read_file(str(star_file)).find_block("optics")
+    assert list(optics.find_loop("_rlnOpticsGroupName")) == ["opticsGroup1"]
+
+
+def test_partly_written_rows_are_removed(tmp_path):
+    job_dir = tmp_path / "MotionCorr/job002"
+    star_file = job_dir / "corrected_micrographs.star"
+    add_motioncorr_rows(job_dir, range(1))
+    spa_output_files.close_output_files()
+
+    # a process stopped half way through writing a row
+    with open(star_file, "a") as f:
+        f.write(f"{job_dir}/Movies/sample_1.mrc 1 ")
+
+    add_motioncorr_rows(job_dir, range(1, 3))
+    spa_output_files.flush_output_files()
+
+    assert micrograph_names(star_file) == [
+        str(job_dir / f"Movies/sample_{movie}.mrc") for movie in range(3)
+    ]
+
+
+def test_replaced_files_are_reopened(tmp_path):
+    csv_file = tmp_path / "IceBreaker/job005/five_figs_test.csv"
+
+    def add_summary(movie):
+        spa_output_files.create_output_files(
+            job_type="icebreaker.micrograph_analysis.summary",
+            job_dir=csv_file.parent,
+            input_file=Path(f"sample_{movie}.mrc"),
+            output_file=csv_file.parent,
+            relion_options=RelionServiceOptions(),
+            results={"icebreaker_type": "summary", "summary": ["1", "2"]},
+        )
+        spa_output_files.flush_output_files()
+
+    add_summary(0)
+    csv_file.unlink()
+    add_summary(1)
+
+    assert csv_file.read_text().splitlines() == [
+        "path,min,q1,q2=median,q3,max",
+        "sample_1.mrc,1,2",
+    ]
+    assert (csv_file.parent / "done_mics.txt").read_text().splitlines() == [
+        "sample_0.mrc",
+        "sample_1.mrc",
+    ]
@@ -230,3 +230,62 @@ def test_parse_tomo_align_output(mock_environment, offline_transport):
     assert service.rot_centre_z_list == ["300.0", "350.0"]
     assert service.tilt_offset == 1.0
     assert service.alignment_quality == 0.07568
+
+
+def test_read_aln_file(tmp_path):
+    """The global alignment table is read, leaving out any local alignments"""
+    aln_file = tmp_path / "test_stack.aln"
+    aln_file.write_text(
+        "# AreTomo Alignment / Priims bprmMn\n"
+        "# RawSize = 4096 4096 3\n"
+        "# NumPatches = 1\n"
+        "# SEC ROT GMAG TX TY SMEAN SFIT SCALE BASE TILT\n"
+        "    0  85.1  1.0  12.5  -4.5  1.0  1.0  1.0  0.0  -3.0\n"
+        "    1  85.2  1.0   0.0   0.0  1.0  1.0  1.0  0.0   0.0\n"
+        "    2  85.3  1.0  -2.5   3.5  1.0  1.0  1.0  0.0   3.0\n"
+        "# Local Alignment\n"
+        "    0    0  100.0  100.0  1.0  1.0  1.0\n"
+    )
+    alignment = tomo_align.read_aln_file(aln_file)
+    assert alignment.shape == (3, 10)
+    assert alignment[:, 9].tolist() == [-3.0, 0.0, 3.0]
+    assert alignment[:, 3].tolist() == [12.5, 0.0, -2.5]
+
+    aln_file.write_text("# SEC ROT GMAG TX TY SMEAN SFIT SCALE BASE TILT\n")
+    assert tomo_align.read_aln_file(aln_file).shape == (0, 10)
+
+
+@mock.patch("relion.zocalo.tomo_align.TomoAlign.newstack")
+def test_tomo_align_keeps_first_image_of_each_tilt(
+    mock_newstack, mock_environment, offline_transport, tmp_path
+):
+    """Images collected again at the same tilt are left out of the stack"""
+    tilts = [("1_0.00", 1000), ("2_3.00", 1000), ("3_0.00", 500), ("4_3.00", 2000)]
+    for name, ctime in tilts:
+        (tmp_path / f"position_{name}.mrc").touch()
+    ctimes = {f"{tmp_path}/position_{name}.mrc": ctime for name, ctime in tilts}
+    mock_newstack.return_value.returncode = 1
+    mock_newstack.return_value.stderr = b""
+
+    service = tomo_align.TomoAlign(environment=mock_environment)
+    service.transport = offline_transport
+    service.start()
+    with mock.patch("relion.zocalo.tomo_align.os.path.getctime", ctimes.get):
+        service.tomo_align(
+            None,
+            header={"message-id": mock.sentinel, "subscription": mock.sentinel},
+            message={
+                "parameters": {
+                    "stack_file": f"{tmp_path}/test_stack.st",
+                    "path_pattern": f"{tmp_path}/position_*.mrc",
+                    "pix_size": 1e-10,
+                },
+                "content": "dummy",
+            },
+        )
+
+    tomo_params = mock_newstack.call_args.args[0]
+    assert tomo_params.input_file_list == [
+        [f"{tmp_path}/position_3_0.00.mrc", "0.00"],
+        [f"{tmp_path}/position_2_3.00.mrc", "3.00"],
+    ]
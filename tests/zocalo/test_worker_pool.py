@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import threading
+from unittest import mock
+
+import pytest
+import zocalo.configuration
+from workflows.transport.offline_transport import OfflineTransport
+
+from relion.zocalo import worker_pool
+
+
+@pytest.fixture
+def mock_environment():
+    mock_zc = mock.MagicMock(zocalo.configuration.Configuration)
+    return {"config": mock_zc}
+
+
+class RecordingTransport(OfflineTransport):
+    """Keeps the order in which messages were sent, acknowledged and rejected"""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    def _send(self, destination, message, transaction=None, **kwargs):
+        self.calls.append(("send", destination, transaction))
+
+    def _ack(self, message_id, subscription_id, transaction=None, **kwargs):
+        self.calls.append(("ack", message_id, transaction))
+
+    def _nack(self, message_id, subscription_id, transaction=None, **kwargs):
+        self.calls.append(("nack", message_id, transaction))
+
+    def _transaction_begin(self, transaction_id, **kwargs):
+        self.calls.append(("begin", transaction_id))
+
+    def _transaction_commit(self, transaction_id, **kwargs):
+        self.calls.append(("commit", transaction_id))
+
+
+class Echo(worker_pool.PooledService):
+    _service_name = "Echo"
+    _logger_name = "relion.zocalo.test_echo"
+
+    barrier = None
+    message_state = ("seen",)
+    seen = []
+
+    def initializing(self):
+        self.subscribe_pooled("echo", self.echo)
+
+    def echo(self, rw, header: dict, message: dict):
+        if self.barrier:
+            # only passes once as many messages as the barrier size are in progress
+            self.barrier.wait(timeout=5)
+        if message.get("fail"):
+            self._transport.send("echo_out", {"partial": True})
+            raise ValueError("failed")
+        self.seen.append(message["value"])
+        self._transport.send("echo_out", {"value": message["value"], "seen": self.seen})
+        self._transport.ack(header)
+
+
+def start_service(mock_environment, concurrency):
+    transport = RecordingTransport()
+    transport.connect()
+    service = Echo(environment=mock_environment)
+    service.transport = transport
+    service.concurrency = concurrency
+    service.start()
+    return service, transport
+
+
+def deliver(service, messages):
+    callback = service.pooled(service.echo)
+    for message_id, message in enumerate(messages, start=1):
+        callback(None, {"message-id": message_id, "subscription": 1}, message)
+    service.in_shutdown()
+
+
+def test_single_concurrency_handles_messages_in_place(mock_environment):
+    service, transport = start_service(mock_environment, 1)
+    assert service.pooled(service.echo) == service.echo
+    assert not isinstance(service._transport, worker_pool.PooledTransport)
+
+    deliver(service, [{"value": 1}, {"value": 2}])
+    assert transport.calls == [
+        ("send", "echo_out", None),
+        ("ack", 1, None),
+        ("send", "echo_out", None),
+        ("ack", 2, None),
+    ]
+
+
+def test_subscription_prefetches_as_many_messages_as_workers(
+    mock_environment, monkeypatch
+):
+    monkeypatch.setenv("RELION_SERVICE_CONCURRENCY", "3")
+    with mock.patch.object(worker_pool.workflows.recipe, "wrap_subscribe") as sub:
+        service, transport = start_service(mock_environment, 1)
+    assert service.concurrency == 3
+    assert sub.call_args.kwargs["prefetch_count"] == 3
+    assert sub.call_args.args[0] is service._transport
+    assert isinstance(service._transport, worker_pool.PooledTransport)
+
+
+def test_subscription_prefetch_can_be_set_apart_from_workers(mock_environment):
+    with mock.patch.object(worker_pool.workflows.recipe, "wrap_subscribe") as sub:
+        with mock.patch.object(Echo, "prefetch_count", 20):
+            service, transport = start_service(mock_environment, 1)
+    assert service.concurrency == 1
+    assert sub.call_args.kwargs["prefetch_count"] == 20
+    assert service.pooled(service.echo) == service.echo
+
+
+def test_messages_are_handled_concurrently_in_transactions(mock_environment):
+    service, transport = start_service(mock_environment, 4)
+    service.barrier = threading.Barrier(4)
+    seen_before = list(service.seen)
+    deliver(service, [{"value": value} for value in range(8)])
+
+    assert not service.barrier.broken
+    # the outputs and acknowledgement of each message are committed together
+    assert len(transport.calls) == 8 * 4
+    acked = []
+    for position in range(0, len(transport.calls), 4):
+        begin, send, ack, commit = transport.calls[position : position + 4]
+        transaction = begin[1]
+        assert begin == ("begin", transaction)
+        assert send == ("send", "echo_out", transaction)
+        assert ack[0] == "ack" and ack[2] == transaction
+        assert commit == ("commit", transaction)
+        acked.append(ack[1])
+    assert sorted(acked) == list(range(1, 9))
+    # messages do not share state
+    assert service.seen == seen_before
+
+
+def test_failing_messages_are_rejected_without_outputs(mock_environment):
+    service, transport = start_service(mock_environment, 2)
+    deliver(service, [{"value": 1, "fail": True}])
+    transaction = transport.calls[0][1]
+    assert transport.calls == [
+        ("begin", transaction),
+        ("nack", 1, transaction),
+        ("commit", transaction),
+    ]
+
+
+def test_handler_transactions_are_kept(mock_environment):
+    class OwnTransactions(Echo):
+        def echo(self, rw, header: dict, message: dict):
+            transaction = self._transport.transaction_begin()
+            self._transport.send("echo_out", {}, transaction=transaction)
+            self._transport.ack(header, transaction=transaction)
+            self._transport.transaction_commit(transaction)
+
+    transport = RecordingTransport()
+    transport.connect()
+    service = OwnTransactions(environment=mock_environment)
+    service.transport = transport
+    service.concurrency = 2
+    service.start()
+    deliver(service, [{"value": 1}])
+
+    transaction = transport.calls[0][1]
+    assert transport.calls == [
+        ("begin", transaction),
+        ("send", "echo_out", transaction),
+        ("ack", 1, transaction),
+        ("commit", transaction),
+    ]